@@ -2,19 +2,79 @@ import json
 import logging
 from pathlib import PurePath
 from types import SimpleNamespace
-from typing import Annotated
+from typing import Annotated, Any
 
 from flask import Blueprint, Flask, current_app
 from flask.wrappers import Response
 from PopPUNK import __version__ as poppunk_version
-from PopPUNK.sketchlib import getKmersFromReferenceDatabase
 from werkzeug.exceptions import NotFound
 
 from beebop import __version__ as beebop_version
 from beebop.models import LocationMetadata
+from beebop.services.species_registry import get_species_registry
 
 from .api_utils import response_success
 
+logger = logging.getLogger(__name__)
+
+# Read-only data shared by every ConfigRoutes instance in a process. beebop.server
+# fills this before forking so pre-forked workers inherit it copy-on-write.
+_read_only_cache: dict[str, Any] = {}
+
+
+def build_species_config(args: SimpleNamespace, dbs_location: str) -> dict:
+    """
+    [Builds the species configuration returned by /speciesConfig from the
+    species registry. Species whose reference database is unavailable are
+    left out, and logged.]
+
+    :param args: [arguments loaded from args.json]
+    :param dbs_location: [location of databases]
+    :return dict: [species name mapped to k-mer info and feature flags]
+    """
+    registry = get_species_registry(args, dbs_location)
+    unavailable = [species for species, entry in registry.items() if not entry.available]
+    if unavailable:
+        logger.warning(f"Left out of species configuration, reference database unavailable: {', '.join(unavailable)}")
+    return {
+        species: {
+            "kmerInfo": entry.kmer_info,
+            "hasSublineages": entry.has_sublineages,
+            "hasLocationMetadata": entry.config.location_metadata_file is not None,
+        }
+        for species, entry in registry.items()
+        if entry.available
+    }
+
+
+def get_location_metadata_info(location_metadata_file: str) -> Annotated[list[dict], LocationMetadata]:
+    """
+    Retrieve location metadata information from a JSON file. Results are cached
+    per process as the resource files never change while the app is running.
+
+    :param location_metadata_file: [Path to the location metadata JSON file.]
+    :return list: [A list containing location metadata information.]
+    """
+    location_cache = _read_only_cache.setdefault("location_metadata", {})
+    if location_metadata_file not in location_cache:
+        with open(PurePath("beebop", "resources", location_metadata_file), "r") as f:
+            location_cache[location_metadata_file] = json.load(f)
+    return location_cache[location_metadata_file]
+
+
+def preload_read_only_cache(args: SimpleNamespace, dbs_location: str) -> None:
+    """
+    [Populates the per-process read-only caches (species registry and location
+    metadata) up front, so they can be shared with forked worker processes.]
+
+    :param args: [arguments loaded from args.json]
+    :param dbs_location: [location of databases]
+    """
+    get_species_registry(args, dbs_location)
+    for species_args in vars(args.species).values():
+        if species_args.location_metadata_file is not None:
+            get_location_metadata_info(species_args.location_metadata_file)
+
 
 class ConfigRoutes:
     """
@@ -62,15 +122,7 @@ class ConfigRoutes:
                 where each key is a species and the value is another
                 dictionary with a list of k-mers for that species and a flag indicating sub-lineage support.]
             """
-            all_species_args = vars(self.args.species)
-            species_config = {
-                species: {
-                    "kmerInfo": self._get_kmer_info(f"{self.dbs_location}/{species_args.refdb}"),
-                    "hasSublineages": species_args.sublineages_db is not None,
-                    "hasLocationMetadata": species_args.location_metadata_file is not None,
-                }
-                for species, species_args in all_species_args.items()
-            }
+            species_config = build_species_config(self.args, self.dbs_location)
             return response_success(species_config)
 
         @self.config_bp.route("/locationMetadata/<species>", methods=["GET"])
@@ -87,35 +139,9 @@ class ConfigRoutes:
             if species_args is None or species_args.location_metadata_file is None:
                 raise NotFound(f"No location metadata configured for species: {species}")
 
-            location_metadata = self._get_location_metadata_info(species_args.location_metadata_file)
+            location_metadata = get_location_metadata_info(species_args.location_metadata_file)
             return response_success(location_metadata)
 
-    def _get_kmer_info(self, db_path: str) -> dict:
-        """
-        Retrieve k-mer information from database for a given species.
-
-        :param species_db_name: [The name of the species database.]
-        :return dict: [A dictionary containing the maximum, minimum, and step
-            k-mer values.]
-        """
-        kmers = getKmersFromReferenceDatabase(db_path)
-        return {
-            "kmerMax": int(kmers[-1]),
-            "kmerMin": int(kmers[0]),
-            "kmerStep": int(kmers[1] - kmers[0]),
-        }
-
-    def _get_location_metadata_info(self, location_metadata_file: str) -> Annotated[list[dict], LocationMetadata]:
-        """
-        Retrieve location metadata information from a JSON file.
-
-        :param location_metadata_file: [Path to the location metadata JSON file.]
-        :return list: [A list containing location metadata information.]
-        """
-        with open(PurePath("beebop", "resources", location_metadata_file), "r") as f:
-            location_metadata = json.load(f)
-        return location_metadata
-
     def get_blueprint(self) -> Blueprint:
         """
         Returns the Flask Blueprint for the configuration routes.
@@ -2,6 +2,7 @@ import logging
 from typing import Literal
 
 from flask import Response
+from werkzeug.exceptions import HTTPException
 
 from .api_utils import response_failure
 
@@ -57,3 +58,51 @@ def register_error_handlers(app) -> None:
             ),
             404,
         )
+
+    @app.errorhandler(409)
+    def conflict(e) -> tuple[Response, Literal[409]]:
+        """
+        :param e: [error]
+        :return Response: [error response object]
+        """
+        logger.warning(f"Conflict: {e}")
+        return (
+            response_failure(error_message="Conflict", error_detail=str(e.description)),
+            409,
+        )
+
+    @app.errorhandler(429)
+    def too_many_requests(e) -> tuple[Response, Literal[429], dict[str, str]]:
+        """
+        :param e: [error]
+        :return Response: [error response object with Retry-After header]
+        """
+        logger.warning(f"Too Many Requests: {e}")
+        return (
+            response_failure(error_message="Too Many Requests", error_detail=str(e.description)),
+            429,
+            get_retry_after_header(e),
+        )
+
+    @app.errorhandler(503)
+    def service_unavailable(e) -> tuple[Response, Literal[503], dict[str, str]]:
+        """
+        :param e: [error]
+        :return Response: [error response object with Retry-After header]
+        """
+        logger.warning(f"Service Unavailable: {e}")
+        return (
+            response_failure(error_message="Service Unavailable", error_detail=str(e.description)),
+            503,
+            get_retry_after_header(e),
+        )
+
+
+def get_retry_after_header(e: HTTPException) -> dict[str, str]:
+    """
+    [Extracts the Retry-After header from an HTTP exception, if it has one.]
+
+    :param e: [HTTP exception]
+    :return dict: [headers to add to the error response]
+    """
+    return {key: value for key, value in e.get_headers() if key == "Retry-After"}
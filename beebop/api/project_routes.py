@@ -1,5 +1,5 @@
 import logging
-from typing import Literal
+from typing import Literal, Optional
 
 from flask import (
     Blueprint,
@@ -14,19 +14,32 @@ from werkzeug.exceptions import BadRequest, NotFound
 
 from beebop.config import PoppunkFileStore, Schema
 from beebop.db import RedisManager
+from beebop.services.archive_service import open_artifact
 from beebop.services.cluster_service import get_cluster_num
+from beebop.services.eta_service import get_completed_project_eta, get_project_eta
 from beebop.services.file_service import (
     get_cluster_assignments,
+    get_cluster_sizes,
     get_failed_samples_internal,
 )
-from beebop.services.job_service import get_project_status
+from beebop.services.gc_service import record_project_access
+from beebop.services.job_service import get_project_status, read_project_status_record
+from beebop.services.result_cache_service import configure_result_cache, result_cache
 from beebop.services.result_service import (
     generate_microreact_url_internal,
     generate_zip,
     get_clusters_results,
     get_sublineage_results,
+    get_zip_etag,
+    open_network_graph,
 )
 from beebop.services.run_PopPUNK import run_PopPUNK_jobs
+from beebop.services.run_PopPUNK.visualise import (
+    ensure_cluster_visualised,
+    get_on_demand_clusters,
+    get_visualised_clusters,
+    rerun_cluster_visualisation,
+)
 
 from .api_utils import response_success
 
@@ -46,7 +59,13 @@ class ProjectRoutes:
             self.redis_manager = RedisManager(current_app.config["redis"])
             self.storage_location: str = current_app.config["storage_location"]
             self.schemas: Schema = current_app.config["schemas"]
+            self.job_timeout: int = current_app.config["job_timeout"]
+            self.result_ttl: int = current_app.config["result_ttl"]
+            self.precompute_clusters: Optional[int] = getattr(
+                current_app.config["args"].visualise, "precompute_clusters", None
+            )
             self.fs = PoppunkFileStore(self.storage_location)
+            configure_result_cache(current_app.config["args"])
         self._setup_routes()
 
     def _setup_routes(self):
@@ -57,7 +76,8 @@ class ProjectRoutes:
             [run poppunks assing_query() and generate_visualisations().
             input: multiple sketches in json format together with project hash
             and filename mapping, schema can be
-            found in spec/sketches.schema.json]
+            found in spec/sketches.schema.json. With append set, the
+            samples are added to the existing project instead]
 
             :return Response: [response object with all
             job IDs stored in 'data']
@@ -69,21 +89,48 @@ class ProjectRoutes:
             name_mapping = request.json["names"]
             species = request.json["species"]
             amr_metadata = request.json["amrForMetadataCsv"]
+            append = request.json.get("append", False)
 
-            job_ids = run_PopPUNK_jobs(sketches, p_hash, name_mapping, species, amr_metadata)
+            job_ids = run_PopPUNK_jobs(sketches, p_hash, name_mapping, species, amr_metadata, append)
             return response_success(job_ids)
 
+        @self.project_bp.route("/resultCacheStats", methods=["GET"])
+        def get_result_cache_stats() -> Response:
+            """
+            [returns hit, miss and eviction counts and the memory use of the
+            parsed project results cache of the process serving the request]
+
+            :return Response: [response object with cache statistics]
+            """
+            return response_success(result_cache.stats())
+
         @self.project_bp.route("/status/<string:p_hash>", methods=["GET"])
         def get_status(p_hash: str) -> Response:
             """
             [returns job statuses for all jobs with given project hash.
             Possible values are: queued, started, deferred,
-            finished, stopped, canceled, scheduled and failed]
+            finished, stopped, canceled, scheduled and failed.
+            Also returns estimated completion times and a suggested
+            polling interval under "eta", and clusters that will only be
+            visualised once requested under "onDemandClusters".
+            Completed projects are served from their status record without Redis.]
 
             :param p_hash: [project hash]
             :return Response: [response object with job statuses]
             """
-            response = get_project_status(p_hash, self.redis_manager)
+            record_project_access(p_hash, self.fs)
+            record = read_project_status_record(p_hash, self.fs)
+            if record is not None:
+                response = {**record["status"], "eta": get_completed_project_eta(record["completedAt"])}
+            else:
+                jobs: dict = {}
+                response = get_project_status(p_hash, self.redis_manager, jobs)
+                cluster_sizes = None
+                if response["assign"] == "finished":
+                    cluster_sizes = get_cluster_sizes(p_hash, self.fs, self.precompute_clusters)
+                # reuse the jobs fetched for the statuses
+                response["eta"] = get_project_eta(p_hash, self.redis_manager, cluster_sizes, jobs)
+            response["onDemandClusters"] = get_on_demand_clusters(p_hash, self.fs, response["visualiseClusters"])
             return response_success(response)
 
         @self.project_bp.route("/project/<string:p_hash>", methods=["GET"])
@@ -95,11 +142,15 @@ class ProjectRoutes:
             :param p_hash: [identifying hash for the project]
             :return: [project data]
             """
-            job_id = self.redis_manager.get_job_status("assign", p_hash)
-            if job_id is None:
-                raise NotFound("Project hash does not have an associated job")
-
-            status = get_project_status(p_hash, self.redis_manager)
+            record_project_access(p_hash, self.fs)
+            record = read_project_status_record(p_hash, self.fs)
+            if record is not None:
+                status = record["status"]
+            else:
+                job_id = self.redis_manager.get_job_status("assign", p_hash)
+                if job_id is None:
+                    raise NotFound("Project hash does not have an associated job")
+                status = get_project_status(p_hash, self.redis_manager)
 
             clusters_result = get_cluster_assignments(p_hash, self.fs)
             failed_samples = get_failed_samples_internal(p_hash, self.fs)
@@ -127,6 +178,19 @@ class ProjectRoutes:
                 }
             )
 
+        @self.project_bp.route("/project/<string:p_hash>/visualise/<string:cluster>", methods=["POST"])
+        def rerun_visualisation(p_hash: str, cluster: str) -> Response:
+            """
+            [Re-runs the visualisation of a single cluster of an existing
+            project, without re-running the rest of the project.]
+
+            :param p_hash: [project hash]
+            :param cluster: [assigned cluster]
+            :return Response: [response object with the visualisation job ID]
+            """
+            job = rerun_cluster_visualisation(p_hash, cluster, self.fs, self.redis_manager, self._get_queue_kwargs())
+            return response_success({"cluster": cluster, "visualise": job.id})
+
         @self.project_bp.route("/results/networkGraphs/<string:p_hash>", methods=["GET"])
         def get_network_graphs(
             p_hash: str,
@@ -138,18 +202,24 @@ class ProjectRoutes:
             :return Response: [response object with all
             graphml files stored in 'data']
             """
+            record_project_access(p_hash, self.fs)
             try:
                 cluster_result = get_cluster_assignments(p_hash, self.fs)
+                # one entry per cluster, however many samples were assigned to it
+                clusters = {cluster_info["cluster"]: cluster_info for cluster_info in cluster_result.values()}
+                # clusters visualised on demand are left out until ready, without queueing them
+                visualised = get_visualised_clusters(p_hash, clusters, self.fs, self.redis_manager)
                 graphmls = {}
-                for cluster_info in cluster_result.values():
-                    cluster = cluster_info["cluster"]
+                for cluster, cluster_info in clusters.items():
+                    if cluster not in visualised:
+                        continue
                     path = self.fs.pruned_network_output_component(
                         p_hash,
                         cluster_info["raw_cluster_num"],
                         get_cluster_num(cluster),
                     )
-                    with open(path, "r") as graphml_file:
-                        graph = graphml_file.read()
+                    with open_artifact(p_hash, self.fs, path) as graphml_file:
+                        graph = graphml_file.read().decode("utf-8")
                     graphmls[cluster] = graph
                 return response_success(graphmls)
 
@@ -158,6 +228,33 @@ class ProjectRoutes:
             except FileNotFoundError as e:
                 raise NotFound("GraphML files not found for the given project hash") from e
 
+        @self.project_bp.route("/results/networkGraphs/<string:p_hash>/<string:cluster>", methods=["GET"])
+        def get_network_graph(p_hash: str, cluster: str) -> Response:
+            """
+            [returns the pruned graphml file of a cluster. Graphs stored
+            compressed are sent as stored, with Content-Encoding gzip, to
+            clients accepting it, and decompressed for other clients]
+
+            :param p_hash: [project hash]
+            :param cluster: [cluster assigned]
+            :return Response: [response object with the graphml file]
+            """
+            record_project_access(p_hash, self.fs)
+            pending_response = self._get_visualisation_pending(p_hash, cluster)
+            if pending_response is not None:
+                return pending_response
+            try:
+                graphml_file, compressed = open_network_graph(
+                    p_hash, self.fs, cluster, request.accept_encodings["gzip"] > 0
+                )
+            except FileNotFoundError as e:
+                raise NotFound("GraphML file not found for the given project hash and cluster") from e
+            response = send_file(graphml_file, mimetype="application/xml")
+            if compressed:
+                response.content_encoding = "gzip"
+            response.vary.add("Accept-Encoding")
+            return response
+
         @self.project_bp.route("/results/<string:result_type>", methods=["POST"])
         def get_results(result_type: Literal["assign", "zip", "microreact", "sublineageAssign"]) -> Response:
             """
@@ -180,6 +277,8 @@ class ProjectRoutes:
             self.logger.info(f"Request for results of type: {result_type}")
             if request.json is None:
                 raise BadRequest("Request body is missing or not in JSON format.")
+            if "projectHash" in request.json:
+                record_project_access(request.json["projectHash"], self.fs)
             match result_type:
                 case "assign":
                     p_hash = request.json["projectHash"]
@@ -189,17 +288,30 @@ class ProjectRoutes:
                     p_hash = request.json["projectHash"]
                     visualisation_type = request.json["type"]
                     cluster = str(request.json["cluster"])
+                    pending_response = self._get_visualisation_pending(p_hash, cluster)
+                    if pending_response is not None:
+                        return pending_response
+                    etag = get_zip_etag(self.fs, p_hash, visualisation_type, cluster)
+                    if etag is not None and request.if_none_match.contains(etag):
+                        # the client's copy is current, the zip is not built again
+                        not_modified = Response(status=304)
+                        not_modified.set_etag(etag)
+                        return not_modified
                     zip_file = generate_zip(self.fs, p_hash, visualisation_type, cluster)
                     return send_file(
                         zip_file,
                         download_name=visualisation_type + ".zip",
                         as_attachment=True,
+                        etag=etag if etag is not None else False,
                     )
                 case "microreact":
                     microreact_api_new_url = "https://microreact.org/api/projects/create"
                     p_hash = request.json["projectHash"]
                     cluster = str(request.json["cluster"])
                     api_token = str(request.json["apiToken"])
+                    pending_response = self._get_visualisation_pending(p_hash, cluster)
+                    if pending_response is not None:
+                        return pending_response
                     url = generate_microreact_url_internal(
                         microreact_api_new_url,
                         p_hash,
@@ -217,6 +329,25 @@ class ProjectRoutes:
                 case _:
                     raise BadRequest("Invalid result type specified.")
 
+    def _get_visualisation_pending(self, p_hash: str, cluster: str) -> Optional[tuple[Response, int]]:
+        """
+        [Queues the visualisation of a cluster that was left to be visualised
+        on demand, at high priority.]
+
+        :param p_hash: [project hash]
+        :param cluster: [assigned cluster]
+        :return: [None if the visualisation is available, otherwise a
+            202 response with the status of the visualisation job]
+        """
+        status = ensure_cluster_visualised(p_hash, cluster, self.fs, self.redis_manager, self._get_queue_kwargs())
+        if status is None:
+            return None
+        return response_success({"cluster": cluster, "status": status}), 202
+
+    def _get_queue_kwargs(self) -> dict:
+        """Get standard queue configuration for visualisation jobs"""
+        return {"job_timeout": self.job_timeout, "result_ttl": self.result_ttl, "failure_ttl": self.result_ttl}
+
     def get_blueprint(self) -> Blueprint:
         """
         Returns the Flask Blueprint for the project routes.
@@ -5,6 +5,7 @@ from waitress import serve
 
 from .api import ConfigRoutes, ProjectRoutes, register_error_handlers
 from .config import Config
+from .services.species_registry import get_species_snapshot
 
 
 def create_app() -> Flask:
@@ -17,6 +18,10 @@ def create_app() -> Flask:
     app = Flask(__name__)
     app.config.update(Config().__dict__)
     logging.basicConfig(level=logging.INFO)
+    # validate all species up front, so misconfiguration fails at startup. A
+    # pre-forked worker inherits a registry that may have been reloaded since
+    # args.json was read above, so serve the arguments it was built from
+    app.config["args"], _ = get_species_snapshot(app.config["args"], app.config["dbs_location"])
 
     # Register error handlers
     register_error_handlers(app)
@@ -7,6 +7,8 @@ from redis import Redis
 
 from .schemas import Schema
 
+ARGS_JSON_PATH = PurePath("beebop", "resources", "args.json")
+
 
 class ConfigurationError(Exception):
     """Raised when required configuration is missing or invalid."""
@@ -22,17 +24,28 @@ def get_environment() -> tuple[str, str, str]:
              and Redis host.
     """
     storage_location = os.getenv("STORAGE_LOCATION")
-    dbs_location = os.getenv("DBS_LOCATION")
     redis_host = os.getenv("REDIS_HOST")
     if not storage_location:
         raise ConfigurationError("STORAGE_LOCATION environment variable is not set.")
-    if not dbs_location:
-        raise ConfigurationError("DBS_LOCATION environment variable is not set.")
+    dbs_location = get_dbs_location()
     if not redis_host:
         redis_host = "127.0.0.1"
     return storage_location, dbs_location, redis_host
 
 
+def get_dbs_location() -> str:
+    """
+    Get the location of databases. Needed by the API and by workers, which
+    look up the databases of the species their jobs run for.
+
+    :return: The database location.
+    """
+    dbs_location = os.getenv("DBS_LOCATION")
+    if not dbs_location:
+        raise ConfigurationError("DBS_LOCATION environment variable is not set.")
+    return dbs_location
+
+
 def get_args() -> SimpleNamespace:
     """
     [Read in fixed arguments to poppunk that are always set, or used as
@@ -41,7 +54,7 @@ def get_args() -> SimpleNamespace:
 
     :return dict: [arguments loaded from json]
     """
-    with open(str(PurePath("beebop", "resources", "args.json"))) as a:
+    with open(str(ARGS_JSON_PATH)) as a:
         args_json = a.read()
     return json.loads(args_json, object_hook=lambda d: SimpleNamespace(**d))
 
@@ -58,5 +71,8 @@ class Config:
         self.redis_host = redis_host
         self.args = get_args()
         self.job_timeout = 1200  # seconds
+        # final statuses are kept in the project's status record, so results
+        # only need to outlive the jobs depending on them
+        self.result_ttl = 7 * 24 * 3600  # seconds
         self.schemas = Schema()
         self.redis = Redis(host=self.redis_host)
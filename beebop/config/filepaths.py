@@ -1,58 +1,219 @@
+import copy
+import errno
 import json
+import logging
 import os
 import shutil
+import uuid
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import PurePath
 from typing import Optional
 
+from .sketch_format import from_hex_sketch, read_binary_sketch, to_hex_sketch, write_binary_sketch
+from .storage import LocalStorageBackend, StorageBackend, create_storage_backend
+
+logger = logging.getLogger(__name__)
+
+# number of leading hash characters naming the sub-folder a sketch is stored in
+SHARD_PREFIX_LENGTH = 2
+SKETCH_WRITE_THREADS = 8
+
 
 class FileStore:
     """
-    General filestore to be used by PoppunkFileStore
+    General filestore to be used by PoppunkFileStore. Sketches are stored in
+    a compact binary format, sharded into sub-folders by the first characters
+    of their hash so no single folder grows too large. Sketches stored flat
+    by earlier versions (as JSON or binary) are still read, and moved into
+    the sharded layout the first time they are read.
+
+    Sharded sketches are kept in a storage backend, the folder itself by
+    default; legacy flat sketches are only ever found in the folder.
     """
 
-    def __init__(self, path):
+    def __init__(self, path, backend: Optional[StorageBackend] = None):
         """
         :param path: path to folder
+        :param backend: [backend sketches are stored in, defaults to the folder]
         """
         self._path = path
+        self.backend = backend or LocalStorageBackend(path)
         os.makedirs(path, exist_ok=True)
 
+    @property
+    def path(self) -> str:
+        """
+        :return str: [path to folder]
+        """
+        return self._path
+
     def filename(self, file_hash) -> str:
         """
         :param file_hash: [file hash]
-        :return str: [path to file incl. filename]
+        :return str: [path to legacy flat JSON file incl. filename]
         """
         return os.path.join(self._path, f"{file_hash}.json")
 
-    def get(self, file_hash) -> str:
+    def binary_filename(self, file_hash) -> str:
         """
         :param file_hash: [file hash]
-        :return str: [sketch]
+        :return str: [path to binary file incl. filename, in the shard of the hash]
         """
-        src = self.filename(file_hash)
-        if not os.path.exists(src):
-            raise Exception(f"Sketch for hash '{file_hash}' not found in storage")
-        else:
-            with open(src, "r") as fp:
-                sketch = json.load(fp)
-        return sketch
+        return os.path.join(self._path, self.key(file_hash))
+
+    def key(self, file_hash) -> str:
+        """
+        :param file_hash: [file hash]
+        :return str: [key of the sketch in the storage backend]
+        """
+        return f"{file_hash[:SHARD_PREFIX_LENGTH]}/{file_hash}.sketch"
+
+    def get(self, file_hash) -> dict:
+        """
+        :param file_hash: [file hash]
+        :return dict: [sketch, with hashes as hexadecimal strings as sent
+            by the frontend]
+        """
+        return to_hex_sketch(self.get_arrays(file_hash))
+
+    def get_arrays(self, file_hash) -> dict:
+        """
+        [Reads a sketch without text parsing. Hashes are uint64 arrays,
+        memory-mapped from the binary file.]
+
+        :param file_hash: [file hash]
+        :return dict: [sketch, with hashes as numpy arrays]
+        """
+        # check the sharded file again after the legacy ones, in case another
+        # process migrated the sketch in between
+        for read in (self._read_binary, self._read_legacy, self._read_binary):
+            sketch = read(file_hash)
+            if sketch is not None:
+                return sketch
+        raise Exception(f"Sketch for hash '{file_hash}' not found in storage")
 
     def exists(self, file_hash) -> bool:
         """
         :param file_hash: [file hash]
         :return bool: [whether file exists]
         """
-        return os.path.exists(self.filename(file_hash))
+        return self.backend.exists(self.key(file_hash)) or any(
+            os.path.exists(path) for path in self._legacy_filenames(file_hash)
+        )
 
     def put(self, file_hash, sketch) -> None:
         """
+        [Stores a sketch, unless it is stored already: sketches are named by
+        the hash of their content, so an existing one never needs rewriting.
+        The write is atomic, so a crash never leaves a truncated sketch.]
+
         :param file_hash: [file hash]
         :param sketch: [sketch to be stored]
         """
-        dst = self.filename(file_hash)
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        with open(dst, "w") as fp:
-            json.dump(sketch, fp)
+        if self.exists(file_hash):
+            return
+        write_binary_sketch(self.backend.write_path(self.key(file_hash)), sketch)
+        self.backend.commit(self.key(file_hash))
+
+    def put_many(self, sketches: dict, max_workers: int = SKETCH_WRITE_THREADS) -> None:
+        """
+        [Stores many sketches on a bounded thread pool, skipping those stored
+        already, so writes of large submissions overlap their waits on disk.]
+
+        :param sketches: [sketches by file hash]
+        :param max_workers: [maximum number of threads writing at once]
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # consume the results, so errors in any write are raised here
+            list(pool.map(self.put, sketches.keys(), sketches.values()))
+
+    def list_sketches(self) -> Iterator[tuple[str, str]]:
+        """
+        [Lists the sharded sketches stored in the folder, i.e. all sketches
+        when the folder is the storage backend.]
+
+        :return Iterator: [file hash and path of each sketch]
+        """
+        with os.scandir(self._path) as shards:
+            for shard in shards:
+                if not (shard.is_dir() and len(shard.name) == SHARD_PREFIX_LENGTH):
+                    continue
+                with os.scandir(shard.path) as entries:
+                    for entry in entries:
+                        file_hash, extension = os.path.splitext(entry.name)
+                        if extension == ".sketch" and entry.is_file():
+                            yield file_hash, entry.path
+
+    def migrate_flat_layout(self) -> int:
+        """
+        [Moves all sketches stored flat by earlier versions into the sharded
+        layout, converting JSON sketches to binary.]
+
+        :return int: [number of sketches migrated]
+        """
+        migrated = 0
+        with os.scandir(self._path) as entries:
+            for entry in entries:
+                file_hash, extension = os.path.splitext(entry.name)
+                if entry.is_file() and extension in (".json", ".sketch") and self._migrate(file_hash):
+                    migrated += 1
+        return migrated
+
+    def _legacy_filenames(self, file_hash) -> tuple[str, str]:
+        return self.filename(file_hash), os.path.join(self._path, f"{file_hash}.sketch")
+
+    def _read_binary(self, file_hash) -> Optional[dict]:
+        try:
+            return read_binary_sketch(self.backend.local_path(self.key(file_hash)))
+        except FileNotFoundError:
+            return None
+
+    def _read_legacy(self, file_hash) -> Optional[dict]:
+        """
+        [Reads a sketch stored flat by earlier versions where it is: reads
+        never change the store. scripts/migrate_sketch_store.py moves flat
+        sketches into their shards.]
+
+        :param file_hash: [file hash]
+        :return Optional[dict]: [sketch, with hashes as numpy arrays]
+        """
+        json_path, flat_binary_path = self._legacy_filenames(file_hash)
+        try:
+            return read_binary_sketch(flat_binary_path)
+        except FileNotFoundError:
+            pass
+        try:
+            with open(json_path, "r") as fp:
+                return from_hex_sketch(json.load(fp))
+        except FileNotFoundError:
+            return None
+
+    def _migrate(self, file_hash) -> bool:
+        """
+        [Moves a flat sketch into its shard, converting JSON to binary.]
+
+        :param file_hash: [file hash]
+        :return bool: [whether the sketch is now in its shard]
+        """
+        json_path, flat_binary_path = self._legacy_filenames(file_hash)
+        key = self.key(file_hash)
+        try:
+            if os.path.exists(flat_binary_path):
+                os.replace(flat_binary_path, self.backend.write_path(key))
+                self.backend.commit(key)
+            elif os.path.exists(json_path):
+                with open(json_path, "r") as fp:
+                    write_binary_sketch(self.backend.write_path(key), json.load(fp))
+                self.backend.commit(key)
+                os.remove(json_path)
+        except FileNotFoundError:
+            # migrated by another process in the meantime
+            pass
+        except OSError:
+            logger.warning(f"Could not migrate sketch {file_hash} to the sharded layout")
+            return False
+        return self.backend.exists(key)
 
 
 class PoppunkFileStore:
@@ -60,12 +221,19 @@ class PoppunkFileStore:
     Filestore that provides paths to poppunk in- and outputs
     """
 
+    # scratch folder of the running job on the worker's local disk, holding
+    # the intermediates otherwise written to the project's tmp folder
+    scratch: Optional[str] = None
+
     def __init__(self, storage_location):
         """
         :param storage_location: [path to storage location]
         """
         self.storage_location = storage_location
-        self.input = FileStore(f"{storage_location}/json")
+        self.input = FileStore(
+            f"{storage_location}/json",
+            create_storage_backend(f"{storage_location}/json", "json"),
+        )
         self.output_base = PurePath(storage_location, "poppunk_output")
         os.makedirs(self.output_base, exist_ok=True)
 
@@ -121,20 +289,155 @@ class PoppunkFileStore:
     def sublineage_results(self, p_hash: str) -> str:
         """
         :param p_hash: [project hash]
-        :return str: [path to sub-lineage results file]
+        :return str: [path to sub-lineage results file of projects run
+            before the project catalog]
         """
         return self.path_str(self.output(p_hash), "sublineage_results.json")
 
+    def visualise_context(self, p_hash: str) -> str:
+        """
+        :param p_hash: [project hash]
+        :return str: [path to arguments needed to visualise further clusters on demand]
+        """
+        return self.path_str(self.output(p_hash), "visualise_context.pickle")
+
+    def project_status(self, p_hash: str) -> str:
+        """
+        :param p_hash: [project hash]
+        :return str: [path to status record written once all jobs of the project finished]
+        """
+        return self.path_str(self.output(p_hash), "status.json")
+
+    def project_last_access(self, p_hash: str) -> str:
+        """
+        :param p_hash: [project hash]
+        :return str: [path to marker file whose modification time is the
+            last time the project was accessed]
+        """
+        return self.path_str(self.output(p_hash), "last_access")
+
+    def project_pin(self, p_hash: str) -> str:
+        """
+        :param p_hash: [project hash]
+        :return str: [path to marker file protecting the project from
+            garbage collection]
+        """
+        return self.path_str(self.output(p_hash), "pinned")
+
+    def run_digest(self, p_hash: str) -> str:
+        """
+        :param p_hash: [project hash]
+        :return str: [path to file holding the digest of the project's
+            inputs, used to reuse the outputs of identical runs]
+        """
+        return self.path_str(self.output(p_hash), "run_digest")
+
+    def manifests(self, p_hash: str) -> str:
+        """
+        :param p_hash: [project hash]
+        :return str: [path to folder holding the artifact manifests written
+            by each stage of the project]
+        """
+        return self.path_str(self.output(p_hash), "manifests")
+
+    def manifest(self, p_hash: str, stage: str) -> str:
+        """
+        :param p_hash: [project hash]
+        :param stage: [pipeline stage, e.g. assign or visualise_<cluster>]
+        :return str: [path to manifest of the artifacts written by the stage]
+        """
+        return self.path_str(self.manifests(p_hash), f"{stage}.json")
+
+    def project_archive(self, p_hash: str) -> str:
+        """
+        :param p_hash: [project hash]
+        :return str: [path to compressed archive holding the output files
+            of a project that has not been accessed for a long time]
+        """
+        return self.path_str(self.output(p_hash), "archive.zip")
+
+    def project_archive_lock(self, p_hash: str) -> str:
+        """
+        :param p_hash: [project hash]
+        :return str: [path to lock file held while a project is archived or
+            rehydrated]
+        """
+        return self.path_str(self.output(p_hash), "archive.lock")
+
+    def run_memo(self, digest: str) -> str:
+        """
+        :param digest: [digest of the inputs of a run]
+        :return str: [path to memo of the completed project the run's
+            outputs can be reused from]
+        """
+        return self.path_str(PurePath(self.storage_location, "run_memo"), f"{digest}.json")
+
+    def assignment_cache(self) -> str:
+        """
+        :return str: [path to SQLite cache of sample cluster assignments,
+            shared by all projects]
+        """
+        return self.path_str(self.storage_location, "assignment_cache.sqlite")
+
+    def blobs(self) -> str:
+        """
+        :return str: [path to content-addressed store of visualisation
+            files, shared by all projects through hard links]
+        """
+        return self.path_str(self.storage_location, "blobs")
+
+    def blob(self, sha256: str) -> str:
+        """
+        :param sha256: [checksum of the file content]
+        :return str: [path to the blob with the content, in the shard of
+            its checksum]
+        """
+        return self.path_str(PurePath(self.blobs(), sha256[:SHARD_PREFIX_LENGTH]), sha256)
+
+    def sketch_library(self) -> str:
+        """
+        :return str: [path to the folder of HDF5 files holding the sketches
+            of all ingested samples]
+        """
+        return self.path_str(self.storage_location, "sketch_library")
+
+    def trash(self) -> str:
+        """
+        :return str: [path to folder holding folders waiting to be deleted
+            in the background]
+        """
+        return self.path_str(self.storage_location, "trash")
+
+    def move_to_trash(self, path: str) -> None:
+        """
+        [Renames a folder into the trash, so it disappears at once and is
+        deleted later by the trash reaper. The trash is in the storage
+        location, so the rename stays on the same filesystem. Folders on
+        another filesystem, e.g. a worker's scratch folder, are deleted at
+        once.]
+
+        :param path: [folder to delete]
+        """
+        os.makedirs(self.trash(), exist_ok=True)
+        try:
+            os.rename(path, self.path_str(self.trash(), f"{os.path.basename(path)}-{uuid.uuid4().hex}"))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.rmtree(path, ignore_errors=True)
+
     def setup_output_directory(self, p_hash: str) -> None:
         """
         [Create output directory that stores all files from PopPUNK assign job.
-        If the directory already exists, it is removed and recreated]
+        If the directory already exists, it is moved to the trash and recreated]
 
         :param p_hash: [project hash]
         """
         outdir = self.output(p_hash)
         if os.path.exists(outdir):
-            shutil.rmtree(outdir)
+            self.move_to_trash(outdir)
         os.makedirs(outdir)
 
     def output_qc_report(self, p_hash) -> str:
@@ -144,17 +447,26 @@ class PoppunkFileStore:
         """
         return self.path_str(self.output(p_hash), f"{p_hash}_qcreport.txt")
 
+    def project_catalog(self, p_hash: str) -> str:
+        """
+        :param p_hash: [project hash]
+        :return str: [path to SQLite catalog of the project's results]
+        """
+        return self.path_str(self.output(p_hash), "catalog.sqlite")
+
     def output_cluster(self, p_hash) -> str:
         """
         :param p_hash: [project hash]
-        :return str: [path to cluster results file]
+        :return str: [path to cluster results file of projects run before
+            the project catalog]
         """
         return str(PurePath(self.output(p_hash), "cluster_results.pickle"))
 
     def external_to_poppunk_clusters(self, p_hash) -> str:
         """
         :param p_hash: [project hash]
-        :return str: [path to mapping between external and poppunk clusters]
+        :return str: [path to mapping between external and poppunk clusters
+            of projects run before the project catalog]
         """
         return self.path_str(self.output(p_hash), "external_to_poppunk_clusters.pickle")
 
@@ -182,6 +494,14 @@ class PoppunkFileStore:
         """
         return self.path_str(self.output(p_hash), f"{p_hash}.h5")
 
+    def query_distances(self, p_hash) -> str:
+        """
+        :param p_hash: [project hash]
+        :return str: [path prefix of the query-reference distances stored by
+            PopPUNK assign, the names in .pkl and the distances in .npy]
+        """
+        return self.path_str(self.output(p_hash), f"{p_hash}.dists")
+
     def include_file(self, p_hash: str, cluster: str) -> str:
         """
         :param p_hash: [project hash]
@@ -258,12 +578,29 @@ class PoppunkFileStore:
     def tmp(self, p_hash) -> str:
         """
         :param p_hash: [project hash]
-        :return str: [path to tmp folder]
+        :return str: [path to tmp folder, in the job's scratch folder if
+            the worker has one]
         """
-        tmp_path = PurePath(self.output(p_hash), "tmp")
+        if self.scratch is not None:
+            tmp_path = PurePath(self.scratch, p_hash)
+        else:
+            tmp_path = PurePath(self.output(p_hash), "tmp")
         os.makedirs(tmp_path, exist_ok=True)
         return str(tmp_path)
 
+    def appended_samples_store(self, p_hash: str) -> "PoppunkFileStore":
+        """
+        [Returns a copy of the filestore with the project's output folder in
+        its tmp folder, where samples added to an existing project are
+        assigned before their outputs are merged into the project's.]
+
+        :param p_hash: [project hash]
+        :return PoppunkFileStore: [filestore of the added samples]
+        """
+        store = copy.copy(self)
+        store.output_base = PurePath(self.tmp(p_hash), "append")
+        return store
+
     def output_tmp(self, p_hash) -> str:
         """
         Generates the path to the full assign output folder when using full db.
@@ -295,15 +632,16 @@ class PoppunkFileStore:
             f"{p_hash}_external_clusters.csv",
         )
 
-    def tmp_output_metadata(self, p_hash: str) -> str:
+    def output_metadata(self, p_hash: str) -> str:
         """
         [Generates the path to the metadata csv file
-        for the given project hash.]
+        for the given project hash. Kept in the output folder, as
+        clusters can be visualised on demand after tmp is removed.]
 
         :param p_hash: [project hash]
         :return str: [path to metadata file]
         """
-        return self.path_str(self.tmp(p_hash), "metadata.csv")
+        return self.path_str(self.output(p_hash), "metadata.csv")
 
     def tmp_output_cluster_metadata(self, p_hash: str, cluster_num: str) -> str:
         """
@@ -0,0 +1,131 @@
+import json
+import os
+import struct
+import tempfile
+from typing import Any, BinaryIO
+
+import numpy as np
+
+# File layout: magic, header length (uint32), JSON header, zero padding to an
+# 8 byte boundary, then the k-mer hashes of all sketch properties as one
+# little-endian uint64 array. The header holds all other sketch properties and
+# the offset and length of each property's hashes in the array.
+MAGIC = b"BBSKETCH"
+FORMAT_VERSION = 1
+HASH_DTYPE = np.dtype("<u8")
+_LENGTH = struct.Struct("<I")
+
+
+def is_hex_list(value: Any) -> bool:
+    """
+    :param value: [sketch property]
+    :return bool: [whether the property is a list of hexadecimal hashes,
+        the way k-mer sketches are sent by the frontend]
+    """
+    return isinstance(value, list) and len(value) > 0 and isinstance(value[0], str) and value[0].startswith("0x")
+
+
+def write_binary_sketch(path: str, sketch: dict) -> None:
+    """
+    [Writes a sketch in binary format. The file is written under a temporary
+    name and renamed, so readers never see a partly written sketch.]
+
+    :param path: [destination path]
+    :param sketch: [sketch as sent by the frontend, hashes in hexadecimal]
+    """
+    properties = {}
+    hashes = {}
+    arrays = []
+    offset = 0
+    for key, value in sketch.items():
+        if is_hex_list(value):
+            array = np.fromiter((int(x, 16) for x in value), dtype=HASH_DTYPE, count=len(value))
+            hashes[key] = [offset, len(array)]
+            arrays.append(array)
+            offset += len(array)
+        else:
+            properties[key] = value
+
+    header = json.dumps({"version": FORMAT_VERSION, "properties": properties, "hashes": hashes}).encode("utf-8")
+    padding = -(len(MAGIC) + _LENGTH.size + len(header)) % HASH_DTYPE.itemsize
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(_LENGTH.pack(len(header)))
+            f.write(header)
+            f.write(b"\0" * padding)
+            for array in arrays:
+                f.write(array.tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_binary_sketch(path: str) -> dict:
+    """
+    [Reads a binary sketch without parsing any hashes. Hashes are returned
+    as uint64 arrays memory-mapped from the file.]
+
+    :param path: [path to binary sketch]
+    :return dict: [sketch properties, hashes as numpy arrays]
+    """
+    with open(path, "rb") as f:
+        header, data_offset = _read_header(f)
+    total = sum(length for _, length in header["hashes"].values())
+    data = (
+        np.memmap(path, dtype=HASH_DTYPE, mode="r", offset=data_offset, shape=(total,))
+        if total
+        else np.empty(0, dtype=HASH_DTYPE)
+    )
+    sketch = dict(header["properties"])
+    for key, (offset, length) in header["hashes"].items():
+        sketch[key] = data[offset : offset + length]
+    return sketch
+
+
+def to_hex_sketch(sketch: dict) -> dict:
+    """
+    [Converts hashes read from a binary sketch back to the hexadecimal
+    strings the frontend sent.]
+
+    :param sketch: [sketch with hashes as numpy arrays]
+    :return dict: [sketch with hashes as lists of hexadecimal strings]
+    """
+    return {
+        key: [f"0x{x:x}" for x in value.tolist()] if isinstance(value, np.ndarray) else value
+        for key, value in sketch.items()
+    }
+
+
+def from_hex_sketch(sketch: dict) -> dict:
+    """
+    [Converts the hexadecimal hashes of a JSON sketch to uint64 arrays, the
+    form binary sketches are read in.]
+
+    :param sketch: [sketch as sent by the frontend]
+    :return dict: [sketch with hashes as numpy arrays]
+    """
+    return {
+        key: np.fromiter((int(x, 16) for x in value), dtype=HASH_DTYPE, count=len(value))
+        if is_hex_list(value)
+        else value
+        for key, value in sketch.items()
+    }
+
+
+def _read_header(f: BinaryIO) -> tuple[dict, int]:
+    """
+    :param f: [binary sketch file opened for reading]
+    :return tuple: [header and offset of the hash array in the file]
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{f.name} is not a binary sketch")
+    (header_length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+    header = json.loads(f.read(header_length))
+    if header["version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported binary sketch version {header['version']} in {f.name}")
+    end_of_header = len(MAGIC) + _LENGTH.size + header_length
+    return header, end_of_header + (-end_of_header % HASH_DTYPE.itemsize)
@@ -0,0 +1,375 @@
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+from .config import ConfigurationError
+
+# objects above this size are transferred in parts, in parallel
+MULTIPART_THRESHOLD = 16 * 1024**2
+MULTIPART_PART_SIZE = 8 * 1024**2
+TRANSFER_THREADS = 8
+
+
+class StorageBackend(ABC):
+    """
+    [Where stored objects, e.g. sketches, live. Objects are addressed by
+    a key relative to the store and are read and written through local
+    files, as PopPUNK and numpy need paths.]
+    """
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """
+        :param key: [object key]
+        :return bool: [whether the object exists]
+        """
+
+    @abstractmethod
+    def local_path(self, key: str) -> str:
+        """
+        :param key: [object key]
+        :raises FileNotFoundError: [if the object does not exist]
+        :return str: [path to a local copy of the object to read]
+        """
+
+    @abstractmethod
+    def write_path(self, key: str) -> str:
+        """
+        [Local path to write a new object to, before it is committed.]
+
+        :param key: [object key]
+        :return str: [local path, its folder exists]
+        """
+
+    @abstractmethod
+    def commit(self, key: str) -> None:
+        """
+        [Publishes an object written to its write_path.]
+
+        :param key: [object key]
+        """
+
+
+class LocalStorageBackend(StorageBackend):
+    """
+    [Objects stored as files in a local or shared (e.g. NFS) folder.]
+    """
+
+    def __init__(self, root: str):
+        """
+        :param root: [folder objects are stored in]
+        """
+        self.root = root
+
+    def path(self, key: str) -> str:
+        """
+        :param key: [object key]
+        :return str: [path of the object]
+        """
+        return os.path.join(self.root, key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def local_path(self, key: str) -> str:
+        if not self.exists(key):
+            raise FileNotFoundError(self.path(key))
+        return self.path(key)
+
+    def write_path(self, key: str) -> str:
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        return self.path(key)
+
+    def commit(self, key: str) -> None:
+        # written in place
+        pass
+
+
+class ObjectStorageBackend(StorageBackend):
+    """
+    [Objects stored in an S3-compatible object store. Reads go through a
+    local disk cache, which is safe as stored objects are never modified,
+    and new objects are written to the cache before upload. Large objects
+    are transferred as parallel multipart uploads and ranged downloads.
+
+    The client is created lazily, so the backend can be pickled into jobs;
+    workers use their own client and cache.]
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        cache_location: Optional[str] = None,
+    ):
+        """
+        :param bucket: [bucket objects are stored in]
+        :param prefix: [prefix of all keys of this store]
+        :param endpoint_url: [URL of an S3-compatible service, a file:// URL
+            for a local stand-in, or None for AWS S3]
+        :param cache_location: [local cache folder, defaults to
+            STORAGE_CACHE_LOCATION or a folder in the temp directory]
+        """
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.cache_location = cache_location
+        self._client = None
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "_client": None}
+
+    @property
+    def client(self) -> Any:
+        """
+        :return Any: [S3 client, or the local stand-in for file:// endpoints]
+        """
+        if self._client is None:
+            if self.endpoint_url is not None and self.endpoint_url.startswith("file://"):
+                self._client = LocalObjectStoreClient(urlparse(self.endpoint_url).path)
+            else:
+                try:
+                    import boto3  # noqa: PLC0415
+                except ImportError as e:
+                    raise ConfigurationError("boto3 must be installed to use an S3 object store.") from e
+                self._client = boto3.client("s3", endpoint_url=self.endpoint_url)
+        return self._client
+
+    def object_key(self, key: str) -> str:
+        """
+        :param key: [key relative to the store]
+        :return str: [key in the bucket]
+        """
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def cache_path(self, key: str) -> str:
+        """
+        :param key: [object key]
+        :return str: [path of the object in the local cache]
+        """
+        cache_location = (
+            self.cache_location
+            or os.getenv("STORAGE_CACHE_LOCATION")
+            or os.path.join(tempfile.gettempdir(), "beebop_storage_cache")
+        )
+        return os.path.join(cache_location, self.bucket, self.object_key(key))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.cache_path(key)) or self._head(key) is not None
+
+    def local_path(self, key: str) -> str:
+        path = self.cache_path(key)
+        if not os.path.exists(path):
+            self.download_file(key, path)
+        return path
+
+    def write_path(self, key: str) -> str:
+        path = self.cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def commit(self, key: str) -> None:
+        self.upload_file(self.cache_path(key), key)
+
+    def upload_file(self, src: str, key: str) -> None:
+        """
+        [Uploads a file, in parallel parts if it is large.]
+
+        :param src: [local file]
+        :param key: [object key]
+        """
+        object_key = self.object_key(key)
+        size = os.path.getsize(src)
+        if size < MULTIPART_THRESHOLD:
+            with open(src, "rb") as f:
+                self.client.put_object(Bucket=self.bucket, Key=object_key, Body=f.read())
+            return
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=object_key)["UploadId"]
+
+        def upload_part(part_number: int) -> dict:
+            with open(src, "rb") as f:
+                f.seek((part_number - 1) * MULTIPART_PART_SIZE)
+                body = f.read(MULTIPART_PART_SIZE)
+            response = self.client.upload_part(
+                Bucket=self.bucket, Key=object_key, UploadId=upload_id, PartNumber=part_number, Body=body
+            )
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+        try:
+            with ThreadPoolExecutor(max_workers=TRANSFER_THREADS) as pool:
+                parts = list(pool.map(upload_part, range(1, -(-size // MULTIPART_PART_SIZE) + 1)))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=object_key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id)
+            raise
+
+    def download_file(self, key: str, dst: str) -> None:
+        """
+        [Downloads an object, in parallel byte ranges if it is large. The
+        file is written under a temporary name and renamed, so readers never
+        see a partial download.]
+
+        :param key: [object key]
+        :param dst: [local destination]
+        :raises FileNotFoundError: [if the object does not exist]
+        """
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(f"{self.bucket}/{self.object_key(key)}")
+        size = head["ContentLength"]
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst), suffix=".tmp")
+
+        def download_range(start: int) -> None:
+            end = min(start + MULTIPART_PART_SIZE, size) - 1
+            body = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key), Range=f"bytes={start}-{end}")
+            os.pwrite(fd, body["Body"].read(), start)
+
+        try:
+            if size < MULTIPART_THRESHOLD:
+                body = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))
+                os.write(fd, body["Body"].read())
+            else:
+                with ThreadPoolExecutor(max_workers=TRANSFER_THREADS) as pool:
+                    list(pool.map(download_range, range(0, size, MULTIPART_PART_SIZE)))
+            os.close(fd)
+            os.replace(tmp_path, dst)
+        except BaseException:
+            os.close(fd)
+            os.unlink(tmp_path)
+            raise
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except Exception as e:
+            if _is_not_found(e):
+                return None
+            raise
+
+
+class LocalObjectStoreClient:
+    """
+    [Stand-in for an S3 client, storing buckets as folders on local disk.
+    Implements the subset of the S3 API used by ObjectStorageBackend, so the
+    object store path can be tested, and developed against, without a
+    service. Method signatures match the S3 client's, so some arguments are
+    unused.]
+    """
+
+    def __init__(self, root: str):
+        """
+        :param root: [folder holding one sub-folder per bucket]
+        """
+        self.root = root
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"NoSuchKey: {Bucket}/{Key}")
+        return {"ContentLength": os.path.getsize(path)}
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None) -> dict:
+        self.head_object(Bucket, Key)
+        with open(self._path(Bucket, Key), "rb") as f:
+            if Range is None:
+                data = f.read()
+            else:
+                start, end = (int(x) for x in Range.removeprefix("bytes=").split("-"))
+                f.seek(start)
+                data = f.read(end - start + 1)
+        return {"Body": _Body(data)}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes) -> dict:
+        self._write(self._path(Bucket, Key), Body)
+        return {}
+
+    def create_multipart_upload(self, Bucket: str, Key: str) -> dict:  # noqa: ARG002
+        upload_id = tempfile.mkdtemp(dir=self._uploads(Bucket))
+        return {"UploadId": os.path.basename(upload_id)}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes) -> dict:  # noqa: ARG002
+        self._write(os.path.join(self._uploads(Bucket), UploadId, str(PartNumber)), Body)
+        return {"ETag": f"{UploadId}-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict) -> dict:
+        upload_folder = os.path.join(self._uploads(Bucket), UploadId)
+        data = b""
+        for part in sorted(MultipartUpload["Parts"], key=lambda part: part["PartNumber"]):
+            with open(os.path.join(upload_folder, str(part["PartNumber"])), "rb") as f:
+                data += f.read()
+        self._write(self._path(Bucket, Key), data)
+        shutil.rmtree(upload_folder)
+        return {}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> dict:  # noqa: ARG002
+        shutil.rmtree(os.path.join(self._uploads(Bucket), UploadId), ignore_errors=True)
+        return {}
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, key)
+
+    def _uploads(self, bucket: str) -> str:
+        path = os.path.join(self.root, ".uploads", bucket)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def read(self) -> bytes:
+        return self._data
+
+
+def _is_not_found(error: Exception) -> bool:
+    """
+    :param error: [error raised by head_object]
+    :return bool: [whether the error means the object does not exist]
+    """
+    if isinstance(error, FileNotFoundError):
+        return True
+    # botocore ClientError
+    code = getattr(error, "response", {}).get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+def create_storage_backend(root: str, prefix: str) -> StorageBackend:
+    """
+    [Creates the backend configured with the STORAGE_BACKEND environment
+    variable: "local" (default) stores objects under root, "object" in the
+    OBJECT_STORE_BUCKET bucket of the S3-compatible service at
+    OBJECT_STORE_ENDPOINT_URL (AWS S3 if unset, a local stand-in for
+    file:// URLs).]
+
+    :param root: [local folder for the local backend]
+    :param prefix: [key prefix of the store in the object store]
+    :raises ConfigurationError: [if the configuration is invalid]
+    :return StorageBackend: [storage backend]
+    """
+    backend = os.getenv("STORAGE_BACKEND", "local")
+    if backend == "local":
+        return LocalStorageBackend(root)
+    if backend == "object":
+        bucket = os.getenv("OBJECT_STORE_BUCKET")
+        if not bucket:
+            raise ConfigurationError("OBJECT_STORE_BUCKET environment variable is not set.")
+        return ObjectStorageBackend(bucket, prefix, os.getenv("OBJECT_STORE_ENDPOINT_URL"))
+    raise ConfigurationError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -1,3 +1,5 @@
+from .assignment_cache import AssignmentCache
+from .catalog import ProjectCatalog
 from .redis import RedisManager
 
-__all__ = ["RedisManager"]
+__all__ = ["AssignmentCache", "ProjectCatalog", "RedisManager"]
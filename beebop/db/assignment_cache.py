@@ -0,0 +1,117 @@
+import json
+import sqlite3
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+# cluster columns are untyped, as in the project catalog
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assignments (
+    species TEXT NOT NULL,
+    db_digest TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    cluster,
+    raw_cluster_num,
+    sublineage TEXT,
+    PRIMARY KEY (species, db_digest, hash)
+);
+"""
+# seconds to wait for another writer to finish
+BUSY_TIMEOUT = 30
+# maximum number of hashes bound in one query
+QUERY_BATCH = 500
+
+
+class AssignmentCache:
+    """
+    [SQLite cache of the cluster assignments and sub-lineage ranks of
+    samples, shared by all projects. Entries are keyed by sample hash,
+    species and a digest of the species' databases, so a database update
+    invalidates them; entries of other database versions are removed when
+    new results are saved.]
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: [path to the cache database]
+        """
+        self.path = path
+
+    def get(self, species: str, db_digest: str, hashes: Iterable[str]) -> dict[str, dict[str, Any]]:
+        """
+        :param species: [species name]
+        :param db_digest: [digest of the species' databases]
+        :param hashes: [sample hashes]
+        :return dict: [cluster, raw cluster number and sub-lineage result
+            (None if not assigned yet) by sample hash, for cached samples]
+        """
+        hashes = list(hashes)
+        cached = {}
+        with self._connect() as conn:
+            for start in range(0, len(hashes), QUERY_BATCH):
+                batch = hashes[start : start + QUERY_BATCH]
+                rows = conn.execute(
+                    "SELECT hash, cluster, raw_cluster_num, sublineage FROM assignments "
+                    f"WHERE species = ? AND db_digest = ? AND hash IN ({', '.join('?' * len(batch))})",
+                    (species, db_digest, *batch),
+                )
+                for row in rows:
+                    cached[row["hash"]] = {
+                        "cluster": row["cluster"],
+                        "raw_cluster_num": row["raw_cluster_num"],
+                        "sublineage": None if row["sublineage"] is None else json.loads(row["sublineage"]),
+                    }
+        return cached
+
+    def save_assignments(self, species: str, db_digest: str, assignments: Iterable[dict]) -> None:
+        """
+        [Stores cluster assignments, keeping cached sub-lineage results of
+        samples already in the cache, and removes the entries of the
+        species' other database versions.]
+
+        :param species: [species name]
+        :param db_digest: [digest of the species' databases]
+        :param assignments: [sample hash with cluster and raw cluster number]
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM assignments WHERE species = ? AND db_digest != ?", (species, db_digest))
+            conn.executemany(
+                "INSERT INTO assignments (species, db_digest, hash, cluster, raw_cluster_num) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (species, db_digest, hash) DO UPDATE SET "
+                "cluster = excluded.cluster, raw_cluster_num = excluded.raw_cluster_num",
+                (
+                    (species, db_digest, value["hash"], value["cluster"], value["raw_cluster_num"])
+                    for value in assignments
+                ),
+            )
+
+    def save_sublineages(self, species: str, db_digest: str, sublineages: dict[str, dict]) -> None:
+        """
+        [Stores sub-lineage results of samples whose cluster assignment is cached.]
+
+        :param species: [species name]
+        :param db_digest: [digest of the species' databases]
+        :param sublineages: [sub-lineage assignment results by sample hash]
+        """
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE assignments SET sublineage = ? WHERE species = ? AND db_digest = ? AND hash = ?",
+                ((json.dumps(result), species, db_digest, sample_hash) for sample_hash, result in sublineages.items()),
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        [Opens a connection in a transaction, committed on success and
+        rolled back on error. The cache is created on first use.]
+        """
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        conn.row_factory = sqlite3.Row
+        try:
+            # caches written by earlier versions are in WAL mode, which persists in the file
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.executescript(SCHEMA)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
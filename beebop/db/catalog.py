@@ -0,0 +1,249 @@
+import json
+import os
+import sqlite3
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any, Optional
+
+# cluster columns are declared without a type, so clusters keep the type
+# PopPUNK assigned them (numbers for internal clusters, strings for external)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    idx INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    cluster,
+    raw_cluster_num
+);
+CREATE INDEX IF NOT EXISTS samples_cluster ON samples (cluster);
+CREATE TABLE IF NOT EXISTS failed_samples (
+    hash TEXT PRIMARY KEY,
+    fail_reasons TEXT NOT NULL,
+    fail_type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sublineages (
+    hash TEXT PRIMARY KEY,
+    result TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS external_clusters (
+    external_cluster,
+    poppunk_cluster,
+    PRIMARY KEY (external_cluster, poppunk_cluster)
+);
+"""
+# seconds to wait for another writer to finish
+BUSY_TIMEOUT = 30
+
+
+class ProjectCatalog:
+    """
+    [SQLite catalog of the results of a project: cluster assignments,
+    failed samples, sub-lineages and the mapping of external to PopPUNK
+    clusters. Workers write each result in a single transaction; the API
+    looks up single samples and clusters through indexes, without loading
+    the whole project. The database uses SQLite's default rollback journal,
+    as WAL mode needs shared memory that network filesystems do not
+    provide; a read waits for a job writing for up to BUSY_TIMEOUT.]
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: [path to the catalog database]
+        """
+        self.path = path
+
+    def exists(self) -> bool:
+        """
+        :return bool: [whether the catalog has been created]
+        """
+        return os.path.exists(self.path)
+
+    def save_assignments(self, assignments: dict[int, dict], failed_samples: Optional[dict[str, dict]] = None) -> None:
+        """
+        [Replaces the cluster assignments and, if given, the failed samples
+        of the project, in one transaction.]
+
+        :param assignments: [dict with index (key) and sample hash with
+            cluster and raw cluster number, if assigned yet (value)]
+        :param failed_samples: [failed samples by sample hash, with
+            failReasons and failType]
+        """
+        with self._connect(write=True) as conn:
+            conn.execute("DELETE FROM samples")
+            conn.executemany(
+                "INSERT INTO samples (idx, hash, cluster, raw_cluster_num) VALUES (?, ?, ?, ?)",
+                (
+                    (idx, value["hash"], value.get("cluster"), value.get("raw_cluster_num"))
+                    for idx, value in assignments.items()
+                ),
+            )
+            if failed_samples is not None:
+                conn.execute("DELETE FROM failed_samples")
+                conn.executemany(
+                    "INSERT INTO failed_samples (hash, fail_reasons, fail_type) VALUES (?, ?, ?)",
+                    (
+                        (sample_hash, json.dumps(value["failReasons"]), value["failType"])
+                        for sample_hash, value in failed_samples.items()
+                    ),
+                )
+
+    def save_sublineages(self, sublineages: dict[str, dict]) -> None:
+        """
+        :param sublineages: [sub-lineage assignment results by sample hash]
+        """
+        with self._connect(write=True) as conn:
+            conn.execute("DELETE FROM sublineages")
+            conn.executemany(
+                "INSERT INTO sublineages (hash, result) VALUES (?, ?)",
+                ((sample_hash, json.dumps(result)) for sample_hash, result in sublineages.items()),
+            )
+
+    def save_external_to_poppunk_clusters(self, external_to_poppunk_clusters: dict[str, set[str]]) -> None:
+        """
+        :param external_to_poppunk_clusters: [PopPUNK clusters by external cluster]
+        """
+        with self._connect(write=True) as conn:
+            conn.execute("DELETE FROM external_clusters")
+            conn.executemany(
+                "INSERT INTO external_clusters (external_cluster, poppunk_cluster) VALUES (?, ?)",
+                (
+                    (external_cluster, poppunk_cluster)
+                    for external_cluster, poppunk_clusters in external_to_poppunk_clusters.items()
+                    for poppunk_cluster in poppunk_clusters
+                ),
+            )
+
+    def get_assignments(self) -> dict[int, dict]:
+        """
+        :return dict: [dict with index (key) and sample hash with cluster
+            and raw cluster number, if assigned yet (value)]
+        """
+        with self._connect() as conn:
+            return {
+                row["idx"]: _assignment(row)
+                for row in conn.execute("SELECT idx, hash, cluster, raw_cluster_num FROM samples ORDER BY idx")
+            }
+
+    def get_sample(self, sample_hash: str) -> Optional[dict]:
+        """
+        :param sample_hash: [sample hash]
+        :return Optional[dict]: [cluster assignment of the sample, None if
+            it is not in the project]
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT hash, cluster, raw_cluster_num FROM samples WHERE hash = ?", (sample_hash,)
+            ).fetchone()
+        return None if row is None else _assignment(row)
+
+    def get_cluster_samples(self, cluster: Any) -> list[dict]:
+        """
+        :param cluster: [assigned cluster]
+        :return list[dict]: [cluster assignments of the samples in the cluster]
+        """
+        with self._connect() as conn:
+            return [
+                _assignment(row)
+                for row in conn.execute(
+                    "SELECT hash, cluster, raw_cluster_num FROM samples WHERE cluster = ? ORDER BY idx", (cluster,)
+                )
+            ]
+
+    def get_cluster_sizes(self, limit: Optional[int] = None) -> dict[Any, int]:
+        """
+        :param limit: [number of largest clusters to return, all if None]
+        :return dict: [number of samples by cluster, largest first; ties in
+            the order the clusters were first assigned]
+        """
+        with self._connect() as conn:
+            return dict(
+                conn.execute(
+                    "SELECT cluster, COUNT(*) FROM samples WHERE cluster IS NOT NULL GROUP BY cluster "
+                    "ORDER BY COUNT(*) DESC, MIN(idx) LIMIT ?",
+                    (-1 if limit is None else limit,),
+                ).fetchall()
+            )
+
+    def get_failed_samples(self) -> dict[str, dict]:
+        """
+        :return dict: [failed samples by sample hash, with hash, failReasons and failType]
+        """
+        with self._connect() as conn:
+            return {
+                row["hash"]: {
+                    "failReasons": json.loads(row["fail_reasons"]),
+                    "failType": row["fail_type"],
+                    "hash": row["hash"],
+                }
+                for row in conn.execute("SELECT hash, fail_reasons, fail_type FROM failed_samples")
+            }
+
+    def get_sublineages(self) -> dict[str, dict]:
+        """
+        :return dict: [sub-lineage assignment results by sample hash]
+        """
+        with self._connect() as conn:
+            return {
+                row["hash"]: json.loads(row["result"]) for row in conn.execute("SELECT hash, result FROM sublineages")
+            }
+
+    def get_external_to_poppunk_clusters(self) -> dict[str, set[str]]:
+        """
+        :return dict: [PopPUNK clusters by external cluster]
+        """
+        external_to_poppunk_clusters: dict[str, set[str]] = {}
+        with self._connect() as conn:
+            for row in conn.execute("SELECT external_cluster, poppunk_cluster FROM external_clusters"):
+                external_to_poppunk_clusters.setdefault(row["external_cluster"], set()).add(row["poppunk_cluster"])
+        return external_to_poppunk_clusters
+
+    def copy(self, path: str) -> "ProjectCatalog":
+        """
+        [Copies the catalog, including changes still in its write-ahead log,
+        using SQLite's online backup.]
+
+        :param path: [path to the new catalog database]
+        :return ProjectCatalog: [the copy]
+        """
+        with self._connect() as conn:
+            target = sqlite3.connect(path)
+            try:
+                conn.backup(target)
+            finally:
+                target.close()
+        return ProjectCatalog(path)
+
+    @contextmanager
+    def _connect(self, write: bool = False) -> Iterator[sqlite3.Connection]:
+        """
+        [Opens a connection in a transaction, committed on success and
+        rolled back on error. The catalog is created by the first write.]
+
+        :param write: [whether the connection writes]
+        :raises FileNotFoundError: [if reading a catalog that does not exist]
+        """
+        if not write and not self.exists():
+            raise FileNotFoundError(self.path)
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        conn.row_factory = sqlite3.Row
+        try:
+            if write:
+                # catalogs written by earlier versions are in WAL mode, which persists in the file
+                conn.execute("PRAGMA journal_mode=DELETE")
+                conn.executescript(SCHEMA)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+def _assignment(row: sqlite3.Row) -> dict:
+    """
+    :param row: [row of the samples table]
+    :return dict: [sample hash, with cluster and raw cluster number if assigned]
+    """
+    assignment = {"hash": row["hash"]}
+    if row["cluster"] is not None:
+        assignment["cluster"] = row["cluster"]
+    if row["raw_cluster_num"] is not None:
+        assignment["raw_cluster_num"] = row["raw_cluster_num"]
+    return assignment
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from redis import Redis
 from werkzeug.exceptions import InternalServerError
 
@@ -69,6 +71,16 @@ class RedisManager:
         """
         return self.redis.hgetall(f"beebop:hash:job:visualise:{p_hash}")
 
+    def get_visualisation_status(self, p_hash: str, assign_cluster: str) -> Optional[bytes]:
+        """
+        [retrieves the visualisation job of a specific cluster in a project]
+
+        :param p_hash: [project hash]
+        :param assign_cluster: [cluster identifier]
+        :return: [visualisation job ID, None if the cluster has not been queued]
+        """
+        return self.redis.hget(f"beebop:hash:job:visualise:{p_hash}", assign_cluster)
+
     def set_visualisation_status(self, p_hash: str, assign_cluster: str, job_id: str) -> None:
         """
         [sets a visualisation job for a specific cluster in a project]
@@ -83,6 +95,73 @@ class RedisManager:
             job_id,
         )
 
+    def claim_cluster_visualisation(self, p_hash: str, assign_cluster: str, ttl: int = 60) -> bool:
+        """
+        [claims queueing the visualisation of a cluster, so concurrent
+        requests for the same cluster queue a single job. The claim expires
+        after ttl seconds if the claiming process dies]
+
+        :param p_hash: [project hash]
+        :param assign_cluster: [cluster identifier]
+        :param ttl: [seconds until the claim expires]
+        :return: [True if the claim was taken, False if another process holds it]
+        """
+        return bool(self.redis.set(f"beebop:claim:visualise:{p_hash}:{assign_cluster}", 1, nx=True, ex=ttl))
+
+    def release_cluster_visualisation(self, p_hash: str, assign_cluster: str) -> None:
+        """
+        [releases a claim taken by claim_cluster_visualisation]
+
+        :param p_hash: [project hash]
+        :param assign_cluster: [cluster identifier]
+        """
+        self.redis.delete(f"beebop:claim:visualise:{p_hash}:{assign_cluster}")
+
+    def record_stage_duration(self, species: str, stage: str, size: int, seconds: float) -> None:
+        """
+        [adds a completed stage duration to the running sums used to fit
+        duration against input size for a species and stage]
+
+        :param species: [species the stage ran for]
+        :param stage: [pipeline stage, e.g. assign]
+        :param size: [input size of the stage, e.g. number of samples]
+        :param seconds: [duration of the stage in seconds]
+        """
+        key = f"beebop:eta:{species}:{stage}"
+        pipeline = self.redis.pipeline()
+        pipeline.hincrbyfloat(key, "n", 1)
+        pipeline.hincrbyfloat(key, "sx", size)
+        pipeline.hincrbyfloat(key, "sy", seconds)
+        pipeline.hincrbyfloat(key, "sxx", size * size)
+        pipeline.hincrbyfloat(key, "sxy", size * seconds)
+        pipeline.hincrbyfloat("beebop:eta:all", "n", 1)
+        pipeline.hincrbyfloat("beebop:eta:all", "sy", seconds)
+        pipeline.execute()
+
+    def get_stage_duration_sums(self, species: str, stage: str) -> dict[str, float]:
+        """
+        [retrieves the running duration sums for a species and stage]
+
+        :param species: [species the stage ran for]
+        :param stage: [pipeline stage, e.g. assign]
+        :return: [dict with n, sx, sy, sxx and sxy sums, empty if never recorded]
+        """
+        return {
+            key.decode("utf-8"): float(value)
+            for key, value in self.redis.hgetall(f"beebop:eta:{species}:{stage}").items()
+        }
+
+    def get_mean_job_duration(self) -> Optional[float]:
+        """
+        [retrieves the mean duration of all recorded stages, across species]
+
+        :return: [mean duration in seconds, None if nothing was recorded]
+        """
+        n, total = self.redis.hmget("beebop:eta:all", ["n", "sy"])
+        if not n:
+            return None
+        return float(total) / float(n)
+
     def check_redis_connection(self) -> None:
         """
         [checks the Redis connection and raises error if connection fails]
@@ -1,14 +1,33 @@
-from .dataclasses import ClusteringConfig, LocationMetadata, Qc, ResponseBody, ResponseError, SpeciesConfig
+from .dataclasses import (
+    AdmissionLimits,
+    Archival,
+    ClusteringConfig,
+    CpuBudget,
+    GarbageCollection,
+    LocationMetadata,
+    ProjectUsage,
+    Qc,
+    ResponseBody,
+    ResponseError,
+    SpeciesConfig,
+    SpeciesRegistryEntry,
+)
 from .enums import FailedSampleType
 from .types import Job_Types
 
 __all__ = [
+    "AdmissionLimits",
+    "Archival",
     "ClusteringConfig",
+    "CpuBudget",
     "FailedSampleType",
+    "GarbageCollection",
     "Job_Types",
     "LocationMetadata",
+    "ProjectUsage",
     "Qc",
     "ResponseBody",
     "ResponseError",
     "SpeciesConfig",
+    "SpeciesRegistryEntry",
 ]
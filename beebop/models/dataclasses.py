@@ -34,6 +34,48 @@ class Qc:
     upper_n: Optional[int]
 
 
+@dataclass
+class AdmissionLimits:
+    max_queue_depth: int
+    max_backlog_seconds: int
+    min_free_disk_gb: float
+    expected_job_seconds: int
+
+
+@dataclass
+class CpuBudget:
+    total_cores: Optional[int]
+    samples_per_thread: int
+    max_wait_seconds: int
+    lease_seconds: int
+    ledger_file: str
+
+
+@dataclass
+class GarbageCollection:
+    quota_gigabytes: float
+    min_age_hours: float
+    interval_minutes: int
+
+
+@dataclass
+class Archival:
+    cold_days: float
+
+
+@dataclass
+class ProjectUsage:
+    p_hash: str
+    size: int
+    last_access: float
+    pinned: bool
+    in_flight: bool
+
+    @property
+    def protected(self) -> bool:
+        return self.pinned or self.in_flight
+
+
 @dataclass
 class SpeciesConfig:
     refdb: str
@@ -42,9 +84,24 @@ class SpeciesConfig:
     external_clusters_file: Optional[str]
     db_metadata_file: Optional[str]
     sublineages_db: Optional[str]
+    admission: Optional[AdmissionLimits]
     qc_dict: Qc
 
 
+@dataclass(frozen=True)
+class SpeciesRegistryEntry:
+    name: str
+    config: SpeciesConfig
+    ref_db_fs: DatabaseFileStore
+    full_db_fs: DatabaseFileStore
+    has_sublineages: bool
+    kmer_info: Optional[dict[str, int]]
+
+    @property
+    def available(self) -> bool:
+        return self.kmer_info is not None
+
+
 @dataclass
 class ResponseError:
     error: str
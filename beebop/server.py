@@ -0,0 +1,359 @@
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Optional
+
+from waitress import create_server
+
+from .api.config_routes import preload_read_only_cache
+from .config import PoppunkFileStore
+from .config.config import ARGS_JSON_PATH, get_args, get_environment
+from .services.species_registry import reload_species_registry
+from .services.trash_service import start_trash_reaper
+
+logger = logging.getLogger(__name__)
+
+# workers exiting sooner than this after starting count as crashing on start
+MIN_WORKER_LIFETIME_SECONDS = 10
+MAX_RESPAWN_DELAY_SECONDS = 60
+
+
+def create_listen_socket(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    """
+    [Creates the listening socket shared by all worker processes. It is bound
+    once in the master so every forked worker accepts from the same queue.]
+
+    :param host: [host to bind to]
+    :param port: [port to bind to]
+    :param backlog: [maximum number of pending connections]
+    :return socket.socket: [bound and listening socket]
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkServer:
+    """
+    [Pre-forking server that runs several waitress processes sharing one
+    listening socket, so API throughput scales with the number of cores.
+
+    The Flask app is created in each worker after the fork, so Redis clients
+    are never shared between processes. Read-only caches are populated in the
+    master before forking and inherited copy-on-write. The master also runs
+    the one thread emptying the trash, which the workers do not inherit.
+
+    When args.json changes, the master reloads it and builds a new species
+    registry while the current workers keep serving, then restarts the
+    workers gracefully so they pick it up. Projects already submitted keep
+    the configuration and databases they were submitted with.
+
+    Signals handled by the master:
+        SIGTERM/SIGINT - stop all workers gracefully and exit
+        SIGHUP - reload args.json, then restart gracefully: start new
+            workers, then drain the old ones]
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        workers: int,
+        threads: int = 4,
+        graceful_timeout: int = 30,
+        reload_interval: int = 10,
+    ):
+        """
+        :param host: [host to bind to]
+        :param port: [port to bind to]
+        :param workers: [number of worker processes]
+        :param threads: [number of waitress threads per worker]
+        :param graceful_timeout: [seconds a worker may spend finishing
+            in-flight requests before it is stopped]
+        :param reload_interval: [seconds between checks of args.json for
+            changes, 0 to only reload on SIGHUP]
+        """
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.reload_interval = reload_interval
+        self.workers: set[int] = set()
+        self._started_at: dict[int, float] = {}
+        self._respawn_delay = 0.0
+        self._next_respawn = 0.0
+        self.socket: Optional[socket.socket] = None
+        self._stopping = False
+        self._reloading = False
+        self._args_mtime = get_args_mtime()
+        self._next_reload_check = time.monotonic() + reload_interval
+
+    def run(self) -> None:
+        """
+        [Binds the socket, preloads shared caches, forks the workers and
+        supervises them until asked to stop.]
+        """
+        self.socket = create_listen_socket(self.host, self.port)
+        self.preload()
+        self.start_trash_reaper()
+        # keep objects created so far out of the cyclic GC, so collections in
+        # the workers do not touch (and copy) the pages they share with us
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        logger.info(f"Serving on http://{self.host}:{self.port} with {self.num_workers} workers")
+        self.spawn_workers()
+        while not self._stopping:
+            self.check_reload()
+            self.reap_workers()
+            time.sleep(0.5)
+        self.stop_workers(list(self.workers))
+
+    def preload(self) -> None:
+        """
+        [Loads read-only data used by the config routes once in the master.]
+        """
+        _, dbs_location, _ = get_environment()
+        try:
+            preload_read_only_cache(get_args(), dbs_location)
+        except Exception:
+            # workers will build the cache lazily instead
+            logger.exception("Could not preload read-only cache")
+
+    def start_trash_reaper(self) -> None:
+        """
+        [Starts emptying the trash in the master, so it is emptied by one
+        thread however many workers are running.]
+        """
+        storage_location, _, _ = get_environment()
+        start_trash_reaper(PoppunkFileStore(storage_location), get_args())
+
+    def check_reload(self) -> None:
+        """
+        [Reloads args.json if SIGHUP was received or the file changed, and
+        restarts the workers only if the new configuration was accepted.]
+        """
+        reload_requested, self._reloading = self._reloading, False
+        if (reload_requested or self.args_changed()) and self.reload():
+            self.restart_workers()
+
+    def reload(self) -> bool:
+        """
+        [Reloads args.json and prewarms the shared caches for it in the
+        master. The current workers keep serving in the meantime.]
+
+        :return bool: [whether the new configuration is now in use]
+        """
+        self._args_mtime = get_args_mtime()
+        _, dbs_location, _ = get_environment()
+        args = reload_species_registry(dbs_location)
+        if args is None:
+            return False
+        try:
+            preload_read_only_cache(args, dbs_location)
+        except Exception:
+            logger.exception("Could not preload read-only cache")
+        gc.freeze()
+        return True
+
+    def args_changed(self) -> bool:
+        """
+        [Checks, at most every reload interval, whether args.json changed
+        since it was last loaded.]
+
+        :return bool: [whether args.json changed]
+        """
+        if not self.reload_interval or time.monotonic() < self._next_reload_check:
+            return False
+        self._next_reload_check = time.monotonic() + self.reload_interval
+        return get_args_mtime() != self._args_mtime
+
+    def spawn_workers(self) -> list[int]:
+        """
+        [Forks workers until the configured number is running.]
+
+        :return list[int]: [pids of the newly started workers]
+        """
+        new_pids = []
+        while len(self.workers) < self.num_workers:
+            pid = self.spawn_worker()
+            self.workers.add(pid)
+            self._started_at[pid] = time.monotonic()
+            new_pids.append(pid)
+        return new_pids
+
+    def spawn_worker(self) -> int:
+        """
+        [Forks a single worker process. The child never returns.]
+
+        :return int: [pid of the worker]
+        """
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            exit_code = 0
+            try:
+                self.run_worker()
+            except Exception:
+                logger.exception("Worker exited with error")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        return pid
+
+    def run_worker(self) -> None:  # pragma: no cover
+        """
+        [Entry point of a worker process: creates the app and serves requests
+        from the shared socket until told to stop.]
+        """
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+        # beebop.app builds the app at import time, so it must only be imported after the fork
+        from .app import app  # noqa: PLC0415
+
+        server = create_server(app, sockets=[self.socket], threads=self.threads)
+
+        def drain(*_):
+            server.accepting = False
+            threading.Thread(target=self.exit_when_idle, args=(server,), daemon=True).start()
+
+        signal.signal(signal.SIGTERM, drain)
+        server.run()
+
+    def exit_when_idle(self, server) -> None:
+        """
+        [Waits until a draining worker has no open connections, or the graceful
+        timeout passed, then terminates the worker process.]
+
+        :param server: [waitress server of this worker]
+        """
+        deadline = time.monotonic() + self.graceful_timeout
+        while server.active_channels and time.monotonic() < deadline:
+            time.sleep(0.1)
+        os._exit(0)
+
+    def restart_workers(self) -> None:
+        """
+        [Graceful restart: starts a full set of new workers first, then drains
+        the old ones, so there is no point at which nobody is accepting.]
+        """
+        old_workers = list(self.workers)
+        self.workers.clear()
+        self.spawn_workers()
+        self.stop_workers(old_workers)
+
+    def reap_workers(self) -> None:
+        """
+        [Collects exited workers and replaces them. Workers that exit soon
+        after starting, e.g. failing to import the app, are replaced after a
+        delay doubling with each such exit, so they are not forked in a
+        tight loop.]
+        """
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            started_at = self._started_at.pop(pid, None)
+            if pid in self.workers:
+                self.workers.discard(pid)
+                if started_at is not None and time.monotonic() - started_at < MIN_WORKER_LIFETIME_SECONDS:
+                    self._respawn_delay = min(max(self._respawn_delay * 2, 1), MAX_RESPAWN_DELAY_SECONDS)
+                    self._next_respawn = time.monotonic() + self._respawn_delay
+                    logger.warning(f"Worker {pid} exited on start, restarting in {self._respawn_delay:g} seconds")
+                else:
+                    self._respawn_delay = 0.0
+                    logger.warning(f"Worker {pid} exited unexpectedly, restarting")
+        if not self._stopping and time.monotonic() >= self._next_respawn:
+            self.spawn_workers()
+
+    def stop_workers(self, pids: list[int]) -> None:
+        """
+        [Asks workers to drain and waits for them, killing any that outlive
+        the graceful timeout.]
+
+        :param pids: [pids of the workers to stop]
+        """
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                continue
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    finished, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    finished = pid
+                if finished:
+                    remaining.discard(pid)
+            time.sleep(0.1)
+        for pid in remaining:
+            logger.warning(f"Worker {pid} did not stop in time, killing it")
+            os.kill(pid, signal.SIGKILL)
+        self.workers.difference_update(pids)
+        for pid in pids:
+            self._started_at.pop(pid, None)
+
+    def _handle_stop(self, *_) -> None:
+        self._stopping = True
+
+    def _handle_reload(self, *_) -> None:
+        self._reloading = True
+
+
+def get_args_mtime() -> Optional[int]:
+    """
+    :return Optional[int]: [modification time of args.json in nanoseconds,
+        None if it cannot be read]
+    """
+    try:
+        return os.stat(ARGS_JSON_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """
+    [Command line entry point: python -m beebop.server --port 5000 --workers 4]
+
+    :param argv: [command line arguments, defaults to sys.argv]
+    """
+    parser = argparse.ArgumentParser(description="Multi-process server for the beebop API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--graceful-timeout", type=int, default=30)
+    parser.add_argument("--reload-interval", type=int, default=10)
+    options = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    PreforkServer(
+        options.host,
+        options.port,
+        options.workers,
+        options.threads,
+        options.graceful_timeout,
+        options.reload_interval,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
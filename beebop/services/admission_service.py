@@ -0,0 +1,60 @@
+import math
+import shutil
+from types import SimpleNamespace
+from typing import Optional
+
+from rq import Queue, Worker
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+# there is no way to predict when disk space frees up, so ask clients to back off for a while
+DISK_RETRY_AFTER_SECONDS = 600
+
+
+def check_admission(queue: Queue, storage_location: str, limits: Optional[SimpleNamespace]) -> None:
+    """
+    [Checks whether a new project can be accepted, based on queue depth,
+    estimated backlog time and free disk space in the storage location.
+    Species without admission limits are always accepted.]
+
+    :param queue: [rq queue new jobs would be submitted to]
+    :param storage_location: [path to storage location]
+    :param limits: [admission limits for the species, from args.json]
+    :raises TooManyRequests: [when the queue is too deep or the backlog too long]
+    :raises ServiceUnavailable: [when the storage location is running out of space]
+    """
+    if limits is None:
+        return
+
+    free_gb = shutil.disk_usage(storage_location).free / 1024**3
+    if free_gb < limits.min_free_disk_gb:
+        raise ServiceUnavailable(
+            f"Not enough free disk space to accept new projects ({free_gb:.1f} GB free).",
+            retry_after=DISK_RETRY_AFTER_SECONDS,
+        )
+
+    queue_depth = get_queue_depth(queue)
+    seconds_per_job = limits.expected_job_seconds / max(Worker.count(queue=queue), 1)
+    if queue_depth >= limits.max_queue_depth:
+        jobs_over_limit = queue_depth - limits.max_queue_depth + 1
+        raise TooManyRequests(
+            f"Too many jobs waiting ({queue_depth}). Please try again later.",
+            retry_after=max(math.ceil(jobs_over_limit * seconds_per_job), 1),
+        )
+
+    backlog_seconds = queue_depth * seconds_per_job
+    if backlog_seconds > limits.max_backlog_seconds:
+        raise TooManyRequests(
+            f"Estimated wait of {math.ceil(backlog_seconds)} seconds is too long. Please try again later.",
+            retry_after=max(math.ceil(backlog_seconds - limits.max_backlog_seconds), 1),
+        )
+
+
+def get_queue_depth(queue: Queue) -> int:
+    """
+    [Number of jobs waiting to run: queued jobs plus jobs deferred until
+    their dependencies finish.]
+
+    :param queue: [rq queue]
+    :return int: [number of waiting jobs]
+    """
+    return queue.count + len(queue.deferred_job_registry)
@@ -0,0 +1,263 @@
+import fcntl
+import logging
+import os
+import time
+import zipfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import IO, Optional
+
+from beebop.config import PoppunkFileStore
+from beebop.db import RedisManager
+from beebop.models import Archival, GarbageCollection
+
+from .compression_service import COMPRESS_LEVEL, GZIP_SUFFIX, decompress_stream
+from .file_service import get_project_catalog
+from .gc_service import get_project_usage
+from .manifest_service import read_manifest, visualisation_stage, write_visualisation_manifest
+
+logger = logging.getLogger(__name__)
+
+
+def is_archived(p_hash: str, fs: PoppunkFileStore) -> bool:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return bool: [whether the project's output files are in its archive]
+    """
+    return os.path.exists(fs.project_archive(p_hash))
+
+
+@contextmanager
+def _project_archive_lock(p_hash: str, fs: PoppunkFileStore) -> Iterator[None]:
+    """
+    [Holds the archive lock of a project, so it is not archived and
+    rehydrated at the same time.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    """
+    with open(fs.project_archive_lock(p_hash), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def get_kept_files(p_hash: str, fs: PoppunkFileStore) -> set[str]:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return set[str]: [files in the output folder that are never archived,
+        as the API reads or writes them for every project]
+    """
+    catalog = os.path.basename(fs.project_catalog(p_hash))
+    return {
+        catalog,
+        f"{catalog}-journal",
+        *(
+            os.path.basename(path)
+            for path in (
+                fs.project_status(p_hash),
+                fs.project_last_access(p_hash),
+                fs.project_pin(p_hash),
+                fs.run_digest(p_hash),
+                fs.visualise_context(p_hash),
+                fs.project_archive(p_hash),
+                fs.project_archive_lock(p_hash),
+            )
+        ),
+    }
+
+
+def get_archivable_files(p_hash: str, fs: PoppunkFileStore) -> list[str]:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return list[str]: [paths of the project's output files, relative to its
+        output folder, other than the files that are never archived]
+    """
+    output_dir = fs.output(p_hash)
+    kept = get_kept_files(p_hash, fs)
+    names = []
+    for root, dirs, files in os.walk(output_dir):
+        relative = os.path.relpath(root, output_dir)
+        if relative == ".":
+            # manifests are read for every request of a file
+            dirs[:] = [name for name in dirs if name not in ("tmp", os.path.basename(fs.manifests(p_hash)))]
+        for name in files:
+            if relative == "." and name in kept:
+                continue
+            names.append(os.path.normpath(os.path.join(relative, name)))
+    return sorted(names)
+
+
+def archive_project(p_hash: str, fs: PoppunkFileStore) -> int:
+    """
+    [Packs the output files of a project into a single compressed archive
+    and deletes them. Folders, the catalog, status record, markers and
+    manifests are kept, so the project's results are still served without
+    reading the archive. Visualisation manifests are written first for
+    projects run before manifests existed, as zips are built from them. The
+    folder's modification time is restored, so archiving does not count as
+    an access.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return int: [bytes saved]
+    """
+    output_dir = fs.output(p_hash)
+    output_stat = os.stat(output_dir)
+    with _project_archive_lock(p_hash, fs):
+        if is_archived(p_hash, fs):
+            return 0
+        # projects run before the catalog existed are imported from files about to be archived
+        get_project_catalog(p_hash, fs)
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                cluster_num = entry.name.removeprefix("visualise_")
+                if (
+                    entry.is_dir()
+                    and entry.name.startswith("visualise_")
+                    and read_manifest(p_hash, fs, visualisation_stage(cluster_num)) is None
+                ):
+                    write_visualisation_manifest(p_hash, fs, cluster_num)
+
+        names = get_archivable_files(p_hash, fs)
+        if not names:
+            return 0
+        archive_path = fs.project_archive(p_hash)
+        tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+        size = 0
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as archive:
+            for name in names:
+                path = os.path.join(output_dir, name)
+                size += os.path.getsize(path)
+                # compressed files would only be deflated again
+                compress_type = zipfile.ZIP_STORED if name.endswith(GZIP_SUFFIX) else None
+                archive.write(path, arcname=name, compress_type=compress_type)
+        # readers fall back to the archive once a file is gone, so it must be complete first
+        os.replace(tmp_path, archive_path)
+        for name in names:
+            os.remove(os.path.join(output_dir, name))
+        saved = size - os.path.getsize(archive_path)
+    os.utime(output_dir, ns=(output_stat.st_atime_ns, output_stat.st_mtime_ns))
+    logger.info(f"Archived project {p_hash}, saving {saved} bytes")
+    return saved
+
+
+def rehydrate_project(p_hash: str, fs: PoppunkFileStore) -> bool:
+    """
+    [Unpacks the archive of a project, e.g. before a job writes to it
+    again.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return bool: [whether the project was archived]
+    """
+    if not is_archived(p_hash, fs):
+        return False
+    with _project_archive_lock(p_hash, fs):
+        if not is_archived(p_hash, fs):
+            return False
+        with zipfile.ZipFile(fs.project_archive(p_hash)) as archive:
+            archive.extractall(fs.output(p_hash))
+        os.remove(fs.project_archive(p_hash))
+    logger.info(f"Rehydrated project {p_hash}")
+    return True
+
+
+def open_artifact(p_hash: str, fs: PoppunkFileStore, path: str) -> IO[bytes]:
+    """
+    [Opens an output file of a project for reading, from the project's
+    archive if it has been archived. Only the requested member is
+    decompressed. Files stored compressed are decompressed while read.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param path: [path to the output file, without GZIP_SUFFIX]
+    :raises FileNotFoundError: [if the file is neither on disk nor archived]
+    :return IO[bytes]: [file opened in binary mode]
+    """
+    try:
+        return _open_stored_artifact(p_hash, fs, path)
+    except FileNotFoundError:
+        compressed = open_compressed_artifact(p_hash, fs, path)
+        if compressed is None:
+            raise
+    return decompress_stream(compressed)
+
+
+def open_compressed_artifact(p_hash: str, fs: PoppunkFileStore, path: str) -> Optional[IO[bytes]]:
+    """
+    [Opens the gzip compressed copy of an output file of a project, so it
+    can be sent without decompressing it.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param path: [path to the output file, without GZIP_SUFFIX]
+    :return Optional[IO[bytes]]: [gzip stream, None if the file is not
+        stored compressed]
+    """
+    try:
+        return _open_stored_artifact(p_hash, fs, f"{path}{GZIP_SUFFIX}")
+    except FileNotFoundError:
+        return None
+
+
+def _open_stored_artifact(p_hash: str, fs: PoppunkFileStore, path: str) -> IO[bytes]:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param path: [path to the stored file]
+    :raises FileNotFoundError: [if the file is neither on disk nor archived]
+    :return IO[bytes]: [file opened in binary mode]
+    """
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        pass
+    try:
+        archive = zipfile.ZipFile(fs.project_archive(p_hash))
+    except FileNotFoundError:
+        # rehydrated since the file was looked for
+        return open(path, "rb")
+    # the member stays readable after the archive is closed
+    with archive:
+        try:
+            return archive.open(os.path.relpath(path, fs.output(p_hash)))
+        except KeyError as e:
+            raise FileNotFoundError(f"No such file: '{path}'") from e
+
+
+def archive_cold_projects(
+    fs: PoppunkFileStore,
+    redis_manager: RedisManager,
+    gc_args: GarbageCollection,
+    archival_args: Archival,
+    dry_run: bool = False,
+) -> dict:
+    """
+    [Archives the projects that have not been accessed for cold_days,
+    skipping projects whose jobs may still be running.]
+
+    :param fs: [PoppunkFileStore instance]
+    :param redis_manager: [RedisManager instance]
+    :param gc_args: [garbage_collection arguments from args.json, deciding
+        which projects are in flight]
+    :param archival_args: [archival arguments from args.json]
+    :param dry_run: [only report what would be archived]
+    :return dict: [archived projects and bytes saved]
+    """
+    cold_before = time.time() - archival_args.cold_days * 86400
+    archived = []
+    saved = 0
+    for project in get_project_usage(fs, redis_manager, gc_args):
+        if project.last_access >= cold_before:
+            # least recently accessed first, so all remaining projects are warm
+            break
+        if project.in_flight or is_archived(project.p_hash, fs):
+            continue
+        logger.info(f"Archiving project {project.p_hash}")
+        if not dry_run:
+            saved += archive_project(project.p_hash, fs)
+        archived.append(project.p_hash)
+    return {"archivedProjects": archived, "savedBytes": saved}
@@ -0,0 +1,93 @@
+import logging
+import os
+import stat
+import time
+import uuid
+
+from beebop.config import PoppunkFileStore
+
+logger = logging.getLogger(__name__)
+
+# smaller files fit in a single block, so sharing them saves nothing
+MIN_BLOB_SIZE = 4096
+
+
+def intern_artifacts(p_hash: str, fs: PoppunkFileStore, manifest: dict) -> int:
+    """
+    [Replaces the artifacts listed in a manifest by hard links to blobs
+    named by their checksum, so identical files of different projects (e.g.
+    visualisations of the same reference samples) share one copy on disk
+    and in the page cache. Files with new content become blobs themselves.
+    Blobs are made read-only, as writing to one would change the file in
+    every project linking to it. A blob's link count is its reference
+    count: blobs only linked from the store are garbage collected.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param manifest: [manifest of the stage that wrote the artifacts]
+    :return int: [bytes saved by linking to existing blobs]
+    """
+    saved = 0
+    for name, artifact in manifest["artifacts"].items():
+        if artifact["size"] < MIN_BLOB_SIZE:
+            continue
+        path = os.path.join(fs.output(p_hash), name)
+        try:
+            if _link_to_blob(path, fs.blob(artifact["sha256"])):
+                saved += artifact["size"]
+        except OSError:
+            # e.g. the blob store is on another filesystem, the file is kept as it is
+            logger.exception(f"Could not store {path} in the blob store")
+            return saved
+    return saved
+
+
+def _link_to_blob(path: str, blob_path: str) -> bool:
+    """
+    :param path: [file to store]
+    :param blob_path: [path to blob with the file's content]
+    :return bool: [whether the file was replaced by a link to an existing blob]
+    """
+    try:
+        if os.path.samefile(path, blob_path):
+            return False
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(blob_path, tmp_path)
+    except FileNotFoundError:
+        try:
+            os.link(path, blob_path)
+        except FileExistsError:
+            # stored by another job in the meantime
+            return _link_to_blob(path, blob_path)
+        os.chmod(blob_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+
+def get_unreferenced_blobs(fs: PoppunkFileStore, min_age_seconds: float) -> list[tuple[str, int]]:
+    """
+    :param fs: [PoppunkFileStore instance]
+    :param min_age_seconds: [blobs changed more recently are kept, as a job
+        may be about to link to them]
+    :return list: [path and size of each blob no project links to]
+    """
+    unreferenced = []
+    now = time.time()
+    try:
+        shards = os.scandir(fs.blobs())
+    except FileNotFoundError:
+        return unreferenced
+    with shards:
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            with os.scandir(shard.path) as entries:
+                for entry in entries:
+                    blob_stat = entry.stat()
+                    if blob_stat.st_nlink == 1 and now - blob_stat.st_ctime >= min_age_seconds:
+                        unreferenced.append((entry.path, blob_stat.st_size))
+    return unreferenced
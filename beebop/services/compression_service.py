@@ -0,0 +1,92 @@
+import gzip
+import os
+import shutil
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from typing import IO
+
+# compression level of archived and compressed files, zlib's default trade-off
+COMPRESS_LEVEL = 6
+GZIP_SUFFIX = ".gz"
+# text visualisation files, stored compressed once a cluster's visualisation is final
+COMPRESSED_SUFFIXES = (".csv", ".nwk", ".graphml", ".microreact", ".dot")
+
+
+class _ClosingGzipFile(gzip.GzipFile):
+    """
+    GzipFile that also closes the stream it decompresses
+    """
+
+    def close(self) -> None:
+        fileobj = self.fileobj
+        try:
+            super().close()
+        finally:
+            if fileobj is not None:
+                fileobj.close()
+
+
+def decompress_stream(stream: IO[bytes]) -> IO[bytes]:
+    """
+    :param stream: [gzip stream, closed with the returned stream]
+    :return IO[bytes]: [decompressed stream]
+    """
+    return _ClosingGzipFile(fileobj=stream, mode="rb")
+
+
+@contextmanager
+def create_compressed_file(path: str) -> Iterator[IO[bytes]]:
+    """
+    [Opens a gzip file for writing. It is written to a temporary file first,
+    so readers never see a partial one. The gzip header has no name or
+    timestamp, so identical content always compresses to identical files,
+    which the blob store can share.]
+
+    :param path: [path of the gzip file]
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with (
+            open(tmp_path, "wb") as raw,
+            gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=COMPRESS_LEVEL, mtime=0) as f,
+        ):
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def compress_file(path: str) -> int:
+    """
+    [Replaces a file by its gzip compressed copy, named with GZIP_SUFFIX
+    appended. The copy is complete before the file is deleted, so readers
+    looking for the copy once the file is gone always find it.]
+
+    :param path: [file to compress]
+    :return int: [bytes saved]
+    """
+    compressed_path = f"{path}{GZIP_SUFFIX}"
+    with open(path, "rb") as src, create_compressed_file(compressed_path) as dst:
+        shutil.copyfileobj(src, dst)
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size - os.path.getsize(compressed_path)
+
+
+def compress_artifacts(folder: str) -> int:
+    """
+    [Compresses the text files of a folder that are final, e.g. the
+    visualisation files of a cluster.]
+
+    :param folder: [folder with the files]
+    :return int: [bytes saved]
+    """
+    saved = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.endswith(COMPRESSED_SUFFIXES):
+                saved += compress_file(os.path.join(root, name))
+    return saved
@@ -0,0 +1,178 @@
+import fcntl
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Optional
+
+from beebop.models import CpuBudget
+
+logger = logging.getLogger(__name__)
+
+WAIT_POLL_SECONDS = 1
+
+
+@contextmanager
+def allocate_threads(args: SimpleNamespace, stage: str, size: int) -> Iterator[int]:
+    """
+    [Allocates threads for a PopPUNK call from the CPU budget of the node
+    and releases them when the call finishes. The lease on the threads is
+    renewed while the call runs. Falls back to the fixed ``threads`` of the
+    stage if args.json has no ``cpu_budget``.]
+
+    :param args: [arguments loaded from args.json]
+    :param stage: [args.json section of the call: assign or visualise]
+    :param size: [input size of the call: number of samples]
+    :return Iterator[int]: [number of threads the call may use]
+    """
+    budget: Optional[CpuBudget] = getattr(args, "cpu_budget", None)
+    if budget is None:
+        yield getattr(args, stage).threads
+        return
+
+    ledger = CpuLedger(budget.ledger_file, get_total_cores(budget), budget.lease_seconds)
+    token, threads = ledger.acquire(get_desired_threads(budget, size), budget.max_wait_seconds)
+    stop_renewing = threading.Event()
+    renewer = threading.Thread(target=ledger.keep_renewed, args=(token, stop_renewing), daemon=True)
+    renewer.start()
+    try:
+        yield threads
+    finally:
+        stop_renewing.set()
+        renewer.join()
+        ledger.release(token)
+
+
+def get_total_cores(budget: CpuBudget) -> int:
+    """
+    :param budget: [cpu_budget settings from args.json]
+    :return int: [number of cores beebop jobs may use on this node,
+        defaults to the cores available to this process]
+    """
+    if budget.total_cores is not None:
+        return budget.total_cores
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+def get_desired_threads(budget: CpuBudget, size: int) -> int:
+    """
+    [Number of threads a call would ideally use: one per
+    ``samples_per_thread`` samples, as small inputs gain nothing from more.]
+
+    :param budget: [cpu_budget settings from args.json]
+    :param size: [number of samples]
+    :return int: [desired number of threads]
+    """
+    return max(math.ceil(size / budget.samples_per_thread), 1)
+
+
+class CpuLedger:
+    """
+    [Records the threads leased by PopPUNK calls running on this node in a
+    file shared by all rq workers, guarded by an exclusive file lock. Each
+    lease has a token unique to the host and an expiry time, so leases of
+    workers that died without releasing, in this or any other container,
+    are discarded once they expire.]
+    """
+
+    def __init__(self, path: str, total_cores: int, lease_seconds: int):
+        """
+        :param path: [path to the ledger file, on a volume shared by all
+            workers of the node]
+        :param total_cores: [number of cores shared by all calls]
+        :param lease_seconds: [time after which a lease that is not renewed
+            expires]
+        """
+        self.path = path
+        self.total_cores = total_cores
+        self.lease_seconds = lease_seconds
+
+    def acquire(self, desired: int, max_wait_seconds: int) -> tuple[str, int]:
+        """
+        [Leases up to ``desired`` threads. Each call gets at most an equal
+        share of the node with the calls already running, so large inputs
+        cannot starve later ones. Waits up to ``max_wait_seconds`` for that
+        share to be free, then takes the cores that are free. Never runs
+        without a free core, which would oversubscribe the node.]
+
+        :param desired: [number of threads the call would ideally use]
+        :param max_wait_seconds: [longest time to wait for the full share]
+        :return tuple: [token to renew and release the lease with, and
+            number of threads leased]
+        """
+        token = f"{socket.gethostname()}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + max_wait_seconds
+        while True:
+            with self._locked() as leases:
+                free = self.total_cores - sum(lease["threads"] for lease in leases.values())
+                fair_share = max(self.total_cores // (len(leases) + 1), 1)
+                wanted = min(desired, fair_share)
+                if free >= wanted or (free >= 1 and time.monotonic() >= deadline):
+                    threads = min(wanted, free)
+                    leases[token] = {"threads": threads, "expires": time.time() + self.lease_seconds}
+                    return token, threads
+            time.sleep(WAIT_POLL_SECONDS)
+
+    def renew(self, token: str) -> None:
+        """
+        [Extends the lease of a call that is still running.]
+
+        :param token: [token returned by acquire]
+        """
+        with self._locked() as leases:
+            if token in leases:
+                leases[token]["expires"] = time.time() + self.lease_seconds
+
+    def keep_renewed(self, token: str, stop: threading.Event) -> None:
+        """
+        [Renews a lease well before it expires until ``stop`` is set.]
+
+        :param token: [token returned by acquire]
+        :param stop: [event set when the call finishes]
+        """
+        while not stop.wait(self.lease_seconds / 3):
+            self.renew(token)
+
+    def release(self, token: str) -> None:
+        """
+        :param token: [token returned by acquire]
+        """
+        with self._locked() as leases:
+            leases.pop(token, None)
+
+    @contextmanager
+    def _locked(self) -> Iterator[dict[str, dict]]:
+        """
+        [Opens the ledger under an exclusive lock and writes back any changes
+        to the yielded leases, without expired ones.]
+
+        :return Iterator[dict]: [leases by token]
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        with os.fdopen(fd, "r+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            now = time.time()
+            leases = {token: lease for token, lease in self._read(f).items() if lease.get("expires", 0) > now}
+            yield leases
+            f.seek(0)
+            f.truncate()
+            json.dump(leases, f)
+
+    @staticmethod
+    def _read(f) -> dict[str, dict]:
+        content = f.read()
+        if not content:
+            return {}
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            logger.warning("Discarding corrupt CPU budget ledger")
+            return {}
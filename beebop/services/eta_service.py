@@ -0,0 +1,280 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from redis import Redis
+from rq import Worker, get_current_job
+from rq.job import Job, JobStatus
+
+from beebop.db import RedisManager
+from beebop.services.job_service import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# durations used until a stage has been observed for a species
+DEFAULT_STAGE_SECONDS = {
+    "assign": 60.0,
+    "fullDbAssign": 120.0,
+    "sublineageAssign": 30.0,
+    "visualise": 5.0,
+    "visualiseCluster": 60.0,
+}
+MIN_RECORDS_FOR_FIT = 2
+MIN_POLL_INTERVAL_SECONDS = 2
+MAX_POLL_INTERVAL_SECONDS = 60
+
+
+def eta_meta(species: str, stage: str, size: int) -> dict:
+    """
+    [Builds the job meta used to learn and predict the duration of a job.
+    Pass as ``meta`` when enqueuing.]
+
+    :param species: [species the job runs for]
+    :param stage: [pipeline stage of the job]
+    :param size: [input size: number of samples in the job]
+    :return dict: [job meta]
+    """
+    return {"eta": {"species": species, "stage": stage, "size": size}}
+
+
+def record_job_duration(job: Job, connection: Redis, *_args, **_kwargs) -> None:
+    """
+    [rq success callback that records how long a job, and any sub-stages it
+    timed itself, took.]
+
+    :param job: [finished job]
+    :param connection: [Redis connection of the worker]
+    """
+    eta = job.meta.get("eta")
+    if not eta or job.started_at is None:
+        return
+    ended_at = job.ended_at or datetime.now(tz=timezone.utc).replace(tzinfo=None)
+    redis_manager = RedisManager(connection)
+    redis_manager.record_stage_duration(
+        eta["species"], eta["stage"], eta["size"], (ended_at - job.started_at).total_seconds()
+    )
+    for stage in job.meta.get("stageDurations", []):
+        redis_manager.record_stage_duration(eta["species"], stage["stage"], stage["size"], stage["seconds"])
+
+
+class StageTimer:
+    """
+    [Context manager timing a stage that runs inside another job, e.g. the
+    full database fallback of the assign job. The duration is stored on the
+    current job and recorded by record_job_duration once the job succeeds.]
+    """
+
+    def __init__(self, stage: str, size: int):
+        """
+        :param stage: [pipeline stage being timed]
+        :param size: [input size of the stage]
+        """
+        self.stage = stage
+        self.size = size
+
+    def __enter__(self) -> "StageTimer":
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, *_) -> None:
+        job = get_current_job()
+        if exc_type is not None or job is None:
+            return
+        job.meta.setdefault("stageDurations", []).append(
+            {"stage": self.stage, "size": self.size, "seconds": time.monotonic() - self.start}
+        )
+        job.save_meta()
+
+
+def predict_stage_seconds(redis_manager: RedisManager, species: str, stage: str, size: int) -> float:
+    """
+    [Predicts the duration of a stage with a least squares fit of recorded
+    durations against input size. Falls back to the mean duration if all
+    recorded sizes are equal, and to a default if nothing was recorded.]
+
+    :param redis_manager: [RedisManager instance]
+    :param species: [species the stage runs for]
+    :param stage: [pipeline stage]
+    :param size: [input size of the stage]
+    :return float: [predicted duration in seconds]
+    """
+    sums = redis_manager.get_stage_duration_sums(species, stage)
+    n = sums.get("n", 0)
+    if n == 0:
+        return DEFAULT_STAGE_SECONDS[stage]
+    mean = sums["sy"] / n
+    variance = n * sums["sxx"] - sums["sx"] ** 2
+    if n < MIN_RECORDS_FOR_FIT or variance <= 0:
+        return mean
+    slope = (n * sums["sxy"] - sums["sx"] * sums["sy"]) / variance
+    intercept = (sums["sy"] - slope * sums["sx"]) / n
+    # never predict less than a fraction of the mean, however the fit extrapolates
+    return max(intercept + slope * size, mean * 0.1)
+
+
+def get_project_eta(
+    p_hash: str,
+    redis_manager: RedisManager,
+    cluster_sizes: Optional[dict[str, int]] = None,
+    jobs: Optional[dict[str, Job]] = None,
+) -> dict:
+    """
+    [Estimates remaining time for all jobs of a project. The jobs of a
+    project run one after another (assign, sublineage assignment,
+    visualise and then each cluster), so each job's estimate includes the
+    remaining time of the jobs before it. Queued jobs also wait for the jobs
+    ahead of them in the queue.]
+
+    :param p_hash: [project hash]
+    :param redis_manager: [RedisManager instance]
+    :param cluster_sizes: [number of samples per assigned cluster, if known,
+        used to estimate visualisation jobs that have not been queued yet]
+    :param jobs: [jobs of the project already fetched by status key, e.g.
+        by get_project_status, fetched again if not given]
+    :return dict: [remaining seconds and estimated completion per job and
+        for the whole project, and a suggested polling interval]
+    """
+    now = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+    chain = get_project_job_chain(p_hash, redis_manager, jobs)
+    if not chain:
+        return {}
+
+    assign_eta = chain[0][1].meta.get("eta", {})
+    species = assign_eta.get("species")
+    num_samples = assign_eta.get("size", 1)
+    seconds_per_queued_job = (redis_manager.get_mean_job_duration() or DEFAULT_STAGE_SECONDS["assign"]) / max(
+        Worker.count(connection=redis_manager.redis), 1
+    )
+
+    cumulative = 0.0
+    eta: dict[str, Any] = {"visualiseClusters": {}}
+    visualise_clusters_queued = False
+    for key, job in chain:
+        cumulative += get_job_remaining_seconds(job, redis_manager, species, seconds_per_queued_job, now)
+        if key.startswith("visualiseClusters:"):
+            visualise_clusters_queued = True
+            eta["visualiseClusters"][key.split(":", 1)[1]] = format_eta(cumulative, now)
+        else:
+            eta[key] = format_eta(cumulative, now)
+
+    if not visualise_clusters_queued and species is not None:
+        # visualisation jobs are only queued once assignment is done
+        sizes = cluster_sizes.values() if cluster_sizes else [1] * num_samples
+        cumulative += sum(predict_stage_seconds(redis_manager, species, "visualiseCluster", size) for size in sizes)
+
+    eta["project"] = format_eta(cumulative, now)
+    eta["pollInterval"] = get_poll_interval(cumulative)
+    return eta
+
+
+def get_completed_project_eta(completed_at: str) -> dict:
+    """
+    [Estimate for a project that has already completed.]
+
+    :param completed_at: [completion time of the project (ISO 8601)]
+    :return dict: [zero remaining seconds for the project and the longest polling interval]
+    """
+    return {
+        "project": format_eta(0, datetime.fromisoformat(completed_at)),
+        "pollInterval": MAX_POLL_INTERVAL_SECONDS,
+    }
+
+
+def get_project_job_chain(
+    p_hash: str, redis_manager: RedisManager, jobs: Optional[dict[str, Job]] = None
+) -> list[tuple[str, Job]]:
+    """
+    [Orders the jobs of a project as they run.]
+
+    :param p_hash: [project hash]
+    :param redis_manager: [RedisManager instance]
+    :param jobs: [jobs of the project already fetched by status key,
+        fetched from Redis if not given]
+    :return list: [(status key, job) tuples]
+    """
+    if jobs is None:
+        jobs = fetch_project_jobs(p_hash, redis_manager)
+    chain = [(job_type, jobs[job_type]) for job_type in ("assign", "sublineageAssign", "visualise") if job_type in jobs]
+    cluster_jobs = [(key, job) for key, job in jobs.items() if key.startswith("visualiseClusters:")]
+    chain.extend(sorted(cluster_jobs, key=lambda item: item[1].created_at))
+    return chain
+
+
+def fetch_project_jobs(p_hash: str, redis_manager: RedisManager) -> dict[str, Job]:
+    """
+    [Fetches the jobs of a project.]
+
+    :param p_hash: [project hash]
+    :param redis_manager: [RedisManager instance]
+    :return dict: [jobs by status key, visualiseClusters:<cluster> for
+        cluster visualisation jobs]
+    """
+    redis = redis_manager.redis
+    jobs = {}
+    for job_type in ("assign", "sublineageAssign", "visualise"):
+        job_id = redis_manager.get_job_status(job_type, p_hash)
+        if job_id is not None:
+            jobs[job_type] = Job.fetch(job_id.decode("utf-8"), connection=redis)
+    for cluster, job_id in redis_manager.get_visualisation_statuses(p_hash).items():
+        jobs[f"visualiseClusters:{cluster.decode('utf-8')}"] = Job.fetch(job_id.decode("utf-8"), connection=redis)
+    return jobs
+
+
+def get_job_remaining_seconds(
+    job: Job,
+    redis_manager: RedisManager,
+    species: Optional[str],
+    seconds_per_queued_job: float,
+    now: datetime,
+) -> float:
+    """
+    [Estimates the remaining time of a single job, excluding jobs it
+    depends on.]
+
+    :param job: [rq job]
+    :param redis_manager: [RedisManager instance]
+    :param species: [species of the project]
+    :param seconds_per_queued_job: [time each job ahead in the queue adds]
+    :param now: [current time, naive UTC like rq timestamps]
+    :return float: [remaining seconds]
+    """
+    status = job.get_status()
+    if status in TERMINAL_STATUSES:
+        return 0.0
+
+    job_eta = job.meta.get("eta", {})
+    stage = job_eta.get("stage")
+    if species is None or stage is None:
+        return 0.0
+    predicted = predict_stage_seconds(redis_manager, species, stage, job_eta.get("size", 1))
+
+    if status == JobStatus.STARTED and job.started_at is not None:
+        return max(predicted - (now - job.started_at).total_seconds(), 0.0)
+    if status == JobStatus.QUEUED:
+        return (job.get_position() or 0) * seconds_per_queued_job + predicted
+    return predicted
+
+
+def format_eta(remaining_seconds: float, now: datetime) -> dict:
+    """
+    :param remaining_seconds: [estimated remaining seconds]
+    :param now: [current time, naive UTC]
+    :return dict: [remaining seconds and estimated completion time (ISO 8601, UTC)]
+    """
+    completion = (now + timedelta(seconds=remaining_seconds)).replace(tzinfo=timezone.utc)
+    return {
+        "remainingSeconds": round(remaining_seconds),
+        "estimatedCompletion": completion.isoformat(timespec="seconds"),
+    }
+
+
+def get_poll_interval(remaining_seconds: float) -> int:
+    """
+    [Suggests how often clients should poll the status: often when the
+    project is about to finish, rarely for long running projects.]
+
+    :param remaining_seconds: [estimated remaining seconds of the project]
+    :return int: [polling interval in seconds]
+    """
+    return int(min(max(remaining_seconds / 10, MIN_POLL_INTERVAL_SECONDS), MAX_POLL_INTERVAL_SECONDS))
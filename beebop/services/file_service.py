@@ -1,4 +1,5 @@
 import glob
+import json
 import os
 import pickle
 import zipfile
@@ -9,22 +10,95 @@ from typing import Optional
 import pandas as pd
 
 from beebop.config import DatabaseFileStore, PoppunkFileStore
+from beebop.db import ProjectCatalog
 from beebop.models import FailedSampleType, SpeciesConfig
 
+from .manifest_service import get_artifact_paths, read_manifest
+from .result_cache_service import result_cache
+
+
+def get_project_catalog(p_hash: str, fs: PoppunkFileStore) -> ProjectCatalog:
+    """
+    [Returns the catalog of a project's results. Projects run before the
+    catalog existed are imported from their result files on first use.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return ProjectCatalog: [project catalog]
+    """
+    catalog = ProjectCatalog(fs.project_catalog(p_hash))
+    if not catalog.exists():
+        import_legacy_results(p_hash, fs)
+    return catalog
+
+
+def import_legacy_results(p_hash: str, fs: PoppunkFileStore) -> None:
+    """
+    [Creates the catalog of a project run before the catalog existed from its
+    cluster results pickle, QC report, external cluster mapping and
+    sub-lineage results. The catalog is built under a temporary name and
+    renamed, so readers never see a partly imported project.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    """
+    legacy_files = (fs.output_cluster(p_hash), fs.external_to_poppunk_clusters(p_hash), fs.sublineage_results(p_hash))
+    if not any(os.path.exists(path) for path in legacy_files):
+        return
+    tmp_path = f"{fs.project_catalog(p_hash)}.{os.getpid()}.tmp"
+    catalog = ProjectCatalog(tmp_path)
+    if os.path.exists(fs.output_cluster(p_hash)):
+        with open(fs.output_cluster(p_hash), "rb") as f:
+            catalog.save_assignments(pickle.load(f), parse_qc_report(fs.output_qc_report(p_hash)))
+    if os.path.exists(fs.external_to_poppunk_clusters(p_hash)):
+        with open(fs.external_to_poppunk_clusters(p_hash), "rb") as f:
+            catalog.save_external_to_poppunk_clusters(pickle.load(f))
+    if os.path.exists(fs.sublineage_results(p_hash)):
+        with open(fs.sublineage_results(p_hash), "r") as f:
+            catalog.save_sublineages(json.load(f))
+    os.replace(tmp_path, fs.project_catalog(p_hash))
+
+
+def get_catalog_files(p_hash: str, fs: PoppunkFileStore) -> tuple[str]:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return tuple: [catalog database, which changes whenever results are
+        written]
+    """
+    return (fs.project_catalog(p_hash),)
+
 
 def get_cluster_assignments(p_hash: str, fs: PoppunkFileStore) -> dict[int, dict[str, str]]:
     """
-    [returns cluster assignment results.
-    Return of type:
+    [returns cluster assignment results, cached until the project catalog
+    changes. Return of type:
     {idx: {hash: hash, cluster: cluster, raw_cluster_num: raw_cluster_num}}]
 
     :param p_hash: [project hash]
     :param fs: [PoppunkFileStore instance]
+    :raises FileNotFoundError: [if the project has no results]
     :return dict: [cluster results]
     """
-    with open(fs.output_cluster(p_hash), "rb") as f:
-        cluster_result = pickle.load(f)
-        return cluster_result
+    return result_cache.get(
+        ("assignments", fs.project_catalog(p_hash)),
+        get_catalog_files(p_hash, fs),
+        lambda: get_project_catalog(p_hash, fs).get_assignments(),
+    )
+
+
+def get_cluster_sizes(p_hash: str, fs: PoppunkFileStore, limit: Optional[int] = None) -> dict[str, int]:
+    """
+    [returns the number of samples assigned to each cluster, counted by the
+    catalog without loading all assignments]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param limit: [number of largest clusters to return, all if None]
+    :raises FileNotFoundError: [if the project has no results]
+    :return dict: [number of samples by cluster, largest first]
+    """
+    return get_project_catalog(p_hash, fs).get_cluster_sizes(limit)
 
 
 def get_failed_samples_internal(p_hash: str, fs: PoppunkFileStore) -> dict[str, dict]:
@@ -35,13 +109,32 @@ def get_failed_samples_internal(p_hash: str, fs: PoppunkFileStore) -> dict[str,
     :param fs (PoppunkFileStore): The PoppunkFileStore instance.
 
     :return dict[str, dict]: failed samples
-    containing hash and reasons for failure.
+    containing hash and reasons for failure, cached until the project
+    catalog changes.
+    """
+    try:
+        return result_cache.get(
+            ("failed_samples", fs.project_catalog(p_hash)),
+            get_catalog_files(p_hash, fs),
+            lambda: get_project_catalog(p_hash, fs).get_failed_samples(),
+        )
+    except FileNotFoundError:
+        return {}
+
+
+def parse_qc_report(qc_report_file_path: str) -> dict[str, dict]:
+    """
+    [Parses the QC report written by PopPUNK, with samples added that could
+    not be assigned to an external cluster]
+
+    :param qc_report_file_path: [path to QC report]
+    :return dict[str, dict]: [failed samples by sample hash, with hash and
+        reasons for failure. Empty if there is no report]
     """
     MIN_FAIL_PARTS_WITH_TYPE = 3
-    qc_report_file_path = fs.output_qc_report(p_hash)
     failed_samples = {}
     if os.path.exists(qc_report_file_path):
-        with open(fs.output_qc_report(p_hash), "r") as f:
+        with open(qc_report_file_path, "r") as f:
             for line in f:
                 failParts = line.strip().split("\t")
                 sample_hash = failParts[0]
@@ -178,7 +271,7 @@ def add_amr_to_metadata(
     db_metadata = pd.read_csv(metadata_file) if metadata_file else pd.DataFrame()
     amr_df = pd.DataFrame(amr_metadata)
 
-    pd.concat([db_metadata, amr_df], ignore_index=True).to_csv(fs.tmp_output_metadata(p_hash), index=False)
+    pd.concat([db_metadata, amr_df], ignore_index=True).to_csv(fs.output_metadata(p_hash), index=False)
 
 
 SUBLINEAGE_COLUMNS_EXCLUDED = ["Status", "Status:colour", "overall_Lineage"]
@@ -194,10 +287,15 @@ def get_metadata_with_sublineages(fs: PoppunkFileStore, p_hash: str, cluster_no:
     :param cluster_no: cluster number
     :return: path to merged metadata file
     """
-    metadata_file = fs.tmp_output_metadata(p_hash)
+    metadata_file = fs.output_metadata(p_hash)
     sublineage_csv = fs.output_sublineages_csv(p_hash, cluster_no)
 
-    if not os.path.exists(sublineage_csv):
+    manifest = read_manifest(p_hash, fs, "sublineageAssign")
+    if manifest is not None:
+        has_sublineages = sublineage_csv in get_artifact_paths(p_hash, fs, manifest, ("sublineages",))
+    else:
+        has_sublineages = os.path.exists(sublineage_csv)
+    if not has_sublineages:
         return metadata_file
 
     sublineages_df = (
@@ -0,0 +1,270 @@
+import logging
+import os
+import time
+from typing import Optional
+
+from werkzeug.exceptions import NotFound
+
+from beebop.config import PoppunkFileStore
+from beebop.config.storage import LocalStorageBackend
+from beebop.db import RedisManager
+from beebop.models import GarbageCollection, ProjectUsage
+
+from .blob_service import get_unreferenced_blobs
+from .file_service import get_project_catalog
+from .job_service import TERMINAL_STATUSES, get_project_status, read_project_status_record
+
+logger = logging.getLogger(__name__)
+
+# seconds between updates of a project's last access marker
+ACCESS_RESOLUTION = 600
+
+
+def record_project_access(p_hash: str, fs: PoppunkFileStore) -> None:
+    """
+    [Records that a project was accessed, for garbage collection by last
+    access. The marker is touched at most every ACCESS_RESOLUTION seconds,
+    so polling does not write on every request.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    """
+    path = fs.project_last_access(p_hash)
+    try:
+        if time.time() - os.path.getmtime(path) < ACCESS_RESOLUTION:
+            return
+        os.utime(path)
+    except FileNotFoundError:
+        if os.path.isdir(fs.output(p_hash)):
+            open(path, "a").close()
+
+
+def set_project_pinned(p_hash: str, fs: PoppunkFileStore, pinned: bool) -> None:
+    """
+    [Pins a project, so it is never garbage collected, or unpins it.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param pinned: [whether the project is pinned]
+    """
+    if pinned:
+        if not os.path.isdir(fs.output(p_hash)):
+            raise NotFound("Unknown project hash")
+        open(fs.project_pin(p_hash), "a").close()
+    elif os.path.exists(fs.project_pin(p_hash)):
+        os.remove(fs.project_pin(p_hash))
+
+
+def get_directory_size(path: str) -> int:
+    """
+    :param path: [folder]
+    :return int: [total size of the files in the folder and its sub-folders]
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def is_in_flight(p_hash: str, fs: PoppunkFileStore, redis_manager: RedisManager, min_age_seconds: float) -> bool:
+    """
+    [Whether a project may still have jobs writing to it. Completed projects
+    have a status record; otherwise projects modified recently, or with jobs
+    that have not finished in Redis, are in flight.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param redis_manager: [RedisManager instance]
+    :param min_age_seconds: [projects modified more recently are in flight]
+    :return bool: [whether the project is in flight]
+    """
+    if read_project_status_record(p_hash, fs) is not None:
+        return False
+    if time.time() - os.path.getmtime(fs.output(p_hash)) < min_age_seconds:
+        return True
+    try:
+        status = get_project_status(p_hash, redis_manager)
+    except NotFound:
+        # unknown to Redis, so no job can be running
+        return False
+    job_statuses = [
+        *(value for key, value in status.items() if key != "visualiseClusters"),
+        *status["visualiseClusters"].values(),
+    ]
+    return not all(job_status in TERMINAL_STATUSES for job_status in job_statuses)
+
+
+def get_project_usage(
+    fs: PoppunkFileStore, redis_manager: RedisManager, gc_args: GarbageCollection
+) -> list[ProjectUsage]:
+    """
+    :param fs: [PoppunkFileStore instance]
+    :param redis_manager: [RedisManager instance]
+    :param gc_args: [garbage_collection arguments from args.json]
+    :return list[ProjectUsage]: [disk usage and protection of all projects,
+        least recently accessed first]
+    """
+    min_age_seconds = gc_args.min_age_hours * 3600
+    projects = []
+    with os.scandir(fs.output_base) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            p_hash = entry.name
+            last_access = entry.stat().st_mtime
+            if os.path.exists(fs.project_last_access(p_hash)):
+                last_access = max(last_access, os.path.getmtime(fs.project_last_access(p_hash)))
+            projects.append(
+                ProjectUsage(
+                    p_hash,
+                    get_directory_size(entry.path),
+                    last_access,
+                    os.path.exists(fs.project_pin(p_hash)),
+                    is_in_flight(p_hash, fs, redis_manager, min_age_seconds),
+                )
+            )
+    return sorted(projects, key=lambda project: project.last_access)
+
+
+def get_referenced_sketches(fs: PoppunkFileStore, p_hashes: list[str]) -> set[str]:
+    """
+    :param fs: [PoppunkFileStore instance]
+    :param p_hashes: [project hashes]
+    :return set[str]: [hashes of the samples of the projects]
+    """
+    referenced = set()
+    for p_hash in p_hashes:
+        try:
+            catalog = get_project_catalog(p_hash, fs)
+            referenced.update(value["hash"] for value in catalog.get_assignments().values())
+            referenced.update(catalog.get_failed_samples())
+        except FileNotFoundError:
+            # submitted but no results yet, its sketches are protected by age
+            pass
+    return referenced
+
+
+def get_unreferenced_sketches(
+    fs: PoppunkFileStore, referenced: set[str], min_age_seconds: float
+) -> Optional[list[tuple[str, int]]]:
+    """
+    :param fs: [PoppunkFileStore instance]
+    :param referenced: [hashes of sketches used by projects]
+    :param min_age_seconds: [sketches stored more recently are kept, as
+        their project may not have recorded them yet]
+    :return Optional[list]: [path and size of each sketch no project uses,
+        None if the sketch store is not a local folder]
+    """
+    if not isinstance(fs.input.backend, LocalStorageBackend):
+        return None
+    now = time.time()
+    unreferenced = []
+    for file_hash, path in fs.input.list_sketches():
+        if file_hash in referenced:
+            continue
+        stat = os.stat(path)
+        if now - stat.st_mtime >= min_age_seconds:
+            unreferenced.append((path, stat.st_size))
+    return unreferenced
+
+
+def get_gc_report(fs: PoppunkFileStore, redis_manager: RedisManager, gc_args: GarbageCollection) -> dict:
+    """
+    [Reports disk usage against the quota and the bytes garbage collection
+    could reclaim from each project.]
+
+    :param fs: [PoppunkFileStore instance]
+    :param redis_manager: [RedisManager instance]
+    :param gc_args: [garbage_collection arguments from args.json]
+    :return dict: [usage report]
+    """
+    projects = get_project_usage(fs, redis_manager, gc_args)
+    unreferenced = get_unreferenced_sketches(
+        fs, get_referenced_sketches(fs, [project.p_hash for project in projects]), gc_args.min_age_hours * 3600
+    )
+    return {
+        "quotaBytes": int(gc_args.quota_gigabytes * 1024**3),
+        "projectBytes": sum(project.size for project in projects),
+        "sketchBytes": get_directory_size(fs.input.path),
+        "reclaimableSketchBytes": None if unreferenced is None else sum(size for _, size in unreferenced),
+        "reclaimableBlobBytes": sum(size for _, size in get_unreferenced_blobs(fs, gc_args.min_age_hours * 3600)),
+        "projects": [
+            {
+                "hash": project.p_hash,
+                "bytes": project.size,
+                "lastAccess": project.last_access,
+                "pinned": project.pinned,
+                "inFlight": project.in_flight,
+                "reclaimableBytes": 0 if project.protected else project.size,
+            }
+            for project in projects
+        ],
+    }
+
+
+def collect_garbage(
+    fs: PoppunkFileStore, redis_manager: RedisManager, gc_args: GarbageCollection, dry_run: bool = False
+) -> dict:
+    """
+    [Removes the least recently accessed projects until projects and sketches
+    fit the disk quota, skipping pinned and in-flight projects, then removes
+    sketches no remaining project uses and blobs no project links to.]
+
+    :param fs: [PoppunkFileStore instance]
+    :param redis_manager: [RedisManager instance]
+    :param gc_args: [garbage_collection arguments from args.json]
+    :param dry_run: [only report what would be removed]
+    :return dict: [removed projects, number of removed sketches and blobs
+        and bytes freed]
+    """
+    quota = gc_args.quota_gigabytes * 1024**3
+    projects = get_project_usage(fs, redis_manager, gc_args)
+    used = sum(project.size for project in projects) + get_directory_size(fs.input.path)
+
+    removed = []
+    freed = 0
+    for project in projects:
+        if used <= quota:
+            break
+        if project.protected:
+            continue
+        logger.info(f"Removing project {project.p_hash} ({project.size} bytes)")
+        if not dry_run:
+            fs.move_to_trash(fs.output(project.p_hash))
+        removed.append(project.p_hash)
+        used -= project.size
+        freed += project.size
+
+    remaining = [project.p_hash for project in projects if project.p_hash not in removed]
+    unreferenced = get_unreferenced_sketches(fs, get_referenced_sketches(fs, remaining), gc_args.min_age_hours * 3600)
+    if unreferenced is None:
+        logger.info("Sketches are not in a local folder, leaving them to the storage backend")
+        unreferenced = []
+    for path, size in unreferenced:
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+        freed += size
+
+    # blobs of projects removed now are still linked from the trash until it is emptied
+    unreferenced_blobs = get_unreferenced_blobs(fs, gc_args.min_age_hours * 3600)
+    for path, size in unreferenced_blobs:
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+        freed += size
+
+    return {
+        "removedProjects": removed,
+        "removedSketches": len(unreferenced),
+        "removedBlobs": len(unreferenced_blobs),
+        "freedBytes": freed,
+    }
@@ -1,13 +1,28 @@
-from typing import Union
+import json
+import os
+from datetime import datetime, timezone
+from typing import Optional, Union
 
+from redis import Redis
+from rq.exceptions import NoSuchJobError
 from rq.job import Job, JobStatus
 from werkzeug.exceptions import NotFound
 
+from beebop.config import PoppunkFileStore
 from beebop.db import RedisManager
 from beebop.models import Job_Types, ResponseError
 
+TERMINAL_STATUSES = {
+    JobStatus.FINISHED,
+    JobStatus.FAILED,
+    JobStatus.STOPPED,
+    JobStatus.CANCELED,
+}
 
-def get_project_status(p_hash: str, redis_manager: RedisManager) -> Union[dict, ResponseError]:
+
+def get_project_status(
+    p_hash: str, redis_manager: RedisManager, jobs: Optional[dict[str, Job]] = None
+) -> Union[dict, ResponseError]:
     """
     [returns statuses of all jobs from a given project (cluster assignment,
     initial visualisations job that kicks off all other jobs
@@ -15,16 +30,20 @@ def get_project_status(p_hash: str, redis_manager: RedisManager) -> Union[dict,
 
     :param p_hash: [project hash]
     :param redis_manager: [RedisManager instance]
+    :param jobs: [if given, filled with the fetched jobs by status key, so
+        they can be reused e.g. for completion estimates]
+    :raises NotFound: [if the project is unknown to Redis, or its jobs
+        have expired]
     :return: [dict with job statuses]
     """
     redis_manager.check_redis_connection()
 
     try:
-        status_assign = get_status_job("assign", p_hash, redis_manager)
-        visualise = get_status_job("visualise", p_hash, redis_manager)
-        visualise_cluster_statuses = get_visualisation_statuses(p_hash, redis_manager)
+        status_assign = get_status_job("assign", p_hash, redis_manager, jobs)
+        visualise = get_status_job("visualise", p_hash, redis_manager, jobs)
+        visualise_cluster_statuses = get_visualisation_statuses(p_hash, redis_manager, jobs)
         try:
-            sublineage_assign_status = get_status_job("sublineageAssign", p_hash, redis_manager)
+            sublineage_assign_status = get_status_job("sublineageAssign", p_hash, redis_manager, jobs)
         except AttributeError:
             sublineage_assign_status = None
 
@@ -34,7 +53,7 @@ def get_project_status(p_hash: str, redis_manager: RedisManager) -> Union[dict,
             "visualiseClusters": visualise_cluster_statuses,
             **({} if sublineage_assign_status is None else {"sublineageAssign": sublineage_assign_status}),
         }
-    except AttributeError as exc:
+    except (AttributeError, NoSuchJobError) as exc:
         raise NotFound("Unknown project hash") from exc
 
 
@@ -42,6 +61,7 @@ def get_status_job(
     job_type: Job_Types,
     p_hash: str,
     redis_manager: RedisManager,
+    jobs: Optional[dict[str, Job]] = None,
 ) -> JobStatus:
     """
     [Get status of rq job]
@@ -49,21 +69,142 @@ def get_status_job(
     :param job_type: [type of job, either assign or visualise]
     :param p_hash: [hash of project]
     :param redis_manager: [RedisManager instance]
+    :param jobs: [if given, the fetched job is added under job_type]
     :return: [JobStatus: [status of the job]
     """
     job_id = redis_manager.get_job_status(job_type, p_hash).decode("utf-8")
-    return Job.fetch(job_id, connection=redis_manager.redis).get_status()
+    job = Job.fetch(job_id, connection=redis_manager.redis)
+    if jobs is not None:
+        jobs[job_type] = job
+    return job.get_status()
 
 
-def get_visualisation_statuses(p_hash: str, redis_manager: RedisManager) -> dict:
+def get_visualisation_statuses(p_hash: str, redis_manager: RedisManager, jobs: Optional[dict[str, Job]] = None) -> dict:
     """
     [returns statuses of all visualisation jobs for a given project hash]
 
     :param p_hash: [project hash]
     :param redis_manager: [RedisManager instance]
+    :param jobs: [if given, the fetched jobs are added under
+        visualiseClusters:<cluster>]
     :return: [dict with cluster visualisation job statuses]
     """
-    return {
-        cluster.decode("utf-8"): Job.fetch(status.decode("utf-8"), connection=redis_manager.redis).get_status()
-        for cluster, status in redis_manager.get_visualisation_statuses(p_hash).items()
+    statuses = {}
+    for cluster, job_id in redis_manager.get_visualisation_statuses(p_hash).items():
+        job = Job.fetch(job_id.decode("utf-8"), connection=redis_manager.redis)
+        if jobs is not None:
+            jobs[f"visualiseClusters:{cluster.decode('utf-8')}"] = job
+        statuses[cluster.decode("utf-8")] = job.get_status()
+    return statuses
+
+
+def write_project_status_record(
+    p_hash: str,
+    fs: PoppunkFileStore,
+    redis_manager: RedisManager,
+    job_key: str,
+    job_status: JobStatus = JobStatus.FINISHED,
+) -> None:
+    """
+    [Writes the final job statuses of a project to its output folder.
+    Called by the last visualisation job, and by jobs that fail, so the
+    status of finished projects can be served without Redis. Nothing is
+    written while other jobs of the project can still run.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param redis_manager: [RedisManager instance]
+    :param job_key: [status key of the calling job, e.g. assign or
+        visualiseClusters:<cluster>]
+    :param job_status: [status the calling job ends with]
+    """
+    status = get_project_status(p_hash, redis_manager)
+    # the calling job is still running, but ends right after writing the record
+    if job_key.startswith("visualiseClusters:"):
+        status["visualiseClusters"][job_key.split(":", 1)[1]] = job_status
+    else:
+        status[job_key] = job_status
+    job_statuses = [
+        *(value for key, value in status.items() if key != "visualiseClusters"),
+        *status["visualiseClusters"].values(),
+    ]
+    # jobs waiting for a failed assign job never run
+    blocked = status["assign"] != JobStatus.FINISHED
+    if not all(
+        job_status in TERMINAL_STATUSES or (blocked and job_status == JobStatus.DEFERRED) for job_status in job_statuses
+    ):
+        # other jobs, e.g. clusters visualised on demand, are still running, the last of them writes the record
+        return
+    record = {
+        "status": status,
+        "completedAt": datetime.now(tz=timezone.utc).isoformat(timespec="seconds"),
     }
+
+    path = fs.project_status(p_hash)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(record, f)
+    # readers never see a partially written record
+    os.replace(tmp_path, path)
+
+
+def status_record_meta(p_hash: str, fs: PoppunkFileStore, job_key: str) -> dict:
+    """
+    [Builds the job meta used by write_status_record_on_failure. Merge into
+    ``meta`` when enqueuing.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param job_key: [status key of the job]
+    :return dict: [job meta]
+    """
+    return {"statusRecord": {"p_hash": p_hash, "storageLocation": str(fs.storage_location), "jobKey": job_key}}
+
+
+def write_status_record_on_failure(job: Job, connection: Redis, *_args, **_kwargs) -> None:
+    """
+    [rq failure callback that writes the status record of the project if
+    the failed job leaves nothing else to run.]
+
+    :param job: [failed job]
+    :param connection: [Redis connection of the worker]
+    """
+    meta = job.meta.get("statusRecord")
+    if meta is None:
+        return
+    write_project_status_record(
+        meta["p_hash"],
+        PoppunkFileStore(meta["storageLocation"]),
+        RedisManager(connection),
+        meta["jobKey"],
+        JobStatus.FAILED,
+    )
+
+
+def delete_project_status_record(p_hash: str, fs: PoppunkFileStore) -> None:
+    """
+    [Removes the status record of a project, e.g. when new jobs are queued for it]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    """
+    try:
+        os.remove(fs.project_status(p_hash))
+    except FileNotFoundError:
+        pass
+
+
+def read_project_status_record(p_hash: str, fs: PoppunkFileStore) -> Optional[dict]:
+    """
+    [Reads the status record of a completed project]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return: [dict with job statuses (status) and completion time (completedAt),
+        None if the project has not completed]
+    """
+    try:
+        with open(fs.project_status(p_hash)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+from collections.abc import Iterable
+from typing import Optional
+
+from beebop.config import PoppunkFileStore
+
+from .compression_service import GZIP_SUFFIX
+
+# reads files in chunks when computing checksums
+CHUNK_SIZE = 1 << 20
+# artifact roles making up each type of visualisation zip
+ZIP_ROLES = {
+    "microreact": ("microreact",),
+    "network": ("networkComponent", "prunedNetworkComponent", "cytoscape"),
+}
+
+
+def visualisation_stage(cluster_num: str) -> str:
+    """
+    :param cluster_num: [cluster number]
+    :return str: [name of the stage visualising the cluster]
+    """
+    return f"visualise_{cluster_num}"
+
+
+def write_manifest(p_hash: str, fs: PoppunkFileStore, stage: str, artifacts: dict[str, str]) -> dict:
+    """
+    [Writes the manifest of the artifacts a stage produced, with their
+    size, checksum and role, so the API finds them without listing
+    directories. The manifest is replaced atomically.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param stage: [pipeline stage]
+    :param artifacts: [role by path of each artifact]
+    :return dict: [manifest written]
+    """
+    output_dir = fs.output(p_hash)
+    manifest = {
+        "stage": stage,
+        "artifacts": {
+            os.path.relpath(path, output_dir): {**get_file_checksum(path), "role": role}
+            for path, role in sorted(artifacts.items())
+        },
+    }
+    save_manifest(p_hash, fs, stage, manifest)
+    return manifest
+
+
+def save_manifest(p_hash: str, fs: PoppunkFileStore, stage: str, manifest: dict) -> None:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param stage: [pipeline stage]
+    :param manifest: [manifest to write]
+    """
+    path = fs.manifest(p_hash, stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    # readers never see a partially written manifest
+    os.replace(tmp_path, path)
+
+
+def read_manifest(p_hash: str, fs: PoppunkFileStore, stage: str) -> Optional[dict]:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param stage: [pipeline stage]
+    :return Optional[dict]: [manifest of the stage, None if the stage has
+        not finished or ran before manifests were written]
+    """
+    try:
+        with open(fs.manifest(p_hash, stage)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def delete_manifest(p_hash: str, fs: PoppunkFileStore, stage: str) -> None:
+    """
+    [Removes the manifest of a stage about to replace its artifacts]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param stage: [pipeline stage]
+    """
+    try:
+        os.remove(fs.manifest(p_hash, stage))
+    except FileNotFoundError:
+        pass
+
+
+def get_artifact_paths(p_hash: str, fs: PoppunkFileStore, manifest: dict, roles: Iterable[str]) -> list[str]:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param manifest: [manifest of a stage]
+    :param roles: [roles of the artifacts to return]
+    :return list[str]: [paths of the stage's artifacts with the given roles]
+    """
+    roles = set(roles)
+    return [
+        os.path.join(fs.output(p_hash), name)
+        for name, artifact in manifest["artifacts"].items()
+        if artifact["role"] in roles
+    ]
+
+
+def get_manifest_etag(manifest: dict, roles: Iterable[str]) -> str:
+    """
+    :param manifest: [manifest of a stage]
+    :param roles: [roles of the artifacts served together]
+    :return str: [entity tag changing whenever any of the artifacts does]
+    """
+    roles = set(roles)
+    digest = hashlib.sha256()
+    for name, artifact in sorted(manifest["artifacts"].items()):
+        if artifact["role"] in roles:
+            digest.update(f"{os.path.basename(name)}\0{artifact['sha256']}\0".encode())
+    return digest.hexdigest()
+
+
+def get_file_checksum(path: str) -> dict:
+    """
+    :param path: [path to file]
+    :return dict: [size and sha256 checksum of the file]
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    return {"size": size, "sha256": digest.hexdigest()}
+
+
+def write_assign_manifest(p_hash: str, fs: PoppunkFileStore) -> dict:
+    """
+    [Writes the manifest of the files of the assign stage that later stages
+    and the API read: QC report, previous query clustering, partial query
+    graph and include files.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return dict: [manifest written]
+    """
+    artifacts = {}
+    for path, role in (
+        (fs.output_qc_report(p_hash), "qcReport"),
+        (fs.previous_query_clustering(p_hash), "previousQueryClustering"),
+        (fs.partial_query_graph(p_hash), "partialQueryGraph"),
+    ):
+        if os.path.isfile(path):
+            artifacts[path] = role
+    with os.scandir(fs.output(p_hash)) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.startswith("include") and entry.name.endswith(".txt"):
+                artifacts[entry.path] = "includeFile"
+    return write_manifest(p_hash, fs, "assign", artifacts)
+
+
+def write_visualisation_manifest(p_hash: str, fs: PoppunkFileStore, cluster_num: str) -> dict:
+    """
+    [Writes the manifest of the visualisation files of a cluster, with the
+    roles used to build the microreact and network zips. Compressed files
+    are listed under their stored name.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param cluster_num: [cluster number]
+    :return dict: [manifest written]
+    """
+    artifacts = {}
+    for root, _, files in os.walk(fs.output_visualisations(p_hash, cluster_num)):
+        for stored_name in files:
+            name = stored_name.removesuffix(GZIP_SUFFIX)
+            if name.startswith(f"pruned_visualise_{cluster_num}_component_") and name.endswith(".graphml"):
+                role = "prunedNetworkComponent"
+            elif name.startswith(f"visualise_{cluster_num}_component_") and name.endswith(".graphml"):
+                role = "networkComponent"
+            elif name == f"visualise_{cluster_num}_cytoscape.csv":
+                role = "cytoscape"
+            else:
+                role = "microreact"
+            artifacts[os.path.join(root, stored_name)] = role
+    return write_manifest(p_hash, fs, visualisation_stage(cluster_num), artifacts)
+
+
+def get_previous_query_clustering(p_hash: str, fs: PoppunkFileStore) -> str:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return str: [path to previous query clustering file, from the assign
+        manifest if there is one]
+    """
+    manifest = read_manifest(p_hash, fs, "assign")
+    if manifest is not None:
+        paths = get_artifact_paths(p_hash, fs, manifest, ("previousQueryClustering",))
+        if paths:
+            return paths[0]
+    return fs.previous_query_clustering(p_hash)
+
+
+def copy_manifests(source: str, p_hash: str, fs: PoppunkFileStore) -> None:
+    """
+    [Writes the manifests of a project created from another project's
+    outputs, renaming artifacts named after the source project. Checksums
+    are only recomputed for artifacts that were rewritten rather than
+    linked.]
+
+    :param source: [hash of the copied project]
+    :param p_hash: [hash of the new project]
+    :param fs: [PoppunkFileStore instance]
+    """
+    try:
+        names = os.listdir(fs.manifests(source))
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        stage = name.removesuffix(".json")
+        manifest = read_manifest(source, fs, stage)
+        if manifest is None:
+            continue
+        artifacts = {}
+        for artifact_name, artifact in manifest["artifacts"].items():
+            new_name = artifact_name.replace(source, p_hash)
+            source_path = os.path.join(fs.output(source), artifact_name)
+            target_path = os.path.join(fs.output(p_hash), new_name)
+            if not os.path.exists(target_path):
+                continue
+            if os.path.exists(source_path) and os.path.samefile(source_path, target_path):
+                artifacts[new_name] = artifact
+            else:
+                artifacts[new_name] = {**get_file_checksum(target_path), "role": artifact["role"]}
+        save_manifest(p_hash, fs, stage, {"stage": stage, "artifacts": artifacts})
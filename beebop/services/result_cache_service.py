@@ -0,0 +1,163 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterable
+from types import SimpleNamespace
+from typing import Any, Optional, TypeVar
+
+T = TypeVar("T")
+
+DEFAULT_MAX_MEGABYTES = 256
+
+
+class ResultCache:
+    """
+    [Bounded LRU cache of parsed project results in a web process. Each
+    entry is validated by the modification time and size of the files it
+    was parsed from, so results are re-read as soon as a job rewrites them.
+    Memory is accounted by estimating the size of the parsed objects, and
+    least recently used entries are evicted to stay under the cap.
+
+    Cached values are shared between requests and must not be modified.]
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        :param max_bytes: [maximum estimated size of all cached results]
+        """
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, tuple[tuple, Any, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, paths: Iterable[str], load: Callable[[], T]) -> T:
+        """
+        [Returns the cached result for a key if none of its files changed,
+        otherwise loads, caches and returns it. Errors from load are raised
+        and nothing is cached.]
+
+        :param key: [cache key]
+        :param paths: [files the result is parsed from]
+        :param load: [function parsing the result]
+        :return T: [parsed result]
+        """
+        # taken before loading, so a write during the load is seen next time
+        validator = get_file_validator(paths)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == validator:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = load()
+        size = estimate_size(value)
+        with self._lock:
+            self._discard(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (validator, value, size)
+                self._size += size
+                while self._size > self.max_bytes:
+                    self._discard(next(iter(self._entries)))
+                    self.evictions += 1
+        return value
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        """
+        :param max_bytes: [maximum estimated size of all cached results]
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        [Removes all entries and resets the statistics.]
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        :return dict: [hit, miss and eviction counts, number of entries and
+            their estimated size against the cap]
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "maxBytes": self.max_bytes,
+            }
+
+    def _discard(self, key: Hashable) -> None:
+        """
+        :param key: [cache key, the lock must be held]
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+
+def get_file_validator(paths: Iterable[str]) -> tuple:
+    """
+    :param paths: [files a result is parsed from]
+    :return tuple: [modification time and size of each file, None for
+        files that do not exist]
+    """
+    validator = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            validator.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            validator.append(None)
+    return tuple(validator)
+
+
+def estimate_size(value: Any, seen: Optional[set[int]] = None) -> int:
+    """
+    [Estimates the memory held by a parsed result: the size of the object
+    and of all containers and values it references, each counted once.]
+
+    :param value: [parsed result]
+    :param seen: [ids of objects already counted]
+    :return int: [estimated size in bytes]
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, seen) for item in value)
+    return size
+
+
+result_cache = ResultCache(DEFAULT_MAX_MEGABYTES * 1024**2)
+
+
+def configure_result_cache(args: SimpleNamespace) -> None:
+    """
+    [Sets the memory cap of the result cache from the result_cache object in
+    args.json.]
+
+    :param args: [arguments loaded from args.json]
+    """
+    cache_args = getattr(args, "result_cache", None)
+    max_megabytes = getattr(cache_args, "max_megabytes", DEFAULT_MAX_MEGABYTES)
+    result_cache.set_max_bytes(int(max_megabytes * 1024**2))
@@ -1,20 +1,29 @@
 import datetime
 import json
 import os
+import shutil
+import zipfile
 from io import BytesIO
+from typing import IO, Optional
 
 import requests
 from werkzeug.exceptions import InternalServerError, NotFound
 
 from beebop.config import PoppunkFileStore
 
+from .archive_service import open_artifact, open_compressed_artifact
 from .cluster_service import get_cluster_num
+from .compression_service import GZIP_SUFFIX
 from .file_service import (
     add_files,
+    get_catalog_files,
     get_cluster_assignments,
     get_failed_samples_internal,
     get_network_files_for_zip,
+    get_project_catalog,
 )
+from .manifest_service import ZIP_ROLES, get_artifact_paths, get_manifest_etag, read_manifest, visualisation_stage
+from .result_cache_service import result_cache
 
 
 def get_clusters_results(p_hash: str, fs: PoppunkFileStore) -> dict:
@@ -38,18 +47,25 @@ def get_sublineage_results(p_hash: str, fs: PoppunkFileStore) -> dict:
 
     :param p_hash: [project hash]
     :param fs: [PoppunkFileStore instance]
-    :return dict: [dictionary mapping sample hash to their sub-lineage assignment results]
+    :return dict: [dictionary mapping sample hash to their sub-lineage
+        assignment results, cached until the project catalog changes]
     """
-    sublineage_results_path = fs.sublineage_results(p_hash)
-    if not os.path.exists(sublineage_results_path):
+    try:
+        return result_cache.get(
+            ("sublineages", fs.project_catalog(p_hash)),
+            get_catalog_files(p_hash, fs),
+            lambda: get_project_catalog(p_hash, fs).get_sublineages(),
+        )
+    except FileNotFoundError:
         return {}
-    with open(sublineage_results_path, "r") as f:
-        return json.load(f)
 
 
 def generate_zip(fs: PoppunkFileStore, p_hash: str, result_type: str, cluster: str) -> BytesIO:
     """
-    [This generates a .zip folder with results data.]
+    [This generates a .zip folder with results data. Files are taken from
+    the manifest of the cluster's visualisation if there is one, otherwise
+    from a listing of its folder. Files of archived projects are read from
+    the archive, compressed files are added decompressed.]
 
     :param fs: [PoppunkFileStore with path to folder to be zipped]
     :param p_hash: [project hash]
@@ -59,6 +75,16 @@ def generate_zip(fs: PoppunkFileStore, p_hash: str, result_type: str, cluster: s
     """
     memory_file = BytesIO()
     cluster_num = get_cluster_num(cluster)
+    manifest = read_manifest(p_hash, fs, visualisation_stage(cluster_num))
+    if manifest is not None and result_type in ZIP_ROLES:
+        with zipfile.ZipFile(memory_file, "w", zipfile.ZIP_DEFLATED) as zipf:
+            for stored_path in get_artifact_paths(p_hash, fs, manifest, ZIP_ROLES[result_type]):
+                path = stored_path.removesuffix(GZIP_SUFFIX)
+                with open_artifact(p_hash, fs, path) as src, zipf.open(os.path.basename(path), "w") as dst:
+                    shutil.copyfileobj(src, dst)
+        memory_file.seek(0)
+        return memory_file
+
     visualisations_folder = fs.output_visualisations(p_hash, cluster_num)
     network_files = get_network_files_for_zip(visualisations_folder, cluster_num)
 
@@ -73,6 +99,49 @@ def generate_zip(fs: PoppunkFileStore, p_hash: str, result_type: str, cluster: s
     return memory_file
 
 
+def get_zip_etag(fs: PoppunkFileStore, p_hash: str, result_type: str, cluster: str) -> Optional[str]:
+    """
+    :param fs: [PoppunkFileStore instance]
+    :param p_hash: [project hash]
+    :param result_type: [can be either 'microreact' or 'network']
+    :param cluster: [cluster assigned]
+    :return Optional[str]: [entity tag of the zip, from the checksums in the
+        manifest of the cluster's visualisation. None if there is no manifest]
+    """
+    manifest = read_manifest(p_hash, fs, visualisation_stage(get_cluster_num(cluster)))
+    if manifest is None or result_type not in ZIP_ROLES:
+        return None
+    return get_manifest_etag(manifest, ZIP_ROLES[result_type])
+
+
+def open_network_graph(p_hash: str, fs: PoppunkFileStore, cluster: str, accept_gzip: bool) -> tuple[IO[bytes], bool]:
+    """
+    [Opens the pruned network graph of a cluster. If the client accepts gzip
+    and the graph is stored compressed, it is sent as it is stored.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param cluster: [cluster assigned]
+    :param accept_gzip: [whether the client accepts gzip content encoding]
+    :raises NotFound: [if the cluster is not assigned in the project]
+    :raises FileNotFoundError: [if the graph has not been written]
+    :return tuple[IO[bytes], bool]: [graphml file, and whether it is gzip
+        compressed]
+    """
+    cluster_info = next(
+        (info for info in get_cluster_assignments(p_hash, fs).values() if info["cluster"] == cluster),
+        None,
+    )
+    if cluster_info is None:
+        raise NotFound("Cluster not found for the given project hash")
+    path = fs.pruned_network_output_component(p_hash, cluster_info["raw_cluster_num"], get_cluster_num(cluster))
+    if accept_gzip:
+        compressed = open_compressed_artifact(p_hash, fs, path)
+        if compressed is not None:
+            return compressed, True
+    return open_artifact(p_hash, fs, path), False
+
+
 def generate_microreact_url_internal(
     microreact_api_new_url: str,
     p_hash: str,
@@ -96,7 +165,7 @@ def generate_microreact_url_internal(
     cluster_num = get_cluster_num(cluster)
     path_json = fs.microreact_json(p_hash, cluster_num)
 
-    with open(path_json, "rb") as microreact_file:
+    with open_artifact(p_hash, fs, path_json) as microreact_file:
         json_microreact = json.load(microreact_file)
 
     update_microreact_json(json_microreact, cluster_num)
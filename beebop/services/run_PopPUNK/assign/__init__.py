@@ -1,3 +1,3 @@
-from .run import assign_clusters
+from .run import append_clusters, assign_clusters
 
-__all__ = ["assign_clusters"]
+__all__ = ["append_clusters", "assign_clusters"]
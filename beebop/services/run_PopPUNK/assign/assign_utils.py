@@ -1,13 +1,20 @@
+import logging
 import os
-import re
+import pickle
+import shutil
+import uuid
 from pathlib import PurePath
 
+import numpy as np
 import pandas as pd
 from PopPUNK.web import sketch_to_hdf5
 
 from beebop.config import DatabaseFileStore, PoppunkFileStore
 from beebop.models import ClusteringConfig, FailedSampleType
 from beebop.services.cluster_service import get_lowest_cluster
+from beebop.services.sketch_library import SketchLibrary, query_db_path
+
+logger = logging.getLogger(__name__)
 
 
 def update_external_clusters_csv(
@@ -119,41 +126,48 @@ def get_external_clusters_from_file(
     return hash_cluster_info, not_found_hashes
 
 
-def create_sketches_dict(hashes_list: list[str], fs: PoppunkFileStore) -> dict:
+def build_query_sketches_db(hashes_list: list[str], fs: PoppunkFileStore, outdir: str) -> list[str]:
     """
-    [Create a dictionary of sketches for all query samples]
+    [Create the PopPUNK query database for the given samples by copying
+    their sketches from the sketch library. Samples stored before the
+    library existed are added to it first. If the library cannot be read,
+    the database is converted from the sketch store instead.]
 
-    :param hashes_list: [list of file hashes to get sketches for]
+    :param hashes_list: [list of file hashes to include]
     :param fs: [PoppunkFileStore with paths to input files]
-    :return dict: [dictionary with filehash (key) and sketch (value)]
-    """
-    return {sample_hash: fs.input.get(sample_hash) for sample_hash in hashes_list}
-
-
-def preprocess_sketches(sketches_dict: dict, outdir: str) -> list:
-    """
-    [Convert hexadecimal sketches to decimal and save them to hdf5 file]
-
-    :param sketches_dict: [dictionary with filehash (key) and sketch (value)]
     :param outdir: [path to output directory]
     :return list: [list of sample hashes]
     """
-    hex_to_decimal(sketches_dict)
-    return sketch_to_hdf5(sketches_dict, outdir)
+    library = SketchLibrary(fs.sketch_library())
+    try:
+        missing = library.missing(hashes_list)
+        if missing:
+            library.add({sample_hash: fs.input.get_arrays(sample_hash) for sample_hash in missing})
+        return library.build_query_db(hashes_list, outdir)
+    except OSError:
+        logger.exception(f"Could not read sketch library {library.path}, converting sketches instead")
+        return sketch_to_hdf5({sample_hash: fs.input.get_arrays(sample_hash) for sample_hash in hashes_list}, outdir)
 
 
-def hex_to_decimal(sketches_dict) -> None:
+def replace_query_sketches_db(hashes_list: list[str], fs: PoppunkFileStore, p_hash: str, staging_dir: str) -> None:
     """
-    [Converts all hexadecimal numbers in the sketches into decimal numbers.
-    These have been stored in hexadecimal format to not loose precision when
-    sending the sketches from the backend to the frontend]
+    [Rebuilds the project's query database with the given samples, e.g.
+    once samples are added to the project. The database is built in a
+    staging folder, which may be on another filesystem, and then replaces
+    the project's, so sub-lineage folders and projects linking to the old
+    database keep it unchanged.]
 
-    :param sketches_dict: [dictionary holding all sketches]
+    :param hashes_list: [list of file hashes to include]
+    :param fs: [PoppunkFileStore with paths to input files]
+    :param p_hash: [project hash]
+    :param staging_dir: [folder named after the project hash to build the
+        database in]
     """
-    for sample in list(sketches_dict.values()):
-        for key, value in sample.items():
-            if isinstance(value, list) and isinstance(value[0], str) and re.match("0x.*", value[0]):
-                sample[key] = [int(x, 16) for x in value]
+    build_query_sketches_db(hashes_list, fs, staging_dir)
+    query_db = fs.query_sketches_hdf5(p_hash)
+    tmp_path = f"{query_db}.{uuid.uuid4().hex}.tmp"
+    shutil.copyfile(query_db_path(staging_dir), tmp_path)
+    os.replace(tmp_path, query_db)
 
 
 def filter_queries(
@@ -248,7 +262,8 @@ def copy_include_files(output_full_tmp: str, outdir: str) -> None:
             merge_txt_files(dest_file, source_file)
             os.remove(source_file)
         else:
-            os.rename(source_file, dest_file)
+            # the full assign output may be in the worker's scratch folder, on another filesystem
+            shutil.move(source_file, dest_file)
 
 
 def merge_txt_files(main_file: str, merge_file: str) -> None:
@@ -269,6 +284,125 @@ def merge_txt_files(main_file: str, merge_file: str) -> None:
         f.write("\n".join(combined_lines))
 
 
+def merge_clustering_csv_files(main_file: str, merge_file: str) -> None:
+    """
+    [Merge the rows of the merge CSV file into the main CSV file, e.g. the
+    clusters of samples added to a project. Rows are keyed by the first
+    column; rows in both files are taken from the merge file. The main file
+    is replaced rather than written in place.]
+
+    :param main_file: [path to main file]
+    :param merge_file: [path to merge file]
+    """
+    main_df = pd.read_csv(main_file, dtype=str)
+    merge_df = pd.read_csv(merge_file, dtype=str)
+    merged_df = pd.concat([main_df, merge_df], ignore_index=True).drop_duplicates(
+        subset=main_df.columns[0], keep="last"
+    )
+    tmp_path = f"{main_file}.{uuid.uuid4().hex}.tmp"
+    merged_df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, main_file)
+
+
+def get_novel_cluster_mapping(
+    db_clusters_file: str, main_clusters_file: str, merge_clusters_file: str
+) -> dict[str, str]:
+    """
+    [PopPUNK numbers the clusters it finds that are not in the database
+    from the database's highest cluster on, in every run, so novel clusters
+    of samples added to a project can reuse the numbers of novel clusters
+    found earlier. Maps the novel clusters of the added samples to numbers
+    above the project's highest cluster instead.]
+
+    :param db_clusters_file: [path to the clusters CSV of the database]
+    :param main_clusters_file: [path to the project's clusters CSV]
+    :param merge_clusters_file: [path to the clusters CSV of the added samples]
+    :return dict[str, str]: [new cluster number by novel cluster number of
+        the added samples]
+    """
+    if not os.path.exists(merge_clusters_file):
+        return {}
+    db_clusters = set(pd.read_csv(db_clusters_file, dtype=str)["Cluster"])
+    merge_clusters = set(pd.read_csv(merge_clusters_file, dtype=str)["Cluster"])
+    novel_clusters = sorted((cluster for cluster in merge_clusters - db_clusters if cluster.isdigit()), key=int)
+    if not novel_clusters:
+        return {}
+
+    known_clusters = set(db_clusters)
+    if os.path.exists(main_clusters_file):
+        known_clusters.update(pd.read_csv(main_clusters_file, dtype=str)["Cluster"])
+    # merged clusters are named by their numbers joined with '_'
+    highest = max(
+        (int(number) for cluster in known_clusters for number in str(cluster).split("_") if number.isdigit()),
+        default=0,
+    )
+    return {cluster: str(highest + i) for i, cluster in enumerate(novel_clusters, start=1)}
+
+
+def renumber_clusters(clusters_file: str, output_dir: str, cluster_mapping: dict[str, str]) -> None:
+    """
+    [Renumbers clusters in the clusters CSV and the include files of a
+    PopPUNK assign run, e.g. the novel clusters of samples added to a
+    project, before they are merged into the project's.]
+
+    :param clusters_file: [path to the clusters CSV of the run]
+    :param output_dir: [output folder of the run, with its include files]
+    :param cluster_mapping: [new cluster number by cluster number]
+    """
+    if not cluster_mapping:
+        return
+    df = pd.read_csv(clusters_file, dtype=str)
+    df["Cluster"] = df["Cluster"].replace(cluster_mapping)
+    df.to_csv(clusters_file, index=False)
+
+    # rename through temporary names, as new numbers may be old numbers of other clusters
+    tmp_suffix = f".{uuid.uuid4().hex}.tmp"
+    renamed = []
+    for cluster, new_cluster in cluster_mapping.items():
+        include_file = PurePath(output_dir, f"include{cluster}.txt")
+        if os.path.exists(include_file):
+            os.replace(include_file, f"{include_file}{tmp_suffix}")
+            renamed.append((f"{include_file}{tmp_suffix}", PurePath(output_dir, f"include{new_cluster}.txt")))
+    for tmp_path, include_file in renamed:
+        os.replace(tmp_path, include_file)
+
+
+def merge_query_distances(main_distances: str, merge_distances: str) -> bool:
+    """
+    [Merge the query-reference distances of a PopPUNK assign run, e.g. of
+    samples added to a project, into those of another run against the same
+    references. PopPUNK stores the reference names, query names and a self
+    flag in the .pkl file and one row of distances per pair in the .npy
+    file, with the queries as the outer loop, so the rows of the merged
+    queries follow the main ones. Both files are replaced rather than
+    written in place.]
+
+    :param main_distances: [path prefix of the main distances]
+    :param merge_distances: [path prefix of the distances to merge]
+    :return bool: [whether the distances were merged, they are not if
+        either run has none or they are against other references]
+    """
+    try:
+        with open(f"{main_distances}.pkl", "rb") as f:
+            ref_names, query_names, is_self = pickle.load(f)
+        with open(f"{merge_distances}.pkl", "rb") as f:
+            merge_ref_names, merge_query_names, _ = pickle.load(f)
+    except FileNotFoundError:
+        return False
+    if is_self or list(ref_names) != list(merge_ref_names):
+        return False
+
+    distances = np.concatenate([np.load(f"{main_distances}.npy"), np.load(f"{merge_distances}.npy")])
+    tmp_suffix = f".{uuid.uuid4().hex}.tmp"
+    with open(f"{main_distances}.npy{tmp_suffix}", "wb") as f:
+        np.save(f, distances)
+    with open(f"{main_distances}.pkl{tmp_suffix}", "wb") as f:
+        pickle.dump([ref_names, list(query_names) + list(merge_query_names), is_self], f)
+    os.replace(f"{main_distances}.npy{tmp_suffix}", f"{main_distances}.npy")
+    os.replace(f"{main_distances}.pkl{tmp_suffix}", f"{main_distances}.pkl")
+    return True
+
+
 def process_unassignable_samples(unassignable_names: list[str], fs: PoppunkFileStore, p_hash: str) -> None:
     """
     [Process samples that are unassignable to external clusters.
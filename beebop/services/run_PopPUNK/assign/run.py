@@ -1,37 +1,50 @@
-import pickle
+import logging
+import os
 import shutil
+import sqlite3
 from collections import defaultdict
 from collections.abc import ItemsView
-from types import SimpleNamespace
-from typing import Union
+from typing import Optional, Union
 
 from PopPUNK.utils import setupDBFuncs
-from PopPUNK.web import sketch_to_hdf5
 
 from beebop.config import DatabaseFileStore, PoppunkFileStore
+from beebop.db import AssignmentCache, ProjectCatalog
 from beebop.models import ClusteringConfig
+from beebop.services.eta_service import StageTimer
+from beebop.services.file_service import parse_qc_report
+from beebop.services.manifest_service import write_assign_manifest
+from beebop.services.run_memo_service import unshare_file
 from beebop.services.run_PopPUNK.poppunkWrapper import PoppunkWrapper
+from beebop.services.scratch_service import job_scratch
+from beebop.services.species_registry import resolve_species
 
 from .assign_utils import (
-    create_sketches_dict,
+    build_query_sketches_db,
+    copy_include_files,
     filter_queries,
     get_external_clusters_from_file,
+    get_novel_cluster_mapping,
     handle_files_manipulation,
-    preprocess_sketches,
+    merge_clustering_csv_files,
+    merge_query_distances,
+    merge_txt_files,
     process_assign_clusters_csv,
     process_unassignable_samples,
+    renumber_clusters,
+    replace_query_sketches_db,
     update_external_clusters_csv,
 )
 
+logger = logging.getLogger(__name__)
+
 
 def assign_clusters(
     hashes_list: list,
     p_hash: str,
     fs: PoppunkFileStore,
-    ref_db_fs: DatabaseFileStore,
-    full_db_fs: DatabaseFileStore,
-    args: SimpleNamespace,
     species: str,
+    db_digest: Optional[str] = None,
 ) -> dict:
     """
     Assign cluster numbers to samples using PopPUNK.
@@ -41,44 +54,106 @@ def assign_clusters(
     :param hashes_list: [list of file hashes from all query samples]
     :param p_hash: [project_hash]
     :param fs: [PoppunkFileStore with paths to input files]
-    :param ref_db_fs: [DatabaseFileStore which provides paths
-        to database files for the reference database]
-    :param full_db_fs: [DatabaseFileStore which provides paths
-        to database files for the full database]
-    :param args: [arguments for Poppunk's assign function, stored in
-        resources/args.json]
-    :param species: [Type of species]
+    :param species: [Type of species, resolved to arguments and database
+        file stores in the worker]
+    :param db_digest: [digest of the species' databases, to cache the
+        assignments for other projects under]
     :return dict: [dict with filehash (key) and cluster number (value)]
     """
-    db_funcs = setupDBFuncs(args=args.assign)
+    args, species_entry = resolve_species(species)
     config = ClusteringConfig(
         species,
         p_hash,
         args,
-        getattr(args.species, species).external_cluster_prefix,
+        species_entry.config.external_cluster_prefix,
         fs,
-        full_db_fs,
-        ref_db_fs,
-        db_funcs,
+        species_entry.full_db_fs,
+        species_entry.ref_db_fs,
+        setupDBFuncs(args=args.assign),
         fs.output(p_hash),
     )
+    result = assign_query_samples(config, hashes_list)
+    write_assign_manifest(p_hash, fs)
+    cache_assignments(fs, species, db_digest, result)
+    return result
+
+
+def append_clusters(
+    hashes_list: list,
+    p_hash: str,
+    fs: PoppunkFileStore,
+    species: str,
+    db_digest: Optional[str] = None,
+) -> dict:
+    """
+    [Assign cluster numbers to samples added to an existing project, without
+    assigning its other samples again. The added samples are assigned in a
+    folder of their own, whose outputs are then merged into the project's.]
+
+    :param hashes_list: [list of file hashes of the added samples]
+    :param p_hash: [project_hash]
+    :param fs: [PoppunkFileStore with paths to input files]
+    :param species: [Type of species, resolved to arguments and database
+        file stores in the worker]
+    :param db_digest: [digest of the species' databases, to cache the
+        assignments for other projects under]
+    :return dict: [dict with index (key) and sample hash with cluster and
+        raw cluster number (value) of all samples of the project]
+    """
+    args, species_entry = resolve_species(species)
+    with job_scratch(p_hash, fs):
+        append_fs = fs.appended_samples_store(p_hash)
+        try:
+            config = ClusteringConfig(
+                species,
+                p_hash,
+                args,
+                species_entry.config.external_cluster_prefix,
+                append_fs,
+                species_entry.full_db_fs,
+                species_entry.ref_db_fs,
+                setupDBFuncs(args=args.assign),
+                append_fs.output(p_hash),
+            )
+            os.makedirs(config.out_dir, exist_ok=True)
+            added_result = assign_query_samples(config, hashes_list)
+            result = merge_appended_samples(
+                p_hash, fs, append_fs, hashes_list, species_entry.full_db_fs, config.external_clusters_prefix
+            )
+        finally:
+            fs.move_to_trash(str(append_fs.output_base))
+    write_assign_manifest(p_hash, fs)
+    cache_assignments(fs, species, db_digest, added_result)
+    return result
 
-    sketches_dict = create_sketches_dict(hashes_list, config.fs)
-    qNames = preprocess_sketches(sketches_dict, config.out_dir)
+
+def assign_query_samples(config: ClusteringConfig, hashes_list: list) -> dict:
+    """
+    [Assigns clusters to the samples with PopPUNK, writing its outputs to
+    the config's output folder and the result to the project catalog of
+    the config's filestore.]
+
+    :param config: [ClusteringConfig with all necessary information]
+    :param hashes_list: [list of file hashes of the samples]
+    :return dict: [dict with index (key) and sample hash with cluster and
+        raw cluster number (value)]
+    """
+    # the query database stays in the output folder, as visualisations are built from it
+    qNames = build_query_sketches_db(hashes_list, config.fs, config.out_dir)
 
     assign_query_clusters(config, config.ref_db_fs, qNames, config.out_dir)
 
     queries_names, queries_clusters = process_assign_clusters_csv(
-        qNames, p_hash, config.full_db_fs, config.fs.output(p_hash)
+        qNames, config.p_hash, config.full_db_fs, config.fs.output(config.p_hash)
     )
 
     if config.external_clusters_prefix:
-        result = handle_external_clusters(
-            config,
-            sketches_dict,
-            queries_names,
-            queries_clusters,
-        )
+        with job_scratch(config.p_hash, config.fs):
+            result = handle_external_clusters(
+                config,
+                queries_names,
+                queries_clusters,
+            )
     else:
         result = get_internal_clusters_result(queries_names, queries_clusters)
 
@@ -86,6 +161,113 @@ def assign_clusters(
     return result
 
 
+def merge_appended_samples(
+    p_hash: str,
+    fs: PoppunkFileStore,
+    append_fs: PoppunkFileStore,
+    added_hashes: list[str],
+    db_fs: DatabaseFileStore,
+    external_clusters_prefix: Optional[str],
+) -> dict:
+    """
+    [Merges the outputs of assigning samples added to a project into the
+    project's: cluster assignments, failed samples and external to PopPUNK
+    clusters in the catalog, clusters CSVs, include files, QC report,
+    partial query graph and query distances. Novel clusters of the added
+    samples are first renumbered above the project's clusters, as PopPUNK
+    numbers them the same way in every run. The query database is rebuilt
+    with all samples, as visualisations are built from it. Files linked
+    into other projects get a copy of their own before they are changed.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore of the project]
+    :param append_fs: [PoppunkFileStore the added samples were assigned with]
+    :param added_hashes: [sample hashes of the added samples]
+    :param db_fs: [DatabaseFileStore of the database the include files
+        were written with]
+    :param external_clusters_prefix: [prefix of external clusters, None if
+        samples are assigned PopPUNK clusters]
+    :return dict: [dict with index (key) and sample hash with cluster and
+        raw cluster number (value) of all samples of the project]
+    """
+    out_dir = fs.output(p_hash)
+    append_dir = append_fs.output(p_hash)
+    novel_clusters = get_novel_cluster_mapping(
+        db_fs.previous_clustering,
+        os.path.join(out_dir, f"{p_hash}_clusters.csv"),
+        os.path.join(append_dir, f"{p_hash}_clusters.csv"),
+    )
+    renumber_clusters(os.path.join(append_dir, f"{p_hash}_clusters.csv"), append_dir, novel_clusters)
+    for name in (f"{p_hash}_clusters.csv", f"{p_hash}_external_clusters.csv"):
+        merge_file = os.path.join(append_dir, name)
+        if not os.path.exists(merge_file):
+            continue
+        main_file = os.path.join(out_dir, name)
+        if os.path.exists(main_file):
+            merge_clustering_csv_files(main_file, merge_file)
+        else:
+            shutil.move(merge_file, main_file)
+
+    for name in os.listdir(append_dir):
+        if name.startswith("include") and os.path.exists(os.path.join(out_dir, name)):
+            unshare_file(os.path.join(out_dir, name))
+    copy_include_files(append_dir, out_dir)
+    for main_file, merge_file in (
+        (fs.partial_query_graph(p_hash), append_fs.partial_query_graph(p_hash)),
+        (fs.output_qc_report(p_hash), append_fs.output_qc_report(p_hash)),
+    ):
+        if not os.path.exists(merge_file):
+            continue
+        if os.path.exists(main_file):
+            unshare_file(main_file)
+            merge_txt_files(main_file, merge_file)
+        else:
+            shutil.move(merge_file, main_file)
+    if not merge_query_distances(fs.query_distances(p_hash), append_fs.query_distances(p_hash)):
+        logger.warning(f"Could not merge the query distances of the samples added to project {p_hash}")
+
+    catalog = ProjectCatalog(fs.project_catalog(p_hash))
+    append_catalog = ProjectCatalog(append_fs.project_catalog(p_hash))
+    added = set(added_hashes)
+    assignments = [value for value in catalog.get_assignments().values() if value["hash"] not in added]
+    for assignment in append_catalog.get_assignments().values():
+        new_cluster = novel_clusters.get(str(assignment.get("cluster")))
+        if new_cluster is not None and not external_clusters_prefix:
+            assignment.update(cluster=new_cluster, raw_cluster_num=new_cluster)
+        assignments.append(assignment)
+    result = dict(enumerate(assignments))
+    catalog.save_assignments(result, {**catalog.get_failed_samples(), **append_catalog.get_failed_samples()})
+    external_to_poppunk_clusters = catalog.get_external_to_poppunk_clusters()
+    for external_cluster, poppunk_clusters in append_catalog.get_external_to_poppunk_clusters().items():
+        external_to_poppunk_clusters.setdefault(external_cluster, set()).update(
+            novel_clusters.get(cluster, cluster) for cluster in poppunk_clusters
+        )
+    catalog.save_external_to_poppunk_clusters(external_to_poppunk_clusters)
+
+    replace_query_sketches_db(
+        [value["hash"] for value in assignments], fs, p_hash, os.path.join(append_dir, "query_db", p_hash)
+    )
+    return result
+
+
+def cache_assignments(fs: PoppunkFileStore, species: str, db_digest: Optional[str], result: dict) -> None:
+    """
+    [Caches cluster assignments for other projects with the same samples]
+
+    :param fs: [PoppunkFileStore instance]
+    :param species: [Type of species]
+    :param db_digest: [digest of the species' databases, nothing is cached if None]
+    :param result: [dict with index (key) and sample hash with cluster and
+        raw cluster number (value)]
+    """
+    if db_digest is None:
+        return
+    try:
+        AssignmentCache(fs.assignment_cache()).save_assignments(species, db_digest, result.values())
+    except sqlite3.Error:
+        logger.exception("Could not cache cluster assignments")
+
+
 def get_internal_clusters_result(queries_names: list[str], queries_clusters: list[str]) -> dict:
     """
     [Get internal clusters result]
@@ -125,7 +307,6 @@ def assign_query_clusters(
 
 def handle_external_clusters(
     config: ClusteringConfig,
-    sketches_dict: dict,
     queries_names: list[str],
     queries_clusters: list[str],
 ) -> dict[int, dict[str, str]]:
@@ -136,7 +317,6 @@ def handle_external_clusters(
     updates the external clusters, and finally saves the updated clusters.]
 
     :param config: [ClusteringConfig with all necessary information]
-    :param sketches_dict: [dictionary with filehash (key) and sketch (value)]
     :param queries_names: [list of sample hashes]
     :param queries_clusters: [list of sample PopPUNK clusters]
     :return dict: [dict with filehash (key) and external cluster (value)]
@@ -152,13 +332,13 @@ def handle_external_clusters(
             queries_names, queries_clusters, not_found_query_names
         )
         output_full_tmp = config.fs.output_tmp(config.p_hash)
-        found_query_names_full_db, found_query_clusters_full_db = handle_not_found_queries(
-            config,
-            sketches_dict,
-            not_found_query_names,
-            output_full_tmp,
-            not_found_query_clusters,
-        )
+        with StageTimer("fullDbAssign", len(not_found_query_names)):
+            found_query_names_full_db, found_query_clusters_full_db = handle_not_found_queries(
+                config,
+                not_found_query_names,
+                output_full_tmp,
+                not_found_query_clusters,
+            )
         queries_names.extend(found_query_names_full_db)
         queries_clusters.extend(found_query_clusters_full_db)
         update_external_clusters(
@@ -169,7 +349,7 @@ def handle_external_clusters(
         )
 
         # Clean up temporary output directory used to assign to full database
-        shutil.rmtree(output_full_tmp)
+        config.fs.move_to_trash(output_full_tmp)
 
     save_external_to_poppunk_clusters(
         queries_names,
@@ -183,7 +363,6 @@ def handle_external_clusters(
 
 def handle_not_found_queries(
     config: ClusteringConfig,
-    sketches_dict: dict,
     not_found_query_names: list,
     output_full_tmp: str,
     not_found_query_clusters: set[str],
@@ -198,8 +377,6 @@ def handle_not_found_queries(
     handles all file manipulations needed]
 
     :param config: [ClusteringConfig with all necessary information]
-    :param sketches_dict: [dictionary
-        with filehash (key) and sketch (value)]
     :param not_found_query_names: [list of sample hashes that were not found]
     :param output_full_tmp: [path to temporary output directory]
     :param not_found_query_clusters: [set of clusters assigned to
@@ -207,8 +384,7 @@ def handle_not_found_queries(
     :return tuple[list, list]: [list initial not found sample hashes,
         list of clusters assigned to initial not found samples]
     """
-    not_found_sketches_dict = {key: value for key, value in sketches_dict.items() if key in not_found_query_names}
-    sketch_to_hdf5(not_found_sketches_dict, output_full_tmp)
+    build_query_sketches_db(not_found_query_names, config.fs, output_full_tmp)
 
     assign_query_clusters(config, config.full_db_fs, not_found_query_names, output_full_tmp)
 
@@ -295,17 +471,18 @@ def assign_clusters_to_result(
 
 def save_result(config: ClusteringConfig, result: dict) -> None:
     """
-    [save result to retrieve when reloading project results - this
-    overwrites the initial output file written before the assign
-    job ran]
+    [save result, and the samples that failed, to the project catalog to
+    retrieve when reloading project results - this overwrites the initial
+    assignments written before the assign job ran]
 
     :param config: [ClusteringConfig with
         all necessary information]
     :param result: [dict with index (key)
         and sample hash and cluster number (value)]
     """
-    with open(config.fs.output_cluster(config.p_hash), "wb") as f:
-        pickle.dump(result, f)
+    ProjectCatalog(config.fs.project_catalog(config.p_hash)).save_assignments(
+        result, parse_qc_report(config.fs.output_qc_report(config.p_hash))
+    )
 
 
 def save_external_to_poppunk_clusters(
@@ -337,5 +514,4 @@ def save_external_to_poppunk_clusters(
             continue
         external_to_poppunk_clusters[external_cluster].add(queries_clusters[i])
 
-    with open(fs.external_to_poppunk_clusters(p_hash), "wb") as f:
-        pickle.dump(external_to_poppunk_clusters, f)
+    ProjectCatalog(fs.project_catalog(p_hash)).save_external_to_poppunk_clusters(external_to_poppunk_clusters)
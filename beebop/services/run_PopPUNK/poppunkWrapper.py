@@ -4,7 +4,9 @@ from PopPUNK.assign import assign_query_hdf5
 from PopPUNK.visualise import generate_visualisations
 
 from beebop.config import DatabaseFileStore, PoppunkFileStore
+from beebop.services.cpu_budget_service import allocate_threads
 from beebop.services.file_service import get_metadata_with_sublineages
+from beebop.services.manifest_service import get_previous_query_clustering
 
 
 class PoppunkWrapper:
@@ -47,32 +49,33 @@ class PoppunkWrapper:
         :param qNames: [hd5 database with all sketches]
         :param output: [output folder for assign_clusters]
         """
-        assign_query_hdf5(
-            dbFuncs=db_funcs,
-            ref_db=self.db_fs.db,
-            qNames=qNames,
-            output=output,
-            qc_dict=vars(getattr(self.args.species, self.species).qc_dict),
-            update_db=self.args.assign.update_db,
-            write_references=self.args.assign.write_references,
-            distances=self.db_fs.distances,
-            serial=self.args.assign.serial,
-            threads=self.args.assign.threads,
-            overwrite=self.args.assign.overwrite,
-            plot_fit=self.args.assign.plot_fit,
-            graph_weights=self.args.assign.graph_weights,
-            model_dir=self.db_fs.db,
-            strand_preserved=self.args.assign.strand_preserved,
-            previous_clustering=self.db_fs.db,
-            external_clustering=self.db_fs.external_clustering,
-            core=self.args.assign.core_only,
-            accessory=self.args.assign.accessory_only,
-            gpu_dist=self.args.assign.gpu_dist,
-            gpu_graph=self.args.assign.gpu_graph,
-            save_partial_query_graph=self.args.assign.save_partial_query_graph,
-            stable=self.args.assign.stable,
-            use_full_network=self.args.assign.use_full_network,
-        )
+        with allocate_threads(self.args, "assign", len(qNames)) as threads:
+            assign_query_hdf5(
+                dbFuncs=db_funcs,
+                ref_db=self.db_fs.db,
+                qNames=qNames,
+                output=output,
+                qc_dict=vars(getattr(self.args.species, self.species).qc_dict),
+                update_db=self.args.assign.update_db,
+                write_references=self.args.assign.write_references,
+                distances=self.db_fs.distances,
+                serial=self.args.assign.serial,
+                threads=threads,
+                overwrite=self.args.assign.overwrite,
+                plot_fit=self.args.assign.plot_fit,
+                graph_weights=self.args.assign.graph_weights,
+                model_dir=self.db_fs.db,
+                strand_preserved=self.args.assign.strand_preserved,
+                previous_clustering=self.db_fs.db,
+                external_clustering=self.db_fs.external_clustering,
+                core=self.args.assign.core_only,
+                accessory=self.args.assign.accessory_only,
+                gpu_dist=self.args.assign.gpu_dist,
+                gpu_graph=self.args.assign.gpu_graph,
+                save_partial_query_graph=self.args.assign.save_partial_query_graph,
+                stable=self.args.assign.stable,
+                use_full_network=self.args.assign.use_full_network,
+            )
 
     def assign_sublineages(
         self,
@@ -92,32 +95,33 @@ class PoppunkWrapper:
         :param model_folder: [folder containing sublineage model files]
         :param distances: [path to distances file]
         """
-        assign_query_hdf5(
-            dbFuncs=db_funcs,
-            ref_db=self.db_fs.db,
-            qNames=qNames,
-            output=output,
-            qc_dict={"run_qc": False},
-            update_db=self.args.assign.update_db,
-            write_references=self.args.assign.write_references,
-            distances=distances,
-            serial=self.args.assign.serial,
-            threads=self.args.assign.threads,
-            overwrite=False,
-            plot_fit=self.args.assign.plot_fit,
-            graph_weights=self.args.assign.graph_weights,
-            model_dir=model_folder,
-            strand_preserved=self.args.assign.strand_preserved,
-            previous_clustering=None,
-            external_clustering=None,
-            core=self.args.assign.core_only,
-            accessory=self.args.assign.accessory_only,
-            gpu_dist=self.args.assign.gpu_dist,
-            gpu_graph=self.args.assign.gpu_graph,
-            save_partial_query_graph=False,
-            stable=self.args.assign.stable,
-            use_full_network=self.args.assign.use_full_network,
-        )
+        with allocate_threads(self.args, "assign", len(qNames)) as threads:
+            assign_query_hdf5(
+                dbFuncs=db_funcs,
+                ref_db=self.db_fs.db,
+                qNames=qNames,
+                output=output,
+                qc_dict={"run_qc": False},
+                update_db=self.args.assign.update_db,
+                write_references=self.args.assign.write_references,
+                distances=distances,
+                serial=self.args.assign.serial,
+                threads=threads,
+                overwrite=False,
+                plot_fit=self.args.assign.plot_fit,
+                graph_weights=self.args.assign.graph_weights,
+                model_dir=model_folder,
+                strand_preserved=self.args.assign.strand_preserved,
+                previous_clustering=None,
+                external_clustering=None,
+                core=self.args.assign.core_only,
+                accessory=self.args.assign.accessory_only,
+                gpu_dist=self.args.assign.gpu_dist,
+                gpu_graph=self.args.assign.gpu_graph,
+                save_partial_query_graph=False,
+                stable=self.args.assign.stable,
+                use_full_network=self.args.assign.use_full_network,
+            )
 
     def create_visualisations(self, cluster: str, include_file: str) -> None:
         """
@@ -130,40 +134,54 @@ class PoppunkWrapper:
         to include in visualisation]
         """
         print(shutil.which("rapidnj"))
-        generate_visualisations(
-            query_db=self.fs.output(self.p_hash),
-            ref_db=self.db_fs.db,
-            distances=None,
-            rank_fit=None,
-            threads=self.args.visualise.threads,
-            output=self.fs.output_visualisations(self.p_hash, cluster),
-            gpu_dist=self.args.visualise.gpu_dist,
-            deviceid=self.args.visualise.deviceid,
-            external_clustering=self.db_fs.external_clustering,
-            microreact=self.args.visualise.microreact,
-            phandango=self.args.visualise.phandango,
-            grapetree=self.args.visualise.grapetree,
-            cytoscape=self.args.visualise.cytoscape,
-            perplexity=self.args.visualise.perplexity,
-            maxIter=self.args.visualise.maxIter,
-            strand_preserved=self.args.visualise.strand_preserved,
-            include_files=include_file,
-            model_dir=self.db_fs.db,
-            previous_clustering=self.db_fs.previous_clustering,
-            previous_query_clustering=(self.fs.previous_query_clustering(self.p_hash)),
-            previous_mst=None,
-            previous_distances=None,
-            network_file=None,
-            gpu_graph=self.args.visualise.gpu_graph,
-            info_csv=get_metadata_with_sublineages(self.fs, self.p_hash, cluster),
-            rapidnj=shutil.which("rapidnj"),
-            api_key=None,
-            tree=self.args.visualise.tree,
-            mst_distances=self.args.visualise.mst_distances,
-            overwrite=self.args.visualise.overwrite,
-            display_cluster=self.args.visualise.display_cluster,
-            read_distances=self.args.visualise.read_distances,
-            use_partial_query_graph=self.fs.partial_query_graph(self.p_hash),
-            tmp=self.fs.tmp(self.p_hash),
-            extend_query_graph=self.args.visualise.extend_query_graph,
-        )
+        with allocate_threads(self.args, "visualise", count_isolates(include_file)) as threads:
+            generate_visualisations(
+                query_db=self.fs.output(self.p_hash),
+                ref_db=self.db_fs.db,
+                distances=None,
+                rank_fit=None,
+                threads=threads,
+                output=self.fs.output_visualisations(self.p_hash, cluster),
+                gpu_dist=self.args.visualise.gpu_dist,
+                deviceid=self.args.visualise.deviceid,
+                external_clustering=self.db_fs.external_clustering,
+                microreact=self.args.visualise.microreact,
+                phandango=self.args.visualise.phandango,
+                grapetree=self.args.visualise.grapetree,
+                cytoscape=self.args.visualise.cytoscape,
+                perplexity=self.args.visualise.perplexity,
+                maxIter=self.args.visualise.maxIter,
+                strand_preserved=self.args.visualise.strand_preserved,
+                include_files=include_file,
+                model_dir=self.db_fs.db,
+                previous_clustering=self.db_fs.previous_clustering,
+                previous_query_clustering=get_previous_query_clustering(self.p_hash, self.fs),
+                previous_mst=None,
+                previous_distances=None,
+                network_file=None,
+                gpu_graph=self.args.visualise.gpu_graph,
+                info_csv=get_metadata_with_sublineages(self.fs, self.p_hash, cluster),
+                rapidnj=shutil.which("rapidnj"),
+                api_key=None,
+                tree=self.args.visualise.tree,
+                mst_distances=self.args.visualise.mst_distances,
+                overwrite=self.args.visualise.overwrite,
+                display_cluster=self.args.visualise.display_cluster,
+                read_distances=self.args.visualise.read_distances,
+                use_partial_query_graph=self.fs.partial_query_graph(self.p_hash),
+                tmp=self.fs.tmp(self.p_hash),
+                extend_query_graph=self.args.visualise.extend_query_graph,
+            )
+
+
+def count_isolates(include_file: str) -> int:
+    """
+    :param include_file: [path to txt file with isolates to include in
+        visualisation, one per line]
+    :return int: [number of isolates, 1 if the file cannot be read]
+    """
+    try:
+        with open(include_file) as f:
+            return max(sum(1 for line in f if line.strip()), 1)
+    except OSError:
+        return 1
@@ -1,23 +1,47 @@
+import logging
+import os
 import pickle
-from collections.abc import ItemsView
+import sqlite3
+from collections.abc import ItemsView, Iterable
 from types import SimpleNamespace
 from typing import Optional
 
 from flask import current_app
 from redis import Redis
-from rq import Queue
+from rq import Callback, Queue
 from rq.job import Dependency, Job
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, Conflict, NotFound
 
 from beebop.config import PoppunkFileStore
-from beebop.db import RedisManager
+from beebop.db import AssignmentCache, ProjectCatalog, RedisManager
 from beebop.models import SpeciesConfig
-from beebop.services.file_service import add_amr_to_metadata, setup_db_file_stores
-
-from .assign import assign_clusters
+from beebop.services.admission_service import check_admission
+from beebop.services.archive_service import rehydrate_project
+from beebop.services.eta_service import eta_meta, record_job_duration
+from beebop.services.file_service import add_amr_to_metadata, get_project_catalog
+from beebop.services.gc_service import is_in_flight
+from beebop.services.job_service import (
+    delete_project_status_record,
+    status_record_meta,
+    write_status_record_on_failure,
+)
+from beebop.services.manifest_service import read_manifest
+from beebop.services.run_memo_service import (
+    delete_run_digest,
+    get_db_digest,
+    get_run_digest,
+    reuse_memoized_run,
+    unshare_file,
+    write_run_digest,
+)
+from beebop.services.species_registry import get_species_entry, get_species_snapshot
+
+from .assign import append_clusters, assign_clusters
 from .sublineage import assign_sublineages
 from .visualise import visualise
 
+logger = logging.getLogger(__name__)
+
 
 class PopPUNKJobRunner:
     """Service class for running PopPUNK jobs"""
@@ -33,19 +57,22 @@ class PopPUNKJobRunner:
         self.redis_host: str = config["redis_host"]
         self.redis: Redis = config["redis"]
         self.redis_manager = RedisManager(self.redis)
-        self.args: SimpleNamespace = config["args"]
         self.job_timeout: int = config["job_timeout"]
+        self.result_ttl: int = config["result_ttl"]
         self.dbs_location: str = config["dbs_location"]
         self.storage_location: str = config["storage_location"]
 
-        # Validate species configuration
-        self.species_args: Optional[SpeciesConfig] = getattr(self.args.species, self.species, None)
-        if not self.species_args:
+        # Look up the species, validated and resolved at startup or on the last
+        # reload. Jobs only get the species name and look it up again in the worker
+        self.args: SimpleNamespace
+        self.args, registry = get_species_snapshot(config["args"], self.dbs_location)
+        species_entry = get_species_entry(registry, self.species)
+        if species_entry is None:
             raise BadRequest(f"No database found for species: {self.species}")
 
-        # Setup file stores and services
-        self.sublineages_db = self.species_args.sublineages_db
-        self.ref_db_fs, self.full_db_fs = setup_db_file_stores(self.species_args, self.dbs_location)
+        self.species_args: SpeciesConfig = species_entry.config
+        self.has_sublineages = species_entry.has_sublineages
+        self.ref_db_fs, self.full_db_fs = species_entry.ref_db_fs, species_entry.full_db_fs
         self.queue = Queue(connection=self.redis)
         self.fs = PoppunkFileStore(self.storage_location)
 
@@ -55,6 +82,7 @@ class PopPUNKJobRunner:
         p_hash: str,
         name_mapping: dict,
         amr_metadata: list[dict],
+        append: bool = False,
     ) -> dict:
         """
         Run all PopPUNK jobs (assign and visualise).
@@ -66,27 +94,135 @@ class PopPUNKJobRunner:
         :param p_hash: Project hash
         :param name_mapping: Maps filehashes to filenames for all query samples
         :param amr_metadata: AMR metadata for query samples
+        :param append: Whether to add the samples to the existing project
         :return: Dictionary with job IDs
         """
+        self.db_digest = get_db_digest((self.ref_db_fs, self.full_db_fs))
+        if append:
+            return self.append_jobs(sketches, p_hash, name_mapping, amr_metadata)
+
+        # Identical runs reuse the outputs of a completed project, without queueing jobs
+        digest = get_run_digest(
+            (key for key, _ in sketches),
+            self.species,
+            self.args,
+            self.species_args,
+            self.db_digest,
+            amr_metadata,
+        )
+        memoized_job_ids = reuse_memoized_run(digest, p_hash, self.fs, name_mapping, self.redis_manager)
+        if memoized_job_ids is not None:
+            self.fs.input.put_many(dict(sketches))
+            return memoized_job_ids
+
+        # Reject the submission before touching storage if the node is overloaded
+        check_admission(self.queue, self.storage_location, getattr(self.species_args, "admission", None))
+
         # Prepare data and setup output directory
         hashes_list = self._store_sketches_and_setup_output(sketches, p_hash)
+        write_run_digest(p_hash, self.fs, digest)
 
         # Setup job configuration
         queue_kwargs = self._get_queue_kwargs()
 
+        # Clean up previous visualize cluster job results
+        self.redis_manager.delete_visualisation_statuses(p_hash)
+        # Prepare metadata
+        add_amr_to_metadata(self.fs, p_hash, amr_metadata, self.ref_db_fs.metadata)
+
+        return self._submit_jobs(hashes_list, p_hash, name_mapping, queue_kwargs)
+
+    def append_jobs(
+        self,
+        sketches: ItemsView,
+        p_hash: str,
+        name_mapping: dict,
+        amr_metadata: list[dict],
+    ) -> dict:
+        """
+        Run PopPUNK jobs for samples added to an existing project. Only the
+        added samples are assigned and their results merged into the
+        project's; sub-lineages are assigned and visualisations re-run only
+        for the clusters the added samples are assigned to.
+
+        :param sketches: Sketches in json format, samples already in the
+            project are ignored
+        :param p_hash: Project hash
+        :param name_mapping: Maps filehashes to filenames for the added samples
+        :param amr_metadata: AMR metadata for the added samples
+        :return: Dictionary with job IDs
+        """
+        catalog = get_project_catalog(p_hash, self.fs)
+        if not catalog.exists():
+            raise NotFound("Project not found")
+        if is_in_flight(p_hash, self.fs, self.redis_manager, 0):
+            raise Conflict("Samples can be added once the jobs of the project have finished")
+        # the outputs of an archived project are merged with those of the added samples
+        rehydrate_project(p_hash, self.fs)
+        if read_manifest(p_hash, self.fs, "assign") is None and not os.path.exists(self.fs.output_cluster(p_hash)):
+            raise BadRequest("Samples can only be added to projects whose cluster assignment has finished")
+
+        assignments = catalog.get_assignments()
+        project_hashes = {value["hash"] for value in assignments.values()} | set(catalog.get_failed_samples())
+        added_sketches = [(key, sketch) for key, sketch in sketches if key not in project_hashes]
+        if not added_sketches:
+            raise BadRequest("All samples are already in the project")
+
+        check_admission(self.queue, self.storage_location, getattr(self.species_args, "admission", None))
+
+        hashes_list = self._store_sketches(added_sketches)
+        cached = self._get_cached_assignments(hashes_list)
+        catalog.save_assignments(
+            {
+                **assignments,
+                **{len(assignments) + i: value for i, value in enumerate(get_initial_assignments(hashes_list, cached))},
+            }
+        )
+        cached_sublineages = get_cached_sublineage_results(cached)
+        if cached_sublineages:
+            catalog.save_sublineages({**catalog.get_sublineages(), **cached_sublineages})
+        # the project's outputs no longer match those of a run with the same inputs
+        delete_run_digest(p_hash, self.fs)
+        delete_project_status_record(p_hash, self.fs)
+
+        metadata = self.fs.output_metadata(p_hash)
+        if os.path.exists(metadata):
+            unshare_file(metadata)
+            add_amr_to_metadata(self.fs, p_hash, amr_metadata, metadata)
+        else:
+            add_amr_to_metadata(self.fs, p_hash, amr_metadata, self.ref_db_fs.metadata)
+        try:
+            with open(self.fs.visualise_context(p_hash), "rb") as context_file:
+                name_mapping = {**pickle.load(context_file)["name_mapping"], **name_mapping}
+        except FileNotFoundError:
+            logger.warning(f"No visualisation context for project {p_hash}, earlier samples keep their hashes")
+
+        return self._submit_jobs(hashes_list, p_hash, name_mapping, self._get_queue_kwargs(), added_hashes=hashes_list)
+
+    def _submit_jobs(
+        self,
+        hashes_list: list[str],
+        p_hash: str,
+        name_mapping: dict,
+        queue_kwargs: dict,
+        added_hashes: Optional[list[str]] = None,
+    ) -> dict:
+        """Submit assign, sublineage assign and visualise jobs to Redis queue"""
         # Submit cluster assignment job
-        job_assign = self._submit_assign_job(hashes_list, p_hash, queue_kwargs)
+        job_assign = self._submit_assign_job(hashes_list, p_hash, queue_kwargs, added_hashes is not None)
         viz_dependencies = [Dependency(jobs=[job_assign])]
 
         # Submit sublineage assignment job - only if species supports it
         job_sublineage_assign: Optional[Job] = None
-        if self.sublineages_db is not None:
-            job_sublineage_assign = self._submit_sublineage_assign_jobs(p_hash, job_assign, queue_kwargs)
+        if self.has_sublineages:
+            job_sublineage_assign = self._submit_sublineage_assign_jobs(
+                p_hash, job_assign, len(hashes_list), queue_kwargs, added_hashes
+            )
             viz_dependencies.append(Dependency(jobs=[job_sublineage_assign], allow_failure=True))
 
         # Submit visualization job - only for valid species
         job_visualise = self._submit_visualization_job(
-            p_hash, name_mapping, amr_metadata, viz_dependencies, queue_kwargs
+            p_hash, name_mapping, viz_dependencies, len(hashes_list), queue_kwargs, added_hashes
         )
 
         return {
@@ -97,52 +233,85 @@ class PopPUNKJobRunner:
 
     def _store_sketches_and_setup_output(self, sketches: ItemsView, p_hash: str) -> list[str]:
         """Store sketches and setup initial output directory"""
-        hashes_list: list[str] = []
-        initial_output: dict[int, dict[str, str]] = {}
-
-        for i, (key, value) in enumerate(sketches):
-            hashes_list.append(key)
-            self.fs.input.put(key, value)
-            initial_output[i] = {"hash": key}
+        hashes_list = self._store_sketches(sketches)
+        # samples assigned by earlier projects are resolved straight away, jobs update them
+        cached = self._get_cached_assignments(hashes_list)
 
         # Setup output directory and save hashes
         self.fs.setup_output_directory(p_hash)
-        with open(self.fs.output_cluster(p_hash), "wb") as f:
-            pickle.dump(initial_output, f)
+        catalog = ProjectCatalog(self.fs.project_catalog(p_hash))
+        catalog.save_assignments(dict(enumerate(get_initial_assignments(hashes_list, cached))))
+        cached_sublineages = get_cached_sublineage_results(cached)
+        if cached_sublineages:
+            catalog.save_sublineages(cached_sublineages)
 
         return hashes_list
 
+    def _store_sketches(self, sketches: Iterable[tuple[str, dict]]) -> list[str]:
+        """Store sketches in the sketch store, the assign job adds them to the sketch library"""
+        sketches_dict = dict(sketches)
+        self.fs.input.put_many(sketches_dict)
+        return list(sketches_dict)
+
+    def _get_cached_assignments(self, hashes_list: list[str]) -> dict[str, dict]:
+        """Get assignments of samples assigned by earlier projects"""
+        try:
+            return AssignmentCache(self.fs.assignment_cache()).get(self.species, self.db_digest, hashes_list)
+        except sqlite3.Error:
+            logger.exception("Could not read the assignment cache")
+            return {}
+
     def _get_queue_kwargs(self) -> dict:
         """Get standard queue configuration"""
         return {
             "job_timeout": self.job_timeout,
-            "result_ttl": -1,
-            "failure_ttl": -1,
+            "result_ttl": self.result_ttl,
+            "failure_ttl": self.result_ttl,
         }
 
-    def _submit_assign_job(self, hashes_list: list[str], p_hash: str, queue_kwargs: dict):
+    def _submit_assign_job(self, hashes_list: list[str], p_hash: str, queue_kwargs: dict, append: bool = False):
         """Submit cluster assignment job to Redis queue"""
         job_assign = self.queue.enqueue(
-            assign_clusters,
+            append_clusters if append else assign_clusters,
             hashes_list,
             p_hash,
             self.fs,
-            self.ref_db_fs,
-            self.full_db_fs,
-            self.args,
             self.species,
+            self.db_digest,
+            meta={
+                **eta_meta(self.species, "assign", len(hashes_list)),
+                **status_record_meta(p_hash, self.fs, "assign"),
+            },
+            on_success=Callback(record_job_duration),
+            on_failure=Callback(write_status_record_on_failure),
             **queue_kwargs,
         )
 
         self.redis_manager.set_job_status("assign", p_hash, job_assign.id)
         return job_assign
 
-    def _submit_sublineage_assign_jobs(self, p_hash: str, job_assign: Job, queue_kwargs: dict):
+    def _submit_sublineage_assign_jobs(
+        self,
+        p_hash: str,
+        job_assign: Job,
+        num_samples: int,
+        queue_kwargs: dict,
+        added_hashes: Optional[list[str]] = None,
+    ):
         """Submit sublineage assignment job to Redis queue"""
         sublineage_assign_job = self.queue.enqueue(
             assign_sublineages,
-            args=(p_hash, self.fs, self.full_db_fs, self.args, self.redis_host, self.species),
+            args=(
+                p_hash,
+                self.fs,
+                self.redis_host,
+                self.species,
+                self.db_digest,
+                added_hashes,
+            ),
             depends_on=job_assign,
+            meta=eta_meta(self.species, "sublineageAssign", num_samples),
+            on_success=Callback(record_job_duration),
             **queue_kwargs,
         )
 
@@ -153,42 +322,72 @@ class PopPUNKJobRunner:
         self,
         p_hash: str,
         name_mapping: dict,
-        amr_metadata: list[dict],
         jobs_dependencies: list[Dependency],
+        num_samples: int,
         queue_kwargs: dict,
+        added_hashes: Optional[list[str]] = None,
     ):
         """Submit visualization job to Redis queue"""
-        # Prepare metadata
-        add_amr_to_metadata(self.fs, p_hash, amr_metadata, self.ref_db_fs.metadata)
-
-        # Clean up previous visualize cluster job results
-        self.redis_manager.delete_visualisation_statuses(p_hash)
-
         job_visualise = self.queue.enqueue(
             visualise,
             args=(
                 p_hash,
                 self.fs,
-                self.full_db_fs,
-                self.args,
                 name_mapping,
                 self.species,
                 self.redis_host,
                 queue_kwargs,
+                added_hashes,
             ),
             depends_on=jobs_dependencies,
+            meta={
+                **eta_meta(self.species, "visualise", num_samples),
+                **status_record_meta(p_hash, self.fs, "visualise"),
+            },
+            on_success=Callback(record_job_duration),
+            on_failure=Callback(write_status_record_on_failure),
             **queue_kwargs,
         )
         self.redis_manager.set_job_status("visualise", p_hash, job_visualise.id)
         return job_visualise
 
 
+def get_initial_assignments(hashes_list: list[str], cached: dict[str, dict]) -> list[dict]:
+    """
+    :param hashes_list: [sample hashes]
+    :param cached: [assignments of samples assigned by earlier projects, by
+        sample hash]
+    :return list[dict]: [sample hash of each sample, with cluster and raw
+        cluster number if cached, until the assign job updates them]
+    """
+    initial_assignments = []
+    for sample_hash in hashes_list:
+        value = {"hash": sample_hash}
+        if sample_hash in cached:
+            value["cluster"] = cached[sample_hash]["cluster"]
+            value["raw_cluster_num"] = cached[sample_hash]["raw_cluster_num"]
+        initial_assignments.append(value)
+    return initial_assignments
+
+
+def get_cached_sublineage_results(cached: dict[str, dict]) -> dict[str, dict]:
+    """
+    :param cached: [assignments of samples assigned by earlier projects, by
+        sample hash]
+    :return dict: [cached sub-lineage results by sample hash]
+    """
+    return {
+        sample_hash: value["sublineage"] for sample_hash, value in cached.items() if value["sublineage"] is not None
+    }
+
+
 def run_PopPUNK_jobs(
     sketches: ItemsView,
     p_hash: str,
     name_mapping: dict,
     species: str,
     amr_metadata: list[dict],
+    append: bool = False,
 ) -> dict:
     """
     Convenience function to run assign and
@@ -199,7 +398,8 @@ def run_PopPUNK_jobs(
     :param name_mapping: Maps filehashes to filenames for all query samples
     :param species: Type of species to be analyzed
     :param amr_metadata: AMR metadata for query samples
+    :param append: Whether to add the samples to the existing project
     :return: Dictionary with job IDs
     """
     runner = PopPUNKJobRunner(species)
-    return runner.run_jobs(sketches, p_hash, name_mapping, amr_metadata)
+    return runner.run_jobs(sketches, p_hash, name_mapping, amr_metadata, append)
@@ -1,18 +1,25 @@
 import logging
 import os
+import sqlite3
 from types import SimpleNamespace
+from typing import Optional
 
 import pandas as pd
 from PopPUNK.utils import setupDBFuncs
 
 from beebop.config import DatabaseFileStore, PoppunkFileStore
+from beebop.db import AssignmentCache, ProjectCatalog
 from beebop.services.cluster_service import get_cluster_num
+from beebop.services.manifest_service import get_artifact_paths, read_manifest, write_manifest
 from beebop.services.run_PopPUNK.poppunkWrapper import PoppunkWrapper
+from beebop.services.species_registry import resolve_species
 
 from .sublineage_utils import (
     get_cluster_to_hashes,
     get_query_sublineage_result,
     link_sketches_hdf5,
+    merge_sublineages_csv,
+    reset_sublineages_folder,
     save_sublineage_results,
 )
 
@@ -21,32 +28,121 @@ logger = logging.getLogger(__name__)
 
 
 def assign_sublineages(
-    p_hash: str, fs: PoppunkFileStore, db_fs: DatabaseFileStore, args: SimpleNamespace, redis_host: str, species: str
+    p_hash: str,
+    fs: PoppunkFileStore,
+    redis_host: str,
+    species: str,
+    db_digest: Optional[str] = None,
+    added_hashes: Optional[list[str]] = None,
 ) -> None:
     """
-    [Assign sub-lineages for all clusters based on cluster assignment results.]
+    [Assign sub-lineages for all clusters based on cluster assignment results.
+    Samples with sub-lineages cached by earlier projects are not assigned
+    again. If samples were added to an existing project, only they are
+    assigned, and the results of the project's other samples are kept.]
 
     :param p_hash: [project hash]
     :param fs: [PoppunkFileStore instance]
-    :param db_fs: [DatabaseFileStore instance]
-    :param args: [SimpleNamespace containing arguments for PopPUNK functions]
     :param redis_host: [host of redis server]
-    :param species: [Type of species]
+    :param species: [Type of species, resolved to arguments and the full
+        database file store in the worker]
+    :param db_digest: [digest of the species' databases, the assignment
+        cache is not used if None]
+    :param added_hashes: [sample hashes added to an existing project, None
+        if all samples of the project were assigned]
     """
+    args, species_entry = resolve_species(species)
+    db_fs = species_entry.full_db_fs
     if db_fs.sublineages_db_path is None:
         raise ValueError("Sub-lineages database path is not provided.")
 
     cluster_to_hashes = get_cluster_to_hashes(redis_host)
+    sublineage_csvs = {}
+    previous_sublineages: dict[str, dict] = {}
+    if added_hashes is not None:
+        cluster_to_hashes = filter_cluster_to_hashes(cluster_to_hashes, added_hashes)
+        added = set(added_hashes)
+        previous_sublineages = {
+            sample_hash: result
+            for sample_hash, result in ProjectCatalog(fs.project_catalog(p_hash)).get_sublineages().items()
+            if sample_hash not in added
+        }
+        manifest = read_manifest(p_hash, fs, "sublineageAssign")
+        if manifest is not None:
+            sublineage_csvs = dict.fromkeys(get_artifact_paths(p_hash, fs, manifest, ("sublineages",)), "sublineages")
+    cached_sublineages = {
+        **previous_sublineages,
+        **get_cached_sublineages(fs, species, db_digest, cluster_to_hashes),
+    }
 
     sublineage_results_list: list[pd.DataFrame] = []
     for cluster, hashes in cluster_to_hashes.items():
-        sublineage_query_df = assign_cluster_sublineages(p_hash, fs, db_fs, args, cluster, hashes, species)
+        uncached_hashes = [sample_hash for sample_hash in hashes if sample_hash not in cached_sublineages]
+        if not uncached_hashes:
+            continue
+        cluster_num = get_cluster_num(cluster)
+        # samples added to a cluster assigned before are assigned in a new folder
+        previous_sublineages_df = (
+            reset_sublineages_folder(fs, p_hash, cluster_num) if added_hashes is not None else None
+        )
+        sublineage_query_df = assign_cluster_sublineages(p_hash, fs, db_fs, args, cluster, uncached_hashes, species)
+        if previous_sublineages_df is not None:
+            merge_sublineages_csv(fs.output_sublineages_csv(p_hash, cluster_num), previous_sublineages_df)
         sublineage_results_list.append(sublineage_query_df)
+        if not sublineage_query_df.empty:
+            sublineage_csvs[fs.output_sublineages_csv(p_hash, cluster_num)] = "sublineages"
 
     sublineage_results = (
         pd.concat(sublineage_results_list, ignore_index=True) if sublineage_results_list else pd.DataFrame()
     )
-    save_sublineage_results(p_hash, fs, sublineage_results)
+    new_sublineages = save_sublineage_results(p_hash, fs, sublineage_results, cached_sublineages)
+    write_manifest(p_hash, fs, "sublineageAssign", sublineage_csvs)
+    if db_digest is not None and new_sublineages:
+        try:
+            AssignmentCache(fs.assignment_cache()).save_sublineages(species, db_digest, new_sublineages)
+        except sqlite3.Error:
+            logger.exception("Could not cache sub-lineage results")
+
+
+def filter_cluster_to_hashes(cluster_to_hashes: dict[str, list[str]], hashes: list[str]) -> dict[str, list[str]]:
+    """
+    :param cluster_to_hashes: [sample hashes by assigned cluster]
+    :param hashes: [sample hashes to keep]
+    :return dict: [the given sample hashes by assigned cluster, without
+        clusters they are not in]
+    """
+    hashes_set = set(hashes)
+    filtered = {
+        cluster: [sample_hash for sample_hash in cluster_hashes if sample_hash in hashes_set]
+        for cluster, cluster_hashes in cluster_to_hashes.items()
+    }
+    return {cluster: cluster_hashes for cluster, cluster_hashes in filtered.items() if cluster_hashes}
+
+
+def get_cached_sublineages(
+    fs: PoppunkFileStore, species: str, db_digest: Optional[str], cluster_to_hashes: dict[str, list[str]]
+) -> dict[str, dict]:
+    """
+    :param fs: [PoppunkFileStore instance]
+    :param species: [Type of species]
+    :param db_digest: [digest of the species' databases, None to not use the cache]
+    :param cluster_to_hashes: [sample hashes by assigned cluster]
+    :return dict: [cached sub-lineage results by sample hash, for samples
+        cached with the cluster they were assigned now]
+    """
+    if db_digest is None:
+        return {}
+    cluster_by_hash = {sample_hash: cluster for cluster, hashes in cluster_to_hashes.items() for sample_hash in hashes}
+    try:
+        cached = AssignmentCache(fs.assignment_cache()).get(species, db_digest, cluster_by_hash)
+    except sqlite3.Error:
+        logger.exception("Could not read the assignment cache")
+        return {}
+    return {
+        sample_hash: value["sublineage"]
+        for sample_hash, value in cached.items()
+        if value["sublineage"] is not None and value["cluster"] == cluster_by_hash[sample_hash]
+    }
 
 
 def assign_cluster_sublineages(
@@ -1,11 +1,14 @@
+import json
 import os
 from collections import defaultdict
+from typing import Optional
 
 import pandas as pd
 from redis import Redis
 from rq import get_current_job
 
 from beebop.config import PoppunkFileStore
+from beebop.db import ProjectCatalog
 from beebop.services.file_service import SUBLINEAGE_COLUMNS_EXCLUDED
 
 
@@ -64,22 +67,67 @@ def get_query_sublineage_result(fs: PoppunkFileStore, p_hash: str, cluster_num:
     return sublineage_df[sublineage_df["Status"] == "Query"]
 
 
+def reset_sublineages_folder(fs: PoppunkFileStore, p_hash: str, cluster_num: str) -> Optional[pd.DataFrame]:
+    """
+    [Moves the sub-lineages folder of a cluster assigned before, e.g. before
+    samples added to the cluster are assigned, to the trash. Its query
+    database is a link to the project's old one, and PopPUNK does not
+    overwrite outputs.]
+
+    :param fs: [PoppunkFileStore instance]
+    :param p_hash: [project hash]
+    :param cluster_num: [cluster number as string]
+    :return Optional[pd.DataFrame]: [results of the earlier assignment,
+        None if the cluster was not assigned before]
+    """
+    sublineages_csv = fs.output_sublineages_csv(p_hash, cluster_num)
+    if not os.path.exists(sublineages_csv):
+        return None
+    previous_sublineages_df = pd.read_csv(sublineages_csv)
+    fs.move_to_trash(fs.output_sublineages_folder(p_hash, cluster_num))
+    return previous_sublineages_df
+
+
+def merge_sublineages_csv(sublineages_csv: str, previous_sublineages_df: pd.DataFrame) -> None:
+    """
+    [Keeps the results of an earlier sub-lineage assignment of a cluster in
+    its sub-lineages CSV file. Samples in both are taken from the new
+    assignment.]
+
+    :param sublineages_csv: [path to the cluster's sub-lineages csv file]
+    :param previous_sublineages_df: [results of the earlier assignment]
+    """
+    dfs = [previous_sublineages_df]
+    if os.path.exists(sublineages_csv):
+        dfs.append(pd.read_csv(sublineages_csv))
+    pd.concat(dfs, ignore_index=True).drop_duplicates(subset="id", keep="last").to_csv(sublineages_csv, index=False)
+
+
 def save_sublineage_results(
     p_hash: str,
     fs: PoppunkFileStore,
     sublineage_results: pd.DataFrame,
-) -> None:
+    cached_sublineages: Optional[dict[str, dict]] = None,
+) -> dict[str, dict]:
     """
-    [Save sub-lineage assignment results to a JSON file.]
+    [Save sub-lineage assignment results, and those of samples taken from
+    the assignment cache, to the project catalog.]
 
     :param p_hash: [project hash]
     :param fs: [PoppunkFileStore instance]
     :param sublineage_results: [DataFrame containing sub-lineage assignment results]
+    :param cached_sublineages: [cached sub-lineage results by sample hash]
+    :return dict: [sub-lineage results assigned now, by sample hash]
     """
-    if sublineage_results.empty:
-        return
-
-    sublineage_results_cleaned = sublineage_results.set_index("id").drop(
-        columns=SUBLINEAGE_COLUMNS_EXCLUDED, errors="ignore"
-    )
-    sublineage_results_cleaned.to_json(fs.sublineage_results(p_hash), orient="index")
+    new_sublineages = {}
+    if not sublineage_results.empty:
+        sublineage_results_cleaned = sublineage_results.set_index("id").drop(
+            columns=SUBLINEAGE_COLUMNS_EXCLUDED, errors="ignore"
+        )
+        # through JSON, so numpy values are stored as their JSON equivalents
+        new_sublineages = json.loads(sublineage_results_cleaned.to_json(orient="index"))
+
+    sublineages = {**(cached_sublineages or {}), **new_sublineages}
+    if sublineages:
+        ProjectCatalog(fs.project_catalog(p_hash)).save_sublineages(sublineages)
+    return new_sublineages
@@ -1,3 +1,15 @@
-from .run import visualise
+from .run import (
+    ensure_cluster_visualised,
+    get_on_demand_clusters,
+    get_visualised_clusters,
+    rerun_cluster_visualisation,
+    visualise,
+)
 
-__all__ = ["visualise"]
+__all__ = [
+    "ensure_cluster_visualised",
+    "get_on_demand_clusters",
+    "get_visualised_clusters",
+    "rerun_cluster_visualisation",
+    "visualise",
+]
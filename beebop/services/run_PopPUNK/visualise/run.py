@@ -1,16 +1,35 @@
+import os
 import pickle
-import shutil
-from types import SimpleNamespace
+from collections import Counter
+from collections.abc import Iterable
 from typing import Optional
 
 from redis import Redis
-from rq import Queue, get_current_job
-from rq.job import Dependency
+from rq import Callback, Queue, get_current_job
+from rq.job import Dependency, Job, JobStatus
+from werkzeug.exceptions import Conflict, NotFound
 
-from beebop.config import DatabaseFileStore, PoppunkFileStore
+from beebop.config import PoppunkFileStore
 from beebop.db import RedisManager
+from beebop.services.archive_service import rehydrate_project
+from beebop.services.blob_service import intern_artifacts
 from beebop.services.cluster_service import get_cluster_num
+from beebop.services.compression_service import compress_artifacts
+from beebop.services.eta_service import eta_meta, record_job_duration
+from beebop.services.file_service import get_cluster_sizes, get_project_catalog
+from beebop.services.job_service import (
+    TERMINAL_STATUSES,
+    delete_project_status_record,
+    read_project_status_record,
+    status_record_meta,
+    write_project_status_record,
+    write_status_record_on_failure,
+)
+from beebop.services.manifest_service import delete_manifest, visualisation_stage, write_visualisation_manifest
+from beebop.services.run_memo_service import record_run
 from beebop.services.run_PopPUNK.poppunkWrapper import PoppunkWrapper
+from beebop.services.scratch_service import job_scratch
+from beebop.services.species_registry import resolve_species
 
 from .visualise_utils import (
     create_subgraph,
@@ -22,30 +41,32 @@ from .visualise_utils import (
 def visualise(
     p_hash: str,
     fs: PoppunkFileStore,
-    db_fs: DatabaseFileStore,
-    args: SimpleNamespace,
     name_mapping: dict,
     species: str,
     redis_host: str,
     queue_kwargs: dict,
+    added_hashes: Optional[list[str]] = None,
 ) -> None:
     """
     [generate files to use on microreact.org
     and graphml files for network visualisations.
     Output files are .csv, .dot and .nwk
     (last one only for clusters with >3 isolates).
-    Also, a .microreact file is provided which can alternatively be uploaded.]
+    Also, a .microreact file is provided which can alternatively be uploaded.
+    If samples were added to an existing project, only the clusters they
+    were assigned to are visualised again.]
 
     :param p_hash: [project hash to find input data (output from
         assignClusters)]
     :param fs: [PoppunkFileStore with paths to input data]
-    :param db_fs: [DatabaseFileStore with paths to db files]
-    :param args: [arguments for poppunk functions]
     :param name_mapping: [dict that maps filehashes (keys) to
         corresponding filenames (values) of all query samples.]
-    :param species: [Type of species]
+    :param species: [Type of species, resolved to arguments and database
+        file stores in the worker]
     :param redis_host: [host of redis server]
     :param queue_kwargs: [kwargs for the queue]
+    :param added_hashes: [sample hashes added to an existing project, None
+        if all samples of the project were assigned]
     """
     redis = Redis(host=redis_host)
     # get results from previous job
@@ -54,47 +75,61 @@ def visualise(
         raise ValueError("Current job or its dependencies are not set.")
     # gets first dependency result (i.e assign_clusters)
     assign_result = current_job.dependency.result
-    external_to_poppunk_clusters: Optional[dict[str, set[str]]] = None
-
-    try:
-        with open(fs.external_to_poppunk_clusters(p_hash), "rb") as pkl_file:
-            external_to_poppunk_clusters = pickle.load(pkl_file)
-    except FileNotFoundError:
+    external_to_poppunk_clusters: Optional[dict[str, set[str]]] = (
+        get_project_catalog(p_hash, fs).get_external_to_poppunk_clusters() or None
+    )
+    if external_to_poppunk_clusters is None:
         print("no external cluster info found")
 
-    wrapper = PoppunkWrapper(fs, db_fs, args, p_hash, species)
+    args, _ = resolve_species(species)
     queue_visualisation_jobs(
         assign_result,
         p_hash,
         fs,
-        wrapper,
         name_mapping,
         external_to_poppunk_clusters,
         redis,
         queue_kwargs,
+        species,
+        getattr(args.visualise, "precompute_clusters", None),
+        None if added_hashes is None else get_changed_clusters(assign_result, added_hashes),
     )
+    # keep what is needed to visualise the remaining clusters on demand
+    with open(fs.visualise_context(p_hash), "wb") as context_file:
+        pickle.dump(
+            {
+                "name_mapping": name_mapping,
+                "external_to_poppunk_clusters": external_to_poppunk_clusters,
+                "species": species,
+            },
+            context_file,
+        )
 
 
 def queue_visualisation_jobs(
     assign_result: dict,
     p_hash: str,
     fs: PoppunkFileStore,
-    wrapper: PoppunkWrapper,
     name_mapping: dict,
     external_to_poppunk_clusters: Optional[dict[str, set[str]]],
     redis: Redis,
     queue_kwargs: dict,
+    species: str,
+    precompute_clusters: Optional[int] = None,
+    clusters: Optional[list[str]] = None,
 ) -> None:
     """
     Enqueues visualisation jobs for each
-    unique cluster in the assignment results.
+    unique cluster in the assignment results, or only for the clusters
+    with most queries if precompute_clusters is set. The other clusters
+    are visualised on demand. If clusters are given, only they are
+    visualised.
     Runs sequentially, with each job depending on the previous one.
 
     :param assign_result: Dictionary containing the assignment results,
         where each value is expected to have a "cluster" key.
     :param p_hash: Unique hash identifier for the current process.
     :param fs: Instance of PoppunkFileStore for file storage operations.
-    :param wrapper: Instance of PoppunkWrapper for wrapping Poppunk operations.
     :param name_mapping: Dictionary mapping names to
         their respective identifiers.
     :param external_to_poppunk_clusters: Dictionary mapping
@@ -102,10 +137,20 @@ def queue_visualisation_jobs(
     :param redis: Redis connection instance.
     :param queue_kwargs: Additional keyword arguments to pass
         to the queue when enqueuing jobs.
+    :param species: Type of species, resolved by the jobs and used to
+        estimate job durations.
+    :param precompute_clusters: Number of clusters to visualise now,
+        None to visualise all clusters.
+    :param clusters: Clusters to visualise, e.g. those samples were added
+        to, None to pick them by precompute_clusters.
     """
     q = Queue(connection=redis)
     redis_manager = RedisManager(redis)
-    queries_clusters = {item["cluster"] for item in assign_result.values()}
+    cluster_sizes = Counter(item["cluster"] for item in assign_result.values())
+    if clusters is None:
+        queries_clusters = [cluster for cluster, _ in cluster_sizes.most_common(precompute_clusters)]
+    else:
+        queries_clusters = [cluster for cluster, _ in cluster_sizes.most_common() if cluster in clusters]
     previous_job = None
     last_cluster_idx = len(queries_clusters) - 1
     for idx, assign_cluster in enumerate(queries_clusters):
@@ -116,12 +161,18 @@ def queue_visualisation_jobs(
                 assign_cluster,
                 p_hash,
                 fs,
-                wrapper,
+                species,
                 name_mapping,
                 external_to_poppunk_clusters,
                 (idx == last_cluster_idx),
             ),
             depends_on=dependency,
+            meta={
+                **eta_meta(species, "visualiseCluster", cluster_sizes[assign_cluster]),
+                **status_record_meta(p_hash, fs, f"visualiseClusters:{assign_cluster}"),
+            },
+            on_success=Callback(record_job_duration),
+            on_failure=Callback(write_status_record_on_failure),
             **queue_kwargs,
         )
 
@@ -129,11 +180,224 @@ def queue_visualisation_jobs(
         previous_job = cluster_visualise_job
 
 
+def get_changed_clusters(assign_result: dict, added_hashes: list[str]) -> list[str]:
+    """
+    :param assign_result: [assignment results of all samples of the project]
+    :param added_hashes: [sample hashes added to the project]
+    :return list[str]: [clusters the added samples were assigned to]
+    """
+    added = set(added_hashes)
+    return list(dict.fromkeys(item["cluster"] for item in assign_result.values() if item["hash"] in added))
+
+
+def get_on_demand_clusters(p_hash: str, fs: PoppunkFileStore, visualise_clusters: dict) -> list[str]:
+    """
+    [Returns clusters that were left to be visualised on demand and have
+    not been requested yet.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore with paths to input data]
+    :param visualise_clusters: [visualisation job statuses by cluster]
+    :return list[str]: [clusters without visualisation]
+    """
+    if not os.path.exists(fs.visualise_context(p_hash)):
+        return []
+    clusters = get_cluster_sizes(p_hash, fs)
+    return sorted(
+        cluster
+        for cluster in clusters
+        if cluster not in visualise_clusters
+        and not os.path.exists(fs.output_visualisations(p_hash, get_cluster_num(cluster)))
+    )
+
+
+def ensure_cluster_visualised(
+    p_hash: str,
+    cluster: str,
+    fs: PoppunkFileStore,
+    redis_manager: RedisManager,
+    queue_kwargs: dict,
+) -> Optional[JobStatus]:
+    """
+    [Checks whether the visualisation of a cluster is available, and queues
+    it at high priority if the cluster was left to be visualised on demand.]
+
+    :param p_hash: [project hash]
+    :param cluster: [assigned cluster]
+    :param fs: [PoppunkFileStore with paths to input data]
+    :param redis_manager: [RedisManager instance]
+    :param queue_kwargs: [kwargs for the queue]
+    :return Optional[JobStatus]: [None if the visualisation can be served,
+        otherwise the status of the job producing it]
+    """
+    record = read_project_status_record(p_hash, fs)
+    if record is not None and cluster in record["status"]["visualiseClusters"]:
+        # the job of the cluster ended with the project, Redis is not needed
+        return None
+    job_id = redis_manager.get_visualisation_status(p_hash, cluster)
+    if job_id is not None:
+        status = Job.fetch(job_id.decode("utf-8"), connection=redis_manager.redis).get_status()
+        return None if status in TERMINAL_STATUSES else status
+    if os.path.exists(fs.output_visualisations(p_hash, get_cluster_num(cluster))):
+        # visualised before job statuses were kept, or Redis was flushed
+        return None
+    if not os.path.exists(fs.visualise_context(p_hash)):
+        # visualise job has not run yet, it queues the clusters itself
+        return JobStatus.DEFERRED
+
+    if not redis_manager.claim_cluster_visualisation(p_hash, cluster):
+        # another request is queueing the cluster right now
+        return JobStatus.QUEUED
+    try:
+        # the claim holder may have queued the job and released the claim since it was looked up
+        job_id = redis_manager.get_visualisation_status(p_hash, cluster)
+        if job_id is not None:
+            return Job.fetch(job_id.decode("utf-8"), connection=redis_manager.redis).get_status()
+        return queue_cluster_visualisation(p_hash, cluster, fs, redis_manager, queue_kwargs).get_status()
+    finally:
+        redis_manager.release_cluster_visualisation(p_hash, cluster)
+
+
+def get_visualised_clusters(
+    p_hash: str, clusters: Iterable[str], fs: PoppunkFileStore, redis_manager: RedisManager
+) -> set[str]:
+    """
+    [Returns the clusters whose visualisation can be served, without
+    queueing clusters left to be visualised on demand. Reads the status
+    record of completed projects, and otherwise fetches the jobs of all
+    clusters at once.]
+
+    :param p_hash: [project hash]
+    :param clusters: [assigned clusters]
+    :param fs: [PoppunkFileStore with paths to input data]
+    :param redis_manager: [RedisManager instance]
+    :return set[str]: [clusters with visualisations available]
+    """
+    clusters = set(clusters)
+    record = read_project_status_record(p_hash, fs)
+    if record is not None:
+        job_statuses = {cluster: JobStatus(status) for cluster, status in record["status"]["visualiseClusters"].items()}
+    else:
+        job_ids = {
+            cluster.decode("utf-8"): job_id.decode("utf-8")
+            for cluster, job_id in redis_manager.get_visualisation_statuses(p_hash).items()
+        }
+        queued = [cluster for cluster in clusters if cluster in job_ids]
+        jobs = Job.fetch_many([job_ids[cluster] for cluster in queued], connection=redis_manager.redis)
+        # jobs that expired from Redis are treated like clusters without job
+        job_statuses = {cluster: job.get_status() for cluster, job in zip(queued, jobs) if job is not None}
+
+    return {
+        cluster
+        for cluster in clusters
+        if (
+            job_statuses[cluster] in TERMINAL_STATUSES
+            if cluster in job_statuses
+            # visualised before job statuses were kept, or Redis was flushed
+            else os.path.exists(fs.output_visualisations(p_hash, get_cluster_num(cluster)))
+        )
+    }
+
+
+def rerun_cluster_visualisation(
+    p_hash: str,
+    cluster: str,
+    fs: PoppunkFileStore,
+    redis_manager: RedisManager,
+    queue_kwargs: dict,
+) -> Job:
+    """
+    [Re-runs the visualisation of one cluster of an existing project, e.g.
+    after its job failed or timed out. Reuses the project's include files,
+    external cluster mapping, metadata and partial query graph, and leaves
+    other clusters untouched.]
+
+    :param p_hash: [project hash]
+    :param cluster: [assigned cluster]
+    :param fs: [PoppunkFileStore with paths to input data]
+    :param redis_manager: [RedisManager instance]
+    :param queue_kwargs: [kwargs for the queue]
+    :return Job: [queued visualisation job]
+    """
+    if not os.path.exists(fs.visualise_context(p_hash)):
+        raise NotFound("Project has not been visualised yet, or was visualised before re-runs were supported")
+
+    job_id = redis_manager.get_visualisation_status(p_hash, cluster)
+    if job_id is not None:
+        status = Job.fetch(job_id.decode("utf-8"), connection=redis_manager.redis).get_status()
+        if status not in TERMINAL_STATUSES:
+            raise Conflict(f"Visualisation of cluster {cluster} is already {JobStatus(status).value}")
+
+    return queue_cluster_visualisation(p_hash, cluster, fs, redis_manager, queue_kwargs)
+
+
+def queue_cluster_visualisation(
+    p_hash: str,
+    cluster: str,
+    fs: PoppunkFileStore,
+    redis_manager: RedisManager,
+    queue_kwargs: dict,
+) -> Job:
+    """
+    [Enqueues the visualisation of a single cluster at the front of the
+    queue. It waits for visualisation jobs of the project still in flight,
+    as they share the project's tmp folder.]
+
+    :param p_hash: [project hash]
+    :param cluster: [assigned cluster]
+    :param fs: [PoppunkFileStore with paths to input data]
+    :param redis_manager: [RedisManager instance]
+    :param queue_kwargs: [kwargs for the queue]
+    :return Job: [queued visualisation job]
+    """
+    cluster_size = len(get_project_catalog(p_hash, fs).get_cluster_samples(cluster))
+    if cluster_size == 0:
+        raise NotFound("Cluster not found for the given project hash")
+
+    with open(fs.visualise_context(p_hash), "rb") as context_file:
+        context = pickle.load(context_file)
+
+    in_flight = [
+        job
+        for job in (
+            Job.fetch(job_id.decode("utf-8"), connection=redis_manager.redis)
+            for job_id in redis_manager.get_visualisation_statuses(p_hash).values()
+        )
+        if job.get_status() not in TERMINAL_STATUSES
+    ]
+    # the project has running jobs again, status is served from Redis until they finish
+    delete_project_status_record(p_hash, fs)
+
+    job = Queue(connection=redis_manager.redis).enqueue(
+        visualise_per_cluster,
+        args=(
+            cluster,
+            p_hash,
+            fs,
+            context["species"],
+            context["name_mapping"],
+            context["external_to_poppunk_clusters"],
+            True,
+        ),
+        depends_on=Dependency(in_flight, allow_failure=True, enqueue_at_front=True) if in_flight else None,
+        at_front=True,
+        meta={
+            **eta_meta(context["species"], "visualiseCluster", cluster_size),
+            **status_record_meta(p_hash, fs, f"visualiseClusters:{cluster}"),
+        },
+        on_success=Callback(record_job_duration),
+        on_failure=Callback(write_status_record_on_failure),
+        **queue_kwargs,
+    )
+    redis_manager.set_visualisation_status(p_hash, cluster, job.id)
+    return job
+
+
 def visualise_per_cluster(
     assign_cluster: str,
     p_hash: str,
     fs: PoppunkFileStore,
-    wrapper: PoppunkWrapper,
+    species: str,
     name_mapping: dict,
     external_to_poppunk_clusters: Optional[dict[str, set[str]]],
     is_last_cluster_to_process: bool = False,
@@ -147,18 +411,26 @@ def visualise_per_cluster(
     :param p_hash: [project hash to find input data (output from
         assignClusters)]
     :param fs: [PoppunkFileStore with paths to input data]
-    :param wrapper: [PoppunkWrapper with paths to input data]
+    :param species: [Type of species, resolved to arguments and database
+        file stores in the worker]
     :param name_mapping: [dict that maps filehashes (keys) to
         corresponding filenames (values) of all query samples.]
     :param external_to_poppunk_clusters: [dict of external to poppunk
         clusters, used to identify the include file
         to pass to poppunk]
     :param is_last_cluster_to_process: [Boolean flag to indicate if
-    this is the last cluster to process]
+    this is the last cluster to process (always set for clusters visualised
+    on demand). The last job also writes the project's status record]
     """
 
     cluster_no = get_cluster_num(assign_cluster)
     output_folder = fs.output_visualisations(p_hash, cluster_no)
+    # include files and the partial query graph of an archived project are needed again
+    rehydrate_project(p_hash, fs)
+    # files of a re-run cluster may be hard links shared with another project
+    if os.path.exists(output_folder):
+        delete_manifest(p_hash, fs, visualisation_stage(cluster_no))
+        fs.move_to_trash(output_folder)
     internal_cluster = get_internal_cluster(
         external_to_poppunk_clusters,
         assign_cluster,
@@ -166,12 +438,24 @@ def visualise_per_cluster(
         fs,
     )
 
-    wrapper.create_visualisations(
-        cluster_no,
-        fs.include_file(p_hash, internal_cluster),
-    )
+    args, species_entry = resolve_species(species)
+    wrapper = PoppunkWrapper(fs, species_entry.full_db_fs, args, p_hash, species)
+    with job_scratch(p_hash, fs):
+        wrapper.create_visualisations(
+            cluster_no,
+            fs.include_file(p_hash, internal_cluster),
+        )
 
     replace_filehashes(output_folder, name_mapping)
     create_subgraph(output_folder, name_mapping, cluster_no)
+    if getattr(wrapper.args.visualise, "compress_outputs", False):
+        compress_artifacts(output_folder)
+    intern_artifacts(p_hash, fs, write_visualisation_manifest(p_hash, fs, cluster_no))
     if is_last_cluster_to_process:
-        shutil.rmtree(fs.tmp(p_hash))
+        fs.move_to_trash(fs.tmp(p_hash))
+        current_job = get_current_job()
+        if current_job is not None:
+            write_project_status_record(
+                p_hash, fs, RedisManager(current_job.connection), f"visualiseClusters:{assign_cluster}"
+            )
+            record_run(p_hash, fs, name_mapping)
@@ -0,0 +1,413 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import shutil
+import uuid
+from collections.abc import Iterable
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Optional
+
+from beebop.config import DatabaseFileStore, PoppunkFileStore
+from beebop.db import ProjectCatalog, RedisManager
+from beebop.models import SpeciesConfig
+
+from .archive_service import rehydrate_project
+from .compression_service import GZIP_SUFFIX, create_compressed_file
+from .job_service import read_project_status_record
+from .manifest_service import copy_manifests
+
+logger = logging.getLogger(__name__)
+
+# args.json objects that affect the outputs of a run
+MEMO_ARGS = ("assign", "visualise")
+# job types whose statuses are shared with the project the outputs are reused from
+MEMO_JOB_TYPES = ("assign", "visualise", "sublineageAssign")
+
+
+def get_run_digest(
+    hashes: Iterable[str],
+    species: str,
+    args: SimpleNamespace,
+    species_args: SpeciesConfig,
+    db_digest: str,
+    amr_metadata: list[dict],
+) -> str:
+    """
+    [Digest of everything that determines the outputs of a run: the sample
+    hashes in any order, the species and its settings, the assign and
+    visualise arguments, the AMR metadata and the databases.]
+
+    :param hashes: [sample hashes]
+    :param species: [species name]
+    :param args: [arguments loaded from args.json]
+    :param species_args: [species settings from args.json]
+    :param db_digest: [digest of the species' databases, from get_db_digest]
+    :param amr_metadata: [AMR metadata for query samples]
+    :return str: [hex digest]
+    """
+    species_settings = {key: value for key, value in vars(species_args).items() if key != "admission"}
+    inputs = {
+        "hashes": sorted(hashes),
+        "species": species,
+        "species_args": species_settings,
+        "args": {name: getattr(args, name, None) for name in MEMO_ARGS},
+        "amr_metadata": amr_metadata,
+        "databases": db_digest,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=vars).encode()).hexdigest()
+
+
+def get_db_digest(db_stores: Iterable[DatabaseFileStore]) -> str:
+    """
+    [Digest identifying a version of a species' databases, which changes
+    when any of their files is replaced or modified.]
+
+    :param db_stores: [DatabaseFileStores of the species' databases]
+    :return str: [hex digest]
+    """
+    return hashlib.sha256(json.dumps(get_db_fingerprint(db_stores)).encode()).hexdigest()
+
+
+def get_db_fingerprint(db_stores: Iterable[DatabaseFileStore]) -> list:
+    """
+    :param db_stores: [DatabaseFileStores of the species' databases]
+    :return list: [path, size and modification time of each database,
+        sub-lineage database and metadata file]
+    """
+    paths = sorted(
+        {
+            path
+            for db_fs in db_stores
+            for path in (db_fs.db, db_fs.sublineages_db_path, db_fs.metadata, db_fs.external_clustering)
+            if path is not None
+        }
+    )
+    fingerprint = []
+    for path in paths:
+        for file_path in [path] if os.path.isfile(path) else _walk_files(path):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            fingerprint.append((file_path, stat.st_size, stat.st_mtime_ns))
+    return fingerprint
+
+
+def _walk_files(path: str) -> Iterable[str]:
+    """
+    :param path: [folder]
+    :return Iterable[str]: [files in the folder and its sub-folders, in a stable order]
+    """
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            yield os.path.join(root, name)
+
+
+def write_run_digest(p_hash: str, fs: PoppunkFileStore, digest: str) -> None:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param digest: [digest of the project's inputs]
+    """
+    with open(fs.run_digest(p_hash), "w") as f:
+        f.write(digest)
+
+
+def delete_run_digest(p_hash: str, fs: PoppunkFileStore) -> None:
+    """
+    [Removes the digest of a project whose outputs no longer match a run of
+    its inputs, e.g. once samples are added to it, so it is not reused]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    """
+    try:
+        os.remove(fs.run_digest(p_hash))
+    except FileNotFoundError:
+        pass
+
+
+def read_run_digest(p_hash: str, fs: PoppunkFileStore) -> Optional[str]:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return Optional[str]: [digest of the project's inputs, None if unknown]
+    """
+    try:
+        with open(fs.run_digest(p_hash)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def is_completed(p_hash: str, fs: PoppunkFileStore) -> bool:
+    """
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :return bool: [whether all jobs of the project finished successfully]
+    """
+    record = read_project_status_record(p_hash, fs)
+    if record is None:
+        return False
+    status = record["status"]
+    job_statuses = [
+        *(value for key, value in status.items() if key != "visualiseClusters"),
+        *status["visualiseClusters"].values(),
+    ]
+    return all(job_status == "finished" for job_status in job_statuses)
+
+
+def record_run(p_hash: str, fs: PoppunkFileStore, name_mapping: dict) -> None:
+    """
+    [Records a completed project as the one to reuse the outputs of for
+    runs with the same inputs. Called once the project's status record has
+    been written; projects with failed jobs are not recorded.]
+
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param name_mapping: [dict that maps filehashes (keys) to
+        corresponding filenames (values) of all query samples.]
+    """
+    digest = read_run_digest(p_hash, fs)
+    if digest is None or not is_completed(p_hash, fs):
+        return
+    path = fs.run_memo(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"project": p_hash, "nameMapping": name_mapping}, f)
+    os.replace(tmp_path, path)
+
+
+def find_memoized_run(digest: str, fs: PoppunkFileStore) -> Optional[dict]:
+    """
+    [Looks up the completed project a run with the given inputs can reuse
+    the outputs of. Memos of projects that were removed, re-submitted with
+    other inputs or re-run with failures are discarded.]
+
+    :param digest: [digest of the run's inputs]
+    :param fs: [PoppunkFileStore instance]
+    :return Optional[dict]: [hash of the project (project) and its name
+        mapping (nameMapping), None if there is none]
+    """
+    path = fs.run_memo(digest)
+    try:
+        with open(path) as f:
+            memo = json.load(f)
+    except FileNotFoundError:
+        return None
+    source = memo["project"]
+    if (
+        read_run_digest(source, fs) == digest
+        and is_completed(source, fs)
+        and os.path.exists(fs.visualise_context(source))
+    ):
+        return memo
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def get_name_rewrites(memo_name_mapping: dict, name_mapping: dict) -> Optional[dict[str, str]]:
+    """
+    :param memo_name_mapping: [name mapping of the project the outputs are reused from]
+    :param name_mapping: [name mapping of the new project]
+    :return Optional[dict]: [new filename by reused filename for samples
+        whose name differs, None if the reused names are ambiguous]
+    """
+    rewrites = {
+        old_name: name_mapping[sample_hash]
+        for sample_hash, old_name in memo_name_mapping.items()
+        if name_mapping.get(sample_hash, old_name) != old_name
+    }
+    if rewrites and len(set(memo_name_mapping.values())) != len(memo_name_mapping):
+        # two samples had the same name, so it cannot be told which one to rename
+        return None
+    return rewrites
+
+
+def reuse_memoized_run(
+    digest: str,
+    p_hash: str,
+    fs: PoppunkFileStore,
+    name_mapping: dict,
+    redis_manager: RedisManager,
+) -> Optional[dict]:
+    """
+    [Creates a project from the outputs of a completed project with the same
+    inputs, if there is one, instead of running any jobs. Output files are
+    hard linked; only files naming the samples are rewritten, if the new
+    project names them differently. The new project shares the finished
+    jobs of the project it reuses.]
+
+    :param digest: [digest of the run's inputs]
+    :param p_hash: [project hash]
+    :param fs: [PoppunkFileStore instance]
+    :param name_mapping: [dict that maps filehashes (keys) to
+        corresponding filenames (values) of all query samples.]
+    :param redis_manager: [RedisManager instance]
+    :return Optional[dict]: [job IDs, as returned for a new run, None if
+        the project must be run]
+    """
+    memo = find_memoized_run(digest, fs)
+    if memo is None or memo["project"] == p_hash:
+        return None
+    source = memo["project"]
+    rewrites = get_name_rewrites(memo["nameMapping"], name_mapping)
+    job_ids = {
+        job_type: job_id.decode("utf-8")
+        for job_type in MEMO_JOB_TYPES
+        if (job_id := redis_manager.get_job_status(job_type, source)) is not None
+    }
+    if rewrites is None or "assign" not in job_ids or "visualise" not in job_ids:
+        return None
+
+    logger.info(f"Reusing the outputs of project {source} for project {p_hash}")
+    rehydrate_project(source, fs)
+    fs.setup_output_directory(p_hash)
+    copy_project_outputs(source, p_hash, fs, rewrites)
+    copy_manifests(source, p_hash, fs)
+    ProjectCatalog(fs.project_catalog(source)).copy(fs.project_catalog(p_hash))
+    with open(fs.visualise_context(source), "rb") as context_file:
+        context = pickle.load(context_file)
+    # contexts written before jobs resolved their species held a pickled wrapper
+    context.pop("wrapper", None)
+    context["name_mapping"] = name_mapping
+    with open(fs.visualise_context(p_hash), "wb") as context_file:
+        pickle.dump(context, context_file)
+
+    redis_manager.delete_visualisation_statuses(p_hash)
+    for job_type, job_id in job_ids.items():
+        redis_manager.set_job_status(job_type, p_hash, job_id)
+    for cluster, job_id in redis_manager.get_visualisation_statuses(source).items():
+        redis_manager.set_visualisation_status(p_hash, cluster.decode("utf-8"), job_id.decode("utf-8"))
+
+    record = read_project_status_record(source, fs)
+    record["completedAt"] = datetime.now(tz=timezone.utc).isoformat(timespec="seconds")
+    with open(fs.project_status(p_hash), "w") as f:
+        json.dump(record, f)
+    write_run_digest(p_hash, fs, digest)
+    return job_ids
+
+
+def copy_project_outputs(source: str, p_hash: str, fs: PoppunkFileStore, rewrites: dict[str, str]) -> None:
+    """
+    [Hard links the output files of a project into another project, renaming
+    files named after the project. Visualisation files are rewritten instead
+    if samples are renamed. Files kept per project (catalog, status and
+    garbage collection markers, visualisation context) and stage manifests
+    are not copied.]
+
+    :param source: [hash of the project to copy]
+    :param p_hash: [hash of the new project]
+    :param fs: [PoppunkFileStore instance]
+    :param rewrites: [new filename by reused filename]
+    """
+    source_dir = fs.output(source)
+    target_dir = fs.output(p_hash)
+    per_project = {
+        os.path.basename(path)
+        for path in (
+            fs.project_status(source),
+            fs.project_last_access(source),
+            fs.project_pin(source),
+            fs.run_digest(source),
+            fs.visualise_context(source),
+            fs.project_archive_lock(source),
+        )
+    }
+    catalog = os.path.basename(fs.project_catalog(source))
+    per_project.update({catalog, f"{catalog}-journal"})
+    pattern = _get_names_pattern(rewrites)
+
+    for root, dirs, files in os.walk(source_dir):
+        relative = os.path.relpath(root, source_dir)
+        # tmp only holds intermediate files of running jobs, manifests are rewritten for the new project
+        dirs[:] = [name for name in dirs if not (relative == "." and name in ("tmp", "manifests"))]
+        target_root = os.path.normpath(os.path.join(target_dir, relative.replace(source, p_hash)))
+        os.makedirs(target_root, exist_ok=True)
+        in_visualisations = relative.split(os.sep)[0].startswith("visualise_")
+        for name in files:
+            if relative == "." and name in per_project:
+                continue
+            source_path = os.path.join(root, name)
+            target_path = os.path.join(target_root, name.replace(source, p_hash))
+            if pattern is not None and in_visualisations and not name.endswith(".h5"):
+                rewrite_names(source_path, target_path, pattern, rewrites)
+            else:
+                link_or_copy(source_path, target_path)
+
+
+def link_or_copy(source_path: str, target_path: str) -> None:
+    """
+    [Hard links a file, or copies it if the filesystem does not support
+    hard links.]
+
+    :param source_path: [file to link]
+    :param target_path: [path of the link]
+    """
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy2(source_path, target_path)
+
+
+def unshare_file(path: str) -> None:
+    """
+    [Gives a file hard linked into other projects by copy_project_outputs a
+    copy of its own, so it can be changed in place without changing theirs.]
+
+    :param path: [file about to be changed]
+    """
+    if os.stat(path).st_nlink > 1:
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        shutil.copy2(path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def _get_names_pattern(rewrites: dict[str, str]) -> Optional[re.Pattern]:
+    """
+    :param rewrites: [new filename by reused filename]
+    :return Optional[re.Pattern]: [pattern matching the reused filenames as
+        whole names, None if there is nothing to rewrite]
+    """
+    if not rewrites:
+        return None
+    # longest first, so names that are prefixes of others do not match early
+    names = "|".join(re.escape(name) for name in sorted(rewrites, key=len, reverse=True))
+    return re.compile(rf"(?<![\w.\-])({names})(?![\w.\-])")
+
+
+def rewrite_names(source_path: str, target_path: str, pattern: re.Pattern, rewrites: dict[str, str]) -> None:
+    """
+    [Writes a copy of a visualisation file with samples renamed. Files
+    that are not text are linked unchanged; compressed text files are
+    rewritten compressed.]
+
+    :param source_path: [file to copy]
+    :param target_path: [path of the copy]
+    :param pattern: [pattern matching the reused filenames]
+    :param rewrites: [new filename by reused filename]
+    """
+    compressed = source_path.endswith(GZIP_SUFFIX)
+    try:
+        with gzip.open(source_path, "rt") if compressed else open(source_path) as f:
+            content = f.read()
+    except UnicodeDecodeError:
+        link_or_copy(source_path, target_path)
+        return
+    content = pattern.sub(lambda match: rewrites[match.group(1)], content)
+    if compressed:
+        with create_compressed_file(target_path) as f:
+            f.write(content.encode())
+    else:
+        with open(target_path, "w") as f:
+            f.write(content)
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from beebop.config import PoppunkFileStore
+
+# environment variable with the worker's scratch location, e.g. on local disk or tmpfs
+SCRATCH_LOCATION_VARIABLE = "SCRATCH_LOCATION"
+
+
+@contextmanager
+def job_scratch(p_hash: str, *file_stores: PoppunkFileStore) -> Iterator[None]:
+    """
+    [Gives the running job a scratch folder in the worker's scratch
+    location, so PopPUNK intermediates (e.g. the query database and
+    distances of an assignment to the full database) are not written to
+    shared storage. Jobs copy only their final artifacts to the project's
+    output folder. The scratch folder is deleted when the job ends, whether
+    it succeeded or failed. Without a scratch location the project's tmp
+    folder is used.]
+
+    :param p_hash: [project hash]
+    :param file_stores: [PoppunkFileStore instances of the job, each
+        resolving its tmp folder to the scratch folder]
+    """
+    scratch_location = os.getenv(SCRATCH_LOCATION_VARIABLE)
+    if not scratch_location:
+        yield
+        return
+    os.makedirs(scratch_location, exist_ok=True)
+    scratch = tempfile.mkdtemp(prefix=f"{p_hash}-", dir=scratch_location)
+    # scratch folders of enclosing job steps are restored on exit
+    previous = [fs.scratch for fs in file_stores]
+    for fs in file_stores:
+        fs.scratch = scratch
+    try:
+        yield
+    finally:
+        for fs, previous_scratch in zip(file_stores, previous):
+            fs.scratch = previous_scratch
+        shutil.rmtree(scratch, ignore_errors=True)
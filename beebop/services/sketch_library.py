@@ -0,0 +1,120 @@
+import os
+import tempfile
+import uuid
+
+import h5py
+from PopPUNK.web import sketch_to_hdf5
+
+from beebop.config.filepaths import SHARD_PREFIX_LENGTH
+from beebop.config.sketch_format import from_hex_sketch
+
+SKETCHES_GROUP = "sketches"
+
+
+def query_db_path(output: str) -> str:
+    """
+    :param output: [PopPUNK output folder]
+    :return str: [path PopPUNK expects the query database in, as created
+        by sketch_to_hdf5]
+    """
+    return os.path.join(output, f"{os.path.basename(output)}.h5")
+
+
+class SketchLibrary:
+    """
+    [Library holding the sketch of every ingested sample in PopPUNK's
+    database format, one HDF5 file per sample, sharded by the first
+    characters of the sample hash. Sketches are converted once when they are
+    added; query databases are then assembled by copying the stored groups,
+    without converting sketches again.
+
+    Sample files are written in full under a temporary name and renamed into
+    place, so they are never seen half written and never change afterwards.
+    Readers and writers need no locks, which are unreliable on shared
+    storage such as NFS. The sketch store remains the source of truth, so
+    the library can be deleted at any time and is repopulated as sketches
+    are used.]
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: [path to the library folder]
+        """
+        self.path = path
+
+    def sample_path(self, sample_hash: str) -> str:
+        """
+        :param sample_hash: [sample hash]
+        :return str: [path to the file holding the sample's sketch]
+        """
+        return os.path.join(self.path, sample_hash[:SHARD_PREFIX_LENGTH], f"{sample_hash}.h5")
+
+    def missing(self, sample_hashes: list[str]) -> list[str]:
+        """
+        :param sample_hashes: [sample hashes]
+        :return list[str]: [sample hashes not in the library yet]
+        """
+        return [sample_hash for sample_hash in sample_hashes if not os.path.exists(self.sample_path(sample_hash))]
+
+    def add(self, sketches: dict[str, dict]) -> None:
+        """
+        [Adds sketches to the library, skipping samples that are already in
+        it. Sketches are converted with PopPUNK's sketch_to_hdf5 into a
+        staging database first, so the library holds exactly what PopPUNK
+        would have written.]
+
+        :param sketches: [sketches by sample hash, hashes either as
+            hexadecimal strings or as uint64 arrays]
+        """
+        new_hashes = self.missing(list(sketches))
+        if not new_hashes:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.path) as staging:
+            sketch_to_hdf5({sample_hash: from_hex_sketch(sketches[sample_hash]) for sample_hash in new_hashes}, staging)
+            with h5py.File(query_db_path(staging), "r") as source:
+                for sample_hash in new_hashes:
+                    self._write_sample(source[SKETCHES_GROUP], sample_hash)
+
+    def build_query_db(self, sample_hashes: list[str], output: str) -> list[str]:
+        """
+        [Assembles a PopPUNK query database for the given samples by copying
+        their groups from the library. All samples must be in the library.]
+
+        :param sample_hashes: [sample hashes to include]
+        :param output: [PopPUNK output folder to create the database in]
+        :return list[str]: [sample hashes in the database, i.e. PopPUNK's qNames]
+        """
+        os.makedirs(output, exist_ok=True)
+        with h5py.File(query_db_path(output), "w") as query_db:
+            target = query_db.create_group(SKETCHES_GROUP)
+            for sample_hash in sample_hashes:
+                with h5py.File(self.sample_path(sample_hash), "r") as sample:
+                    source = sample[SKETCHES_GROUP]
+                    sample.copy(source[sample_hash], target, name=sample_hash)
+                    # as with sketch_to_hdf5, the last sample's values win
+                    target.attrs.update(source.attrs)
+        return list(sample_hashes)
+
+    def _write_sample(self, sketches: h5py.Group, sample_hash: str) -> None:
+        """
+        [Writes a sample's file with its group and the attributes PopPUNK
+        keeps on the sketches group, then renames it into place. Another
+        process adding the same sample writes the same content.]
+
+        :param sketches: [sketches group of the staging database]
+        :param sample_hash: [sample hash]
+        """
+        path = self.sample_path(sample_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with h5py.File(tmp_path, "w") as sample:
+                target = sample.create_group(SKETCHES_GROUP)
+                sketches.file.copy(sketches[sample_hash], target, name=sample_hash)
+                target.attrs.update(sketches.attrs)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,230 @@
+import logging
+import os
+from collections.abc import Mapping
+from types import MappingProxyType, SimpleNamespace
+from typing import Any, Optional
+
+from PopPUNK.sketchlib import getKmersFromReferenceDatabase
+
+from beebop.config.config import ConfigurationError, get_args, get_dbs_location
+from beebop.models import SpeciesConfig, SpeciesRegistryEntry
+
+from .file_service import setup_db_file_stores
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_SPECIES_FIELDS = ("refdb", "fulldb", "qc_dict")
+
+
+class ReadOnlyNamespace(SimpleNamespace):
+    """
+    [SimpleNamespace whose attributes cannot be set or deleted once created,
+    so species settings shared through the registry cannot be changed by
+    one request under another.]
+    """
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+
+def freeze_namespace(namespace: SimpleNamespace) -> ReadOnlyNamespace:
+    """
+    :param namespace: [settings loaded from args.json]
+    :return ReadOnlyNamespace: [read-only copy, nested namespaces included]
+    """
+    return ReadOnlyNamespace(
+        **{
+            key: freeze_namespace(value) if isinstance(value, SimpleNamespace) else value
+            for key, value in vars(namespace).items()
+        }
+    )
+
+
+# args.json and the registry built from it, shared by everything in a process.
+# beebop.server builds them before forking so pre-forked workers inherit them
+# copy-on-write. Both are replaced together in a single assignment on reload.
+_registry_holder: dict[str, tuple[SimpleNamespace, Mapping[str, SpeciesRegistryEntry]]] = {}
+
+
+def get_species_registry(args: SimpleNamespace, dbs_location: str) -> Mapping[str, SpeciesRegistryEntry]:
+    """
+    [Returns the species registry of this process, building it on first use.]
+
+    :param args: [arguments loaded from args.json, used if the registry
+        has not been built yet]
+    :param dbs_location: [location of databases]
+    :return Mapping: [read-only mapping of species name to registry entry]
+    """
+    return get_species_snapshot(args, dbs_location)[1]
+
+
+def get_species_snapshot(
+    args: SimpleNamespace, dbs_location: str
+) -> tuple[SimpleNamespace, Mapping[str, SpeciesRegistryEntry]]:
+    """
+    [Returns the arguments and species registry currently in use, building
+    the registry on first use. A reload may have replaced both since the
+    app started, so callers needing both should take them from here.]
+
+    :param args: [arguments loaded from args.json, used if the registry
+        has not been built yet]
+    :param dbs_location: [location of databases]
+    :return tuple: [arguments and the registry built from them]
+    """
+    if "current" not in _registry_holder:
+        _registry_holder["current"] = (args, build_species_registry(args, dbs_location))
+    return _registry_holder["current"]
+
+
+def reload_species_registry(dbs_location: str, args: Optional[SimpleNamespace] = None) -> Optional[SimpleNamespace]:
+    """
+    [Re-reads args.json and swaps in a registry built from it. The new
+    registry is built, and so its databases read, before the swap, so
+    requests keep being served from the current registry until the new one
+    is ready. The reload is rejected if a species that is available now
+    would become unavailable, e.g. because a new database version has not
+    been fully copied yet. Jobs look the species up when they run, see
+    resolve_species.]
+
+    :param dbs_location: [location of databases]
+    :param args: [new arguments, read from args.json if not given]
+    :return Optional[SimpleNamespace]: [the new arguments, None if the
+        current configuration was kept]
+    """
+    try:
+        new_args = args if args is not None else get_args()
+        new_registry = build_species_registry(new_args, dbs_location)
+    except Exception:
+        logger.exception("Could not reload species configuration, keeping the current one")
+        return None
+
+    current = _registry_holder.get("current")
+    if current is not None:
+        lost = [
+            species
+            for species, entry in current[1].items()
+            if entry.available and not (species in new_registry and new_registry[species].available)
+        ]
+        if lost:
+            logger.error(
+                f"Not reloading species configuration: databases of {', '.join(lost)} would become unavailable"
+            )
+            return None
+
+    _registry_holder["current"] = (new_args, new_registry)
+    logger.info("Reloaded species configuration")
+    return new_args
+
+
+def build_species_registry(args: SimpleNamespace, dbs_location: str) -> Mapping[str, SpeciesRegistryEntry]:
+    """
+    [Validates every species in args.json and precomputes what is needed to
+    serve and run it: database file stores, sub-lineage model availability
+    and k-mer info.]
+
+    :param args: [arguments loaded from args.json]
+    :param dbs_location: [location of databases]
+    :raises ConfigurationError: [if a species is missing required settings]
+    :return Mapping: [read-only mapping of species name to registry entry]
+    """
+    return MappingProxyType(
+        {
+            species: build_species_entry(species, species_args, dbs_location)
+            for species, species_args in vars(args.species).items()
+        }
+    )
+
+
+def build_species_entry(species: str, species_args: SpeciesConfig, dbs_location: str) -> SpeciesRegistryEntry:
+    """
+    [Builds the registry entry of a single species. Species whose reference
+    database cannot be read are kept, but marked as unavailable.]
+
+    :param species: [species name]
+    :param species_args: [species settings from args.json]
+    :param dbs_location: [location of databases]
+    :raises ConfigurationError: [if the species is missing required settings]
+    :return SpeciesRegistryEntry: [registry entry]
+    """
+    missing = [field for field in REQUIRED_SPECIES_FIELDS if getattr(species_args, field, None) is None]
+    if missing:
+        raise ConfigurationError(f"Species {species} is missing required settings: {', '.join(missing)}")
+
+    ref_db_fs, full_db_fs = setup_db_file_stores(species_args, dbs_location)
+    kmer_info = None
+    try:
+        kmer_info = get_kmer_info(ref_db_fs.db)
+    except Exception:
+        logger.exception(
+            f"Reference database for species {species} not readable at {ref_db_fs.db}, the species is unavailable"
+        )
+
+    return SpeciesRegistryEntry(
+        name=species,
+        config=freeze_namespace(species_args),
+        ref_db_fs=ref_db_fs,
+        full_db_fs=full_db_fs,
+        has_sublineages=full_db_fs.sublineages_db_path is not None and os.path.isdir(full_db_fs.sublineages_db_path),
+        kmer_info=kmer_info,
+    )
+
+
+def get_kmer_info(db_path: str) -> dict[str, Any]:
+    """
+    Retrieve k-mer information from database for a given species.
+
+    :param db_path: [path to the species reference database.]
+    :return dict: [A dictionary containing the maximum, minimum, and step
+        k-mer values.]
+    """
+    kmers = getKmersFromReferenceDatabase(db_path)
+    return {
+        "kmerMax": int(kmers[-1]),
+        "kmerMin": int(kmers[0]),
+        "kmerStep": int(kmers[1] - kmers[0]),
+    }
+
+
+def get_species_entry(registry: Mapping[str, SpeciesRegistryEntry], species: str) -> Optional[SpeciesRegistryEntry]:
+    """
+    [Looks up a species that can be run.]
+
+    :param registry: [species registry]
+    :param species: [species name]
+    :return Optional[SpeciesRegistryEntry]: [registry entry, None if the species
+        is unknown or its reference database is unavailable]
+    """
+    entry = registry.get(species)
+    if entry is None or not entry.available:
+        return None
+    return entry
+
+
+def resolve_species(species: str) -> tuple[SimpleNamespace, SpeciesRegistryEntry]:
+    """
+    [Looks up a species in a job. Jobs are given the species name instead of
+    pickled arguments and database file stores, and resolve it from the
+    registry of the worker process if it has one. Otherwise only the
+    species is built, from args.json and DBS_LOCATION, as rq runs each job
+    in a fresh fork of the worker.]
+
+    :param species: [species name]
+    :raises ConfigurationError: [if the species is unknown or its reference
+        database is unavailable]
+    :return tuple: [arguments and registry entry of the species]
+    """
+    if "current" in _registry_holder:
+        args, registry = _registry_holder["current"]
+        entry = get_species_entry(registry, species)
+    else:
+        args = get_args()
+        species_args = getattr(args.species, species, None)
+        entry = None
+        if species_args is not None:
+            entry = build_species_entry(species, species_args, get_dbs_location())
+    if entry is None or not entry.available:
+        raise ConfigurationError(f"No database found for species: {species}")
+    return args, entry
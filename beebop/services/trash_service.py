@@ -0,0 +1,108 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from collections.abc import Iterator
+from types import SimpleNamespace
+
+from beebop.config import PoppunkFileStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DELETES_PER_SECOND = 1000
+DEFAULT_INTERVAL_SECONDS = 30
+# number of files deleted between checks of the delete rate
+DELETE_BATCH = 100
+# name of the lock file, so one process at a time empties the trash
+LOCK_FILE = ".lock"
+
+# process the reaper thread was started in
+_reaper_holder: dict[str, int] = {}
+
+
+def empty_trash(fs: PoppunkFileStore, deletes_per_second: float) -> int:
+    """
+    [Deletes the folders moved to the trash, at most deletes_per_second
+    files and folders per second, so deleting large projects does not
+    starve other I/O. Does nothing if another process is emptying the
+    trash.]
+
+    :param fs: [PoppunkFileStore instance]
+    :param deletes_per_second: [maximum rate of deletes]
+    :return int: [number of files and folders deleted]
+    """
+    trash = fs.trash()
+    os.makedirs(trash, exist_ok=True)
+    with open(os.path.join(trash, LOCK_FILE), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+        deleted = 0
+        start = time.monotonic()
+        for entry in os.listdir(trash):
+            if entry == LOCK_FILE:
+                continue
+            for path in _walk_bottom_up(os.path.join(trash, entry)):
+                try:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        os.rmdir(path)
+                    else:
+                        os.remove(path)
+                except FileNotFoundError:
+                    continue
+                deleted += 1
+                if deleted % DELETE_BATCH == 0:
+                    ahead = deleted / deletes_per_second - (time.monotonic() - start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+    if deleted:
+        logger.info(f"Deleted {deleted} files and folders from the trash")
+    return deleted
+
+
+def _walk_bottom_up(path: str) -> Iterator[str]:
+    """
+    :param path: [file or folder in the trash]
+    :return Iterator[str]: [files, then folders after their contents]
+    """
+    if not os.path.isdir(path) or os.path.islink(path):
+        yield path
+        return
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            yield os.path.join(root, name)
+        # symlinks to folders are listed in dirs, and removed as files
+        for name in dirs:
+            if os.path.islink(os.path.join(root, name)):
+                yield os.path.join(root, name)
+        yield root
+
+
+def start_trash_reaper(fs: PoppunkFileStore, args: SimpleNamespace) -> None:
+    """
+    [Starts a daemon thread emptying the trash every interval_seconds, at
+    the rate set in the trash object in args.json. At most one thread is
+    started per process.]
+
+    :param fs: [PoppunkFileStore instance]
+    :param args: [arguments loaded from args.json]
+    """
+    # threads do not survive a fork, so check the process rather than a flag
+    if _reaper_holder.get("pid") == os.getpid():
+        return
+    _reaper_holder["pid"] = os.getpid()
+    trash_args = getattr(args, "trash", None)
+    deletes_per_second = getattr(trash_args, "deletes_per_second", DEFAULT_DELETES_PER_SECOND)
+    interval_seconds = getattr(trash_args, "interval_seconds", DEFAULT_INTERVAL_SECONDS)
+
+    def reap() -> None:
+        while True:
+            try:
+                empty_trash(fs, deletes_per_second)
+            except OSError:
+                logger.exception("Could not empty the trash")
+            time.sleep(interval_seconds)
+
+    threading.Thread(target=reap, name="trash-reaper", daemon=True).start()
@@ -0,0 +1,76 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+from redis import Redis
+
+from beebop.config import PoppunkFileStore
+from beebop.config.config import get_args
+from beebop.db import RedisManager
+from beebop.services.archive_service import archive_cold_projects
+from beebop.services.gc_service import collect_garbage, get_gc_report, set_project_pinned
+from beebop.services.trash_service import DEFAULT_DELETES_PER_SECOND, empty_trash, start_trash_reaper
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Archive cold projects, then remove least recently accessed projects and unused sketches to "
+        "keep storage under its quota."
+    )
+    parser.add_argument(
+        "-s",
+        "--storage",
+        type=str,
+        required=True,
+        help="Path to the storage location (STORAGE_LOCATION).",
+    )
+    parser.add_argument("--report", action="store_true", help="Print disk usage and reclaimable bytes and exit.")
+    parser.add_argument("--dry-run", action="store_true", help="Log what would be removed without removing it.")
+    parser.add_argument("--pin", metavar="PROJECT_HASH", help="Protect a project from garbage collection and exit.")
+    parser.add_argument("--unpin", metavar="PROJECT_HASH", help="Remove the protection of a project and exit.")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running, collecting every interval_minutes from args.json.",
+    )
+    return parser
+
+
+def main():
+    """Collect garbage in the storage location once, or periodically with --daemon."""
+    logging.basicConfig(level=logging.INFO)
+    options = get_parser().parse_args()
+    fs = PoppunkFileStore(options.storage)
+
+    if options.pin or options.unpin:
+        set_project_pinned(options.pin or options.unpin, fs, options.pin is not None)
+        return
+
+    redis_manager = RedisManager(Redis(host=os.getenv("REDIS_HOST", "127.0.0.1")))
+    if options.daemon and not options.dry_run:
+        # empty the trash every interval_seconds between collections
+        start_trash_reaper(fs, get_args())
+    while True:
+        # re-read, so changes to the quota apply without a restart
+        args = get_args()
+        gc_args = args.garbage_collection
+        if options.report:
+            print(json.dumps(get_gc_report(fs, redis_manager, gc_args), indent=2))
+            return
+        archival_args = getattr(args, "archival", None)
+        if archival_args is not None:
+            # archived projects take less space, so fewer projects are removed
+            print(json.dumps(archive_cold_projects(fs, redis_manager, gc_args, archival_args, options.dry_run)))
+        print(json.dumps(collect_garbage(fs, redis_manager, gc_args, options.dry_run)))
+        if not options.dry_run:
+            # removed projects are moved to the trash, delete them even if no API process is running
+            empty_trash(fs, getattr(getattr(args, "trash", None), "deletes_per_second", DEFAULT_DELETES_PER_SECOND))
+        if not options.daemon:
+            return
+        time.sleep(gc_args.interval_minutes * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import logging
+from pathlib import Path
+
+from beebop.config.filepaths import FileStore
+from beebop.config.storage import create_storage_backend
+
+
+def get_sketch_store_path() -> Path:
+    parser = argparse.ArgumentParser(description="Move sketches stored flat into the sharded sketch store layout.")
+    parser.add_argument(
+        "-s",
+        "--storage",
+        type=str,
+        required=True,
+        help="Path to the storage location (STORAGE_LOCATION).",
+    )
+    args = parser.parse_args()
+
+    sketch_store_path = Path(args.storage, "json")
+    if not sketch_store_path.is_dir():
+        raise FileNotFoundError(f"Sketch store {sketch_store_path} does not exist.")
+    return sketch_store_path
+
+
+def main():
+    """Migrate the sketch store to the sharded layout. Safe to run while the app is serving."""
+    logging.basicConfig(level=logging.INFO)
+    sketch_store_path = get_sketch_store_path()
+    # moves sketches into the backend configured with STORAGE_BACKEND
+    backend = create_storage_backend(str(sketch_store_path), "json")
+    migrated = FileStore(str(sketch_store_path), backend).migrate_flat_layout()
+    print(f"Migrated {migrated} sketches in {sketch_store_path}")
+
+
+if __name__ == "__main__":
+    main()
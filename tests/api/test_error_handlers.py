@@ -0,0 +1,11 @@
+from werkzeug.exceptions import NotFound, TooManyRequests
+
+from beebop.api.error_handlers import get_retry_after_header
+
+
+def test_get_retry_after_header():
+    assert get_retry_after_header(TooManyRequests("busy", retry_after=30)) == {"Retry-After": "30"}
+
+
+def test_get_retry_after_header_missing():
+    assert get_retry_after_header(NotFound()) == {}
@@ -0,0 +1,50 @@
+from beebop.db import AssignmentCache
+
+SPECIES = "Streptococcus pneumoniae"
+ASSIGNMENTS = [
+    {"hash": "aa11", "cluster": "GPSC1", "raw_cluster_num": "1"},
+    {"hash": "bb22", "cluster": "GPSC2", "raw_cluster_num": "2;7"},
+]
+
+
+def test_assignment_cache_round_trip(tmp_path):
+    cache = AssignmentCache(str(tmp_path / "cache.sqlite"))
+
+    cache.save_assignments(SPECIES, "v1", ASSIGNMENTS)
+    cache.save_sublineages(SPECIES, "v1", {"aa11": {"Rank_5_Lineage": 3}, "unknown": {"Rank_5_Lineage": 1}})
+
+    assert cache.get(SPECIES, "v1", ["aa11", "bb22", "cc33"]) == {
+        "aa11": {"cluster": "GPSC1", "raw_cluster_num": "1", "sublineage": {"Rank_5_Lineage": 3}},
+        "bb22": {"cluster": "GPSC2", "raw_cluster_num": "2;7", "sublineage": None},
+    }
+    assert cache.get("other species", "v1", ["aa11"]) == {}
+
+
+def test_assignment_cache_keeps_sublineages_on_reassignment(tmp_path):
+    cache = AssignmentCache(str(tmp_path / "cache.sqlite"))
+    cache.save_assignments(SPECIES, "v1", ASSIGNMENTS)
+    cache.save_sublineages(SPECIES, "v1", {"aa11": {"Rank_5_Lineage": 3}})
+
+    cache.save_assignments(SPECIES, "v1", ASSIGNMENTS[:1])
+
+    assert cache.get(SPECIES, "v1", ["aa11"])["aa11"]["sublineage"] == {"Rank_5_Lineage": 3}
+
+
+def test_assignment_cache_invalidated_by_new_database(tmp_path):
+    cache = AssignmentCache(str(tmp_path / "cache.sqlite"))
+    cache.save_assignments(SPECIES, "v1", ASSIGNMENTS)
+    cache.save_assignments("other species", "v1", ASSIGNMENTS)
+
+    cache.save_assignments(SPECIES, "v2", ASSIGNMENTS[1:])
+
+    assert cache.get(SPECIES, "v1", ["aa11", "bb22"]) == {}
+    assert list(cache.get(SPECIES, "v2", ["aa11", "bb22"])) == ["bb22"]
+    assert len(cache.get("other species", "v1", ["aa11", "bb22"])) == 2
+
+
+def test_assignment_cache_batches_lookups(tmp_path):
+    cache = AssignmentCache(str(tmp_path / "cache.sqlite"))
+    assignments = [{"hash": f"hash{i}", "cluster": i, "raw_cluster_num": i} for i in range(1200)]
+    cache.save_assignments(SPECIES, "v1", assignments)
+
+    assert len(cache.get(SPECIES, "v1", (value["hash"] for value in assignments))) == 1200
@@ -73,6 +73,7 @@ def test_config_setup():
     assert config.dbs_location is not None
     assert config.redis_host is not None
     assert config.job_timeout == 1200  # seconds
+    assert config.result_ttl == 7 * 24 * 3600  # seconds
     assert isinstance(config.schemas, Schema)
     assert isinstance(config.redis, Redis)
     assert hasattr(config, "args")
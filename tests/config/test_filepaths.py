@@ -1,3 +1,5 @@
+import errno
+import json
 import os
 import random
 import string
@@ -68,12 +70,12 @@ def test_get_sublineages_distances_path_success():
     assert result_path == expected_path
 
 
-def test_tmp_output_metadata(tmp_path):
+def test_output_metadata(tmp_path):
     fs = PoppunkFileStore(tmp_path)
 
-    result = fs.tmp_output_metadata("hash")
+    result = fs.output_metadata("hash")
 
-    assert result == str(PurePath(fs.tmp("hash"), "metadata.csv"))
+    assert result == str(PurePath(fs.output("hash"), "metadata.csv"))
 
 
 def test_pruned_network_output_component(tmp_path):
@@ -92,21 +94,61 @@ def test_pruned_network_output_component(tmp_path):
     )
 
 
-@patch("os.makedirs")
-@patch("os.path.exists")
-@patch("shutil.rmtree")
-def test_setup_output_directory_removes_existing_directory(mock_rmtree, mock_exists, mock_makedirs, tmp_path):
+def test_setup_output_directory_moves_existing_directory_to_trash(tmp_path):
     fs = PoppunkFileStore(tmp_path)
-    # Test when the directory already exists
-    mock_exists.return_value = True
     directory = fs.output("mock_hash")
+    os.makedirs(directory)
+    with open(os.path.join(directory, "old_result"), "w") as f:
+        f.write("old")
 
     fs.setup_output_directory("mock_hash")
 
-    mock_exists.assert_called_once_with(directory)
-    mock_rmtree.assert_called_once_with(directory)
-    mock_makedirs.assert_called_with(directory)
-    assert os.path.exists(directory)
+    assert os.listdir(directory) == []
+    [trashed] = os.listdir(fs.trash())
+    assert trashed.startswith("mock_hash-")
+    assert os.listdir(os.path.join(fs.trash(), trashed)) == ["old_result"]
+
+
+def test_move_to_trash_ignores_missing_folder(tmp_path):
+    fs = PoppunkFileStore(tmp_path)
+
+    fs.move_to_trash(fs.path_str(tmp_path, "missing"))
+
+    assert os.listdir(fs.trash()) == []
+
+
+def test_move_to_trash_deletes_folder_on_other_filesystem(tmp_path):
+    fs = PoppunkFileStore(tmp_path)
+    folder = fs.path_str(tmp_path, "scratch")
+    os.makedirs(folder)
+
+    with patch("os.rename", side_effect=OSError(errno.EXDEV, "Invalid cross-device link")):
+        fs.move_to_trash(folder)
+
+    assert not os.path.exists(folder)
+    assert os.listdir(fs.trash()) == []
+
+
+def test_tmp_in_scratch(tmp_path):
+    fs = PoppunkFileStore(tmp_path)
+    fs.scratch = fs.path_str(tmp_path, "scratch")
+
+    assert fs.tmp("test_hash") == str(PurePath(fs.scratch, "test_hash"))
+    assert fs.output_tmp("test_hash") == str(PurePath(fs.scratch, "test_hash", "test_hash"))
+    assert os.path.isdir(fs.output_tmp("test_hash"))
+    assert not os.path.exists(fs.output("test_hash"))
+
+
+def test_appended_samples_store(tmp_path):
+    fs = PoppunkFileStore(tmp_path)
+    append_fs = fs.appended_samples_store("test_hash")
+
+    assert append_fs.output("test_hash") == str(PurePath(fs.tmp("test_hash"), "append", "test_hash"))
+    assert append_fs.query_distances("test_hash") == str(
+        PurePath(fs.tmp("test_hash"), "append", "test_hash", "test_hash.dists")
+    )
+    assert append_fs.sketch_library() == fs.sketch_library()
+    assert fs.query_distances("test_hash") == str(PurePath(fs.output("test_hash"), "test_hash.dists"))
 
 
 def test_partial_query_graph(tmp_path):
@@ -177,6 +219,20 @@ def test_sublineage_results(tmp_path):
     assert result_path == expected_path
 
 
+def test_visualise_context(tmp_path):
+    fs = PoppunkFileStore(tmp_path)
+    p_hash = "test_hash"
+
+    assert fs.visualise_context(p_hash) == str(PurePath(fs.output(p_hash), "visualise_context.pickle"))
+
+
+def test_project_status(tmp_path):
+    fs = PoppunkFileStore(tmp_path)
+    p_hash = "test_hash"
+
+    assert fs.project_status(p_hash) == str(PurePath(fs.output(p_hash), "status.json"))
+
+
 def test_tmp_output_cluster_metadata(tmp_path):
     fs = PoppunkFileStore(tmp_path)
     p_hash = "test_hash"
@@ -223,3 +279,61 @@ def test_filestore():
     assert fs_test.exists(new_hash) is False
     fs_test.put(new_hash, new_sketch)
     assert fs_test.exists(new_hash) is True
+    assert fs_test.get(new_hash) == new_sketch
+
+
+def test_filestore_reads_legacy_sketches_without_moving_them(tmp_path):
+    fs_test = FileStore(str(tmp_path))
+    sketch = {"14": ["0x112482333510dfc9", "0xc2b6e311ab28d988"], "bases": [0.3, 0.2], "bbits": 14}
+    with open(fs_test.filename("hash1"), "w") as f:
+        json.dump(sketch, f)
+    fs_test.put("hash2", sketch)
+    os.replace(fs_test.binary_filename("hash2"), tmp_path / "hash2.sketch")
+
+    sketch_arrays = fs_test.get_arrays("hash1")
+
+    assert sketch_arrays["14"].tolist() == [0x112482333510DFC9, 0xC2B6E311AB28D988]
+    assert fs_test.exists("hash1") is True
+    assert fs_test.get("hash1") == sketch
+    assert fs_test.get("hash2") == sketch
+    assert os.path.exists(fs_test.filename("hash1"))
+    assert os.path.exists(tmp_path / "hash2.sketch")
+    assert not os.path.exists(fs_test.binary_filename("hash1"))
+    assert not os.path.exists(fs_test.binary_filename("hash2"))
+
+
+def test_filestore_shards_sketches(tmp_path):
+    fs_test = FileStore(str(tmp_path))
+
+    fs_test.put("abcdef", {"14": ["0x1f"]})
+
+    assert fs_test.binary_filename("abcdef") == str(tmp_path / "ab" / "abcdef.sketch")
+    assert os.listdir(tmp_path / "ab") == ["abcdef.sketch"]
+
+
+@patch("beebop.config.filepaths.write_binary_sketch")
+def test_filestore_put_many_skips_existing_sketches(mock_write, tmp_path):
+    fs_test = FileStore(str(tmp_path))
+    os.makedirs(tmp_path / "ha")
+    (tmp_path / "ha" / "hash1.sketch").touch()
+
+    fs_test.put_many({"hash1": {"14": ["0x1"]}, "hash2": {"14": ["0x2"]}, "hash3": {"14": ["0x3"]}}, max_workers=2)
+
+    written = sorted(call_args[0][0] for call_args in mock_write.call_args_list)
+    assert written == [fs_test.binary_filename("hash2"), fs_test.binary_filename("hash3")]
+
+
+def test_filestore_migrate_flat_layout(tmp_path):
+    fs_test = FileStore(str(tmp_path))
+    sketch = {"14": ["0x1f"], "bbits": 14}
+    with open(fs_test.filename("hash1"), "w") as f:
+        json.dump(sketch, f)
+    fs_test.put("hash2", sketch)
+    os.replace(fs_test.binary_filename("hash2"), tmp_path / "hash2.sketch")
+    (tmp_path / "notes.txt").touch()
+
+    assert fs_test.migrate_flat_layout() == 2
+
+    assert sorted(os.listdir(tmp_path)) == ["ha", "notes.txt"]
+    assert fs_test.get("hash1") == sketch
+    assert fs_test.get("hash2") == sketch
@@ -1,4 +1,4 @@
-from unittest.mock import Mock
+from unittest.mock import Mock, call
 
 from redis import Redis
 
@@ -96,3 +96,81 @@ def test_set_visualisation_status():
     redis_manager.set_visualisation_status(p_hash, assign_cluster, job_id)
 
     redis_mock.hset.assert_called_once_with(f"beebop:hash:job:visualise:{p_hash}", assign_cluster, job_id)
+
+
+def test_get_visualisation_status():
+    redis_mock = Mock(spec=Redis)
+    redis_manager = RedisManager(redis_mock)
+    redis_mock.hget.return_value = b"job789"
+
+    job_id = redis_manager.get_visualisation_status("test_project_hash", "GPSC1")
+
+    assert job_id == b"job789"
+    redis_mock.hget.assert_called_once_with("beebop:hash:job:visualise:test_project_hash", "GPSC1")
+
+
+def test_record_stage_duration():
+    redis_mock = Mock(spec=Redis)
+    redis_manager = RedisManager(redis_mock)
+    pipeline = redis_mock.pipeline.return_value
+
+    redis_manager.record_stage_duration("strep", "assign", 4, 10.0)
+
+    key = "beebop:eta:strep:assign"
+    pipeline.hincrbyfloat.assert_has_calls(
+        [
+            call(key, "n", 1),
+            call(key, "sx", 4),
+            call(key, "sy", 10.0),
+            call(key, "sxx", 16),
+            call(key, "sxy", 40.0),
+            call("beebop:eta:all", "n", 1),
+            call("beebop:eta:all", "sy", 10.0),
+        ]
+    )
+    pipeline.execute.assert_called_once()
+
+
+def test_get_stage_duration_sums():
+    redis_mock = Mock(spec=Redis)
+    redis_manager = RedisManager(redis_mock)
+    redis_mock.hgetall.return_value = {b"n": b"2", b"sy": b"30.5"}
+
+    sums = redis_manager.get_stage_duration_sums("strep", "assign")
+
+    assert sums == {"n": 2.0, "sy": 30.5}
+    redis_mock.hgetall.assert_called_once_with("beebop:eta:strep:assign")
+
+
+def test_get_mean_job_duration():
+    redis_mock = Mock(spec=Redis)
+    redis_manager = RedisManager(redis_mock)
+    redis_mock.hmget.return_value = [b"4", b"100"]
+
+    assert redis_manager.get_mean_job_duration() == 25.0
+
+
+def test_get_mean_job_duration_nothing_recorded():
+    redis_mock = Mock(spec=Redis)
+    redis_manager = RedisManager(redis_mock)
+    redis_mock.hmget.return_value = [None, None]
+
+    assert redis_manager.get_mean_job_duration() is None
+
+
+def test_claim_cluster_visualisation():
+    """
+    Test the claim_cluster_visualisation method takes the claim with SET NX,
+    and reports claims held by another process.
+    """
+    redis_mock = Mock(spec=Redis)
+    redis_manager = RedisManager(redis_mock)
+    redis_mock.set.side_effect = [True, None]
+
+    assert redis_manager.claim_cluster_visualisation("test_project_hash", "cluster1") is True
+    assert redis_manager.claim_cluster_visualisation("test_project_hash", "cluster1") is False
+    redis_mock.set.assert_called_with("beebop:claim:visualise:test_project_hash:cluster1", 1, nx=True, ex=60)
+
+    redis_manager.release_cluster_visualisation("test_project_hash", "cluster1")
+
+    redis_mock.delete.assert_called_once_with("beebop:claim:visualise:test_project_hash:cluster1")
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from beebop.config.sketch_format import (
+    from_hex_sketch,
+    is_hex_list,
+    read_binary_sketch,
+    to_hex_sketch,
+    write_binary_sketch,
+)
+
+sketch = {
+    "14": ["0x112482333510dfc9", "0xc2b6e311ab28d988"],
+    "17": ["0x926340c8a598f28a"],
+    "bases": [0.305505, 0.177977],
+    "bbits": 14,
+    "codon_phased": False,
+    "version": "e3007ebd97ffb3c6f9376ee1ba74b35af2d7809c",
+}
+
+
+def test_write_and_read_binary_sketch(tmp_path):
+    path = str(tmp_path / "hash1.sketch")
+
+    write_binary_sketch(path, sketch)
+    result = read_binary_sketch(path)
+
+    assert isinstance(result["14"], np.memmap)
+    assert result["14"].tolist() == [0x112482333510DFC9, 0xC2B6E311AB28D988]
+    assert result["17"].tolist() == [0x926340C8A598F28A]
+    assert result["bases"] == sketch["bases"]
+    assert result["bbits"] == 14
+    assert to_hex_sketch(result) == sketch
+    # no temporary files are left behind
+    assert [p.name for p in tmp_path.iterdir()] == ["hash1.sketch"]
+
+
+def test_read_binary_sketch_without_hashes(tmp_path):
+    path = str(tmp_path / "hash1.sketch")
+
+    write_binary_sketch(path, {"random": "input"})
+
+    assert read_binary_sketch(path) == {"random": "input"}
+
+
+def test_read_binary_sketch_rejects_other_files(tmp_path):
+    path = tmp_path / "hash1.sketch"
+    path.write_bytes(b"{}")
+
+    with pytest.raises(ValueError, match="not a binary sketch"):
+        read_binary_sketch(str(path))
+
+
+def test_from_hex_sketch():
+    result = from_hex_sketch(sketch)
+
+    assert result["14"].dtype == np.uint64
+    assert to_hex_sketch(result) == sketch
+
+
+def test_is_hex_list():
+    assert is_hex_list(["0x1f"]) is True
+    assert is_hex_list([0.3]) is False
+    assert is_hex_list([]) is False
+    assert is_hex_list("0x1f") is False
@@ -0,0 +1,99 @@
+import os
+import pickle
+from unittest.mock import patch
+
+import pytest
+
+from beebop.config import storage
+from beebop.config.config import ConfigurationError
+from beebop.config.filepaths import FileStore
+from beebop.config.storage import (
+    LocalStorageBackend,
+    ObjectStorageBackend,
+    create_storage_backend,
+)
+
+
+def make_backend(tmp_path):
+    return ObjectStorageBackend(
+        "bucket", "json", f"file://{tmp_path / 'object_store'}", cache_location=str(tmp_path / "cache")
+    )
+
+
+def test_local_backend(tmp_path):
+    backend = LocalStorageBackend(str(tmp_path))
+
+    with open(backend.write_path("ab/abc.sketch"), "w") as f:
+        f.write("sketch")
+    backend.commit("ab/abc.sketch")
+
+    assert backend.exists("ab/abc.sketch")
+    assert backend.local_path("ab/abc.sketch") == str(tmp_path / "ab" / "abc.sketch")
+    with pytest.raises(FileNotFoundError):
+        backend.local_path("cd/cde.sketch")
+
+
+def test_object_backend_reads_through_cache(tmp_path):
+    backend = make_backend(tmp_path)
+    with open(backend.write_path("ab/abc.sketch"), "w") as f:
+        f.write("sketch")
+    backend.commit("ab/abc.sketch")
+    assert os.path.isfile(tmp_path / "object_store" / "bucket" / "json" / "ab" / "abc.sketch")
+
+    # another worker, with an empty cache
+    worker = pickle.loads(pickle.dumps(backend))
+    worker.cache_location = str(tmp_path / "worker_cache")
+
+    assert worker.exists("ab/abc.sketch")
+    path = worker.local_path("ab/abc.sketch")
+    assert path == str(tmp_path / "worker_cache" / "bucket" / "json" / "ab" / "abc.sketch")
+    with open(path) as f:
+        assert f.read() == "sketch"
+    assert not worker.exists("cd/cde.sketch")
+    with pytest.raises(FileNotFoundError):
+        worker.local_path("cd/cde.sketch")
+
+
+@patch.object(storage, "MULTIPART_PART_SIZE", 4)
+@patch.object(storage, "MULTIPART_THRESHOLD", 8)
+def test_object_backend_multipart_transfers(tmp_path):
+    backend = make_backend(tmp_path)
+    data = bytes(range(30))
+    src = tmp_path / "artifact"
+    src.write_bytes(data)
+
+    with patch.object(backend.client, "upload_part", wraps=backend.client.upload_part) as upload_part:
+        backend.upload_file(str(src), "artifact")
+    assert upload_part.call_count == 8
+
+    with patch.object(backend.client, "get_object", wraps=backend.client.get_object) as get_object:
+        backend.download_file("artifact", str(tmp_path / "downloaded"))
+    assert get_object.call_count == 8
+    assert (tmp_path / "downloaded").read_bytes() == data
+    assert os.listdir(tmp_path / "object_store" / ".uploads" / "bucket") == []
+
+
+def test_file_store_with_object_backend(tmp_path):
+    sample_hash = "e868c76fec83ee1f69a95bd27b8d5e76"
+    sketch = {"14": ["0x1f", "0xa"], "bbits": 14}
+    store = FileStore(str(tmp_path / "json"), make_backend(tmp_path))
+
+    store.put(sample_hash, sketch)
+
+    assert store.exists(sample_hash)
+    assert store.get(sample_hash) == sketch
+    assert not os.path.exists(store.binary_filename(sample_hash))
+
+
+def test_create_storage_backend(tmp_path):
+    with patch.dict(os.environ, {"STORAGE_BACKEND": "local"}):
+        assert isinstance(create_storage_backend(str(tmp_path), "json"), LocalStorageBackend)
+    with patch.dict(os.environ, {"STORAGE_BACKEND": "object", "OBJECT_STORE_BUCKET": "bucket"}):
+        backend = create_storage_backend(str(tmp_path), "json")
+        assert (backend.bucket, backend.prefix) == ("bucket", "json")
+    with patch.dict(os.environ, {"STORAGE_BACKEND": "object", "OBJECT_STORE_BUCKET": ""}):
+        with pytest.raises(ConfigurationError):
+            create_storage_backend(str(tmp_path), "json")
+    with patch.dict(os.environ, {"STORAGE_BACKEND": "nfs"}):
+        with pytest.raises(ConfigurationError):
+            create_storage_backend(str(tmp_path), "json")
@@ -1,25 +1,32 @@
+import os
+import pickle
 from pathlib import PurePath
 from unittest.mock import Mock, patch
 
+import numpy as np
 import pandas as pd
 
+from beebop.config.sketch_format import to_hex_sketch
 from beebop.models.enums import FailedSampleType
 from beebop.services.run_PopPUNK.assign.assign_utils import (
+    build_query_sketches_db,
     copy_include_files,
-    create_sketches_dict,
     delete_include_files,
     filter_queries,
     get_df_filtered_by_samples,
     get_df_sample_mask,
     get_external_cluster_nums,
     get_external_clusters_from_file,
+    get_novel_cluster_mapping,
     get_refs,
     handle_files_manipulation,
-    hex_to_decimal,
+    merge_clustering_csv_files,
+    merge_query_distances,
     merge_txt_files,
-    preprocess_sketches,
     process_assign_clusters_csv,
     process_unassignable_samples,
+    renumber_clusters,
+    replace_query_sketches_db,
     update_external_clusters_csv,
     write_include_files,
 )
@@ -108,56 +115,38 @@ def test_get_external_clusters_from_file(sample_clustering_csv):
     }
 
 
-def test_create_sketches_dict():
-    sketches = {
-        "e868c76fec83ee1f69a95bd27b8d5e76": fs.input.get("e868c76fec83ee1f69a95bd27b8d5e76"),
-        "f3d9b387e311d5ab59a8c08eb3545dbb": fs.input.get("f3d9b387e311d5ab59a8c08eb3545dbb"),
-    }
+@patch("beebop.services.run_PopPUNK.assign.assign_utils.SketchLibrary")
+def test_build_query_sketches_db_adds_missing_sketches(mock_library_class):
+    library = mock_library_class.return_value
+    library.missing.return_value = ["e868c76fec83ee1f69a95bd27b8d5e76"]
+    library.build_query_db.return_value = ["e868c76fec83ee1f69a95bd27b8d5e76", "f3d9b387e311d5ab59a8c08eb3545dbb"]
+    hashes = ["e868c76fec83ee1f69a95bd27b8d5e76", "f3d9b387e311d5ab59a8c08eb3545dbb"]
 
-    sketches_dict = create_sketches_dict(list(sketches.keys()), fs)
+    q_names = build_query_sketches_db(hashes, fs, "outdir")
 
-    assert sketches_dict == sketches
+    assert q_names == hashes
+    mock_library_class.assert_called_once_with(fs.sketch_library())
+    added = library.add.call_args[0][0]
+    assert list(added) == ["e868c76fec83ee1f69a95bd27b8d5e76"]
+    # sketches are read as decimal arrays, needing no conversion
+    assert added["e868c76fec83ee1f69a95bd27b8d5e76"]["14"].dtype == np.uint64
+    library.build_query_db.assert_called_once_with(hashes, "outdir")
 
 
-@patch("beebop.services.run_PopPUNK.assign.assign_utils.hex_to_decimal")
 @patch("beebop.services.run_PopPUNK.assign.assign_utils.sketch_to_hdf5")
-def test_preprocess_sketches(mock_sketch_to_hdf5, mock_hex_to_decimal):
-    sketches = {"hash1": "sketch sample 1", "hash2": "sketch sample 2"}
-    outdir = "outdir"
-    mock_sketch_to_hdf5.return_value = list(sketches.keys())
-
-    hashes = preprocess_sketches(sketches, outdir)
-
-    assert hashes == list(sketches.keys())
-    mock_hex_to_decimal.assert_called_once_with(sketches)
-    mock_sketch_to_hdf5.assert_called_once_with(sketches, outdir)
-
-
-def test_hex_to_decimal():
-    dummy_sketch = {
-        "sample1": {
-            "14": ["0x2964619C7"],
-            "17": ["0x52C8C338E"],
-            "20": ["0x7C2D24D55"],
-            "23": ["0xA5918671C"],
-            "26": ["0xCEF5E80E3"],
-            "29": ["0xF85A49AAA"],
-        }
-    }
-    dummy_converted = {
-        "sample1": {
-            "14": [11111111111],
-            "17": [22222222222],
-            "20": [33333333333],
-            "23": [44444444444],
-            "26": [55555555555],
-            "29": [66666666666],
-        }
-    }
+@patch("beebop.services.run_PopPUNK.assign.assign_utils.SketchLibrary")
+def test_build_query_sketches_db_falls_back_to_conversion(mock_library_class, mock_sketch_to_hdf5):
+    mock_library_class.return_value.missing.side_effect = OSError("corrupt")
+    mock_sketch_to_hdf5.return_value = ["e868c76fec83ee1f69a95bd27b8d5e76"]
 
-    hex_to_decimal(dummy_sketch)
+    q_names = build_query_sketches_db(["e868c76fec83ee1f69a95bd27b8d5e76"], fs, "outdir")
 
-    assert dummy_sketch == dummy_converted
+    assert q_names == ["e868c76fec83ee1f69a95bd27b8d5e76"]
+    sketches, outdir = mock_sketch_to_hdf5.call_args[0]
+    assert to_hex_sketch(sketches["e868c76fec83ee1f69a95bd27b8d5e76"]) == fs.input.get(
+        "e868c76fec83ee1f69a95bd27b8d5e76"
+    )
+    assert outdir == "outdir"
 
 
 def test_filter_queries():
@@ -386,3 +375,96 @@ def test_get_refs():
     refs = get_refs(db_clusters_df, output_clusters_df, "10")
 
     assert refs == {"ref_10", "sample_10", "sample1", "ref_10x"}
+
+
+def test_merge_clustering_csv_files(tmp_path):
+    main_file = tmp_path / "main_clusters.csv"
+    merge_file = tmp_path / "merge_clusters.csv"
+    main_file.write_text("Taxon,Cluster\nref1,1\nsample1,1\n")
+    merge_file.write_text("Taxon,Cluster\nref1,1\nsample2,05\n")
+
+    merge_clustering_csv_files(str(main_file), str(merge_file))
+
+    assert main_file.read_text() == "Taxon,Cluster\nsample1,1\nref1,1\nsample2,05\n"
+
+
+def write_distances(prefix, ref_names, query_names, distances):
+    with open(f"{prefix}.pkl", "wb") as f:
+        pickle.dump([ref_names, query_names, False], f)
+    np.save(f"{prefix}.npy", np.array(distances))
+
+
+def test_merge_query_distances(tmp_path):
+    main, merge = str(tmp_path / "main.dists"), str(tmp_path / "merge.dists")
+    write_distances(main, ["ref1", "ref2"], ["sample1"], [[0.1, 0.2], [0.3, 0.4]])
+    write_distances(merge, ["ref1", "ref2"], ["sample2"], [[0.5, 0.6], [0.7, 0.8]])
+    os.link(f"{main}.npy", tmp_path / "linked.npy")
+
+    assert merge_query_distances(main, merge)
+
+    with open(f"{main}.pkl", "rb") as f:
+        assert pickle.load(f) == [["ref1", "ref2"], ["sample1", "sample2"], False]
+    assert np.load(f"{main}.npy").tolist() == [[0.1, 0.2], [0.3, 0.4], [0.5, 0.6], [0.7, 0.8]]
+    # files linked elsewhere are not changed
+    assert np.load(tmp_path / "linked.npy").tolist() == [[0.1, 0.2], [0.3, 0.4]]
+
+
+def test_merge_query_distances_against_other_references(tmp_path):
+    main, merge = str(tmp_path / "main.dists"), str(tmp_path / "merge.dists")
+    write_distances(main, ["ref1"], ["sample1"], [[0.1, 0.2]])
+    write_distances(merge, ["ref2"], ["sample2"], [[0.5, 0.6]])
+
+    assert not merge_query_distances(main, merge)
+    assert not merge_query_distances(main, str(tmp_path / "missing.dists"))
+    assert np.load(f"{main}.npy").tolist() == [[0.1, 0.2]]
+
+
+@patch("beebop.services.run_PopPUNK.assign.assign_utils.build_query_sketches_db")
+def test_replace_query_sketches_db(mock_build_query_sketches_db, tmp_path):
+    project_fs = Mock()
+    query_db = tmp_path / "p_hash.h5"
+    query_db.write_text("old samples")
+    os.link(query_db, tmp_path / "sublineage.h5")
+    project_fs.query_sketches_hdf5.return_value = str(query_db)
+    staging_dir = tmp_path / "staging" / "p_hash"
+
+    def build_query_db(_hashes_list, _fs, outdir):
+        os.makedirs(outdir)
+        with open(os.path.join(outdir, "p_hash.h5"), "w") as f:
+            f.write("all samples")
+
+    mock_build_query_sketches_db.side_effect = build_query_db
+
+    replace_query_sketches_db(["sample1", "sample2"], project_fs, "p_hash", str(staging_dir))
+
+    mock_build_query_sketches_db.assert_called_once_with(["sample1", "sample2"], project_fs, str(staging_dir))
+    assert query_db.read_text() == "all samples"
+    assert (tmp_path / "sublineage.h5").read_text() == "old samples"
+
+
+def test_get_novel_cluster_mapping(tmp_path):
+    db_clusters = tmp_path / "db_clusters.csv"
+    db_clusters.write_text("Taxon,Cluster\nref1,1\nref2,2_5\n")
+    main_clusters = tmp_path / "main_clusters.csv"
+    main_clusters.write_text("Taxon,Cluster\nsample1,6\nsample2,7\n")
+    merge_clusters = tmp_path / "merge_clusters.csv"
+    merge_clusters.write_text("Taxon,Cluster\nref1,1\nsample3,7\nsample4,6\n")
+
+    mapping = get_novel_cluster_mapping(str(db_clusters), str(main_clusters), str(merge_clusters))
+
+    assert mapping == {"6": "8", "7": "9"}
+    assert get_novel_cluster_mapping(str(db_clusters), str(main_clusters), str(tmp_path / "missing.csv")) == {}
+
+
+def test_renumber_clusters(tmp_path):
+    clusters_file = tmp_path / "clusters.csv"
+    clusters_file.write_text("Taxon,Cluster\nsample1,3\nsample2,4\nref1,1\n")
+    (tmp_path / "include3.txt").write_text("sample1")
+    (tmp_path / "include4.txt").write_text("sample2")
+
+    renumber_clusters(str(clusters_file), str(tmp_path), {"3": "4", "4": "5"})
+
+    assert clusters_file.read_text() == "Taxon,Cluster\nsample1,4\nsample2,5\nref1,1\n"
+    assert (tmp_path / "include4.txt").read_text() == "sample1"
+    assert (tmp_path / "include5.txt").read_text() == "sample2"
+    assert not (tmp_path / "include3.txt").exists()
@@ -1,14 +1,17 @@
-import pickle
+import os
 from unittest.mock import Mock, patch
 
 from pytest_unordered import unordered
 
+from beebop.config import PoppunkFileStore
+from beebop.db import ProjectCatalog
 from beebop.services.run_PopPUNK.assign.run import (
     assign_clusters_to_result,
     assign_query_clusters,
     get_internal_clusters_result,
     handle_external_clusters,
     handle_not_found_queries,
+    merge_appended_samples,
     save_external_to_poppunk_clusters,
     save_result,
     update_external_clusters,
@@ -67,7 +70,7 @@ def test_handle_external_clusters_all_found(mocker, clustering_config):
     mock_save_clusters = mocker.patch("beebop.services.run_PopPUNK.assign.run.save_external_to_poppunk_clusters")
     clustering_config.fs.previous_query_clustering.return_value = "previous_query_clustering"
 
-    res = handle_external_clusters(clustering_config, {}, ["sample1", "sample2"], ["1", "2"])
+    res = handle_external_clusters(clustering_config, ["sample1", "sample2"], ["1", "2"])
 
     assert res == {
         0: {"hash": "sample1", "cluster": "GPSC69", "raw_cluster_num": "69"},
@@ -108,24 +111,23 @@ def test_handle_external_clusters_with_not_found(mocker, clustering_config):
         return_value=(q_names, q_clusters),
     )
     mock_update_external_clusters = mocker.patch("beebop.services.run_PopPUNK.assign.run.update_external_clusters")
-    mock_shutil_rmtree = mocker.patch("shutil.rmtree")
 
     tmp_output = "output_tmp"
     clustering_config.fs.previous_query_clustering.return_value = "previous_query_clustering"
     clustering_config.fs.output_tmp.return_value = tmp_output
 
-    res = handle_external_clusters(clustering_config, {}, q_names, q_clusters)
+    res = handle_external_clusters(clustering_config, q_names, q_clusters)
 
     # not found function calls
     mock_filter_queries.assert_called_once_with(q_names, q_clusters, not_found)
-    mock_handle_not_found.assert_called_once_with(clustering_config, {}, not_found, tmp_output, not_found_q_clusters)
+    mock_handle_not_found.assert_called_once_with(clustering_config, not_found, tmp_output, not_found_q_clusters)
     mock_update_external_clusters.assert_called_once_with(
         clustering_config,
         not_found,
         external_clusters,
         "previous_query_clustering",
     )
-    mock_shutil_rmtree.assert_called_once_with(tmp_output)
+    clustering_config.fs.move_to_trash.assert_called_once_with(tmp_output)
 
     # check return calls
     assert res == {
@@ -141,7 +143,7 @@ def test_handle_external_clusters_with_not_found(mocker, clustering_config):
     )
 
 
-@patch("beebop.services.run_PopPUNK.assign.run.sketch_to_hdf5")
+@patch("beebop.services.run_PopPUNK.assign.run.build_query_sketches_db")
 @patch("beebop.services.run_PopPUNK.assign.run.assign_query_clusters")
 @patch("beebop.services.run_PopPUNK.assign.run.process_assign_clusters_csv")
 @patch("beebop.services.run_PopPUNK.assign.run.handle_files_manipulation")
@@ -149,10 +151,9 @@ def test_handle_not_found_queries(
     mock_files_manipulation,
     mock_process_assign_clusters_csv,
     mock_assign,
-    mock_sketch_to_hdf5,
+    mock_build_query_db,
     clustering_config,
 ):
-    sketches = {"hash1": "sketch sample 1", "hash2": "sketch sample 2"}
     not_found = ["hash2"]
     not_found_query_clusters = {"6969"}
     output_dir = "output_dir"
@@ -160,13 +161,12 @@ def test_handle_not_found_queries(
 
     query_names, query_clusters = handle_not_found_queries(
         clustering_config,
-        sketches,
         not_found,
         output_dir,
         not_found_query_clusters,
     )
 
-    mock_sketch_to_hdf5.assert_called_once_with({"hash2": "sketch sample 2"}, output_dir)
+    mock_build_query_db.assert_called_once_with(not_found, clustering_config.fs, output_dir)
     mock_assign.assert_called_once_with(clustering_config, clustering_config.full_db_fs, not_found, output_dir)
     mock_files_manipulation.assert_called_once_with(clustering_config, output_dir, not_found_query_clusters)
     mock_process_assign_clusters_csv.assert_called_once_with(
@@ -269,15 +269,20 @@ def test_save_result(tmp_path, clustering_config):
         0: {"hash": "sample1", "cluster": 1},
         1: {"hash": "sample2", "cluster": 2},
     }
-    result_path = tmp_path / "output.pkl"
-    clustering_config.fs.output_cluster.return_value = str(result_path)
+    catalog_path = tmp_path / "catalog.sqlite"
+    clustering_config.fs.project_catalog.return_value = str(catalog_path)
+    qc_report_path = tmp_path / "qcreport.txt"
+    qc_report_path.write_text("sample3\tFailed distance QC (too high)\n")
+    clustering_config.fs.output_qc_report.return_value = str(qc_report_path)
 
     save_result(clustering_config, assign_result)
 
-    clustering_config.fs.output_cluster.assert_called_once_with(clustering_config.p_hash)
-    assert result_path.exists()
-    with open(result_path, "rb") as f:
-        assert assign_result == pickle.load(f)
+    clustering_config.fs.project_catalog.assert_called_once_with(clustering_config.p_hash)
+    catalog = ProjectCatalog(str(catalog_path))
+    assert catalog.get_assignments() == assign_result
+    assert catalog.get_failed_samples() == {
+        "sample3": {"failReasons": ["Failed distance QC (too high)"], "failType": "error", "hash": "sample3"}
+    }
 
 
 def test_save_external_to_poppunk_clusters(
@@ -291,15 +296,122 @@ def test_save_external_to_poppunk_clusters(
         "sample3": {"cluster": "GPSC69", "raw_cluster_num": "69"},
     }
     fs = Mock()
-    external_clusters_path = tmp_path / "external_clusters.pkl"
-    fs.external_to_poppunk_clusters.return_value = str(external_clusters_path)
+    catalog_path = tmp_path / "catalog.sqlite"
+    fs.project_catalog.return_value = str(catalog_path)
 
     save_external_to_poppunk_clusters(q_names, q_clusters, external_clusters, "test_hash", fs)
 
-    fs.external_to_poppunk_clusters.assert_called_once_with("test_hash")
-    assert external_clusters_path.exists()
-    with open(external_clusters_path, "rb") as f:
-        assert pickle.load(f) == {
-            "GPSC69": {"1", "3"},
-            "GPSC420": {"2"},
+    fs.project_catalog.assert_called_once_with("test_hash")
+    assert ProjectCatalog(str(catalog_path)).get_external_to_poppunk_clusters() == {
+        "GPSC69": {"1", "3"},
+        "GPSC420": {"2"},
+    }
+
+
+@patch("beebop.services.run_PopPUNK.assign.run.replace_query_sketches_db")
+def test_merge_appended_samples(mock_replace_query_sketches_db, tmp_path):
+    p_hash = "test_hash"
+    fs = PoppunkFileStore(str(tmp_path))
+    fs.setup_output_directory(p_hash)
+    catalog = ProjectCatalog(fs.project_catalog(p_hash))
+    catalog.save_assignments(
+        {0: {"hash": "sample1", "cluster": "1", "raw_cluster_num": "1"}, 1: {"hash": "sample2"}},
+        {"sample0": {"failReasons": ["Failed distance QC"], "failType": "error"}},
+    )
+    catalog.save_external_to_poppunk_clusters({"GPSC1": {"1"}})
+    with open(fs.include_file(p_hash, "1"), "w") as f:
+        f.write("ref1\nsample1")
+    # include files may be linked into a project reusing this one
+    os.link(fs.include_file(p_hash, "1"), tmp_path / "reused_include1.txt")
+    with open(fs.previous_query_clustering(p_hash), "w") as f:
+        f.write("Taxon,Cluster\nref1,1\nsample1,1\n")
+
+    append_fs = fs.appended_samples_store(p_hash)
+    os.makedirs(append_fs.output(p_hash))
+    ProjectCatalog(append_fs.project_catalog(p_hash)).save_assignments(
+        {0: {"hash": "sample2", "cluster": "2", "raw_cluster_num": "2"}},
+        {"sample3": {"failReasons": ["Failed distance QC"], "failType": "error"}},
+    )
+    ProjectCatalog(append_fs.project_catalog(p_hash)).save_external_to_poppunk_clusters({"GPSC1": {"2"}})
+    for cluster, samples in (("1", "ref1\nsample2"), ("2", "ref2\nsample2")):
+        with open(append_fs.include_file(p_hash, cluster), "w") as f:
+            f.write(samples)
+    with open(append_fs.previous_query_clustering(p_hash), "w") as f:
+        f.write("Taxon,Cluster\nref1,1\nsample2,2\n")
+    with open(append_fs.partial_query_graph(p_hash), "w") as f:
+        f.write("sample2")
+
+    db_clusters = tmp_path / "db_clusters.csv"
+    db_clusters.write_text("Taxon,Cluster\nref1,1\nref2,2\n")
+
+    result = merge_appended_samples(
+        p_hash, fs, append_fs, ["sample2", "sample3"], Mock(previous_clustering=str(db_clusters)), None
+    )
+
+    expected = {
+        0: {"hash": "sample1", "cluster": "1", "raw_cluster_num": "1"},
+        1: {"hash": "sample2", "cluster": "2", "raw_cluster_num": "2"},
+    }
+    assert result == expected
+    assert catalog.get_assignments() == expected
+    assert set(catalog.get_failed_samples()) == {"sample0", "sample3"}
+    assert catalog.get_external_to_poppunk_clusters() == {"GPSC1": {"1", "2"}}
+    with open(fs.include_file(p_hash, "1")) as f:
+        assert set(f.read().splitlines()) == {"ref1", "sample1", "sample2"}
+    assert (tmp_path / "reused_include1.txt").read_text() == "ref1\nsample1"
+    with open(fs.include_file(p_hash, "2")) as f:
+        assert f.read() == "ref2\nsample2"
+    with open(fs.previous_query_clustering(p_hash)) as f:
+        assert f.read() == "Taxon,Cluster\nsample1,1\nref1,1\nsample2,2\n"
+    with open(fs.partial_query_graph(p_hash)) as f:
+        assert f.read() == "sample2"
+    mock_replace_query_sketches_db.assert_called_once_with(
+        ["sample1", "sample2"], fs, p_hash, os.path.join(append_fs.output(p_hash), "query_db", p_hash)
+    )
+
+
+@patch("beebop.services.run_PopPUNK.assign.run.replace_query_sketches_db")
+def test_merge_appended_samples_renumbers_novel_clusters(_mock_replace_query_sketches_db, tmp_path):
+    p_hash = "test_hash"
+    fs = PoppunkFileStore(str(tmp_path))
+    fs.setup_output_directory(p_hash)
+    db_clusters = tmp_path / "db_clusters.csv"
+    db_clusters.write_text("Taxon,Cluster\nref1,1\nref2,2\n")
+    # both runs find a novel cluster, which PopPUNK numbers 3 in each
+    ProjectCatalog(fs.project_catalog(p_hash)).save_assignments(
+        {0: {"hash": "sample1", "cluster": "3", "raw_cluster_num": "3"}}
+    )
+    with open(fs.include_file(p_hash, "3"), "w") as f:
+        f.write("sample1")
+    with open(fs.previous_query_clustering(p_hash), "w") as f:
+        f.write("Taxon,Cluster\nref1,1\nsample1,3\n")
+
+    append_fs = fs.appended_samples_store(p_hash)
+    os.makedirs(append_fs.output(p_hash))
+    ProjectCatalog(append_fs.project_catalog(p_hash)).save_assignments(
+        {
+            0: {"hash": "sample2", "cluster": "3", "raw_cluster_num": "3"},
+            1: {"hash": "sample3", "cluster": "2", "raw_cluster_num": "2"},
         }
+    )
+    for cluster, samples in (("3", "sample2"), ("2", "ref2\nsample3")):
+        with open(append_fs.include_file(p_hash, cluster), "w") as f:
+            f.write(samples)
+    with open(append_fs.previous_query_clustering(p_hash), "w") as f:
+        f.write("Taxon,Cluster\nref2,2\nsample2,3\nsample3,2\n")
+
+    result = merge_appended_samples(
+        p_hash, fs, append_fs, ["sample2", "sample3"], Mock(previous_clustering=str(db_clusters)), None
+    )
+
+    assert result == {
+        0: {"hash": "sample1", "cluster": "3", "raw_cluster_num": "3"},
+        1: {"hash": "sample2", "cluster": "4", "raw_cluster_num": "4"},
+        2: {"hash": "sample3", "cluster": "2", "raw_cluster_num": "2"},
+    }
+    with open(fs.include_file(p_hash, "3")) as f:
+        assert f.read() == "sample1"
+    with open(fs.include_file(p_hash, "4")) as f:
+        assert f.read() == "sample2"
+    with open(fs.previous_query_clustering(p_hash)) as f:
+        assert f.read() == "Taxon,Cluster\nref1,1\nsample1,3\nref2,2\nsample2,4\nsample3,2\n"
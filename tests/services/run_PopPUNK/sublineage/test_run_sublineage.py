@@ -1,16 +1,22 @@
+import os
 from unittest.mock import Mock, patch
 
 import pandas as pd
 import pytest
 
 from beebop.config import DatabaseFileStore, PoppunkFileStore
+from beebop.db import AssignmentCache, ProjectCatalog
+from beebop.services.manifest_service import read_manifest, write_manifest
 from beebop.services.run_PopPUNK.sublineage.run import assign_cluster_sublineages, assign_sublineages
 
 
+@patch("beebop.services.run_PopPUNK.sublineage.run.write_manifest")
 @patch("beebop.services.run_PopPUNK.sublineage.run.get_cluster_to_hashes")
 @patch("beebop.services.run_PopPUNK.sublineage.run.save_sublineage_results")
 @patch("beebop.services.run_PopPUNK.sublineage.run.assign_cluster_sublineages")
-def test_assign_sublineages(mock_assign_cluster_sublineages, mock_save_sublineage_results, mock_get_cluster_to_hashes):
+def test_assign_sublineages(
+    mock_assign_cluster_sublineages, mock_save_sublineage_results, mock_get_cluster_to_hashes, mock_write_manifest
+):
     mock_get_cluster_to_hashes.return_value = {
         "GPSC1": ["hash1", "hash2"],
         "GPSC2": ["hash3"],
@@ -27,7 +33,10 @@ def test_assign_sublineages(mock_assign_cluster_sublineages, mock_save_sublineag
     redis_host = "localhost"
     species = "test_species"
 
-    assign_sublineages(p_hash, fs, db_fs, args, redis_host, species)
+    with patch(
+        "beebop.services.run_PopPUNK.sublineage.run.resolve_species", return_value=(args, Mock(full_db_fs=db_fs))
+    ):
+        assign_sublineages(p_hash, fs, redis_host, species)
 
     mock_get_cluster_to_hashes.assert_called_once_with(redis_host)
 
@@ -40,15 +49,108 @@ def test_assign_sublineages(mock_assign_cluster_sublineages, mock_save_sublineag
     assert call_args[0] == p_hash
     assert call_args[1] == fs
     pd.testing.assert_frame_equal(call_args[2], pd.concat(sublineage_dfs, ignore_index=True))
+    mock_write_manifest.assert_called_once_with(
+        p_hash, fs, "sublineageAssign", {fs.output_sublineages_csv.return_value: "sublineages"}
+    )
+
+
+@patch("beebop.services.run_PopPUNK.sublineage.run.get_cluster_to_hashes")
+@patch("beebop.services.run_PopPUNK.sublineage.run.assign_cluster_sublineages")
+def test_assign_sublineages_skips_cached_samples(mock_assign_cluster_sublineages, mock_get_cluster_to_hashes, tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    fs.setup_output_directory("test_hash")
+    cache = AssignmentCache(fs.assignment_cache())
+    cache.save_assignments(
+        "test_species",
+        "digest",
+        [
+            {"hash": "hash1", "cluster": "GPSC1", "raw_cluster_num": "1"},
+            {"hash": "hash2", "cluster": "GPSC1", "raw_cluster_num": "1"},
+            {"hash": "hash3", "cluster": "GPSC3", "raw_cluster_num": "3"},
+        ],
+    )
+    cache.save_sublineages("test_species", "digest", {"hash1": {"Rank_5_Lineage": 5}, "hash3": {"Rank_5_Lineage": 15}})
+    # hash3 has been assigned to another cluster since it was cached
+    mock_get_cluster_to_hashes.return_value = {"GPSC1": ["hash1"], "GPSC2": ["hash2", "hash3"]}
+    mock_assign_cluster_sublineages.return_value = pd.DataFrame(
+        {"id": ["hash2", "hash3"], "Rank_5_Lineage": [10, 20], "Status": ["Query", "Query"]}
+    )
+    db_fs = Mock(spec=DatabaseFileStore, sublineages_db_path="/sublineages")
+    args = Mock()
+    mock_assign_cluster_sublineages.return_value.to_csv(fs.output_sublineages_csv("test_hash", "2"), index=False)
+
+    with patch(
+        "beebop.services.run_PopPUNK.sublineage.run.resolve_species", return_value=(args, Mock(full_db_fs=db_fs))
+    ):
+        assign_sublineages("test_hash", fs, "localhost", "test_species", "digest")
+
+    mock_assign_cluster_sublineages.assert_called_once_with(
+        "test_hash", fs, db_fs, args, "GPSC2", ["hash2", "hash3"], "test_species"
+    )
+    assert ProjectCatalog(fs.project_catalog("test_hash")).get_sublineages() == {
+        "hash1": {"Rank_5_Lineage": 5},
+        "hash2": {"Rank_5_Lineage": 10},
+        "hash3": {"Rank_5_Lineage": 20},
+    }
+    assert cache.get("test_species", "digest", ["hash2"])["hash2"]["sublineage"] == {"Rank_5_Lineage": 10}
+    assert list(read_manifest("test_hash", fs, "sublineageAssign")["artifacts"]) == [
+        os.path.join("sublineage_2", "sublineage_2_lineages.csv")
+    ]
+
+
+@patch("beebop.services.run_PopPUNK.sublineage.run.get_cluster_to_hashes")
+@patch("beebop.services.run_PopPUNK.sublineage.run.assign_cluster_sublineages")
+def test_assign_sublineages_for_added_samples(mock_assign_cluster_sublineages, mock_get_cluster_to_hashes, tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    fs.setup_output_directory("test_hash")
+    ProjectCatalog(fs.project_catalog("test_hash")).save_sublineages(
+        {"hash1": {"Rank_5_Lineage": 5}, "hash2": {"Rank_5_Lineage": 10}, "hash4": {"Rank_5_Lineage": 1}}
+    )
+    previous_csvs = [fs.output_sublineages_csv("test_hash", cluster_num) for cluster_num in ("1", "2")]
+    pd.DataFrame({"id": ["hash1"], "Rank_5_Lineage": [5], "Status": ["Query"]}).to_csv(previous_csvs[0], index=False)
+    pd.DataFrame({"id": ["hash2"], "Rank_5_Lineage": [10], "Status": ["Query"]}).to_csv(previous_csvs[1], index=False)
+    write_manifest("test_hash", fs, "sublineageAssign", dict.fromkeys(previous_csvs, "sublineages"))
+    mock_get_cluster_to_hashes.return_value = {"GPSC1": ["hash1"], "GPSC2": ["hash2", "hash4"]}
+    added_df = pd.DataFrame({"id": ["hash4"], "Rank_5_Lineage": [20], "Status": ["Query"]})
+
+    def assign_cluster(p_hash, fs, *_args):
+        # the cluster's earlier outputs were moved out of the way
+        assert not os.path.exists(fs.output_sublineages_csv(p_hash, "2"))
+        added_df.to_csv(fs.output_sublineages_csv(p_hash, "2"), index=False)
+        return added_df
+
+    mock_assign_cluster_sublineages.side_effect = assign_cluster
+    db_fs = Mock(spec=DatabaseFileStore, sublineages_db_path="/sublineages")
+    args = Mock()
+
+    with patch(
+        "beebop.services.run_PopPUNK.sublineage.run.resolve_species", return_value=(args, Mock(full_db_fs=db_fs))
+    ):
+        assign_sublineages("test_hash", fs, "localhost", "test_species", None, ["hash4"])
+
+    mock_assign_cluster_sublineages.assert_called_once_with(
+        "test_hash", fs, db_fs, args, "GPSC2", ["hash4"], "test_species"
+    )
+    assert ProjectCatalog(fs.project_catalog("test_hash")).get_sublineages() == {
+        "hash1": {"Rank_5_Lineage": 5},
+        "hash2": {"Rank_5_Lineage": 10},
+        "hash4": {"Rank_5_Lineage": 20},
+    }
+    assert pd.read_csv(previous_csvs[1])["id"].tolist() == ["hash2", "hash4"]
+    assert list(read_manifest("test_hash", fs, "sublineageAssign")["artifacts"]) == [
+        os.path.join("sublineage_1", "sublineage_1_lineages.csv"),
+        os.path.join("sublineage_2", "sublineage_2_lineages.csv"),
+    ]
+
 
+@patch("beebop.services.run_PopPUNK.sublineage.run.resolve_species")
+def test_assign_sublineages_no_sublineages(mock_resolve_species):
+    mock_resolve_species.return_value = (Mock(), Mock(full_db_fs=Mock(sublineages_db_path=None)))
 
-def test_assign_sublineages_no_sublineages():
     with pytest.raises(ValueError, match="Sub-lineages database path is not provided."):
         assign_sublineages(
             p_hash="test_hash",
             fs=Mock(),
-            db_fs=Mock(sublineages_db_path=None),
-            args=Mock(),
             redis_host="localhost",
             species="test_species",
         )
@@ -1,4 +1,3 @@
-import json
 import os
 from unittest.mock import Mock, patch
 
@@ -6,10 +5,13 @@ import pandas as pd
 import pytest
 
 from beebop.config import PoppunkFileStore
+from beebop.db import ProjectCatalog
 from beebop.services.run_PopPUNK.sublineage.sublineage_utils import (
     get_cluster_to_hashes,
     get_query_sublineage_result,
     link_sketches_hdf5,
+    merge_sublineages_csv,
+    reset_sublineages_folder,
     save_sublineage_results,
 )
 
@@ -110,8 +112,8 @@ hash4,SL3,Reference
 def test_save_sublineage_results(tmp_path):
     p_hash = "test_project"
     fs = Mock(spec=PoppunkFileStore)
-    result_path = tmp_path / "sublineages.json"
-    fs.sublineage_results.return_value = str(result_path)
+    catalog_path = tmp_path / "catalog.sqlite"
+    fs.project_catalog.return_value = str(catalog_path)
 
     sublineage_result = pd.DataFrame(
         {
@@ -128,10 +130,7 @@ def test_save_sublineage_results(tmp_path):
 
     save_sublineage_results(p_hash, fs, sublineage_result)
 
-    assert result_path.exists()
-
-    with open(result_path, "r") as f:
-        data = json.load(f)
+    data = ProjectCatalog(str(catalog_path)).get_sublineages()
 
     assert len(data) == 2
     assert "sample1" in data
@@ -150,3 +149,44 @@ def test_save_sublineage_results(tmp_path):
         "Rank_25_Subsublineage": "SSSL2",
         "Rank_50_Subsubsublineage": "SSSSL2",
     }
+
+
+def test_save_sublineage_results_with_cached_sublineages(tmp_path):
+    fs = Mock(spec=PoppunkFileStore)
+    catalog_path = tmp_path / "catalog.sqlite"
+    fs.project_catalog.return_value = str(catalog_path)
+    sublineage_result = pd.DataFrame({"id": ["sample1"], "Rank_5_Lineage": [1], "Status": ["Query"]})
+
+    new = save_sublineage_results("test_project", fs, sublineage_result, {"sample2": {"Rank_5_Lineage": 2}})
+
+    assert new == {"sample1": {"Rank_5_Lineage": 1}}
+    assert ProjectCatalog(str(catalog_path)).get_sublineages() == {
+        "sample1": {"Rank_5_Lineage": 1},
+        "sample2": {"Rank_5_Lineage": 2},
+    }
+
+
+def test_save_sublineage_results_only_cached(tmp_path):
+    fs = Mock(spec=PoppunkFileStore)
+    catalog_path = tmp_path / "catalog.sqlite"
+    fs.project_catalog.return_value = str(catalog_path)
+
+    new = save_sublineage_results("test_project", fs, pd.DataFrame(), {"sample2": {"Rank_5_Lineage": 2}})
+
+    assert new == {}
+    assert ProjectCatalog(str(catalog_path)).get_sublineages() == {"sample2": {"Rank_5_Lineage": 2}}
+
+
+def test_reset_sublineages_folder(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    assert reset_sublineages_folder(fs, "test_hash", "1") is None
+
+    sublineages_csv = fs.output_sublineages_csv("test_hash", "1")
+    pd.DataFrame({"id": ["hash1"], "Rank_5_Lineage": [5]}).to_csv(sublineages_csv, index=False)
+    previous_df = reset_sublineages_folder(fs, "test_hash", "1")
+
+    assert previous_df["id"].tolist() == ["hash1"]
+    assert not os.path.exists(sublineages_csv)
+    # no new outputs, e.g. the cluster's model is missing, keeps the earlier results
+    merge_sublineages_csv(fs.output_sublineages_csv("test_hash", "1"), previous_df)
+    assert pd.read_csv(sublineages_csv).equals(previous_df)
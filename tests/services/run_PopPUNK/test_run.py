@@ -1,14 +1,20 @@
+import json
+import os
 import pickle
 from types import SimpleNamespace
+from unittest.mock import Mock
 
 import pytest
 from redis import Redis
 from rq import Queue, SimpleWorker
 from rq.job import Job
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, NotFound
 
+from beebop.config import PoppunkFileStore
 from beebop.config.filepaths import FileStore
-from beebop.db import RedisManager
+from beebop.db import ProjectCatalog, RedisManager
+from beebop.services.manifest_service import write_assign_manifest
+from beebop.services.run_memo_service import read_run_digest, write_run_digest
 from beebop.services.run_PopPUNK.run import PopPUNKJobRunner, run_PopPUNK_jobs
 from tests import setup
 from tests.test_utils import read_redis
@@ -25,6 +31,7 @@ def test_sets_up_PopPUNKJobRunner():
     assert runner.dbs_location is not None
     assert runner.redis_host is not None
     assert runner.job_timeout == 1200  # seconds
+    assert runner.result_ttl == 7 * 24 * 3600  # seconds
     assert isinstance(runner.redis, Redis)
     assert isinstance(runner.redis_manager, RedisManager)
     assert hasattr(runner, "args")
@@ -74,10 +81,9 @@ def test_run_PopPUNK_jobs():
     assert read_redis("beebop:hash:job:assign", project_hash, redis) == job_ids["assign"]
     # writes initial output file linking project hash with sample hashes
 
-    with open(setup.fs.output_cluster(project_hash), "rb") as f:
-        initial_output = pickle.load(f)
-        assert initial_output[0]["hash"] == "e868c76fec83ee1f69a95bd27b8d5e76"
-        assert initial_output[1]["hash"] == "f3d9b387e311d5ab59a8c08eb3545dbb"
+    initial_output = ProjectCatalog(setup.fs.project_catalog(project_hash)).get_assignments()
+    assert initial_output[0]["hash"] == "e868c76fec83ee1f69a95bd27b8d5e76"
+    assert initial_output[1]["hash"] == "f3d9b387e311d5ab59a8c08eb3545dbb"
 
     # submits sublienage job to queue
     job_sublineage = Job.fetch(job_ids["sublineageAssign"], connection=redis)
@@ -87,3 +93,83 @@ def test_run_PopPUNK_jobs():
     job_visualise = Job.fetch(job_ids["visualise"], connection=redis)
     assert job_visualise.get_status() in status_options
     assert read_redis("beebop:hash:job:visualise", project_hash, redis) == job_ids["visualise"]
+
+
+def make_append_runner(mocker, tmp_path):
+    mocker.patch.object(PopPUNKJobRunner, "_setup_context")
+    mocker.patch("beebop.services.run_PopPUNK.run.get_db_digest", return_value="digest")
+    mocker.patch("beebop.services.run_PopPUNK.run.check_admission")
+    runner = PopPUNKJobRunner(setup.species)
+    runner.fs = PoppunkFileStore(str(tmp_path))
+    runner.redis_manager = Mock()
+    runner.queue = Mock()
+    runner.storage_location = str(tmp_path)
+    runner.species_args = SimpleNamespace()
+    runner.ref_db_fs, runner.full_db_fs = Mock(metadata=None), Mock()
+    runner.job_timeout = 60
+    runner.result_ttl = 3600
+    mocker.patch.object(runner, "_submit_jobs", return_value={"assign": "1", "visualise": "2"})
+    return runner
+
+
+def test_run_jobs_appends_samples(mocker, tmp_path):
+    runner = make_append_runner(mocker, tmp_path)
+    p_hash = "append_project"
+    fs = runner.fs
+    fs.setup_output_directory(p_hash)
+    ProjectCatalog(fs.project_catalog(p_hash)).save_assignments(
+        {0: {"hash": "hash1", "cluster": "GPSC1", "raw_cluster_num": "1"}}
+    )
+    write_assign_manifest(p_hash, fs)
+    write_run_digest(p_hash, fs, "run digest")
+    with open(fs.project_status(p_hash), "w") as f:
+        json.dump({}, f)
+    with open(fs.output_metadata(p_hash), "w") as f:
+        f.write("ID,Penicillin Resistance\nsample1.fa,R\n")
+    with open(fs.visualise_context(p_hash), "wb") as f:
+        pickle.dump({"name_mapping": {"hash1": "sample1.fa"}}, f)
+    with open("./tests/files/json/e868c76fec83ee1f69a95bd27b8d5e76.json") as f:
+        sketch = json.load(f)
+    amr_metadata = [{"ID": "sample2.fa", "Penicillin Resistance": "S"}]
+
+    job_ids = runner.run_jobs(
+        {"hash1": sketch, "hash2": sketch}.items(), p_hash, {"hash2": "sample2.fa"}, amr_metadata, append=True
+    )
+
+    assert job_ids == {"assign": "1", "visualise": "2"}
+    runner._submit_jobs.assert_called_once_with(
+        ["hash2"],
+        p_hash,
+        {"hash1": "sample1.fa", "hash2": "sample2.fa"},
+        runner._get_queue_kwargs(),
+        added_hashes=["hash2"],
+    )
+    assert fs.input.exists("hash2")
+    assert ProjectCatalog(fs.project_catalog(p_hash)).get_assignments() == {
+        0: {"hash": "hash1", "cluster": "GPSC1", "raw_cluster_num": "1"},
+        1: {"hash": "hash2"},
+    }
+    assert read_run_digest(p_hash, fs) is None
+    assert not os.path.exists(fs.project_status(p_hash))
+    with open(fs.output_metadata(p_hash)) as f:
+        assert f.read() == "ID,Penicillin Resistance\nsample1.fa,R\nsample2.fa,S\n"
+
+
+def test_run_jobs_append_rejects_projects_without_new_samples(mocker, tmp_path):
+    runner = make_append_runner(mocker, tmp_path)
+    fs = runner.fs
+
+    with pytest.raises(NotFound):
+        runner.run_jobs({}.items(), "unknown", {}, [], append=True)
+
+    fs.setup_output_directory("append_project")
+    ProjectCatalog(fs.project_catalog("append_project")).save_assignments({0: {"hash": "hash1"}})
+    with open(fs.project_status("append_project"), "w") as f:
+        json.dump({}, f)
+    with pytest.raises(BadRequest, match="assignment has finished"):
+        runner.run_jobs({"hash2": {}}.items(), "append_project", {}, [], append=True)
+
+    write_assign_manifest("append_project", fs)
+    with pytest.raises(BadRequest, match="already in the project"):
+        runner.run_jobs({"hash1": {}}.items(), "append_project", {}, [], append=True)
+    runner._submit_jobs.assert_not_called()
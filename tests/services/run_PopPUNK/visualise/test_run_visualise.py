@@ -1,12 +1,24 @@
 import os
+import pickle
 import time
 from unittest.mock import Mock, call, patch
 
-from rq.job import Job
+import pytest
+from rq.job import Job, JobStatus
+from werkzeug.exceptions import Conflict, NotFound
 
+from beebop.config import PoppunkFileStore
 from beebop.services.cluster_service import get_cluster_num
+from beebop.services.eta_service import eta_meta
+from beebop.services.job_service import status_record_meta
 from beebop.services.run_PopPUNK.visualise.run import (
+    ensure_cluster_visualised,
+    get_changed_clusters,
+    get_on_demand_clusters,
+    get_visualised_clusters,
+    queue_cluster_visualisation,
     queue_visualisation_jobs,
+    rerun_cluster_visualisation,
     visualise,
     visualise_per_cluster,
 )
@@ -37,8 +49,6 @@ def test_visualise(mocker):
     visualise(
         p_hash,
         setup.fs,
-        setup.ref_db_fs,
-        setup.args,
         name_mapping,
         setup.species,
         "localhost",
@@ -50,38 +60,52 @@ def test_visualise(mocker):
     for cluster in external_to_poppunk_clusters.keys():
         cluster_num = get_cluster_num(cluster)
 
+        # text files are stored compressed
         # microreact
         assert os.path.exists(
-            setup.fs.output_visualisations(p_hash, cluster_num) + f"/visualise_{cluster_num}_core_NJ.nwk"
+            setup.fs.output_visualisations(p_hash, cluster_num) + f"/visualise_{cluster_num}_core_NJ.nwk.gz"
         )
         assert os.path.exists(
-            setup.fs.output_visualisations(p_hash, cluster_num) + f"/visualise_{cluster_num}_microreact_clusters.csv"
+            setup.fs.output_visualisations(p_hash, cluster_num) + f"/visualise_{cluster_num}_microreact_clusters.csv.gz"
         )
         assert os.path.exists(
-            setup.fs.output_visualisations(p_hash, cluster_num) + f"/visualise_{cluster_num}.microreact"
+            setup.fs.output_visualisations(p_hash, cluster_num) + f"/visualise_{cluster_num}.microreact.gz"
         )
         # network
         assert os.path.exists(
             setup.fs.output_visualisations(p_hash, cluster_num)
-            + f"/visualise_{cluster_num}_component_{cluster_num}.graphml"
+            + f"/visualise_{cluster_num}_component_{cluster_num}.graphml.gz"
         )
         assert os.path.exists(
             setup.fs.output_visualisations(p_hash, cluster_num)
             + f"/pruned_visualise_{cluster_num}"
-            + f"_component_{cluster_num}.graphml"
+            + f"_component_{cluster_num}.graphml.gz"
         )
         assert os.path.exists(
-            setup.fs.output_visualisations(p_hash, cluster_num) + f"/visualise_{cluster_num}_cytoscape.csv"
+            setup.fs.output_visualisations(p_hash, cluster_num) + f"/visualise_{cluster_num}_cytoscape.csv.gz"
         )
 
 
+@patch("beebop.services.run_PopPUNK.visualise.run.PoppunkWrapper")
+@patch("beebop.services.run_PopPUNK.visualise.run.resolve_species")
+@patch("beebop.services.run_PopPUNK.visualise.run.compress_artifacts")
 @patch("beebop.services.run_PopPUNK.visualise.run.replace_filehashes")
 @patch("beebop.services.run_PopPUNK.visualise.run.create_subgraph")
 @patch("beebop.services.run_PopPUNK.visualise.run.get_internal_cluster")
-def test_visualise_per_cluster(mock_get_internal_cluster, mock_create_subgraph, mock_replace_filehashes):
+def test_visualise_per_cluster(
+    mock_get_internal_cluster,
+    mock_create_subgraph,
+    mock_replace_filehashes,
+    mock_compress_artifacts,
+    mock_resolve_species,
+    mock_wrapper_class,
+):
     p_hash = "unit_test_visualise_internal"
     cluster = "GPSC16"
-    wrapper = Mock()
+    args, species_entry = Mock(), Mock()
+    mock_resolve_species.return_value = (args, species_entry)
+    wrapper = mock_wrapper_class.return_value
+    wrapper.args.visualise.compress_outputs = True
     internal_cluster = "9"
     mock_get_internal_cluster.return_value = internal_cluster
 
@@ -89,27 +113,44 @@ def test_visualise_per_cluster(mock_get_internal_cluster, mock_create_subgraph,
         cluster,
         p_hash,
         setup.fs,
-        wrapper,
+        setup.species,
         name_mapping,
         external_to_poppunk_clusters,
     )
 
+    # the species is resolved in the worker, not pickled with the job
+    mock_resolve_species.assert_called_once_with(setup.species)
+    mock_wrapper_class.assert_called_once_with(setup.fs, species_entry.full_db_fs, args, p_hash, setup.species)
     wrapper.create_visualisations.assert_called_with("16", setup.fs.include_file(p_hash, internal_cluster))
     mock_replace_filehashes.assert_called_with(setup.fs.output_visualisations(p_hash, 16), name_mapping)
     mock_create_subgraph.assert_called_with(setup.fs.output_visualisations(p_hash, 16), name_mapping, "16")
     mock_get_internal_cluster.assert_called_with(external_to_poppunk_clusters, cluster, p_hash, setup.fs)
+    mock_compress_artifacts.assert_called_once_with(setup.fs.output_visualisations(p_hash, 16))
 
 
+@patch("beebop.services.run_PopPUNK.visualise.run.PoppunkWrapper")
+@patch("beebop.services.run_PopPUNK.visualise.run.resolve_species", return_value=(Mock(), Mock()))
+@patch("beebop.services.run_PopPUNK.visualise.run.write_project_status_record")
+@patch("beebop.services.run_PopPUNK.visualise.run.RedisManager")
+@patch("beebop.services.run_PopPUNK.visualise.run.get_current_job")
 @patch("beebop.services.run_PopPUNK.visualise.run.replace_filehashes")
-@patch("shutil.rmtree")
+@patch("beebop.config.filepaths.PoppunkFileStore.move_to_trash")
 @patch("beebop.services.run_PopPUNK.visualise.run.create_subgraph")
 @patch("beebop.services.run_PopPUNK.visualise.run.get_internal_cluster")
 def test_visualise_per_cluster_last_cluster(
-    mock_get_internal_cluster, mock_create_subgraph, mock_rmtree, mock_replace_filehashes
+    mock_get_internal_cluster,
+    mock_create_subgraph,
+    mock_move_to_trash,
+    mock_replace_filehashes,
+    mock_get_current_job,
+    mock_redis_manager,
+    mock_write_status_record,
+    _mock_resolve_species,
+    mock_wrapper_class,
 ):
     p_hash = "unit_test_visualise_internal"
     cluster = "GPSC16"
-    wrapper = Mock()
+    wrapper = mock_wrapper_class.return_value
     internal_cluster = "9"
     mock_get_internal_cluster.return_value = internal_cluster
     output_folder = setup.fs.output_visualisations(p_hash, 16)
@@ -118,7 +159,7 @@ def test_visualise_per_cluster_last_cluster(
         cluster,
         p_hash,
         setup.fs,
-        wrapper,
+        setup.species,
         name_mapping,
         external_to_poppunk_clusters,
         True,  # is_last_cluster_to_process
@@ -126,13 +167,16 @@ def test_visualise_per_cluster_last_cluster(
 
     wrapper.create_visualisations.assert_called_with("16", setup.fs.include_file(p_hash, internal_cluster))
     mock_create_subgraph.assert_called_with(output_folder, name_mapping, "16")
-    mock_rmtree.assert_called_with(setup.fs.tmp(p_hash))
+    mock_move_to_trash.assert_called_with(setup.fs.tmp(p_hash))
     mock_replace_filehashes.assert_called_with(output_folder, name_mapping)
+    mock_redis_manager.assert_called_once_with(mock_get_current_job.return_value.connection)
+    mock_write_status_record.assert_called_once_with(
+        p_hash, setup.fs, mock_redis_manager.return_value, "visualiseClusters:GPSC16"
+    )
 
 
 def test_queue_visualise_jobs(mocker):
     p_hash = "unit_test_visualise_internal"
-    wrapper = Mock()
     redis = Mock()
     mocker.patch.object(redis, "hset")
     mockQueue = Mock()
@@ -155,13 +199,19 @@ def test_queue_visualise_jobs(mocker):
                 item["cluster"],
                 p_hash,
                 setup.fs,
-                wrapper,
+                "strep",
                 name_mapping,
                 external_to_poppunk_clusters,
                 mocker.ANY,
             ),
             job_timeout=60,
             depends_on=mocker.ANY,
+            meta={
+                **eta_meta("strep", "visualiseCluster", mocker.ANY),
+                **status_record_meta(p_hash, setup.fs, f"visualiseClusters:{item['cluster']}"),
+            },
+            on_success=mocker.ANY,
+            on_failure=mocker.ANY,
         )
         for i, item in enumerate(setup.expected_assign_result.values())
     ]
@@ -170,12 +220,307 @@ def test_queue_visualise_jobs(mocker):
         setup.expected_assign_result,
         p_hash,
         setup.fs,
-        wrapper,
         name_mapping,
         external_to_poppunk_clusters,
         redis,
         queue_kwargs={"job_timeout": 60},
+        species="strep",
     )
 
     redis.hset.assert_has_calls(expected_hset_calls, any_order=True)
     mockQueue.enqueue.assert_has_calls(expected_enqueue_calls, any_order=True)
+
+
+def test_queue_visualise_jobs_precompute_top_clusters(mocker):
+    p_hash = "unit_test_visualise_internal"
+    redis = Mock()
+    mockQueue = Mock()
+    mocker.patch("beebop.services.run_PopPUNK.visualise.run.Queue", return_value=mockQueue)
+    mocker.patch("beebop.services.run_PopPUNK.visualise.run.Dependency")
+    assign_result = {
+        0: {"cluster": "GPSC16", "hash": "hash1"},
+        1: {"cluster": "GPSC29", "hash": "hash2"},
+        2: {"cluster": "GPSC29", "hash": "hash3"},
+    }
+
+    queue_visualisation_jobs(
+        assign_result,
+        p_hash,
+        setup.fs,
+        name_mapping,
+        external_to_poppunk_clusters,
+        redis,
+        queue_kwargs={"job_timeout": 60},
+        species="strep",
+        precompute_clusters=1,
+    )
+
+    # only the cluster with most queries is visualised, and it is the last one
+    mockQueue.enqueue.assert_called_once()
+    assert mockQueue.enqueue.call_args.kwargs["args"][0] == "GPSC29"
+    assert mockQueue.enqueue.call_args.kwargs["args"][6] is True
+
+
+def test_queue_visualise_jobs_only_changed_clusters(mocker):
+    redis = Mock()
+    mockQueue = Mock()
+    mocker.patch("beebop.services.run_PopPUNK.visualise.run.Queue", return_value=mockQueue)
+    mocker.patch("beebop.services.run_PopPUNK.visualise.run.Dependency")
+    assign_result = {
+        0: {"cluster": "GPSC16", "hash": "hash1"},
+        1: {"cluster": "GPSC29", "hash": "hash2"},
+        2: {"cluster": "GPSC29", "hash": "hash3"},
+        3: {"cluster": "GPSC3", "hash": "hash4"},
+    }
+
+    queue_visualisation_jobs(
+        assign_result,
+        "unit_test_visualise_internal",
+        setup.fs,
+        name_mapping,
+        external_to_poppunk_clusters,
+        redis,
+        queue_kwargs={"job_timeout": 60},
+        species="strep",
+        precompute_clusters=1,
+        clusters=get_changed_clusters(assign_result, ["hash1", "hash4"]),
+    )
+
+    assert [enqueue.kwargs["args"][0] for enqueue in mockQueue.enqueue.call_args_list] == ["GPSC16", "GPSC3"]
+    assert mockQueue.enqueue.call_args.kwargs["args"][6] is True
+
+
+def setup_on_demand_project(tmp_path, p_hash):
+    fs = PoppunkFileStore(tmp_path)
+    os.makedirs(fs.output(p_hash))
+    with open(fs.output_cluster(p_hash), "wb") as f:
+        pickle.dump(
+            {
+                0: {"cluster": "GPSC16", "hash": "hash1"},
+                1: {"cluster": "GPSC29", "hash": "hash2"},
+            },
+            f,
+        )
+    with open(fs.visualise_context(p_hash), "wb") as f:
+        pickle.dump(
+            {
+                "name_mapping": name_mapping,
+                "external_to_poppunk_clusters": external_to_poppunk_clusters,
+                "species": "strep",
+            },
+            f,
+        )
+    return fs
+
+
+def test_get_on_demand_clusters(tmp_path):
+    p_hash = "unit_test_on_demand"
+    fs = setup_on_demand_project(tmp_path, p_hash)
+
+    assert get_on_demand_clusters(p_hash, fs, {"GPSC29": "finished"}) == ["GPSC16"]
+
+
+def test_get_on_demand_clusters_before_visualise(tmp_path):
+    fs = PoppunkFileStore(tmp_path)
+
+    assert get_on_demand_clusters("unit_test_on_demand", fs, {}) == []
+
+
+def test_ensure_cluster_visualised_finished(mocker, tmp_path):
+    redis_manager = Mock()
+    redis_manager.get_visualisation_status.return_value = b"job_id"
+    mock_job = Mock()
+    mock_job.get_status.return_value = JobStatus.FINISHED
+    mocker.patch("beebop.services.run_PopPUNK.visualise.run.Job.fetch", return_value=mock_job)
+
+    assert ensure_cluster_visualised("p_hash", "GPSC16", PoppunkFileStore(tmp_path), redis_manager, {}) is None
+
+
+def test_ensure_cluster_visualised_from_status_record(mocker, tmp_path):
+    fs = PoppunkFileStore(tmp_path)
+    redis_manager = Mock()
+    mocker.patch(
+        "beebop.services.run_PopPUNK.visualise.run.read_project_status_record",
+        return_value={"status": {"visualiseClusters": {"GPSC16": "finished"}}},
+    )
+
+    assert ensure_cluster_visualised("p_hash", "GPSC16", fs, redis_manager, {}) is None
+    redis_manager.get_visualisation_status.assert_not_called()
+
+
+def test_ensure_cluster_visualised_in_progress(mocker, tmp_path):
+    redis_manager = Mock()
+    redis_manager.get_visualisation_status.return_value = b"job_id"
+    mock_job = Mock()
+    mock_job.get_status.return_value = JobStatus.STARTED
+    mocker.patch("beebop.services.run_PopPUNK.visualise.run.Job.fetch", return_value=mock_job)
+
+    status = ensure_cluster_visualised("p_hash", "GPSC16", PoppunkFileStore(tmp_path), redis_manager, {})
+
+    assert status == JobStatus.STARTED
+
+
+def test_ensure_cluster_visualised_queues_on_demand(mocker, tmp_path):
+    p_hash = "unit_test_on_demand"
+    fs = setup_on_demand_project(tmp_path, p_hash)
+    redis_manager = Mock()
+    redis_manager.get_visualisation_status.return_value = None
+    mock_queue_cluster = mocker.patch(
+        "beebop.services.run_PopPUNK.visualise.run.queue_cluster_visualisation",
+    )
+    mock_queue_cluster.return_value.get_status.return_value = JobStatus.QUEUED
+
+    status = ensure_cluster_visualised(p_hash, "GPSC16", fs, redis_manager, {})
+
+    assert status == JobStatus.QUEUED
+    mock_queue_cluster.assert_called_once_with(p_hash, "GPSC16", fs, redis_manager, {})
+    redis_manager.claim_cluster_visualisation.assert_called_once_with(p_hash, "GPSC16")
+    redis_manager.release_cluster_visualisation.assert_called_once_with(p_hash, "GPSC16")
+
+
+def test_ensure_cluster_visualised_claimed_by_another_request(mocker, tmp_path):
+    p_hash = "unit_test_on_demand"
+    fs = setup_on_demand_project(tmp_path, p_hash)
+    redis_manager = Mock()
+    redis_manager.get_visualisation_status.return_value = None
+    redis_manager.claim_cluster_visualisation.return_value = False
+    mock_queue_cluster = mocker.patch(
+        "beebop.services.run_PopPUNK.visualise.run.queue_cluster_visualisation",
+    )
+
+    status = ensure_cluster_visualised(p_hash, "GPSC16", fs, redis_manager, {})
+
+    assert status == JobStatus.QUEUED
+    mock_queue_cluster.assert_not_called()
+    redis_manager.release_cluster_visualisation.assert_not_called()
+
+
+def test_ensure_cluster_visualised_queued_while_claiming(mocker, tmp_path):
+    p_hash = "unit_test_on_demand"
+    fs = setup_on_demand_project(tmp_path, p_hash)
+    redis_manager = Mock()
+    # the job was queued by another request between the lookup and the claim
+    redis_manager.get_visualisation_status.side_effect = [None, b"job_id"]
+    mock_job = Mock()
+    mock_job.get_status.return_value = JobStatus.STARTED
+    mocker.patch("beebop.services.run_PopPUNK.visualise.run.Job.fetch", return_value=mock_job)
+    mock_queue_cluster = mocker.patch(
+        "beebop.services.run_PopPUNK.visualise.run.queue_cluster_visualisation",
+    )
+
+    status = ensure_cluster_visualised(p_hash, "GPSC16", fs, redis_manager, {})
+
+    assert status == JobStatus.STARTED
+    mock_queue_cluster.assert_not_called()
+    redis_manager.release_cluster_visualisation.assert_called_once_with(p_hash, "GPSC16")
+
+
+def test_get_visualised_clusters_does_not_queue(mocker, tmp_path):
+    p_hash = "unit_test_on_demand"
+    fs = setup_on_demand_project(tmp_path, p_hash)
+    redis_manager = Mock()
+    redis_manager.get_visualisation_statuses.return_value = {b"GPSC29": b"job_29", b"GPSC8": b"job_8"}
+    finished_job = Mock()
+    finished_job.get_status.return_value = JobStatus.FINISHED
+    started_job = Mock()
+    started_job.get_status.return_value = JobStatus.STARTED
+    jobs = {"job_29": finished_job, "job_8": started_job}
+    mock_fetch_many = mocker.patch(
+        "beebop.services.run_PopPUNK.visualise.run.Job.fetch_many",
+        side_effect=lambda job_ids, **_kwargs: [jobs[job_id] for job_id in job_ids],
+    )
+    mock_queue_cluster = mocker.patch("beebop.services.run_PopPUNK.visualise.run.queue_cluster_visualisation")
+
+    visualised = get_visualised_clusters(p_hash, ["GPSC29", "GPSC8", "GPSC16"], fs, redis_manager)
+
+    assert visualised == {"GPSC29"}
+    # statuses of all clusters are fetched in one go
+    redis_manager.get_visualisation_statuses.assert_called_once_with(p_hash)
+    assert sorted(mock_fetch_many.call_args.args[0]) == ["job_29", "job_8"]
+    mock_queue_cluster.assert_not_called()
+
+
+def test_get_visualised_clusters_from_status_record(mocker, tmp_path):
+    fs = PoppunkFileStore(tmp_path)
+    redis_manager = Mock()
+    mocker.patch(
+        "beebop.services.run_PopPUNK.visualise.run.read_project_status_record",
+        return_value={"status": {"visualiseClusters": {"GPSC29": "finished"}}},
+    )
+
+    assert get_visualised_clusters("p_hash", ["GPSC29", "GPSC16"], fs, redis_manager) == {"GPSC29"}
+    redis_manager.get_visualisation_statuses.assert_not_called()
+
+
+def test_queue_cluster_visualisation(mocker, tmp_path):
+    p_hash = "unit_test_on_demand"
+    fs = setup_on_demand_project(tmp_path, p_hash)
+    redis_manager = Mock()
+    in_flight_job = Mock()
+    in_flight_job.get_status.return_value = JobStatus.STARTED
+    redis_manager.get_visualisation_statuses.return_value = {b"GPSC29": b"job_id"}
+    mocker.patch("beebop.services.run_PopPUNK.visualise.run.Job.fetch", return_value=in_flight_job)
+    mock_dependency = mocker.patch("beebop.services.run_PopPUNK.visualise.run.Dependency")
+    mockQueue = mocker.patch("beebop.services.run_PopPUNK.visualise.run.Queue").return_value
+    mock_delete_record = mocker.patch("beebop.services.run_PopPUNK.visualise.run.delete_project_status_record")
+
+    job = queue_cluster_visualisation(p_hash, "GPSC16", fs, redis_manager, {"job_timeout": 60})
+
+    mockQueue.enqueue.assert_called_once_with(
+        visualise_per_cluster,
+        args=("GPSC16", p_hash, fs, "strep", name_mapping, external_to_poppunk_clusters, True),
+        depends_on=mock_dependency.return_value,
+        at_front=True,
+        meta={
+            **eta_meta("strep", "visualiseCluster", 1),
+            **status_record_meta(p_hash, fs, "visualiseClusters:GPSC16"),
+        },
+        on_success=mocker.ANY,
+        on_failure=mocker.ANY,
+        job_timeout=60,
+    )
+    mock_dependency.assert_called_once_with([in_flight_job], allow_failure=True, enqueue_at_front=True)
+    mock_delete_record.assert_called_once_with(p_hash, fs)
+    redis_manager.set_visualisation_status.assert_called_once_with(p_hash, "GPSC16", job.id)
+
+
+def test_queue_cluster_visualisation_unknown_cluster(tmp_path):
+    p_hash = "unit_test_on_demand"
+    fs = setup_on_demand_project(tmp_path, p_hash)
+
+    with pytest.raises(NotFound, match="Cluster not found"):
+        queue_cluster_visualisation(p_hash, "GPSC1", fs, Mock(), {})
+
+
+def test_rerun_cluster_visualisation(mocker, tmp_path):
+    p_hash = "unit_test_on_demand"
+    fs = setup_on_demand_project(tmp_path, p_hash)
+    redis_manager = Mock()
+    redis_manager.get_visualisation_status.return_value = b"job_id"
+    failed_job = Mock()
+    failed_job.get_status.return_value = JobStatus.FAILED
+    mocker.patch("beebop.services.run_PopPUNK.visualise.run.Job.fetch", return_value=failed_job)
+    mock_queue_cluster = mocker.patch("beebop.services.run_PopPUNK.visualise.run.queue_cluster_visualisation")
+
+    job = rerun_cluster_visualisation(p_hash, "GPSC16", fs, redis_manager, {})
+
+    assert job == mock_queue_cluster.return_value
+    mock_queue_cluster.assert_called_once_with(p_hash, "GPSC16", fs, redis_manager, {})
+
+
+def test_rerun_cluster_visualisation_in_progress(mocker, tmp_path):
+    p_hash = "unit_test_on_demand"
+    fs = setup_on_demand_project(tmp_path, p_hash)
+    redis_manager = Mock()
+    redis_manager.get_visualisation_status.return_value = b"job_id"
+    running_job = Mock()
+    running_job.get_status.return_value = JobStatus.STARTED
+    mocker.patch("beebop.services.run_PopPUNK.visualise.run.Job.fetch", return_value=running_job)
+
+    with pytest.raises(Conflict, match="already started"):
+        rerun_cluster_visualisation(p_hash, "GPSC16", fs, redis_manager, {})
+
+
+def test_rerun_cluster_visualisation_not_visualised(tmp_path):
+    with pytest.raises(NotFound, match="not been visualised"):
+        rerun_cluster_visualisation("unit_test_on_demand", "GPSC16", PoppunkFileStore(tmp_path), Mock(), {})
@@ -0,0 +1,78 @@
+from collections import namedtuple
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from beebop.services.admission_service import DISK_RETRY_AFTER_SECONDS, check_admission, get_queue_depth
+
+DiskUsage = namedtuple("DiskUsage", ["total", "used", "free"])
+GB = 1024**3
+
+limits = SimpleNamespace(
+    max_queue_depth=10,
+    max_backlog_seconds=300,
+    min_free_disk_gb=5,
+    expected_job_seconds=60,
+)
+
+
+def mock_queue(queued: int, deferred: int = 0) -> MagicMock:
+    queue = MagicMock()
+    queue.count = queued
+    queue.deferred_job_registry.__len__.return_value = deferred
+    return queue
+
+
+def test_get_queue_depth_includes_deferred_jobs():
+    assert get_queue_depth(mock_queue(3, 4)) == 7
+
+
+@patch("beebop.services.admission_service.shutil.disk_usage")
+def test_check_admission_no_limits(mock_disk_usage):
+    check_admission(mock_queue(1000), "storage", None)
+
+    mock_disk_usage.assert_not_called()
+
+
+@patch("beebop.services.admission_service.Worker.count", return_value=4)
+@patch("beebop.services.admission_service.shutil.disk_usage", return_value=DiskUsage(100 * GB, 0, 100 * GB))
+def test_check_admission_accepts_within_limits(_mock_disk_usage, _mock_worker_count):
+    check_admission(mock_queue(5), "storage", limits)
+
+
+@patch("beebop.services.admission_service.shutil.disk_usage", return_value=DiskUsage(100 * GB, 99 * GB, 1 * GB))
+def test_check_admission_rejects_low_disk(_mock_disk_usage):
+    with pytest.raises(ServiceUnavailable, match="Not enough free disk space") as exc_info:
+        check_admission(mock_queue(0), "storage", limits)
+
+    assert exc_info.value.retry_after == DISK_RETRY_AFTER_SECONDS
+
+
+@patch("beebop.services.admission_service.Worker.count", return_value=2)
+@patch("beebop.services.admission_service.shutil.disk_usage", return_value=DiskUsage(100 * GB, 0, 100 * GB))
+def test_check_admission_rejects_deep_queue(_mock_disk_usage, _mock_worker_count):
+    with pytest.raises(TooManyRequests, match="Too many jobs waiting") as exc_info:
+        check_admission(mock_queue(8, 4), "storage", limits)
+
+    # 3 jobs over the limit, each taking 60s shared between 2 workers
+    assert exc_info.value.retry_after == 90
+
+
+@patch("beebop.services.admission_service.Worker.count", return_value=1)
+@patch("beebop.services.admission_service.shutil.disk_usage", return_value=DiskUsage(100 * GB, 0, 100 * GB))
+def test_check_admission_rejects_long_backlog(_mock_disk_usage, _mock_worker_count):
+    with pytest.raises(TooManyRequests, match="Estimated wait of 540 seconds") as exc_info:
+        check_admission(mock_queue(9), "storage", limits)
+
+    assert exc_info.value.retry_after == 240
+
+
+@patch("beebop.services.admission_service.Worker.count", return_value=0)
+@patch("beebop.services.admission_service.shutil.disk_usage", return_value=DiskUsage(100 * GB, 0, 100 * GB))
+def test_check_admission_no_workers_counts_as_one(_mock_disk_usage, _mock_worker_count):
+    with pytest.raises(TooManyRequests) as exc_info:
+        check_admission(mock_queue(6), "storage", limits)
+
+    assert exc_info.value.retry_after == 60
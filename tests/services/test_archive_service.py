@@ -0,0 +1,130 @@
+import gzip
+import os
+import time
+import zipfile
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest
+
+from beebop.config import PoppunkFileStore
+from beebop.db import ProjectCatalog
+from beebop.services.archive_service import (
+    archive_cold_projects,
+    archive_project,
+    is_archived,
+    open_artifact,
+    open_compressed_artifact,
+    rehydrate_project,
+)
+from beebop.services.compression_service import compress_artifacts
+from beebop.services.manifest_service import read_manifest
+from beebop.services.result_service import generate_zip
+
+DAY = 24 * 3600
+GC_ARGS = SimpleNamespace(quota_gigabytes=1, min_age_hours=1, interval_minutes=60)
+
+
+def make_project(fs, p_hash, age=0):
+    fs.setup_output_directory(p_hash)
+    ProjectCatalog(fs.project_catalog(p_hash)).save_assignments({0: {"hash": "aa11", "cluster": "GPSC7"}})
+    with open(fs.project_status(p_hash), "w") as f:
+        f.write("{}")
+    with open(os.path.join(fs.output(p_hash), f"{p_hash}_clusters.csv"), "w") as f:
+        f.write("Taxon,Cluster\n" + "aa11,7\n" * 100)
+    folder = fs.output_visualisations(p_hash, "7")
+    os.makedirs(folder)
+    for name in ("visualise_7.microreact", "visualise_7_component_7.graphml", "visualise_7_cytoscape.csv"):
+        with open(os.path.join(folder, name), "w") as f:
+            f.write(name * 100)
+    timestamp = time.time() - age
+    os.utime(fs.output(p_hash), (timestamp, timestamp))
+
+
+def test_archive_project(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_project(fs, "p_hash", 10 * DAY)
+    mtime = os.path.getmtime(fs.output("p_hash"))
+    clusters_csv = os.path.join(fs.output("p_hash"), "p_hash_clusters.csv")
+
+    assert archive_project("p_hash", fs) > 0
+
+    assert is_archived("p_hash", fs)
+    assert os.path.getmtime(fs.output("p_hash")) == mtime
+    assert not os.path.exists(clusters_csv)
+    # folders, results and manifests stay outside the archive
+    assert os.path.isdir(fs.output_visualisations("p_hash", "7"))
+    assert ProjectCatalog(fs.project_catalog("p_hash")).get_assignments()[0]["cluster"] == "GPSC7"
+    assert read_manifest("p_hash", fs, "visualise_7") is not None
+    with zipfile.ZipFile(fs.project_archive("p_hash")) as archive:
+        assert sorted(archive.namelist()) == [
+            "p_hash_clusters.csv",
+            "visualise_7/visualise_7.microreact",
+            "visualise_7/visualise_7_component_7.graphml",
+            "visualise_7/visualise_7_cytoscape.csv",
+        ]
+    with open_artifact("p_hash", fs, clusters_csv) as f:
+        assert f.read().startswith(b"Taxon,Cluster\naa11,7\n")
+    with pytest.raises(FileNotFoundError):
+        open_artifact("p_hash", fs, os.path.join(fs.output("p_hash"), "missing.csv"))
+    assert archive_project("p_hash", fs) == 0
+
+
+def test_generate_zip_of_archived_project(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_project(fs, "p_hash")
+    archive_project("p_hash", fs)
+
+    with zipfile.ZipFile(generate_zip(fs, "p_hash", "network", "GPSC7")) as zipf:
+        assert sorted(zipf.namelist()) == ["visualise_7_component_7.graphml", "visualise_7_cytoscape.csv"]
+        assert zipf.read("visualise_7_cytoscape.csv") == b"visualise_7_cytoscape.csv" * 100
+
+
+def test_open_compressed_artifact_of_archived_project(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_project(fs, "p_hash")
+    folder = fs.output_visualisations("p_hash", "7")
+    compress_artifacts(folder)
+    microreact = os.path.join(folder, "visualise_7.microreact")
+    archive_project("p_hash", fs)
+
+    with zipfile.ZipFile(fs.project_archive("p_hash")) as archive:
+        assert archive.getinfo("visualise_7/visualise_7.microreact.gz").compress_type == zipfile.ZIP_STORED
+    with open_artifact("p_hash", fs, microreact) as f:
+        assert f.read() == b"visualise_7.microreact" * 100
+    with open_compressed_artifact("p_hash", fs, microreact) as f:
+        assert gzip.decompress(f.read()) == b"visualise_7.microreact" * 100
+    assert open_compressed_artifact("p_hash", fs, os.path.join(fs.output("p_hash"), "p_hash_clusters.csv")) is None
+
+
+def test_rehydrate_project(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_project(fs, "p_hash")
+    microreact = os.path.join(fs.output_visualisations("p_hash", "7"), "visualise_7.microreact")
+    archive_project("p_hash", fs)
+
+    assert rehydrate_project("p_hash", fs)
+
+    assert not is_archived("p_hash", fs)
+    with open(microreact) as f:
+        assert f.read() == "visualise_7.microreact" * 100
+    assert not rehydrate_project("p_hash", fs)
+
+
+@patch("beebop.services.gc_service.is_in_flight", side_effect=lambda p_hash, *_: p_hash == "running")
+def test_archive_cold_projects(_mock_is_in_flight, tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_project(fs, "cold", 40 * DAY)
+    make_project(fs, "warm", 2 * DAY)
+    make_project(fs, "running", 50 * DAY)
+
+    dry_run = archive_cold_projects(fs, Mock(), GC_ARGS, SimpleNamespace(cold_days=30), dry_run=True)
+    assert not is_archived("cold", fs)
+
+    result = archive_cold_projects(fs, Mock(), GC_ARGS, SimpleNamespace(cold_days=30))
+
+    assert result["archivedProjects"] == dry_run["archivedProjects"] == ["cold"]
+    assert result["savedBytes"] > 0
+    assert is_archived("cold", fs)
+    assert not is_archived("warm", fs)
+    assert not is_archived("running", fs)
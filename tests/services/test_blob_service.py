@@ -0,0 +1,75 @@
+import hashlib
+import os
+import shutil
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from beebop.config import PoppunkFileStore
+from beebop.services.blob_service import MIN_BLOB_SIZE, get_unreferenced_blobs, intern_artifacts
+from beebop.services.gc_service import collect_garbage
+from beebop.services.manifest_service import write_visualisation_manifest
+
+SHARED = "reference," * MIN_BLOB_SIZE
+
+
+def make_visualisation(fs, p_hash, query):
+    folder = fs.output_visualisations(p_hash, "7")
+    os.makedirs(folder)
+    for name, content in (
+        ("visualise_7_component_7.graphml", SHARED),
+        ("visualise_7.microreact", query * MIN_BLOB_SIZE),
+        ("visualise_7_cytoscape.csv", query),
+    ):
+        with open(os.path.join(folder, name), "w") as f:
+            f.write(content)
+    return write_visualisation_manifest(p_hash, fs, "7")
+
+
+def visualisation_file(fs, p_hash, name):
+    return os.path.join(fs.output_visualisations(p_hash, "7"), name)
+
+
+def test_intern_artifacts_shares_identical_files(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    first = make_visualisation(fs, "first", "a")
+    second = make_visualisation(fs, "second", "b")
+
+    assert intern_artifacts("first", fs, first) == 0
+    assert intern_artifacts("second", fs, second) == len(SHARED)
+
+    component = "visualise_7_component_7.graphml"
+    assert os.path.samefile(visualisation_file(fs, "first", component), visualisation_file(fs, "second", component))
+    assert os.stat(visualisation_file(fs, "first", component)).st_nlink == 3
+    with open(visualisation_file(fs, "second", component)) as f:
+        assert f.read() == SHARED
+    # distinct files are stored once each, small files are left alone
+    microreact = "visualise_7.microreact"
+    assert not os.path.samefile(
+        visualisation_file(fs, "first", microreact), visualisation_file(fs, "second", microreact)
+    )
+    assert os.stat(visualisation_file(fs, "first", microreact)).st_nlink == 2
+    assert os.stat(visualisation_file(fs, "first", "visualise_7_cytoscape.csv")).st_nlink == 1
+    # interning again changes nothing
+    assert intern_artifacts("second", fs, second) == 0
+
+
+def test_unreferenced_blobs_are_garbage_collected(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    intern_artifacts("first", fs, make_visualisation(fs, "first", "a"))
+    intern_artifacts("second", fs, make_visualisation(fs, "second", "b"))
+    with open(fs.project_status("second"), "w") as f:
+        f.write("{}")
+    shutil.rmtree(fs.output("first"))
+
+    orphan = fs.blob(hashlib.sha256(("a" * MIN_BLOB_SIZE).encode()).hexdigest())
+    assert get_unreferenced_blobs(fs, 0) == [(orphan, MIN_BLOB_SIZE)]
+    assert get_unreferenced_blobs(fs, 3600) == []
+
+    gc_args = SimpleNamespace(quota_gigabytes=1, min_age_hours=0, interval_minutes=60)
+    result = collect_garbage(fs, Mock(), gc_args)
+
+    assert result["removedProjects"] == []
+    assert result["removedBlobs"] == 1
+    assert not os.path.exists(orphan)
+    with open(visualisation_file(fs, "second", "visualise_7_component_7.graphml")) as f:
+        assert f.read() == SHARED
@@ -0,0 +1,72 @@
+import gzip
+import io
+import os
+from unittest.mock import patch
+
+import pytest
+
+from beebop.services.compression_service import (
+    compress_artifacts,
+    compress_file,
+    create_compressed_file,
+    decompress_stream,
+)
+
+
+def test_compress_artifacts(tmp_path):
+    for name in ("visualise_7_core_NJ.nwk", "visualise_7_cytoscape.csv", "visualise_7.h5"):
+        with open(tmp_path / name, "w") as f:
+            f.write(name * 100)
+
+    assert compress_artifacts(str(tmp_path)) > 0
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "visualise_7.h5",
+        "visualise_7_core_NJ.nwk.gz",
+        "visualise_7_cytoscape.csv.gz",
+    ]
+    with gzip.open(tmp_path / "visualise_7_core_NJ.nwk.gz", "rt") as f:
+        assert f.read() == "visualise_7_core_NJ.nwk" * 100
+
+
+def test_compress_file_is_deterministic(tmp_path):
+    for name in ("first.csv", "second.csv"):
+        with open(tmp_path / name, "w") as f:
+            f.write("same content")
+        compress_file(str(tmp_path / name))
+
+    assert (tmp_path / "first.csv.gz").read_bytes() == (tmp_path / "second.csv.gz").read_bytes()
+
+
+def test_create_compressed_file_removes_partial_file(tmp_path):
+    with pytest.raises(ValueError), create_compressed_file(str(tmp_path / "file.csv.gz")) as f:
+        f.write(b"partial")
+        raise ValueError("write failed")
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_decompress_stream_closes_stream():
+    stream = io.BytesIO(gzip.compress(b"content"))
+
+    with decompress_stream(stream) as f:
+        assert f.read() == b"content"
+
+    assert stream.closed
+
+
+@patch("beebop.services.compression_service.os.remove")
+def test_compress_file_keeps_file_until_copy_is_complete(mock_remove, tmp_path):
+    path = str(tmp_path / "file.csv")
+    with open(path, "w") as f:
+        f.write("content")
+
+    def check_copy(removed_path):
+        assert removed_path == path
+        with gzip.open(f"{path}.gz") as f:
+            assert f.read() == b"content"
+
+    mock_remove.side_effect = check_copy
+    compress_file(path)
+
+    mock_remove.assert_called_once()
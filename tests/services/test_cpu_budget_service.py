@@ -0,0 +1,110 @@
+import json
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from beebop.services.cpu_budget_service import (
+    CpuLedger,
+    allocate_threads,
+    get_desired_threads,
+)
+
+
+def make_args(tmp_path, total_cores=8, **overrides):
+    budget = {
+        "total_cores": total_cores,
+        "samples_per_thread": 25,
+        "max_wait_seconds": 0,
+        "lease_seconds": 600,
+        "ledger_file": str(tmp_path / "ledger.json"),
+    }
+    budget.update(overrides)
+    return SimpleNamespace(assign=SimpleNamespace(threads=1), cpu_budget=SimpleNamespace(**budget))
+
+
+def read_ledger(tmp_path):
+    with open(tmp_path / "ledger.json") as f:
+        return json.load(f)
+
+
+def test_allocate_threads_scales_with_size_and_releases(tmp_path):
+    args = make_args(tmp_path)
+
+    with allocate_threads(args, "assign", 3) as small:
+        assert small == 1
+    with allocate_threads(args, "assign", 500) as large:
+        assert large == 8
+        assert [allocation["threads"] for allocation in read_ledger(tmp_path).values()] == [8]
+
+    assert read_ledger(tmp_path) == {}
+
+
+def test_allocate_threads_shares_node_with_running_calls(tmp_path):
+    args = make_args(tmp_path)
+
+    with allocate_threads(args, "assign", 150) as first, allocate_threads(args, "assign", 500) as second:
+        # the next call takes the cores left once its wait for a full share has passed
+        assert first == 6
+        assert second == 2
+
+    ledger = CpuLedger(str(tmp_path / "ledger.json"), 8, 600)
+    _, threads_a = ledger.acquire(2, 0)
+    _, threads_b = ledger.acquire(8, 0)
+    # a call never takes more than an equal share with the calls already running
+    assert (threads_a, threads_b) == (2, 4)
+
+
+def test_ledger_waits_for_a_free_core_instead_of_oversubscribing(tmp_path):
+    ledger = CpuLedger(str(tmp_path / "ledger.json"), 8, 600)
+    token, _ = ledger.acquire(8, 0)
+
+    with patch("beebop.services.cpu_budget_service.time.sleep") as mock_sleep:
+        mock_sleep.side_effect = lambda _: ledger.release(token)
+        _, threads = ledger.acquire(8, 0)
+
+    mock_sleep.assert_called_once()
+    assert threads == 8
+
+
+def test_allocate_threads_without_budget_uses_fixed_threads():
+    args = SimpleNamespace(visualise=SimpleNamespace(threads=3))
+
+    with allocate_threads(args, "visualise", 500) as threads:
+        assert threads == 3
+
+
+def test_ledger_discards_expired_leases(tmp_path):
+    ledger_file = tmp_path / "ledger.json"
+    ledger_file.write_text(
+        json.dumps(
+            {
+                "other-host:expired": {"threads": 8, "expires": time.time() - 1},
+                "legacy": {"pid": 999999, "threads": 8},
+            }
+        )
+    )
+    ledger = CpuLedger(str(ledger_file), 8, 600)
+
+    token, threads = ledger.acquire(8, 0)
+
+    assert threads == 8
+    assert list(read_ledger(tmp_path)) == [token]
+
+
+def test_ledger_renews_leases(tmp_path):
+    ledger = CpuLedger(str(tmp_path / "ledger.json"), 8, 600)
+    token, _ = ledger.acquire(1, 0)
+    expires = read_ledger(tmp_path)[token]["expires"]
+
+    with patch("beebop.services.cpu_budget_service.time.time", return_value=expires - 1):
+        ledger.renew(token)
+
+    assert read_ledger(tmp_path)[token]["expires"] == expires + 599
+
+
+def test_get_desired_threads():
+    budget = SimpleNamespace(samples_per_thread=25)
+
+    assert get_desired_threads(budget, 0) == 1
+    assert get_desired_threads(budget, 25) == 1
+    assert get_desired_threads(budget, 26) == 2
@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
+
+from rq.job import JobStatus
+
+from beebop.services.eta_service import (
+    DEFAULT_STAGE_SECONDS,
+    MAX_POLL_INTERVAL_SECONDS,
+    MIN_POLL_INTERVAL_SECONDS,
+    StageTimer,
+    eta_meta,
+    format_eta,
+    get_completed_project_eta,
+    get_job_remaining_seconds,
+    get_poll_interval,
+    get_project_eta,
+    get_project_job_chain,
+    predict_stage_seconds,
+    record_job_duration,
+)
+
+# rq timestamps are naive UTC
+NOW = datetime(2025, 1, 1, 12, 0, 0)  # noqa: DTZ001
+
+
+def sums_for(points: list[tuple[int, float]]) -> dict[str, float]:
+    return {
+        "n": len(points),
+        "sx": sum(x for x, _ in points),
+        "sy": sum(y for _, y in points),
+        "sxx": sum(x * x for x, _ in points),
+        "sxy": sum(x * y for x, y in points),
+    }
+
+
+def mock_job(stage, size, status, started_at=None, position=None):
+    job = Mock()
+    job.meta = eta_meta("strep", stage, size)
+    job.get_status.return_value = status
+    job.started_at = started_at
+    job.get_position.return_value = position
+    return job
+
+
+def test_eta_meta():
+    assert eta_meta("strep", "assign", 3) == {"eta": {"species": "strep", "stage": "assign", "size": 3}}
+
+
+def test_record_job_duration_records_job_and_stages():
+    job = Mock()
+    job.meta = {
+        **eta_meta("strep", "assign", 10),
+        "stageDurations": [{"stage": "fullDbAssign", "size": 2, "seconds": 5.0}],
+    }
+    job.started_at = NOW
+    job.ended_at = NOW + timedelta(seconds=30)
+
+    with patch("beebop.services.eta_service.RedisManager") as mock_redis_manager:
+        record_job_duration(job, Mock())
+
+    mock_redis_manager.return_value.record_stage_duration.assert_any_call("strep", "assign", 10, 30.0)
+    mock_redis_manager.return_value.record_stage_duration.assert_any_call("strep", "fullDbAssign", 2, 5.0)
+
+
+def test_record_job_duration_ignores_jobs_without_eta():
+    job = Mock(meta={})
+
+    with patch("beebop.services.eta_service.RedisManager") as mock_redis_manager:
+        record_job_duration(job, Mock())
+
+    mock_redis_manager.assert_not_called()
+
+
+@patch("beebop.services.eta_service.get_current_job")
+def test_stage_timer_saves_duration_on_current_job(mock_get_current_job):
+    job = Mock(meta={})
+    mock_get_current_job.return_value = job
+
+    with StageTimer("fullDbAssign", 3):
+        pass
+
+    assert job.meta["stageDurations"][0]["stage"] == "fullDbAssign"
+    assert job.meta["stageDurations"][0]["size"] == 3
+    job.save_meta.assert_called_once()
+
+
+def test_predict_stage_seconds_default_when_not_recorded():
+    redis_manager = Mock()
+    redis_manager.get_stage_duration_sums.return_value = {}
+
+    assert predict_stage_seconds(redis_manager, "strep", "assign", 5) == DEFAULT_STAGE_SECONDS["assign"]
+
+
+def test_predict_stage_seconds_linear_fit():
+    redis_manager = Mock()
+    # 10 seconds overhead plus 2 seconds per sample
+    redis_manager.get_stage_duration_sums.return_value = sums_for([(1, 12.0), (5, 20.0), (10, 30.0)])
+
+    assert predict_stage_seconds(redis_manager, "strep", "assign", 20) == 50.0
+
+
+def test_predict_stage_seconds_mean_when_sizes_equal():
+    redis_manager = Mock()
+    redis_manager.get_stage_duration_sums.return_value = sums_for([(4, 10.0), (4, 20.0)])
+
+    assert predict_stage_seconds(redis_manager, "strep", "assign", 100) == 15.0
+
+
+def test_get_job_remaining_seconds():
+    redis_manager = Mock()
+    redis_manager.get_stage_duration_sums.return_value = sums_for([(2, 40.0)])
+
+    finished = mock_job("assign", 2, JobStatus.FINISHED)
+    started = mock_job("assign", 2, JobStatus.STARTED, started_at=NOW - timedelta(seconds=15))
+    queued = mock_job("assign", 2, JobStatus.QUEUED, position=3)
+    deferred = mock_job("assign", 2, JobStatus.DEFERRED)
+
+    assert get_job_remaining_seconds(finished, redis_manager, "strep", 10.0, NOW) == 0.0
+    assert get_job_remaining_seconds(started, redis_manager, "strep", 10.0, NOW) == 25.0
+    assert get_job_remaining_seconds(queued, redis_manager, "strep", 10.0, NOW) == 70.0
+    assert get_job_remaining_seconds(deferred, redis_manager, "strep", 10.0, NOW) == 40.0
+
+
+@patch("beebop.services.eta_service.Worker")
+@patch("beebop.services.eta_service.get_project_job_chain")
+def test_get_project_eta_accumulates_along_chain(mock_chain, mock_worker):
+    mock_worker.count.return_value = 1
+    redis_manager = Mock()
+    redis_manager.get_mean_job_duration.return_value = None
+    redis_manager.get_stage_duration_sums.return_value = sums_for([(2, 40.0)])
+    mock_chain.return_value = [
+        ("assign", mock_job("assign", 2, JobStatus.FINISHED)),
+        ("visualise", mock_job("visualise", 2, JobStatus.DEFERRED)),
+    ]
+
+    eta = get_project_eta("hash", redis_manager, cluster_sizes={"GPSC1": 1, "GPSC2": 1})
+
+    assert eta["assign"]["remainingSeconds"] == 0
+    assert eta["visualise"]["remainingSeconds"] == 40
+    # two cluster visualisations not queued yet
+    assert eta["project"]["remainingSeconds"] == 120
+    assert eta["visualiseClusters"] == {}
+    assert eta["pollInterval"] == 12
+
+
+@patch("beebop.services.eta_service.get_project_job_chain")
+def test_get_project_eta_no_jobs(mock_chain):
+    mock_chain.return_value = []
+
+    assert get_project_eta("hash", Mock()) == {}
+
+
+@patch("beebop.services.eta_service.Job")
+def test_get_project_job_chain_reuses_fetched_jobs(mock_job_class):
+    redis_manager = Mock()
+    assign = mock_job("assign", 2, JobStatus.FINISHED)
+    visualise = mock_job("visualise", 2, JobStatus.FINISHED)
+    cluster_late = Mock(created_at=NOW)
+    cluster_early = Mock(created_at=NOW - timedelta(seconds=10))
+    jobs = {
+        "visualise": visualise,
+        "visualiseClusters:GPSC2": cluster_late,
+        "assign": assign,
+        "visualiseClusters:GPSC1": cluster_early,
+    }
+
+    chain = get_project_job_chain("hash", redis_manager, jobs)
+
+    assert chain == [
+        ("assign", assign),
+        ("visualise", visualise),
+        ("visualiseClusters:GPSC1", cluster_early),
+        ("visualiseClusters:GPSC2", cluster_late),
+    ]
+    mock_job_class.fetch.assert_not_called()
+    redis_manager.get_visualisation_statuses.assert_not_called()
+
+
+def test_get_completed_project_eta():
+    assert get_completed_project_eta("2025-01-01T12:00:00+00:00") == {
+        "project": {"remainingSeconds": 0, "estimatedCompletion": "2025-01-01T12:00:00+00:00"},
+        "pollInterval": MAX_POLL_INTERVAL_SECONDS,
+    }
+
+
+def test_format_eta():
+    assert format_eta(90.4, NOW) == {
+        "remainingSeconds": 90,
+        "estimatedCompletion": "2025-01-01T12:01:30+00:00",
+    }
+
+
+def test_get_poll_interval_is_clamped():
+    assert get_poll_interval(0) == MIN_POLL_INTERVAL_SECONDS
+    assert get_poll_interval(100) == 10
+    assert get_poll_interval(100000) == MAX_POLL_INTERVAL_SECONDS
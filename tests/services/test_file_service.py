@@ -1,3 +1,4 @@
+import json
 import os
 import pickle
 from io import BytesIO
@@ -8,16 +9,20 @@ import pandas as pd
 import pytest
 
 from beebop.config import PoppunkFileStore
+from beebop.db import ProjectCatalog
 from beebop.services.file_service import (
     add_amr_to_metadata,
     add_files,
     get_cluster_assignments,
+    get_cluster_sizes,
     get_component_filepath,
     get_failed_samples_internal,
     get_metadata_with_sublineages,
     get_network_files_for_zip,
+    get_project_catalog,
     setup_db_file_stores,
 )
+from beebop.services.manifest_service import write_manifest
 from tests.setup import fs
 
 
@@ -25,20 +30,50 @@ def test_get_cluster_assignments(tmp_path):
     """
     Test the get_cluster_assignments function.
     """
-    fs = Mock(spec=PoppunkFileStore)
-    fs.output_cluster.return_value = tmp_path / "cluster_assignments.pkl"
+    fs = PoppunkFileStore(str(tmp_path))
     p_hash = "test_project_hash"
+    os.makedirs(fs.output(p_hash))
     cluster_data = {
         0: {"hash": "sample1", "cluster": "A", "raw_cluster_num": 1},
         1: {"hash": "sample2", "cluster": "B", "raw_cluster_num": 2},
     }
-    with open(fs.output_cluster(p_hash), "wb") as f:
-        pickle.dump(cluster_data, f)
+    ProjectCatalog(fs.project_catalog(p_hash)).save_assignments(cluster_data)
 
     result = get_cluster_assignments(p_hash, fs)
     assert result == cluster_data
 
 
+def test_get_cluster_assignments_imports_legacy_results(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    p_hash = "test_project_hash"
+    os.makedirs(fs.output(p_hash))
+    cluster_data = {
+        0: {"hash": "sample1", "cluster": "A", "raw_cluster_num": 1},
+        1: {"hash": "sample2", "cluster": "A", "raw_cluster_num": 1},
+        2: {"hash": "sample3", "cluster": "B", "raw_cluster_num": 2},
+    }
+    with open(fs.output_cluster(p_hash), "wb") as f:
+        pickle.dump(cluster_data, f)
+    with open(fs.external_to_poppunk_clusters(p_hash), "wb") as f:
+        pickle.dump({"A": {"1"}}, f)
+    with open(fs.sublineage_results(p_hash), "w") as f:
+        json.dump({"sample1": {"Rank_5_Lineage": "SL1"}}, f)
+
+    assert get_cluster_assignments(p_hash, fs) == cluster_data
+    assert get_cluster_sizes(p_hash, fs, 1) == {"A": 2}
+    catalog = get_project_catalog(p_hash, fs)
+    assert catalog.get_sample("sample3") == cluster_data[2]
+    assert catalog.get_cluster_samples("A") == [cluster_data[0], cluster_data[1]]
+    assert catalog.get_external_to_poppunk_clusters() == {"A": {"1"}}
+    assert catalog.get_sublineages() == {"sample1": {"Rank_5_Lineage": "SL1"}}
+    assert os.listdir(fs.output(p_hash)).count("catalog.sqlite") == 1
+
+
+def test_get_cluster_assignments_without_results(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        get_cluster_assignments("test_project_hash", PoppunkFileStore(str(tmp_path)))
+
+
 def test_get_failed_samples_internal_no_file():
     p_hash = "unit_test_get_clusters_internal"
 
@@ -183,7 +218,7 @@ def test_setup_db_file_stores_fulldb_missing(mock_exists):
 
 def test_add_amr_to_metadata_no_init_metadata(tmp_path):
     fs = Mock()
-    fs.tmp_output_metadata.return_value = str(tmp_path / "tmp_output_metadata.csv")
+    fs.output_metadata.return_value = str(tmp_path / "output_metadata.csv")
     amr_metadata = [
         {"ID": "sample1", "AMR": "AMR1"},
         {"ID": "sample2", "AMR": "AMR2"},
@@ -192,8 +227,8 @@ def test_add_amr_to_metadata_no_init_metadata(tmp_path):
 
     add_amr_to_metadata(fs, p_hash, amr_metadata)
 
-    res = pd.read_csv(tmp_path / "tmp_output_metadata.csv")
-    fs.tmp_output_metadata.assert_called_once_with(p_hash)
+    res = pd.read_csv(tmp_path / "output_metadata.csv")
+    fs.output_metadata.assert_called_once_with(p_hash)
     assert len(res) == 2
     assert res["ID"].tolist() == ["sample1", "sample2"]
     assert res["AMR"].tolist() == ["AMR1", "AMR2"]
@@ -201,7 +236,7 @@ def test_add_amr_to_metadata_no_init_metadata(tmp_path):
 
 def test_add_amr_to_metadata_init_metadata(tmp_path):
     fs = Mock()
-    fs.tmp_output_metadata.return_value = str(tmp_path / "tmp_output_metadata.csv")
+    fs.output_metadata.return_value = str(tmp_path / "output_metadata.csv")
     metadata = pd.DataFrame(
         {
             "ID": ["sample1", "sample2"],
@@ -218,8 +253,8 @@ def test_add_amr_to_metadata_init_metadata(tmp_path):
 
     add_amr_to_metadata(fs, p_hash, amr_metadata, metadata_file)
 
-    res = pd.read_csv(tmp_path / "tmp_output_metadata.csv")
-    fs.tmp_output_metadata.assert_called_once_with(p_hash)
+    res = pd.read_csv(tmp_path / "output_metadata.csv")
+    fs.output_metadata.assert_called_once_with(p_hash)
     assert len(res) == 4
     assert res["ID"].tolist() == ["sample1", "sample2", "sample3", "sample4"]
     assert res["AMR"].tolist() == ["AMR1", "AMR2", "AMR3", "AMR4"]
@@ -231,13 +266,14 @@ def test_get_metadata_with_sublineages_returns_metadata_file_if_no_sublineages(t
     cluster_no = "1"
     metadata_file_path = tmp_path / "metadata.csv"
     metadata_file_path.touch()
-    fs.tmp_output_metadata.return_value = str(metadata_file_path)
+    fs.output_metadata.return_value = str(metadata_file_path)
     fs.output_sublineages_csv.return_value = "/not/exist/sublineages.csv"
+    fs.manifest.return_value = str(tmp_path / "sublineageAssign.json")
 
     result = get_metadata_with_sublineages(fs, p_hash, cluster_no)
 
     assert result == str(metadata_file_path)
-    fs.tmp_output_metadata.assert_called_once_with(p_hash)
+    fs.output_metadata.assert_called_once_with(p_hash)
     fs.output_sublineages_csv.assert_called_once_with(p_hash, cluster_no)
 
 
@@ -267,9 +303,10 @@ def test_get_metadata_with_sublineages_merges_metadata_and_sublineages(tmp_path)
     # Setup output file path
     cluster_metadata_path = tmp_path / "cluster_metadata.csv"
 
-    fs.tmp_output_metadata.return_value = str(metadata_file_path)
+    fs.output_metadata.return_value = str(metadata_file_path)
     fs.output_sublineages_csv.return_value = str(sublineage_file_path)
     fs.tmp_output_cluster_metadata.return_value = str(cluster_metadata_path)
+    fs.manifest.return_value = str(tmp_path / "sublineageAssign.json")
 
     result = get_metadata_with_sublineages(fs, p_hash, cluster_no)
 
@@ -288,3 +325,15 @@ def test_get_metadata_with_sublineages_merges_metadata_and_sublineages(tmp_path)
     assert "Status" not in result_df.columns
     assert "Status:colour" not in result_df.columns
     assert "overall_Lineage" not in result_df.columns
+
+
+def test_get_metadata_with_sublineages_uses_manifest(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    p_hash = "test_hash"
+    fs.setup_output_directory(p_hash)
+    pd.DataFrame({"ID": ["sample1"]}).to_csv(fs.output_metadata(p_hash), index=False)
+    pd.DataFrame({"id": ["sample1"], "Rank_5_Lineage": [1]}).to_csv(fs.output_sublineages_csv(p_hash, "1"), index=False)
+    # the sub-lineage stage finished without results for the cluster
+    write_manifest(p_hash, fs, "sublineageAssign", {})
+
+    assert get_metadata_with_sublineages(fs, p_hash, "1") == fs.output_metadata(p_hash)
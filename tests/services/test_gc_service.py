@@ -0,0 +1,139 @@
+import os
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+from rq.job import JobStatus
+from werkzeug.exceptions import NotFound
+
+from beebop.config import PoppunkFileStore
+from beebop.db import ProjectCatalog
+from beebop.services.gc_service import (
+    collect_garbage,
+    get_gc_report,
+    is_in_flight,
+    record_project_access,
+    set_project_pinned,
+)
+
+SKETCH = {"14": ["0x1f", "0xa"], "bbits": 14}
+DAY = 24 * 3600
+
+
+def make_gc_args(quota_bytes):
+    return SimpleNamespace(quota_gigabytes=quota_bytes / 1024**3, min_age_hours=1, interval_minutes=60)
+
+
+def make_project(fs, p_hash, sample_hashes, age, size=1000):
+    os.makedirs(fs.output(p_hash))
+    ProjectCatalog(fs.project_catalog(p_hash)).save_assignments(
+        {i: {"hash": sample_hash, "cluster": "GPSC1"} for i, sample_hash in enumerate(sample_hashes)}
+    )
+    with open(os.path.join(fs.output(p_hash), "data"), "wb") as f:
+        f.write(b"0" * size)
+    with open(fs.project_status(p_hash), "w") as f:
+        f.write("{}")
+    for sample_hash in sample_hashes:
+        fs.input.put(sample_hash, SKETCH)
+        set_age(fs.input.binary_filename(sample_hash), age)
+    set_age(fs.output(p_hash), age)
+
+
+def set_age(path, age):
+    timestamp = time.time() - age
+    os.utime(path, (timestamp, timestamp))
+
+
+def test_collect_garbage_removes_least_recently_accessed(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_project(fs, "old", ["aa11", "bb22"], 3 * DAY)
+    make_project(fs, "recent", ["bb22", "cc33"], 2 * DAY)
+    make_project(fs, "accessed", ["dd44"], 4 * DAY)
+    record_project_access("accessed", fs)
+    report = get_gc_report(fs, Mock(), make_gc_args(0))
+    assert [project["hash"] for project in report["projects"]] == ["old", "recent", "accessed"]
+    # only removing the first project is needed to fit the quota
+    quota = report["projectBytes"] + report["sketchBytes"] - report["projects"][0]["bytes"]
+
+    result = collect_garbage(fs, Mock(), make_gc_args(quota))
+
+    assert result["removedProjects"] == ["old"]
+    assert sorted(os.listdir(fs.output_base)) == ["accessed", "recent"]
+    # the sketch shared with a remaining project is kept
+    assert not fs.input.exists("aa11")
+    assert fs.input.exists("bb22")
+    assert result["removedSketches"] == 1
+
+
+def test_collect_garbage_protects_pinned_and_in_flight_projects(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_project(fs, "pinned", ["aa11"], 3 * DAY)
+    make_project(fs, "running", ["bb22"], 3 * DAY)
+    set_project_pinned("pinned", fs, True)
+    os.remove(fs.project_status("running"))
+    set_age(fs.output("pinned"), 3 * DAY)
+    set_age(fs.output("running"), 3 * DAY)
+    redis_manager = Mock()
+
+    with patch(
+        "beebop.services.gc_service.get_project_status",
+        return_value={"assign": JobStatus.FINISHED, "visualise": JobStatus.STARTED, "visualiseClusters": {}},
+    ):
+        result = collect_garbage(fs, redis_manager, make_gc_args(0))
+        report = get_gc_report(fs, redis_manager, make_gc_args(0))
+
+    assert result["removedProjects"] == []
+    assert {project["hash"]: project["reclaimableBytes"] for project in report["projects"]} == {
+        "pinned": 0,
+        "running": 0,
+    }
+
+
+def test_collect_garbage_dry_run(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_project(fs, "old", ["aa11"], 3 * DAY)
+
+    result = collect_garbage(fs, Mock(), make_gc_args(0), dry_run=True)
+
+    assert result["removedProjects"] == ["old"]
+    assert os.path.isdir(fs.output("old"))
+    assert fs.input.exists("aa11")
+
+
+def test_get_gc_report(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_project(fs, "old", ["aa11"], 3 * DAY, size=5000)
+    fs.input.put("ee55", SKETCH)
+    set_age(fs.input.binary_filename("ee55"), 3 * DAY)
+
+    report = get_gc_report(fs, Mock(), make_gc_args(1024**3))
+
+    assert report["quotaBytes"] == 1024**3
+    assert report["projects"][0]["hash"] == "old"
+    assert report["projects"][0]["reclaimableBytes"] == report["projects"][0]["bytes"] > 5000
+    assert report["reclaimableSketchBytes"] == os.path.getsize(fs.input.binary_filename("ee55"))
+
+
+def test_is_in_flight(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    os.makedirs(fs.output("p_hash"))
+
+    # modified recently
+    assert is_in_flight("p_hash", fs, Mock(), 3600) is True
+    set_age(fs.output("p_hash"), DAY)
+    with patch("beebop.services.gc_service.get_project_status", side_effect=NotFound):
+        assert is_in_flight("p_hash", fs, Mock(), 3600) is False
+
+
+def test_record_project_access(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    record_project_access("unknown", fs)
+    assert not os.path.exists(fs.project_last_access("unknown"))
+
+    os.makedirs(fs.output("p_hash"))
+    record_project_access("p_hash", fs)
+    set_age(fs.project_last_access("p_hash"), 60)
+    record_project_access("p_hash", fs)
+
+    # not touched again within ACCESS_RESOLUTION
+    assert time.time() - os.path.getmtime(fs.project_last_access("p_hash")) >= 60
@@ -1,8 +1,11 @@
+import os
 from unittest.mock import Mock, call
 
 import pytest
+from rq.exceptions import NoSuchJobError
 from werkzeug.exceptions import NotFound
 
+from beebop.config import PoppunkFileStore
 from beebop.services import job_service
 
 mock_redis_manager = Mock()
@@ -76,6 +79,17 @@ def test_get_project_status_attribute_error():
         job_service.get_project_status("test_project_hash", mock_redis_manager)
 
 
+def test_get_project_status_expired_job(mocker):
+    """
+    Test the get_project_status function when the jobs of the project have expired from Redis.
+    """
+    mock_redis_manager.reset_mock(side_effect=True)
+    mocker.patch("beebop.services.job_service.Job.fetch", side_effect=NoSuchJobError)
+
+    with pytest.raises(NotFound, match="Unknown project hash"):
+        job_service.get_project_status("test_project_hash", mock_redis_manager)
+
+
 def test_get_status_job(mocker):
     """
     Test the get_status_job function to ensure it
@@ -110,10 +124,140 @@ def test_get_visualisation_statuses(mocker):
         side_effect=[mock_job_1, mock_job_2],
     )
 
-    statuses = job_service.get_visualisation_statuses("test_project_hash", mock_redis_manager)
+    jobs = {}
+    statuses = job_service.get_visualisation_statuses("test_project_hash", mock_redis_manager, jobs)
 
     assert statuses == {
         "GPSC1": "finished",
         "GPSC2": "running",
     }
+    assert jobs == {"visualiseClusters:GPSC1": mock_job_1, "visualiseClusters:GPSC2": mock_job_2}
     mock_redis_manager.get_visualisation_statuses.assert_called_once_with("test_project_hash")
+
+
+def test_write_and_read_project_status_record(mocker, tmp_path):
+    """
+    Test the status record written by the last job can be read back
+    without Redis, with the calling job reported as finished.
+    """
+    fs = PoppunkFileStore(tmp_path)
+    p_hash = "test_project_hash"
+    os.makedirs(fs.output(p_hash))
+    mocker.patch(
+        "beebop.services.job_service.get_project_status",
+        return_value={
+            "assign": "finished",
+            "visualise": "finished",
+            "visualiseClusters": {"GPSC1": "failed", "GPSC2": "started"},
+        },
+    )
+
+    job_service.write_project_status_record(p_hash, fs, mock_redis_manager, "visualiseClusters:GPSC2")
+    record = job_service.read_project_status_record(p_hash, fs)
+
+    assert record["status"] == {
+        "assign": "finished",
+        "visualise": "finished",
+        "visualiseClusters": {"GPSC1": "failed", "GPSC2": "finished"},
+    }
+    assert "completedAt" in record
+    assert not os.path.exists(f"{fs.project_status(p_hash)}.tmp")
+
+
+def test_read_project_status_record_not_completed(tmp_path):
+    """
+    Test no record is returned for projects that have not completed.
+    """
+    fs = PoppunkFileStore(tmp_path)
+
+    assert job_service.read_project_status_record("test_project_hash", fs) is None
+
+
+def test_write_project_status_record_skipped_while_jobs_in_flight(mocker, tmp_path):
+    """
+    Test no record is written while clusters visualised on demand still run.
+    """
+    fs = PoppunkFileStore(tmp_path)
+    p_hash = "test_project_hash"
+    os.makedirs(fs.output(p_hash))
+    mocker.patch(
+        "beebop.services.job_service.get_project_status",
+        return_value={
+            "assign": "finished",
+            "visualise": "finished",
+            "visualiseClusters": {"GPSC1": "queued", "GPSC2": "started"},
+        },
+    )
+
+    job_service.write_project_status_record(p_hash, fs, mock_redis_manager, "visualiseClusters:GPSC2")
+
+    assert job_service.read_project_status_record(p_hash, fs) is None
+
+
+def test_write_status_record_on_failure_of_assign_job(mocker, tmp_path):
+    """
+    Test a failed assign job writes the record, as the jobs waiting for it
+    never run.
+    """
+    fs = PoppunkFileStore(tmp_path)
+    p_hash = "test_project_hash"
+    os.makedirs(fs.output(p_hash))
+    mocker.patch(
+        "beebop.services.job_service.get_project_status",
+        return_value={
+            "assign": "started",
+            "visualise": "deferred",
+            "visualiseClusters": {},
+            "sublineageAssign": "deferred",
+        },
+    )
+    job = Mock(meta=job_service.status_record_meta(p_hash, fs, "assign"))
+
+    job_service.write_status_record_on_failure(job, Mock())
+    record = job_service.read_project_status_record(p_hash, fs)
+
+    assert record["status"] == {
+        "assign": "failed",
+        "visualise": "deferred",
+        "visualiseClusters": {},
+        "sublineageAssign": "deferred",
+    }
+
+
+def test_write_status_record_on_failure_skipped_while_clusters_queued(mocker, tmp_path):
+    """
+    Test a failed cluster job writes no record while later clusters are
+    still queued behind it.
+    """
+    fs = PoppunkFileStore(tmp_path)
+    p_hash = "test_project_hash"
+    os.makedirs(fs.output(p_hash))
+    mocker.patch(
+        "beebop.services.job_service.get_project_status",
+        return_value={
+            "assign": "finished",
+            "visualise": "finished",
+            "visualiseClusters": {"GPSC1": "started", "GPSC2": "deferred"},
+        },
+    )
+    job = Mock(meta=job_service.status_record_meta(p_hash, fs, "visualiseClusters:GPSC1"))
+
+    job_service.write_status_record_on_failure(job, Mock())
+
+    assert job_service.read_project_status_record(p_hash, fs) is None
+
+
+def test_delete_project_status_record(tmp_path):
+    """
+    Test the status record is removed, and missing records are ignored.
+    """
+    fs = PoppunkFileStore(tmp_path)
+    p_hash = "test_project_hash"
+    os.makedirs(fs.output(p_hash))
+    with open(fs.project_status(p_hash), "w") as f:
+        f.write("{}")
+
+    job_service.delete_project_status_record(p_hash, fs)
+    job_service.delete_project_status_record(p_hash, fs)
+
+    assert not os.path.exists(fs.project_status(p_hash))
@@ -0,0 +1,118 @@
+import os
+
+from beebop.config import PoppunkFileStore
+from beebop.services.manifest_service import (
+    copy_manifests,
+    delete_manifest,
+    get_artifact_paths,
+    get_previous_query_clustering,
+    read_manifest,
+    write_assign_manifest,
+    write_manifest,
+    write_visualisation_manifest,
+)
+
+
+def write_file(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_write_manifest(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    fs.setup_output_directory("p_hash")
+    write_file(fs.output_qc_report("p_hash"), "sample\tfailed")
+
+    manifest = write_manifest("p_hash", fs, "assign", {fs.output_qc_report("p_hash"): "qcReport"})
+
+    assert manifest == {
+        "stage": "assign",
+        "artifacts": {
+            "p_hash_qcreport.txt": {
+                "size": 13,
+                "sha256": "6a35fb7e323f2f5b7455420fb946e5b9146a93fc1221c41defec6b17d9e28bd0",
+                "role": "qcReport",
+            }
+        },
+    }
+    assert read_manifest("p_hash", fs, "assign") == manifest
+    assert get_artifact_paths("p_hash", fs, manifest, ("qcReport",)) == [fs.output_qc_report("p_hash")]
+    assert get_artifact_paths("p_hash", fs, manifest, ("includeFile",)) == []
+
+    delete_manifest("p_hash", fs, "assign")
+    assert read_manifest("p_hash", fs, "assign") is None
+    delete_manifest("p_hash", fs, "assign")
+
+
+def test_write_assign_manifest(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    fs.setup_output_directory("p_hash")
+    write_file(fs.external_previous_query_clustering_path("p_hash"), "id,cluster")
+    write_file(fs.include_file("p_hash", "5"), "sample")
+    write_file(os.path.join(fs.output("p_hash"), "p_hash_unword_clusters.csv"), "id,cluster")
+
+    manifest = write_assign_manifest("p_hash", fs)
+
+    assert {name: artifact["role"] for name, artifact in manifest["artifacts"].items()} == {
+        "p_hash_external_clusters.csv": "previousQueryClustering",
+        "include5.txt": "includeFile",
+    }
+    assert get_previous_query_clustering("p_hash", fs) == fs.external_previous_query_clustering_path("p_hash")
+
+
+def test_get_previous_query_clustering_without_manifest(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    fs.setup_output_directory("p_hash")
+
+    assert get_previous_query_clustering("p_hash", fs) == fs.previous_query_clustering("p_hash")
+
+
+def test_write_visualisation_manifest(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    folder = fs.output_visualisations("p_hash", "7")
+    os.makedirs(folder)
+    for name in (
+        "visualise_7.microreact",
+        "visualise_7_core_NJ.nwk",
+        "visualise_7_component_3.graphml",
+        "pruned_visualise_7_component_3.graphml",
+        "visualise_7_cytoscape.csv",
+    ):
+        write_file(os.path.join(folder, name), name)
+
+    manifest = write_visualisation_manifest("p_hash", fs, "7")
+
+    assert read_manifest("p_hash", fs, "visualise_7") == manifest
+    assert {name: artifact["role"] for name, artifact in manifest["artifacts"].items()} == {
+        os.path.join("visualise_7", "visualise_7.microreact"): "microreact",
+        os.path.join("visualise_7", "visualise_7_core_NJ.nwk"): "microreact",
+        os.path.join("visualise_7", "visualise_7_component_3.graphml"): "networkComponent",
+        os.path.join("visualise_7", "pruned_visualise_7_component_3.graphml"): "prunedNetworkComponent",
+        os.path.join("visualise_7", "visualise_7_cytoscape.csv"): "cytoscape",
+    }
+
+
+def test_copy_manifests(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    fs.setup_output_directory("source")
+    fs.setup_output_directory("copy")
+    write_file(fs.output_qc_report("source"), "qc report")
+    os.link(fs.output_qc_report("source"), fs.output_qc_report("copy"))
+    os.makedirs(fs.output_visualisations("source", "1"))
+    os.makedirs(fs.output_visualisations("copy", "1"))
+    write_file(os.path.join(fs.output_visualisations("source", "1"), "visualise_1.csv"), "sample1.fa")
+    write_file(os.path.join(fs.output_visualisations("copy", "1"), "visualise_1.csv"), "renamed.fa")
+    write_manifest("source", fs, "assign", {fs.output_qc_report("source"): "qcReport"})
+    source_manifest = write_visualisation_manifest("source", fs, "1")
+
+    copy_manifests("source", "copy", fs)
+
+    assert read_manifest("copy", fs, "assign") == {
+        "stage": "assign",
+        "artifacts": {"copy_qcreport.txt": read_manifest("source", fs, "assign")["artifacts"]["source_qcreport.txt"]},
+    }
+    artifact_name = os.path.join("visualise_1", "visualise_1.csv")
+    copied = read_manifest("copy", fs, "visualise_1")["artifacts"][artifact_name]
+    assert copied["size"] == len("renamed.fa")
+    assert copied["sha256"] != source_manifest["artifacts"][artifact_name]["sha256"]
+    copy_manifests("missing", "copy", fs)
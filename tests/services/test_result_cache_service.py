@@ -0,0 +1,92 @@
+import os
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pytest
+
+from beebop.services.result_cache_service import (
+    ResultCache,
+    configure_result_cache,
+    estimate_size,
+    get_file_validator,
+    result_cache,
+)
+
+
+def touch(path, content):
+    path.write_text(content)
+    # make the change visible on filesystems with coarse timestamps
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_result_cache_hits_until_files_change(tmp_path):
+    results = tmp_path / "results"
+    touch(results, "1")
+    cache = ResultCache(1024**2)
+    load = Mock(side_effect=lambda: {"value": results.read_text()})
+
+    assert cache.get("key", [str(results)], load) == {"value": "1"}
+    assert cache.get("key", [str(results)], load) == {"value": "1"}
+    touch(results, "2")
+    assert cache.get("key", [str(results)], load) == {"value": "2"}
+
+    assert load.call_count == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["entries"] == 1
+
+
+def test_result_cache_evicts_least_recently_used():
+    value_size = estimate_size({"value": "x" * 100})
+    cache = ResultCache(2 * value_size)
+
+    cache.get("a", [], lambda: {"value": "x" * 100})
+    cache.get("b", [], lambda: {"value": "x" * 100})
+    cache.get("a", [], Mock())
+    cache.get("c", [], lambda: {"value": "x" * 100})
+
+    load_b = Mock(return_value={"value": "x" * 100})
+    cache.get("b", [], load_b)
+    load_b.assert_called_once()
+    stats = cache.stats()
+    assert stats["evictions"] == 2
+    assert stats["bytes"] <= stats["maxBytes"]
+
+
+def test_result_cache_skips_results_over_cap_and_errors():
+    cache = ResultCache(10)
+    load = Mock(return_value={"value": "too large"})
+
+    cache.get("key", [], load)
+    cache.get("key", [], load)
+    assert load.call_count == 2
+    assert cache.stats()["entries"] == 0
+
+    with pytest.raises(FileNotFoundError):
+        cache.get("missing", [], Mock(side_effect=FileNotFoundError))
+    assert cache.stats()["entries"] == 0
+
+
+def test_get_file_validator(tmp_path):
+    path = tmp_path / "results"
+    path.write_text("abc")
+
+    validator = get_file_validator([str(path), str(tmp_path / "missing")])
+
+    assert validator == ((os.stat(path).st_mtime_ns, 3), None)
+
+
+def test_estimate_size_counts_shared_objects_once():
+    shared = "x" * 1000
+
+    assert estimate_size([shared, shared]) < 2 * estimate_size(shared)
+    assert estimate_size({"a": [shared]}) > estimate_size(shared)
+
+
+def test_configure_result_cache():
+    configure_result_cache(SimpleNamespace(result_cache=SimpleNamespace(max_megabytes=1)))
+    assert result_cache.max_bytes == 1024**2
+
+    configure_result_cache(SimpleNamespace())
+    assert result_cache.max_bytes == 256 * 1024**2
@@ -1,15 +1,22 @@
+import gzip
 import os
+import zipfile
 from unittest.mock import Mock, patch
 
 import pytest
 from werkzeug.exceptions import InternalServerError, NotFound
 
 from beebop.config import PoppunkFileStore
+from beebop.db import ProjectCatalog
+from beebop.services.compression_service import compress_artifacts
+from beebop.services.manifest_service import write_visualisation_manifest
 from beebop.services.result_service import (
     generate_microreact_url_internal,
     generate_zip,
     get_clusters_results,
     get_sublineage_results,
+    get_zip_etag,
+    open_network_graph,
     update_microreact_json,
 )
 from tests.setup import storage_location
@@ -98,6 +105,7 @@ def test_generate_zip_network(mock_add_files, mock_get_network_files_for_zip, mo
     ]
     fs = Mock(spec=PoppunkFileStore)
     fs.output_visualisations.return_value = "/path/to/visualisations"
+    fs.manifest.return_value = "/path/to/manifest.json"
 
     zip_path = generate_zip(fs, "test_project", "network", "123")
 
@@ -121,6 +129,7 @@ def test_generate_zip_microreact(mock_add_files, mock_get_network_files_for_zip,
     ]
     fs = Mock(spec=PoppunkFileStore)
     fs.output_visualisations.return_value = "/path/to/visualisations"
+    fs.manifest.return_value = "/path/to/manifest.json"
 
     zip_path = generate_zip(fs, "test_project", "microreact", "123")
 
@@ -134,6 +143,77 @@ def test_generate_zip_microreact(mock_add_files, mock_get_network_files_for_zip,
     )
 
 
+def test_generate_zip_from_manifest(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    folder = fs.output_visualisations("test_project", "7")
+    os.makedirs(folder)
+    for name in ("visualise_7.microreact", "visualise_7_component_3.graphml", "visualise_7_cytoscape.csv"):
+        with open(os.path.join(folder, name), "w") as f:
+            f.write(name)
+    write_visualisation_manifest("test_project", fs, "7")
+    # files added after the stage finished are not served
+    with open(os.path.join(folder, "stray.csv"), "w") as f:
+        f.write("stray")
+
+    with zipfile.ZipFile(generate_zip(fs, "test_project", "microreact", "GPSC7")) as zipf:
+        assert zipf.namelist() == ["visualise_7.microreact"]
+    with zipfile.ZipFile(generate_zip(fs, "test_project", "network", "GPSC7")) as zipf:
+        assert sorted(zipf.namelist()) == ["visualise_7_component_3.graphml", "visualise_7_cytoscape.csv"]
+
+    etag = get_zip_etag(fs, "test_project", "network", "GPSC7")
+    assert etag != get_zip_etag(fs, "test_project", "microreact", "GPSC7")
+    assert get_zip_etag(fs, "test_project", "network", "GPSC8") is None
+    with open(os.path.join(folder, "visualise_7_cytoscape.csv"), "w") as f:
+        f.write("changed")
+    write_visualisation_manifest("test_project", fs, "7")
+    assert get_zip_etag(fs, "test_project", "network", "GPSC7") != etag
+
+
+def test_generate_zip_of_compressed_files(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    folder = fs.output_visualisations("test_project", "7")
+    os.makedirs(folder)
+    for name in ("visualise_7.microreact", "visualise_7_component_3.graphml", "visualise_7_cytoscape.csv"):
+        with open(os.path.join(folder, name), "w") as f:
+            f.write(name)
+    compress_artifacts(folder)
+    write_visualisation_manifest("test_project", fs, "7")
+
+    with zipfile.ZipFile(generate_zip(fs, "test_project", "network", "GPSC7")) as zipf:
+        assert sorted(zipf.namelist()) == ["visualise_7_component_3.graphml", "visualise_7_cytoscape.csv"]
+        assert zipf.read("visualise_7_cytoscape.csv") == b"visualise_7_cytoscape.csv"
+
+
+def test_open_network_graph(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    fs.setup_output_directory("test_project")
+    ProjectCatalog(fs.project_catalog("test_project")).save_assignments(
+        {0: {"hash": "aa11", "cluster": "GPSC7", "raw_cluster_num": "3"}}
+    )
+    path = fs.pruned_network_output_component("test_project", "3", "7")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write("<graphml></graphml>")
+
+    graphml_file, compressed = open_network_graph("test_project", fs, "GPSC7", True)
+    with graphml_file:
+        assert not compressed
+        assert graphml_file.read() == b"<graphml></graphml>"
+
+    compress_artifacts(os.path.dirname(path))
+    graphml_file, compressed = open_network_graph("test_project", fs, "GPSC7", True)
+    with graphml_file:
+        assert compressed
+        assert gzip.decompress(graphml_file.read()) == b"<graphml></graphml>"
+    graphml_file, compressed = open_network_graph("test_project", fs, "GPSC7", False)
+    with graphml_file:
+        assert not compressed
+        assert graphml_file.read() == b"<graphml></graphml>"
+
+    with pytest.raises(NotFound):
+        open_network_graph("test_project", fs, "GPSC8", True)
+
+
 @patch("requests.post")
 def test_generate_microreact_url_internal(mock_post):
     dummy_url = "https://microreact.org/project/12345-testmicroreactapi"
@@ -240,26 +320,20 @@ def test_generate_microreact_url_internal_API_other_error(mock_post):
 
 
 def test_get_sublineage_results_file_exists(tmp_path):
-    fs = Mock(spec=PoppunkFileStore)
+    fs = PoppunkFileStore(str(tmp_path))
     p_hash = "test_hash"
-    path = tmp_path / f"{p_hash}_sublineages_results.json"
-    fs.sublineage_results.return_value = path
-    # Create the file to simulate it exists
-    with open(path, "w") as f:
-        f.write('{"sublineage_results": "some_data"}')
+    os.makedirs(fs.output(p_hash))
+    ProjectCatalog(fs.project_catalog(p_hash)).save_sublineages({"sample1": {"Rank_5_Lineage": "SL1"}})
 
     result = get_sublineage_results(p_hash, fs)
 
-    assert result == {"sublineage_results": "some_data"}
-    fs.sublineage_results.assert_called_once_with(p_hash)
+    assert result == {"sample1": {"Rank_5_Lineage": "SL1"}}
 
 
-def test_get_sublineage_results_file_not_exists():
-    fs = Mock(spec=PoppunkFileStore)
+def test_get_sublineage_results_file_not_exists(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
     p_hash = "test_hash_nonexistent"
-    fs.sublineage_results.return_value = f"non_existent_path/{p_hash}_sublineages_results.json"
 
     result = get_sublineage_results(p_hash, fs)
 
     assert result == {}
-    fs.sublineage_results.assert_called_once_with(p_hash)
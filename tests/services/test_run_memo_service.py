@@ -0,0 +1,198 @@
+import gzip
+import json
+import os
+import pickle
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from beebop.config import DatabaseFileStore, PoppunkFileStore
+from beebop.db import ProjectCatalog
+from beebop.services.compression_service import compress_artifacts
+from beebop.services.run_memo_service import (
+    delete_run_digest,
+    find_memoized_run,
+    get_db_digest,
+    get_name_rewrites,
+    get_run_digest,
+    record_run,
+    reuse_memoized_run,
+    unshare_file,
+    write_run_digest,
+)
+
+DIGEST = "digest"
+NAME_MAPPING = {"aa11": "sample1.fa", "bb22": "sample10.fa"}
+FINISHED = {"assign": "finished", "visualise": "finished", "visualiseClusters": {"GPSC1": "finished"}}
+
+
+def make_completed_project(fs, p_hash, status=FINISHED):
+    fs.setup_output_directory(p_hash)
+    ProjectCatalog(fs.project_catalog(p_hash)).save_assignments(
+        {0: {"hash": "aa11", "cluster": "GPSC1"}, 1: {"hash": "bb22", "cluster": "GPSC1"}}
+    )
+    with open(fs.output_qc_report(p_hash), "w") as f:
+        f.write("qc report")
+    os.makedirs(fs.output_visualisations(p_hash, "1"))
+    with open(os.path.join(fs.output_visualisations(p_hash, "1"), "visualise_1.csv"), "w") as f:
+        f.write("id,Status\nsample1.fa,Query\nsample10.fa,Query\nref_sample1.fa,Reference\n")
+    with open(fs.visualise_context(p_hash), "wb") as f:
+        pickle.dump({"wrapper": SimpleNamespace(p_hash=p_hash), "name_mapping": NAME_MAPPING}, f)
+    with open(fs.project_status(p_hash), "w") as f:
+        json.dump({"status": status, "completedAt": "2024-01-01T00:00:00+00:00"}, f)
+    write_run_digest(p_hash, fs, DIGEST)
+    record_run(p_hash, fs, NAME_MAPPING)
+
+
+def make_redis_manager():
+    redis_manager = Mock()
+    redis_manager.get_job_status.side_effect = lambda job_type, _: (
+        None if job_type == "sublineageAssign" else f"{job_type}_job".encode()
+    )
+    redis_manager.get_visualisation_statuses.return_value = {b"GPSC1": b"cluster_job"}
+    return redis_manager
+
+
+def test_get_run_digest(tmp_path):
+    db_path = tmp_path / "db"
+    db_path.mkdir()
+    (db_path / "db.h5").write_text("sketches")
+    db_fs = DatabaseFileStore(str(db_path))
+    species_args = SimpleNamespace(refdb="db", admission=SimpleNamespace(max_queue_depth=1))
+    args = SimpleNamespace(assign=SimpleNamespace(threads=1), visualise=SimpleNamespace(threads=1), trash=None)
+
+    db_digest = get_db_digest([db_fs])
+
+    digest = get_run_digest(["aa11", "bb22"], "species", args, species_args, db_digest, [])
+
+    assert get_run_digest(["bb22", "aa11"], "species", args, species_args, db_digest, []) == digest
+    species_args.admission.max_queue_depth = 2
+    args.trash = SimpleNamespace(interval_seconds=1)
+    assert get_run_digest(["aa11", "bb22"], "species", args, species_args, db_digest, []) == digest
+    assert get_run_digest(["aa11"], "species", args, species_args, db_digest, []) != digest
+    assert get_run_digest(["aa11", "bb22"], "species", args, species_args, db_digest, [{"id": "aa11"}]) != digest
+    args.visualise.threads = 2
+    assert get_run_digest(["aa11", "bb22"], "species", args, species_args, db_digest, []) != digest
+
+
+def test_get_db_digest(tmp_path):
+    db_path = tmp_path / "db"
+    db_path.mkdir()
+    (db_path / "db.h5").write_text("sketches")
+    db_fs = DatabaseFileStore(str(db_path))
+    db_digest = get_db_digest([db_fs])
+
+    assert get_db_digest([db_fs]) == db_digest
+    (db_path / "db.h5").write_text("new sketches")
+    assert get_db_digest([db_fs]) != db_digest
+
+
+def test_record_run_only_records_successful_projects(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_completed_project(fs, "failed", {**FINISHED, "visualise": "failed"})
+    assert find_memoized_run(DIGEST, fs) is None
+
+    make_completed_project(fs, "source")
+    assert find_memoized_run(DIGEST, fs) == {"project": "source", "nameMapping": NAME_MAPPING}
+
+
+def test_find_memoized_run_discards_resubmitted_project(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_completed_project(fs, "source")
+    write_run_digest("source", fs, "other digest")
+
+    assert find_memoized_run(DIGEST, fs) is None
+    assert not os.path.exists(fs.run_memo(DIGEST))
+
+
+def test_find_memoized_run_discards_project_with_added_samples(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_completed_project(fs, "source")
+    delete_run_digest("source", fs)
+    delete_run_digest("source", fs)
+
+    assert find_memoized_run(DIGEST, fs) is None
+
+
+def test_unshare_file(tmp_path):
+    path = tmp_path / "include1.txt"
+    path.write_text("sample1")
+    unshare_file(str(path))
+    assert os.stat(path).st_nlink == 1
+
+    os.link(path, tmp_path / "linked.txt")
+    unshare_file(str(path))
+    path.write_text("sample1\nsample2")
+
+    assert os.stat(path).st_nlink == 1
+    assert (tmp_path / "linked.txt").read_text() == "sample1"
+
+
+def test_reuse_memoized_run(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_completed_project(fs, "source")
+    redis_manager = make_redis_manager()
+
+    job_ids = reuse_memoized_run(DIGEST, "copy", fs, NAME_MAPPING, redis_manager)
+
+    assert job_ids == {"assign": "assign_job", "visualise": "visualise_job"}
+    # outputs are hard linked, renamed after the project
+    assert os.stat(fs.output_qc_report("copy")).st_ino == os.stat(fs.output_qc_report("source")).st_ino
+    assert (
+        ProjectCatalog(fs.project_catalog("copy")).get_assignments()
+        == ProjectCatalog(fs.project_catalog("source")).get_assignments()
+    )
+    assert not os.path.samefile(fs.project_catalog("copy"), fs.project_catalog("source"))
+    with open(fs.visualise_context("copy"), "rb") as f:
+        # pickled wrappers of contexts written by earlier versions are dropped
+        assert "wrapper" not in pickle.load(f)
+    with open(fs.project_status("copy")) as f:
+        assert json.load(f)["status"] == FINISHED
+    assert find_memoized_run(DIGEST, fs)["project"] == "source"
+    redis_manager.set_job_status.assert_any_call("assign", "copy", "assign_job")
+    redis_manager.set_visualisation_status.assert_called_once_with("copy", "GPSC1", "cluster_job")
+
+
+def test_reuse_memoized_run_renames_samples(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_completed_project(fs, "source")
+    name_mapping = {"aa11": "sample10.fa", "bb22": "renamed.fa"}
+
+    reuse_memoized_run(DIGEST, "copy", fs, name_mapping, make_redis_manager())
+
+    with open(os.path.join(fs.output_visualisations("copy", "1"), "visualise_1.csv")) as f:
+        assert f.read() == "id,Status\nsample10.fa,Query\nrenamed.fa,Query\nref_sample1.fa,Reference\n"
+    with open(os.path.join(fs.output_visualisations("source", "1"), "visualise_1.csv")) as f:
+        assert "sample1.fa,Query" in f.read()
+    with open(fs.visualise_context("copy"), "rb") as f:
+        assert pickle.load(f)["name_mapping"] == name_mapping
+
+
+def test_reuse_memoized_run_renames_samples_in_compressed_files(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_completed_project(fs, "source")
+    compress_artifacts(fs.output_visualisations("source", "1"))
+    name_mapping = {"aa11": "sample10.fa", "bb22": "renamed.fa"}
+
+    reuse_memoized_run(DIGEST, "copy", fs, name_mapping, make_redis_manager())
+
+    with gzip.open(os.path.join(fs.output_visualisations("copy", "1"), "visualise_1.csv.gz"), "rt") as f:
+        assert f.read() == "id,Status\nsample10.fa,Query\nrenamed.fa,Query\nref_sample1.fa,Reference\n"
+
+
+def test_reuse_memoized_run_without_memo(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_completed_project(fs, "source")
+    redis_manager = make_redis_manager()
+    redis_manager.get_job_status.side_effect = None
+    redis_manager.get_job_status.return_value = None
+
+    assert reuse_memoized_run("unknown", "copy", fs, NAME_MAPPING, redis_manager) is None
+    # jobs of the project are no longer known
+    assert reuse_memoized_run(DIGEST, "copy", fs, NAME_MAPPING, redis_manager) is None
+    assert not os.path.exists(fs.output("copy"))
+
+
+def test_get_name_rewrites():
+    assert get_name_rewrites(NAME_MAPPING, NAME_MAPPING) == {}
+    assert get_name_rewrites(NAME_MAPPING, {"aa11": "new.fa", "bb22": "sample10.fa"}) == {"sample1.fa": "new.fa"}
+    assert get_name_rewrites({"aa11": "same.fa", "bb22": "same.fa"}, {"aa11": "new.fa", "bb22": "same.fa"}) is None
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from beebop.config import PoppunkFileStore
+from beebop.services.scratch_service import job_scratch
+
+
+def test_job_scratch(tmp_path, monkeypatch):
+    scratch_location = str(tmp_path / "scratch")
+    monkeypatch.setenv("SCRATCH_LOCATION", scratch_location)
+    fs = PoppunkFileStore(str(tmp_path / "storage"))
+    other_fs = PoppunkFileStore(str(tmp_path / "storage"))
+
+    with job_scratch("p_hash", fs, other_fs):
+        tmp = fs.tmp("p_hash")
+        assert os.path.dirname(os.path.dirname(tmp)) == scratch_location
+        assert other_fs.tmp("p_hash") == tmp
+        with open(os.path.join(fs.output_tmp("p_hash"), "p_hash.dists.npy"), "w") as f:
+            f.write("distances")
+
+    assert os.listdir(scratch_location) == []
+    assert fs.scratch is None
+    assert not os.path.exists(fs.output("p_hash"))
+
+
+def test_job_scratch_deleted_on_failure(tmp_path, monkeypatch):
+    scratch_location = str(tmp_path / "scratch")
+    monkeypatch.setenv("SCRATCH_LOCATION", scratch_location)
+    fs = PoppunkFileStore(str(tmp_path / "storage"))
+
+    with pytest.raises(ValueError), job_scratch("p_hash", fs):
+        fs.output_tmp("p_hash")
+        raise ValueError("PopPUNK failed")
+
+    assert os.listdir(scratch_location) == []
+    assert fs.scratch is None
+
+
+def test_job_scratch_without_scratch_location(tmp_path, monkeypatch):
+    monkeypatch.delenv("SCRATCH_LOCATION", raising=False)
+    fs = PoppunkFileStore(str(tmp_path))
+
+    with job_scratch("p_hash", fs):
+        assert fs.tmp("p_hash") == os.path.join(fs.output("p_hash"), "tmp")
+
+
+def test_nested_job_scratch(tmp_path, monkeypatch):
+    monkeypatch.setenv("SCRATCH_LOCATION", str(tmp_path / "scratch"))
+    fs = PoppunkFileStore(str(tmp_path / "storage"))
+
+    with job_scratch("p_hash", fs):
+        outer_scratch = fs.scratch
+        with job_scratch("p_hash", fs):
+            assert fs.scratch != outer_scratch
+        assert fs.scratch == outer_scratch
+        assert os.path.isdir(outer_scratch)
+    assert fs.scratch is None
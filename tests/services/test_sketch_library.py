@@ -0,0 +1,68 @@
+import os
+from unittest.mock import patch
+
+import h5py
+import numpy as np
+
+from beebop.services.sketch_library import SketchLibrary, query_db_path
+
+
+def fake_sketch_to_hdf5(sketches_dict, output):
+    # writes the same layout as PopPUNK's sketch_to_hdf5
+    with h5py.File(query_db_path(output), "w") as db:
+        sketches = db.create_group("sketches")
+        for sample_hash, sketch in sketches_dict.items():
+            sketches.attrs["sketch_version"] = sketch["version"]
+            group = sketches.create_group(sample_hash)
+            group.attrs["bbits"] = sketch["bbits"]
+            group.create_dataset("14", data=sketch["14"], dtype="uint64")
+    return list(sketches_dict)
+
+
+def make_sketch(value, version="v1"):
+    return {"14": [hex(value)], "bbits": 14, "version": version}
+
+
+@patch("beebop.services.sketch_library.sketch_to_hdf5", side_effect=fake_sketch_to_hdf5)
+def test_add_and_build_query_db(mock_sketch_to_hdf5, tmp_path):
+    library = SketchLibrary(str(tmp_path / "sketch_library"))
+
+    library.add({"hash1": make_sketch(1), "hash2": make_sketch(2)})
+    # samples already in the library are not converted again
+    library.add({"hash2": make_sketch(2), "hash3": make_sketch(3, version="v2")})
+
+    assert list(mock_sketch_to_hdf5.call_args_list[1][0][0]) == ["hash3"]
+    assert library.missing(["hash1", "hash3", "hash4"]) == ["hash4"]
+
+    output = str(tmp_path / "p_hash")
+    q_names = library.build_query_db(["hash3", "hash1"], output)
+
+    assert q_names == ["hash3", "hash1"]
+    assert query_db_path(output) == os.path.join(output, "p_hash.h5")
+    with h5py.File(query_db_path(output), "r") as query_db:
+        sketches = query_db["sketches"]
+        assert list(sketches) == ["hash1", "hash3"]
+        assert np.array_equal(sketches["hash3"]["14"][()], [3])
+        assert dict(sketches["hash1"].attrs) == {"bbits": 14}
+        assert sketches.attrs["sketch_version"] == "v1"
+
+
+@patch("beebop.services.sketch_library.sketch_to_hdf5", fake_sketch_to_hdf5)
+def test_add_writes_one_file_per_sample(tmp_path):
+    library = SketchLibrary(str(tmp_path / "sketch_library"))
+
+    library.add({"abcdef": make_sketch(1), "abc123": make_sketch(2)})
+
+    assert library.sample_path("abcdef") == str(tmp_path / "sketch_library" / "ab" / "abcdef.h5")
+    # the staging database and temporary files are removed once the samples are in place
+    assert os.listdir(tmp_path / "sketch_library") == ["ab"]
+    assert sorted(os.listdir(tmp_path / "sketch_library" / "ab")) == ["abc123.h5", "abcdef.h5"]
+    with h5py.File(library.sample_path("abcdef"), "r") as sample:
+        assert list(sample["sketches"]) == ["abcdef"]
+        assert sample["sketches"].attrs["sketch_version"] == "v1"
+
+
+def test_missing_without_library(tmp_path):
+    library = SketchLibrary(str(tmp_path / "sketch_library"))
+
+    assert library.missing(["hash1"]) == ["hash1"]
@@ -0,0 +1,185 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from beebop.config.config import ConfigurationError
+from beebop.services import species_registry
+from beebop.services.species_registry import (
+    build_species_registry,
+    get_kmer_info,
+    get_species_entry,
+    get_species_registry,
+    get_species_snapshot,
+    reload_species_registry,
+    resolve_species,
+)
+
+
+def make_species_args(**overrides):
+    species_args = {
+        "refdb": "ref_db",
+        "fulldb": "full_db",
+        "external_clusters_file": None,
+        "db_metadata_file": None,
+        "sublineages_db": None,
+        "location_metadata_file": None,
+        "qc_dict": SimpleNamespace(),
+    }
+    species_args.update(overrides)
+    return SimpleNamespace(**species_args)
+
+
+@patch("beebop.services.species_registry.getKmersFromReferenceDatabase")
+def test_build_species_registry(mock_get_kmers, tmp_path):
+    mock_get_kmers.return_value = [14, 17, 20]
+    (tmp_path / "ref_db").mkdir()
+    (tmp_path / "full_db").mkdir()
+    (tmp_path / "sub_lineages").mkdir()
+    args = SimpleNamespace(
+        species=SimpleNamespace(
+            species_a=make_species_args(sublineages_db="sub_lineages"),
+            species_b=make_species_args(sublineages_db="missing_sub_lineages"),
+        )
+    )
+
+    registry = build_species_registry(args, str(tmp_path))
+
+    entry = registry["species_a"]
+    assert entry.name == "species_a"
+    assert entry.ref_db_fs.db == f"{tmp_path}/ref_db"
+    assert entry.full_db_fs.db == f"{tmp_path}/full_db"
+    assert entry.kmer_info == {"kmerMax": 20, "kmerMin": 14, "kmerStep": 3}
+    assert entry.available is True
+    assert entry.has_sublineages is True
+    # sub-lineage models that are not on disk are not offered
+    assert registry["species_b"].has_sublineages is False
+    with pytest.raises(TypeError):
+        registry["species_c"] = entry
+    # settings shared through the registry cannot be changed
+    with pytest.raises(AttributeError, match="read-only"):
+        entry.config.refdb = "other_db"
+    assert args.species.species_a.refdb == "ref_db"
+
+
+@patch("beebop.services.species_registry.getKmersFromReferenceDatabase")
+def test_build_species_registry_unreadable_database(mock_get_kmers, tmp_path):
+    mock_get_kmers.side_effect = OSError("missing")
+    args = SimpleNamespace(species=SimpleNamespace(species_a=make_species_args()))
+
+    registry = build_species_registry(args, str(tmp_path))
+
+    assert registry["species_a"].available is False
+    assert get_species_entry(registry, "species_a") is None
+
+
+def test_build_species_registry_missing_settings(tmp_path):
+    args = SimpleNamespace(species=SimpleNamespace(species_a=make_species_args(fulldb=None)))
+
+    with pytest.raises(ConfigurationError, match="species_a is missing required settings: fulldb"):
+        build_species_registry(args, str(tmp_path))
+
+
+@patch("beebop.services.species_registry.build_species_registry")
+def test_get_species_registry_is_built_once(mock_build, mocker):
+    mocker.patch.dict(species_registry._registry_holder, clear=True)
+    args = SimpleNamespace(species=SimpleNamespace())
+
+    first = get_species_registry(args, "dbs")
+    second = get_species_registry(args, "dbs")
+
+    assert first is second
+    mock_build.assert_called_once_with(args, "dbs")
+
+
+@patch("beebop.services.species_registry.getKmersFromReferenceDatabase")
+def test_reload_species_registry_swaps_args_and_registry(mock_get_kmers, mocker, tmp_path):
+    mocker.patch.dict(species_registry._registry_holder, clear=True)
+    mock_get_kmers.return_value = [14, 17, 20]
+    old_args = SimpleNamespace(species=SimpleNamespace(species_a=make_species_args()))
+    new_args = SimpleNamespace(species=SimpleNamespace(species_a=make_species_args(refdb="ref_db_v2")))
+    old_registry = get_species_registry(old_args, str(tmp_path))
+
+    assert reload_species_registry(str(tmp_path), new_args) is new_args
+
+    args, registry = get_species_snapshot(old_args, str(tmp_path))
+    assert args is new_args
+    assert registry["species_a"].ref_db_fs.db == f"{tmp_path}/ref_db_v2"
+    # entries handed out before the reload still point at the old database
+    assert old_registry["species_a"].ref_db_fs.db == f"{tmp_path}/ref_db"
+
+
+@patch("beebop.services.species_registry.getKmersFromReferenceDatabase")
+def test_reload_species_registry_rejects_unavailable_database(mock_get_kmers, mocker, tmp_path):
+    mocker.patch.dict(species_registry._registry_holder, clear=True)
+
+    def get_kmers(db_path):
+        if db_path.endswith("ref_db_v2"):
+            raise OSError("still copying")
+        return [14, 17, 20]
+
+    mock_get_kmers.side_effect = get_kmers
+    old_args = SimpleNamespace(species=SimpleNamespace(species_a=make_species_args()))
+    old_registry = get_species_registry(old_args, str(tmp_path))
+    new_args = SimpleNamespace(species=SimpleNamespace(species_a=make_species_args(refdb="ref_db_v2")))
+
+    assert reload_species_registry(str(tmp_path), new_args) is None
+
+    assert get_species_snapshot(new_args, str(tmp_path)) == (old_args, old_registry)
+
+
+def test_reload_species_registry_keeps_current_on_invalid_config(mocker, tmp_path):
+    current = (SimpleNamespace(), {})
+    mocker.patch.dict(species_registry._registry_holder, {"current": current}, clear=True)
+    new_args = SimpleNamespace(species=SimpleNamespace(species_a=make_species_args(qc_dict=None)))
+
+    assert reload_species_registry(str(tmp_path), new_args) is None
+
+    assert species_registry._registry_holder["current"] is current
+
+
+@patch("beebop.services.species_registry.getKmersFromReferenceDatabase")
+def test_get_species_entry_unknown_species(mock_get_kmers, tmp_path):
+    mock_get_kmers.return_value = [14, 17, 20]
+    args = SimpleNamespace(species=SimpleNamespace(species_a=make_species_args()))
+    registry = build_species_registry(args, str(tmp_path))
+
+    assert get_species_entry(registry, "species_a") is registry["species_a"]
+    assert get_species_entry(registry, "unknown") is None
+
+
+@patch("beebop.services.species_registry.getKmersFromReferenceDatabase")
+def test_get_kmer_info(mock_get_kmers):
+    mock_get_kmers.return_value = [13, 15, 17, 19]
+
+    assert get_kmer_info("db") == {"kmerMax": 19, "kmerMin": 13, "kmerStep": 2}
+    mock_get_kmers.assert_called_once_with("db")
+
+
+@patch("beebop.services.species_registry.getKmersFromReferenceDatabase")
+def test_resolve_species_from_registry(mock_get_kmers, mocker, tmp_path):
+    mock_get_kmers.return_value = [14, 17, 20]
+    args = SimpleNamespace(species=SimpleNamespace(species_a=make_species_args()))
+    registry = build_species_registry(args, str(tmp_path))
+    mocker.patch.dict(species_registry._registry_holder, {"current": (args, registry)}, clear=True)
+
+    assert resolve_species("species_a") == (args, registry["species_a"])
+    with pytest.raises(ConfigurationError, match="No database found for species: unknown"):
+        resolve_species("unknown")
+
+
+@patch("beebop.services.species_registry.getKmersFromReferenceDatabase")
+def test_resolve_species_without_registry(mock_get_kmers, mocker, tmp_path):
+    mocker.patch.dict(species_registry._registry_holder, clear=True)
+    mock_get_kmers.return_value = [14, 17, 20]
+    args = SimpleNamespace(species=SimpleNamespace(species_a=make_species_args(), species_b=make_species_args()))
+    mocker.patch("beebop.services.species_registry.get_args", return_value=args)
+    mocker.patch("beebop.services.species_registry.get_dbs_location", return_value=str(tmp_path))
+
+    resolved_args, entry = resolve_species("species_a")
+
+    assert resolved_args is args
+    assert entry.ref_db_fs.db == f"{tmp_path}/ref_db"
+    # only the species of the job is built
+    mock_get_kmers.assert_called_once()
+    assert "current" not in species_registry._registry_holder
@@ -0,0 +1,66 @@
+import fcntl
+import os
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from beebop.config import PoppunkFileStore
+from beebop.services import trash_service
+from beebop.services.trash_service import LOCK_FILE, empty_trash, start_trash_reaper
+
+
+def make_trashed_project(fs, p_hash, n_files):
+    outdir = fs.output(p_hash)
+    os.makedirs(os.path.join(outdir, "visualise"))
+    for i in range(n_files):
+        with open(os.path.join(outdir, "visualise", f"file_{i}"), "w") as f:
+            f.write("result")
+    os.symlink(os.path.join(outdir, "visualise"), os.path.join(outdir, "link"))
+    fs.move_to_trash(outdir)
+
+
+def test_empty_trash(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_trashed_project(fs, "p_hash", 3)
+    with open(os.path.join(fs.tmp("other"), "file"), "w") as f:
+        f.write("tmp")
+    fs.move_to_trash(fs.tmp("other"))
+
+    # 3 files, the symlink and 2 folders, then the tmp file and folder
+    assert empty_trash(fs, 1000) == 8
+    assert os.listdir(fs.trash()) == [LOCK_FILE]
+    assert os.listdir(fs.output_base) == ["other"]
+
+
+@patch("beebop.services.trash_service.time.sleep")
+def test_empty_trash_throttles_deletes(mock_sleep, tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_trashed_project(fs, "p_hash", 2 * trash_service.DELETE_BATCH)
+
+    empty_trash(fs, 1)
+
+    assert mock_sleep.call_count == 2
+    assert mock_sleep.call_args_list[0].args[0] > trash_service.DELETE_BATCH - 1
+
+
+def test_empty_trash_skips_when_locked(tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    make_trashed_project(fs, "p_hash", 1)
+
+    with open(os.path.join(fs.trash(), LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert empty_trash(fs, 1000) == 0
+
+    assert len(os.listdir(fs.trash())) == 2
+
+
+@patch("beebop.services.trash_service.threading.Thread")
+def test_start_trash_reaper_once_per_process(mock_thread, tmp_path):
+    fs = PoppunkFileStore(str(tmp_path))
+    args = SimpleNamespace(trash=SimpleNamespace(deletes_per_second=10, interval_seconds=1))
+
+    with patch.dict(trash_service._reaper_holder, clear=True):
+        start_trash_reaper(fs, args)
+        start_trash_reaper(fs, args)
+
+    mock_thread.assert_called_once()
+    mock_thread.return_value.start.assert_called_once()
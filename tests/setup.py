@@ -22,7 +22,7 @@ def do_assign_clusters(p_hash: str):
     # setup output directory
     fs.setup_output_directory(p_hash)
     # setup metadata csv file for microreact
-    pd.DataFrame(amr_for_metadata_csv).to_csv(fs.tmp_output_metadata(p_hash), index=False)
+    pd.DataFrame(amr_for_metadata_csv).to_csv(fs.output_metadata(p_hash), index=False)
     hashes_list = [
         "02ff334f17f17d775b9ecd69046ed296",
         "9c00583e2f24fed5e3c6baa87a4bfa4c",
@@ -33,9 +33,6 @@ def do_assign_clusters(p_hash: str):
         hashes_list,
         p_hash,
         fs,
-        ref_db_fs,
-        ref_db_fs,
-        args,
         species,
     )
 
@@ -3,6 +3,7 @@ import os
 import re
 
 import jsonschema
+from redis import Redis
 
 from beebop.config import Schema
 from tests import setup
@@ -143,6 +144,16 @@ def test_get_network_graphs(client):
         assert all(x in graph_string for x in ["</graph>", "</graphml>", "</node>", "</edge>"])
 
 
+def test_get_network_graph(client):
+    p_hash, _ = run_pneumo(client)
+
+    # outputs are not compressed by default, so the graph is sent as it is stored
+    response = client.get(f"/results/networkGraphs/{p_hash}/GPSC3", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    assert "</graphml>" in response.data.decode("utf-8")
+
+
 def test_get_network_graphs_file_not_found(client):
     p_hash = "not_a_real_hash"
     response = client.get(f"/results/networkGraphs/{p_hash}")
@@ -225,6 +236,43 @@ def test_get_status_response(client):
     assert data["visualise"] in "finished"
     assert data["visualiseClusters"] == {}
     assert data["sublineageAssign"] == "finished"
+    assert data["eta"]["project"]["remainingSeconds"] == 0
+
+
+def test_get_status_completed_project_without_redis_jobs(client):
+    p_hash, _ = run_pneumo(client)
+    redis = Redis()
+    for job_type in ["assign", "visualise", "sublineageAssign"]:
+        redis.hdel(f"beebop:hash:job:{job_type}", p_hash)
+    redis.delete(f"beebop:hash:job:visualise:{p_hash}")
+
+    res = client.get(f"/status/{p_hash}")
+    data = read_data(res)
+
+    assert res.status_code == 200
+    assert data["assign"] == "finished"
+    assert all(status == "finished" for status in data["visualiseClusters"].values())
+    assert data["eta"]["project"]["remainingSeconds"] == 0
+    assert client.get(f"/project/{p_hash}").status_code == 200
+
+
+def test_rerun_cluster_visualisation(client):
+    p_hash, _ = run_pneumo(client)
+
+    response = client.post(f"/project/{p_hash}/visualise/GPSC3")
+    data = read_data(response)
+
+    assert response.status_code == 200
+    assert data["cluster"] == "GPSC3"
+    assert_correct_poppunk_results(client, p_hash, [3, 60])
+
+
+def test_rerun_cluster_visualisation_unknown_cluster(client):
+    p_hash, _ = run_pneumo(client)
+
+    response = client.post(f"/project/{p_hash}/visualise/GPSC1")
+
+    assert response.status_code == 404
 
 
 def test_get_status_response_not_found(client):
@@ -284,6 +332,18 @@ def test_get_sublineage_results(client):
     assert read_data(res) == expected_data
 
 
+def test_result_cache_stats(client):
+    p_hash = "unit_test_sublineage_results"
+    before = read_data(client.get("/resultCacheStats"))
+
+    client.post("/results/sublineageAssign", json={"projectHash": p_hash})
+    client.post("/results/sublineageAssign", json={"projectHash": p_hash})
+    after = read_data(client.get("/resultCacheStats"))
+
+    assert after["hits"] > before["hits"]
+    assert after["maxBytes"] == 256 * 1024**2
+
+
 def test_get_location_metadata_success(client):
     res = client.get("/locationMetadata/Streptococcus pneumoniae")
 
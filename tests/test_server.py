@@ -0,0 +1,223 @@
+import signal
+import socket
+from types import SimpleNamespace
+from unittest.mock import Mock, call, patch
+
+from beebop.api import config_routes
+from beebop.server import PreforkServer, create_listen_socket, main
+from beebop.services import species_registry
+
+
+def test_create_listen_socket():
+    sock = create_listen_socket("127.0.0.1", 0)
+
+    try:
+        assert sock.get_inheritable() is True
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR) != 0
+        assert sock.getsockname()[0] == "127.0.0.1"
+    finally:
+        sock.close()
+
+
+@patch("beebop.server.os.fork")
+def test_spawn_workers_forks_until_worker_count(mock_fork):
+    mock_fork.side_effect = [101, 102, 103]
+    server = PreforkServer("127.0.0.1", 5000, workers=3)
+
+    new_pids = server.spawn_workers()
+
+    assert new_pids == [101, 102, 103]
+    assert server.workers == {101, 102, 103}
+    assert mock_fork.call_count == 3
+
+
+@patch("beebop.server.os.fork")
+def test_restart_workers_spawns_before_stopping_old(mock_fork):
+    mock_fork.side_effect = [201, 202]
+    server = PreforkServer("127.0.0.1", 5000, workers=2)
+    server.workers = {101, 102}
+    server.stop_workers = Mock()
+
+    server.restart_workers()
+
+    assert server.workers == {201, 202}
+    server.stop_workers.assert_called_once()
+    assert sorted(server.stop_workers.call_args[0][0]) == [101, 102]
+
+
+@patch("beebop.server.os.fork")
+@patch("beebop.server.os.waitpid")
+def test_reap_workers_replaces_dead_worker(mock_waitpid, mock_fork):
+    mock_waitpid.side_effect = [(101, 0), (0, 0)]
+    mock_fork.return_value = 301
+    server = PreforkServer("127.0.0.1", 5000, workers=2)
+    server.workers = {101, 102}
+
+    server.reap_workers()
+
+    assert server.workers == {102, 301}
+
+
+@patch("beebop.server.os.fork")
+@patch("beebop.server.os.waitpid")
+def test_reap_workers_backs_off_workers_crashing_on_start(mock_waitpid, mock_fork):
+    mock_fork.side_effect = [101, 102, 103]
+    server = PreforkServer("127.0.0.1", 5000, workers=1)
+    server.spawn_workers()
+
+    mock_waitpid.side_effect = [(101, 0), (0, 0)]
+    server.reap_workers()
+    # not replaced until the delay passed
+    assert server.workers == set()
+    assert server._respawn_delay == 1
+
+    mock_waitpid.side_effect = [(0, 0)]
+    server._next_respawn = 0
+    server.reap_workers()
+    assert server.workers == {102}
+
+    mock_waitpid.side_effect = [(102, 0), (0, 0)]
+    server.reap_workers()
+    assert server._respawn_delay == 2
+
+
+def test_check_reload_restarts_workers_only_when_reload_accepted():
+    server = PreforkServer("127.0.0.1", 5000, workers=1, reload_interval=0)
+    server.restart_workers = Mock()
+    server.reload = Mock(return_value=False)
+    server._reloading = True
+
+    server.check_reload()
+
+    server.reload.assert_called_once()
+    server.restart_workers.assert_not_called()
+    assert server._reloading is False
+
+    server.reload.return_value = True
+    server._reloading = True
+    server.check_reload()
+
+    server.restart_workers.assert_called_once()
+
+
+@patch("beebop.server.os.kill")
+@patch("beebop.server.os.waitpid")
+def test_stop_workers_sends_sigterm_and_waits(mock_waitpid, mock_kill):
+    mock_waitpid.side_effect = lambda pid, _: (pid, 0)
+    server = PreforkServer("127.0.0.1", 5000, workers=2)
+    server.workers = {101, 102}
+
+    server.stop_workers([101, 102])
+
+    mock_kill.assert_has_calls([call(101, signal.SIGTERM), call(102, signal.SIGTERM)], any_order=True)
+    assert server.workers == set()
+
+
+@patch("beebop.server.get_args_mtime")
+def test_args_changed_checks_at_reload_interval(mock_mtime):
+    mock_mtime.return_value = 1
+    server = PreforkServer("127.0.0.1", 5000, workers=1, reload_interval=0)
+    mock_mtime.return_value = 2
+    # checks are disabled with an interval of 0
+    assert server.args_changed() is False
+
+    server.reload_interval = 10
+    assert server.args_changed() is True
+    # not checked again until the interval has passed
+    assert server.args_changed() is False
+
+
+@patch("beebop.server.gc.freeze")
+@patch("beebop.server.preload_read_only_cache")
+@patch("beebop.server.reload_species_registry")
+@patch("beebop.server.get_environment")
+def test_reload_preloads_new_configuration(mock_env, mock_reload, mock_preload, mock_freeze):
+    mock_env.return_value = ("storage", "dbs", "redis")
+    new_args = SimpleNamespace(species=SimpleNamespace())
+    mock_reload.return_value = new_args
+    server = PreforkServer("127.0.0.1", 5000, workers=1)
+
+    assert server.reload() is True
+
+    mock_reload.assert_called_once_with("dbs")
+    mock_preload.assert_called_once_with(new_args, "dbs")
+    mock_freeze.assert_called_once()
+
+
+@patch("beebop.server.preload_read_only_cache")
+@patch("beebop.server.reload_species_registry")
+@patch("beebop.server.get_environment")
+def test_reload_keeps_current_configuration_when_rejected(mock_env, mock_reload, mock_preload):
+    mock_env.return_value = ("storage", "dbs", "redis")
+    mock_reload.return_value = None
+    server = PreforkServer("127.0.0.1", 5000, workers=1)
+
+    assert server.reload() is False
+
+    mock_preload.assert_not_called()
+
+
+@patch("beebop.server.start_trash_reaper")
+@patch("beebop.server.get_args")
+@patch("beebop.server.get_environment")
+def test_start_trash_reaper_in_master(mock_env, mock_get_args, mock_start_reaper, tmp_path):
+    mock_env.return_value = (str(tmp_path), "dbs", "redis")
+    server = PreforkServer("127.0.0.1", 5000, workers=1)
+
+    server.start_trash_reaper()
+
+    fs, args = mock_start_reaper.call_args[0]
+    assert fs.storage_location == str(tmp_path)
+    assert args == mock_get_args.return_value
+
+
+@patch("beebop.server.os._exit")
+def test_exit_when_idle_waits_for_active_channels(mock_exit):
+    server = PreforkServer("127.0.0.1", 5000, workers=1, graceful_timeout=0)
+    waitress_server = Mock(active_channels={1: Mock()})
+
+    server.exit_when_idle(waitress_server)
+
+    mock_exit.assert_called_once_with(0)
+
+
+@patch("beebop.server.PreforkServer")
+def test_main_parses_arguments(mock_server):
+    main(["--port", "6000", "--workers", "3", "--threads", "2"])
+
+    mock_server.assert_called_once_with("0.0.0.0", 6000, 3, 2, 30, 10)
+    mock_server.return_value.run.assert_called_once()
+
+
+@patch("beebop.services.species_registry.getKmersFromReferenceDatabase")
+def test_preload_read_only_cache(mock_get_kmers, mocker):
+    mocker.patch.dict(config_routes._read_only_cache, clear=True)
+    mocker.patch.dict(species_registry._registry_holder, clear=True)
+    mock_get_kmers.return_value = [14, 17, 20]
+    args = SimpleNamespace(
+        species=SimpleNamespace(
+            species_a=SimpleNamespace(
+                refdb="ref_a",
+                fulldb="full_a",
+                external_clusters_file=None,
+                db_metadata_file=None,
+                sublineages_db=None,
+                location_metadata_file="GPS_v9_metadata_location.json",
+                qc_dict=SimpleNamespace(),
+            )
+        )
+    )
+
+    config_routes.preload_read_only_cache(args, "dbs")
+    # cached results are reused without reading the database again
+    species_config = config_routes.build_species_config(args, "dbs")
+
+    mock_get_kmers.assert_called_once_with("dbs/ref_a")
+    assert species_config == {
+        "species_a": {
+            "kmerInfo": {"kmerMax": 20, "kmerMin": 14, "kmerStep": 3},
+            "hasSublineages": False,
+            "hasLocationMetadata": True,
+        }
+    }
+    assert "GPS_v9_metadata_location.json" in config_routes._read_only_cache["location_metadata"]